@@ -0,0 +1,145 @@
+# management/commands/benchmark_profitability.py
+from datetime import date
+from decimal import Decimal
+import random
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Client, ClientProfitability, Expense, Organization, Profile, TimeEntry
+from ...services.profitability_service import ProfitabilityEngine
+from ...utils import update_client_profitability
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark do motor de rentabilidade em bloco contra update_client_profitability, '
+        'com verificação de paridade contra o caminho de referência em Python. '
+        'Os dados sintéticos são criados numa transação e descartados no fim.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10000, help='Número de clientes sintéticos (padrão: 10000)')
+        parser.add_argument('--months', type=int, default=12, help='Número de meses (padrão: 12)')
+        parser.add_argument('--users', type=int, default=25, help='Número de colaboradores (padrão: 25)')
+        parser.add_argument('--entries-per-month', type=int, default=3, help='Registos de tempo por cliente/mês (padrão: 3)')
+        parser.add_argument('--expenses-per-month', type=int, default=1, help='Despesas por cliente/mês (padrão: 1)')
+        parser.add_argument('--legacy-sample', type=int, default=50,
+                            help='Clientes a medir com o caminho antigo; o tempo total é extrapolado (0 para saltar)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise _Rollback()
+        except _Rollback:
+            self.stdout.write("Dados sintéticos descartados.")
+
+    def _run(self, options):
+        year = date.today().year - 1
+        periods = [(year, month) for month in range(1, min(options['months'], 12) + 1)]
+
+        self.stdout.write(f"A gerar {options['clients']} clientes × {len(periods)} meses...")
+        org, clients = self._generate(options, periods)
+
+        # --- Motor em bloco ---
+        started = time.perf_counter()
+        written = sum(ProfitabilityEngine.recompute(periods, organization=org).values())
+        bulk_seconds = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Motor em bloco: {written} registos em {bulk_seconds:.2f}s "
+            f"({written / bulk_seconds if bulk_seconds else 0:.0f} registos/s)"
+        ))
+
+        # --- Paridade com o caminho de referência ---
+        client_ids = [c.id for c in clients]
+        reference = ProfitabilityEngine.reference_aggregate(
+            TimeEntry.objects.filter(client__organization=org).values_list(
+                'client_id', 'date', 'minutes_spent', 'user__profile__hourly_rate'
+            ).iterator(),
+            Expense.objects.filter(client__organization=org).values_list('client_id', 'date', 'amount').iterator(),
+            periods,
+        )
+        mismatches = 0
+        stored = ClientProfitability.objects.filter(client_id__in=client_ids).values_list(
+            'client_id', 'year', 'month', 'total_time_minutes', 'time_cost', 'total_expenses'
+        )
+        for client_id, rec_year, rec_month, minutes, time_cost, expenses in stored.iterator():
+            expected = reference.get((str(client_id), rec_year, rec_month), ProfitabilityEngine._empty_aggregate())
+            if (
+                minutes != expected['total_time_minutes']
+                or abs(time_cost - expected['time_cost']) > Decimal('0.01')
+                or expenses != expected['total_expenses']
+            ):
+                mismatches += 1
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"Paridade: {mismatches} registos divergem da referência"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Paridade: todos os registos coincidem com a referência"))
+
+        # --- Caminho antigo (amostra extrapolada) ---
+        sample = clients[:options['legacy_sample']]
+        if sample:
+            started = time.perf_counter()
+            for client in sample:
+                for period_year, period_month in periods:
+                    update_client_profitability(client.id, period_year, period_month)
+            legacy_seconds = time.perf_counter() - started
+            estimated = legacy_seconds / len(sample) * len(clients)
+            self.stdout.write(
+                f"Caminho antigo: {len(sample)} clientes em {legacy_seconds:.2f}s "
+                f"(estimativa para {len(clients)} clientes: {estimated:.0f}s, "
+                f"{estimated / bulk_seconds if bulk_seconds else 0:.0f}x mais lento)"
+            )
+
+    def _generate(self, options, periods):
+        org = Organization.objects.create(name=f"Benchmark {uuid.uuid4().hex[:8]}")
+
+        users = User.objects.bulk_create([
+            User(username=f"bench_{uuid.uuid4().hex[:12]}") for _ in range(options['users'])
+        ])
+        Profile.objects.bulk_create([
+            Profile(
+                user=user, organization=org, invitation_code=str(code),
+                hourly_rate=Decimal(random.randint(15, 80)), role='Benchmark', access_level='Standard'
+            )
+            for user, code in zip(users, random.sample(range(1000, 10000), len(users)))
+        ], ignore_conflicts=True)
+
+        clients = Client.objects.bulk_create([
+            Client(name=f"Cliente {i}", organization=org, monthly_fee=Decimal(random.randint(50, 800)))
+            for i in range(options['clients'])
+        ], batch_size=2000)
+
+        entries, expenses = [], []
+        for client in clients:
+            for period_year, period_month in periods:
+                for _ in range(options['entries_per_month']):
+                    entries.append(TimeEntry(
+                        user=random.choice(users), client=client, description='benchmark',
+                        minutes_spent=random.randint(5, 240),
+                        date=date(period_year, period_month, random.randint(1, 28)),
+                    ))
+                for _ in range(options['expenses_per_month']):
+                    expenses.append(Expense(
+                        client=client, amount=Decimal(random.randint(100, 10000)) / 100,
+                        date=date(period_year, period_month, random.randint(1, 28)),
+                    ))
+            if len(entries) >= 20000:
+                TimeEntry.objects.bulk_create(entries, batch_size=5000)
+                entries = []
+            if len(expenses) >= 20000:
+                Expense.objects.bulk_create(expenses, batch_size=5000)
+                expenses = []
+        TimeEntry.objects.bulk_create(entries, batch_size=5000)
+        Expense.objects.bulk_create(expenses, batch_size=5000)
+        return org, clients
@@ -0,0 +1,133 @@
+# management/commands/benchmark_qr_decoding.py
+from collections import defaultdict
+import random
+import statistics
+import time
+
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from ...qr_processor import EnhancedQRProcessor
+
+
+VARIANTS = ['clean', 'small_qr', 'rotated', 'noisy_blur', 'low_contrast', 'jpeg', 'no_qr']
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark da descodificação de QR Codes ATCUD do EnhancedQRProcessor sobre um corpus '
+        'de faturas sintéticas (limpas, QR pequeno, rodadas, com ruído, baixo contraste, JPEG e sem QR). '
+        'Reporta a latência mediana e p95 por imagem.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=70, help='Número de imagens sintéticas (padrão: 70)')
+        parser.add_argument('--budget', type=float, default=None,
+                            help=f'Orçamento de tempo por imagem em segundos (padrão: {EnhancedQRProcessor.DEFAULT_TIME_BUDGET})')
+        parser.add_argument('--dpi', type=int, default=200, help='Resolução das faturas A4 geradas (padrão: 200)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        processor = EnhancedQRProcessor(time_budget=options['budget'])
+        encoder = cv2.QRCodeEncoder.create()
+
+        corpus = [
+            (VARIANTS[i % len(VARIANTS)], *self._invoice_image(encoder, VARIANTS[i % len(VARIANTS)], options['dpi'], rng))
+            for i in range(options['images'])
+        ]
+        self.stdout.write(f"Corpus: {len(corpus)} imagens a {options['dpi']} dpi, orçamento {processor.time_budget:.1f}s")
+
+        latencies = []
+        per_variant = defaultdict(list)
+        decoded_ok = expected_ok = false_negatives = 0
+        attempts_total = 0
+        for variant, image, payload in corpus:
+            log = []
+            started = time.perf_counter()
+            found = processor.detect_qr_codes(image, processing_log=log)
+            elapsed = time.perf_counter() - started
+            latencies.append(elapsed)
+            per_variant[variant].append(elapsed)
+            attempts_total += sum(1 for line in log if line.startswith('Tentativa'))
+            if payload is not None:
+                expected_ok += 1
+                if payload in found:
+                    decoded_ok += 1
+                else:
+                    false_negatives += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Latência: mediana {self._ms(statistics.median(latencies))}, "
+            f"p95 {self._ms(self._percentile(latencies, 95))}, máx {self._ms(max(latencies))}"
+        ))
+        self.stdout.write(
+            f"ATCUD lidos: {decoded_ok}/{expected_ok} ({false_negatives} falhados), "
+            f"média de {attempts_total / len(corpus):.1f} tentativas por imagem"
+        )
+        for variant in VARIANTS:
+            values = per_variant.get(variant)
+            if values:
+                self.stdout.write(
+                    f"  {variant:<13} n={len(values):<3} mediana {self._ms(statistics.median(values))} "
+                    f"p95 {self._ms(self._percentile(values, 95))}"
+                )
+
+    @staticmethod
+    def _ms(seconds):
+        return f"{seconds * 1000:.0f}ms"
+
+    @staticmethod
+    def _percentile(values, percentile):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(percentile / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def _invoice_image(self, encoder, variant, dpi, rng):
+        """Fatura A4 sintética com texto e, exceto em 'no_qr', o QR Code da AT no rodapé."""
+        width, height = int(8.27 * dpi), int(11.69 * dpi)
+        page = np.full((height, width, 3), 255, dtype=np.uint8)
+        for line in range(40):
+            y = int(height * 0.08) + line * int(dpi * 0.22)
+            if y > height * 0.75:
+                break
+            text = ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 .,€') for _ in range(rng.randint(20, 60)))
+            cv2.putText(page, text, (int(dpi * 0.6), y), cv2.FONT_HERSHEY_SIMPLEX, dpi / 250.0, (30, 30, 30), 1)
+
+        payload = None
+        if variant != 'no_qr':
+            payload = self._atcud_payload(rng)
+            qr = encoder.encode(payload)
+            module_px = 2 if variant == 'small_qr' else max(3, dpi // 50)
+            qr = cv2.resize(qr, None, fx=module_px, fy=module_px, interpolation=cv2.INTER_NEAREST)
+            qr = cv2.copyMakeBorder(qr, 4 * module_px, 4 * module_px, 4 * module_px, 4 * module_px,
+                                    cv2.BORDER_CONSTANT, value=255)
+            qr_h, qr_w = qr.shape[:2]
+            x = width - qr_w - int(dpi * 0.5)
+            y = height - qr_h - int(dpi * 0.5)
+            page[y:y + qr_h, x:x + qr_w] = cv2.cvtColor(qr, cv2.COLOR_GRAY2BGR)
+
+        if variant == 'rotated':
+            page = cv2.rotate(page, rng.choice([cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_180, cv2.ROTATE_90_COUNTERCLOCKWISE]))
+        elif variant == 'noisy_blur':
+            noise = np.random.default_rng(rng.randint(0, 2**31)).normal(0, 18, page.shape)
+            page = cv2.GaussianBlur(np.clip(page + noise, 0, 255).astype(np.uint8), (3, 3), 0)
+        elif variant == 'low_contrast':
+            page = cv2.convertScaleAbs(page, alpha=0.35, beta=120)
+        elif variant == 'jpeg':
+            _, encoded = cv2.imencode('.jpg', page, [cv2.IMWRITE_JPEG_QUALITY, 35])
+            page = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+        return page, payload
+
+    @staticmethod
+    def _atcud_payload(rng):
+        nif = str(rng.randint(500000000, 599999999))
+        net = round(rng.uniform(5, 2000), 2)
+        vat = round(net * 0.23, 2)
+        atcud = ''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ23456789') for _ in range(8)) + f"-{rng.randint(1, 99999)}"
+        return (
+            f"A:{nif}*B:999999990*C:PT*D:FT*E:N*F:2026{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+            f"*G:FT A/{rng.randint(1, 9999)}*H:{atcud}*I1:PT*I7:{net:.2f}*I8:{vat:.2f}"
+            f"*N:{vat:.2f}*O:{net + vat:.2f}*Q:{''.join(rng.choice('ABCDEFGHIJ') for _ in range(4))}*R:1234"
+        )
@@ -0,0 +1,152 @@
+# management/commands/benchmark_saft_parser.py
+from datetime import date, timedelta
+from decimal import Decimal
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...services.saft_parser import SAFTParser
+
+SAFT_NAMESPACE = 'urn:OECD:StandardAuditFile-Tax:PT_1.04_01'
+
+
+def _current_rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _measure(path, streaming, queue):
+    """Corre num processo filho para medir o pico de memória de um único parse."""
+    baseline = _current_rss()
+    started = time.perf_counter()
+    result = SAFTParser(path, streaming=streaming).parse()
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    queue.put((elapsed, max(0, peak - baseline), result))
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark de memória e débito do SAFTParser (streaming vs. em memória) sobre ficheiros '
+        'SAF-T sintéticos. Cada parse corre num processo próprio para medir o pico de RSS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, nargs='+', default=[50000, 500000],
+                            help='Tamanhos dos ficheiros gerados, em faturas (padrão: 50000 500000)')
+        parser.add_argument('--lines-per-invoice', type=int, default=3)
+        parser.add_argument('--in-memory-max', type=int, default=100000,
+                            help='Não corre o parser em memória acima deste número de faturas (padrão: 100000)')
+        parser.add_argument('--keep-files', action='store_true', help='Mantém os ficheiros gerados')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        for invoice_count in options['invoices']:
+            handle, path = tempfile.mkstemp(suffix='.xml', prefix=f'saft_{invoice_count}_')
+            os.close(handle)
+            try:
+                started = time.perf_counter()
+                self._generate(path, invoice_count, options['lines_per_invoice'], random.Random(options['seed']))
+                size_mb = os.path.getsize(path) / 1024 / 1024
+                self.stdout.write(
+                    f"\n{invoice_count} faturas: {size_mb:.1f} MB gerados em {time.perf_counter() - started:.1f}s ({path})"
+                )
+
+                results = {}
+                modes = [('streaming', True)]
+                if invoice_count <= options['in_memory_max']:
+                    modes.append(('em memória', False))
+                for label, streaming in modes:
+                    queue = context.Queue()
+                    process = context.Process(target=_measure, args=(path, streaming, queue))
+                    process.start()
+                    elapsed, peak, result = queue.get()
+                    process.join()
+                    results[label] = result
+                    self.stdout.write(
+                        f"  {label:<11} {elapsed:7.2f}s  {invoice_count / elapsed:9.0f} faturas/s  "
+                        f"{size_mb / elapsed:6.1f} MB/s  pico RSS +{peak / 1024 / 1024:.0f} MB"
+                    )
+
+                if len(results) == 2:
+                    if results['streaming'] == results['em memória']:
+                        self.stdout.write(self.style.SUCCESS("  Resultados idênticos nos dois modos"))
+                    else:
+                        self.stdout.write(self.style.ERROR("  Os resultados divergem entre os dois modos"))
+            finally:
+                if not options['keep_files']:
+                    os.remove(path)
+
+    def _generate(self, path, invoice_count, lines_per_invoice, rng):
+        """Escreve um SAF-T sintético em streaming, sem o montar em memória."""
+        customer_count = max(1, invoice_count // 20)
+        start = date(2025, 1, 1)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<AuditFile xmlns="{SAFT_NAMESPACE}">\n')
+            f.write(
+                '<Header><AuditFileVersion>1.04_01</AuditFileVersion><CompanyID>500000000</CompanyID>'
+                '<TaxRegistrationNumber>500000000</TaxRegistrationNumber><TaxAccountingBasis>F</TaxAccountingBasis>'
+                '<CompanyName>Empresa Benchmark Lda</CompanyName><CompanyAddress><AddressDetail>Rua A</AddressDetail>'
+                '<City>Lisboa</City><PostalCode>1000-001</PostalCode><Country>PT</Country></CompanyAddress>'
+                '<FiscalYear>2025</FiscalYear><StartDate>2025-01-01</StartDate><EndDate>2025-12-31</EndDate>'
+                '<CurrencyCode>EUR</CurrencyCode><DateCreated>2026-01-15</DateCreated><TaxEntity>Global</TaxEntity>'
+                '<ProductCompanyTaxID>500000000</ProductCompanyTaxID><SoftwareCertificateNumber>0</SoftwareCertificateNumber>'
+                '<ProductID>Benchmark/PRAgenda</ProductID><ProductVersion>1.0</ProductVersion></Header>\n'
+            )
+            f.write('<MasterFiles>\n')
+            for index in range(customer_count):
+                f.write(
+                    f'<Customer><CustomerID>C{index}</CustomerID><AccountID>211{index}</AccountID>'
+                    f'<CustomerTaxID>{200000000 + index}</CustomerTaxID><CompanyName>Cliente {index}</CompanyName>'
+                    f'<BillingAddress><AddressDetail>Rua {index}</AddressDetail><City>Porto</City>'
+                    f'<PostalCode>4000-001</PostalCode><Country>PT</Country></BillingAddress>'
+                    f'<SelfBillingIndicator>0</SelfBillingIndicator></Customer>\n'
+                )
+            f.write('</MasterFiles>\n<SourceDocuments>\n<SalesInvoices>\n')
+            f.write(f'<NumberOfEntries>{invoice_count}</NumberOfEntries><TotalDebit>0.00</TotalDebit><TotalCredit>0.00</TotalCredit>\n')
+
+            rates = [(Decimal('23'), 'NOR'), (Decimal('13'), 'INT'), (Decimal('6'), 'RED')]
+            doc_types = ['FT', 'FT', 'FT', 'FS', 'FR', 'NC']
+            for number in range(1, invoice_count + 1):
+                doc_type = rng.choice(doc_types)
+                invoice_date = start + timedelta(days=rng.randint(0, 364))
+                status = 'A' if rng.random() < 0.02 else 'N'
+                # Credit notes carry their lines as DebitAmount
+                amount_tag = 'DebitAmount' if doc_type == 'NC' else 'CreditAmount'
+                lines = []
+                net_total = tax_total = Decimal('0')
+                for line_number in range(1, lines_per_invoice + 1):
+                    rate, code = rng.choice(rates)
+                    quantity = Decimal(rng.randint(1, 10))
+                    price = Decimal(rng.randint(100, 50000)) / 100
+                    amount = quantity * price
+                    net_total += amount
+                    tax_total += (amount * rate / 100).quantize(Decimal('0.01'))
+                    lines.append(
+                        f'<Line><LineNumber>{line_number}</LineNumber><ProductCode>P{line_number}</ProductCode>'
+                        f'<ProductDescription>Produto {line_number}</ProductDescription><Quantity>{quantity}</Quantity>'
+                        f'<UnitOfMeasure>UN</UnitOfMeasure><UnitPrice>{price}</UnitPrice><TaxPointDate>{invoice_date}</TaxPointDate>'
+                        f'<Description>Produto {line_number}</Description><{amount_tag}>{amount:.2f}</{amount_tag}>'
+                        f'<Tax><TaxType>IVA</TaxType><TaxCountryRegion>PT</TaxCountryRegion><TaxCode>{code}</TaxCode>'
+                        f'<TaxPercentage>{rate}</TaxPercentage></Tax><SettlementAmount>0.00</SettlementAmount></Line>'
+                    )
+                f.write(
+                    f'<Invoice><InvoiceNo>{doc_type} A/{number}</InvoiceNo><ATCUD>ABCD1234-{number}</ATCUD>'
+                    f'<DocumentStatus><InvoiceStatus>{status}</InvoiceStatus><InvoiceStatusDate>{invoice_date}T10:00:00</InvoiceStatusDate>'
+                    f'<SourceID>admin</SourceID><SourceBilling>P</SourceBilling></DocumentStatus>'
+                    f'<Hash>0</Hash><HashControl>1</HashControl><Period>{invoice_date.month}</Period>'
+                    f'<InvoiceDate>{invoice_date}</InvoiceDate><InvoiceType>{doc_type}</InvoiceType>'
+                    f'<SpecialRegimes><SelfBillingIndicator>0</SelfBillingIndicator><CashVATSchemeIndicator>0</CashVATSchemeIndicator>'
+                    f'<ThirdPartiesBillingIndicator>0</ThirdPartiesBillingIndicator></SpecialRegimes>'
+                    f'<SourceID>admin</SourceID><SystemEntryDate>{invoice_date}T10:00:00</SystemEntryDate>'
+                    f'<CustomerID>C{rng.randrange(customer_count)}</CustomerID>{"".join(lines)}'
+                    f'<DocumentTotals><TaxPayable>{tax_total:.2f}</TaxPayable><NetTotal>{net_total:.2f}</NetTotal>'
+                    f'<GrossTotal>{net_total + tax_total:.2f}</GrossTotal></DocumentTotals></Invoice>\n'
+                )
+            f.write('</SalesInvoices>\n</SourceDocuments>\n</AuditFile>\n')
@@ -50,6 +50,11 @@ class Command(BaseCommand):
             default=30,
             help='Dias para considerar obrigação obsoleta (padrão: 30)',
         )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostrar o plano das tarefas a criar sem gravar nada',
+        )
 
     def handle(self, *args, **options):
         start_time = timezone.now()
@@ -70,7 +75,8 @@ class Command(BaseCommand):
             self.stdout.write("Processando todas as organizações")
 
         # Limpar obrigações obsoletas se solicitado
-        if options['clean_old']:
+        dry_run = options['dry_run']
+        if options['clean_old'] and not dry_run:
             self.stdout.write("Limpando obrigações obsoletas...")
             cleaned_count = FiscalObligationGenerator.clean_old_pending_obligations(
                 days_old=options['days_old'],
@@ -84,17 +90,18 @@ class Command(BaseCommand):
                 # Apenas período atual
                 if options['year'] and options['month']:
                     stats = FiscalObligationGenerator.generate_obligations_for_period(
-                        options['year'], options['month'], organization
+                        options['year'], options['month'], organization, dry_run=dry_run
                     )
                     results = [stats]
                 else:
-                    stats = FiscalObligationGenerator.generate_for_current_period(organization)
+                    stats = FiscalObligationGenerator.generate_for_current_period(organization, dry_run=dry_run)
                     results = [stats]
             else:
                 # Múltiplos meses
                 results = FiscalObligationGenerator.generate_for_next_months(
                     months_ahead=options['months_ahead'],
-                    organization=organization
+                    organization=organization,
+                    dry_run=dry_run
                 )
 
             # Exibir resultados
@@ -117,6 +124,13 @@ class Command(BaseCommand):
                 self.stdout.write(f"Clientes processados: {result['clients_processed']}")
                 self.stdout.write(f"Tarefas criadas: {result['tasks_created']}")
                 self.stdout.write(f"Tarefas ignoradas: {result['tasks_skipped']}")
+                if dry_run:
+                    self.stdout.write(f"Tarefas a criar: {len(result['plan'])}")
+                    for planned in result['plan']:
+                        self.stdout.write(
+                            f"  - {planned['deadline']} {planned['title']} "
+                            f"({planned['client_name']}, {planned['period_key']}, {planned['assigned_to'] or 'sem responsável'})"
+                        )
                 
                 if result['errors']:
                     self.stdout.write(f"Erros: {len(result['errors'])}")
@@ -135,7 +149,9 @@ class Command(BaseCommand):
             duration = timezone.now() - start_time
             self.stdout.write(f"Tempo de execução: {duration.total_seconds():.2f} segundos")
             
-            if total_created > 0:
+            if dry_run:
+                self.stdout.write(self.style.WARNING("Simulação: nenhuma tarefa foi gravada."))
+            elif total_created > 0:
                 self.stdout.write(
                     self.style.SUCCESS(f"✓ Geração concluída com sucesso! {total_created} tarefas criadas.")
                 )
@@ -5,6 +5,7 @@ from django.utils import timezone
 from datetime import timedelta
 from ...models import WorkflowNotification, NotificationDigest
 from ...services.notification_service import NotificationService
+from ...services.notification_counter_service import NotificationCounterService
 from ...services.notification_digest_service import NotificationDigestService
 from ...services.notification_escalation import NotificationEscalationService
 import logging
@@ -87,7 +88,7 @@ class Command(BaseCommand):
         
         if not dry_run:
             # Arquivar notificações antigas lidas
-            archived_count = to_archive.update(is_archived=True)
+            archived_count = NotificationCounterService.update_queryset(to_archive, is_archived=True)
             self.stdout.write(
                 self.style.SUCCESS(f'✅ {archived_count} notificações arquivadas')
             )
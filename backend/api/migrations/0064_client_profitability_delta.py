@@ -0,0 +1,33 @@
+# Generated by Django 4.2.21 on 2026-10-17 23:59
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0063_notificationsettings_digest_enabled_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientProfitabilityDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(verbose_name='Ano')),
+                ('month', models.IntegerField(verbose_name='Mês')),
+                ('minutes_delta', models.IntegerField(default=0, verbose_name='Delta de Minutos')),
+                ('time_cost_delta', models.DecimalField(decimal_places=6, default=Decimal('0'), max_digits=16, verbose_name='Delta do Custo do Tempo')),
+                ('expenses_delta', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Delta de Despesas')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='profitability_deltas', to='api.client', verbose_name='Cliente')),
+            ],
+            options={
+                'verbose_name': 'Delta de Rentabilidade',
+                'verbose_name_plural': 'Deltas de Rentabilidade',
+                'ordering': ['id'],
+            },
+        ),
+    ]
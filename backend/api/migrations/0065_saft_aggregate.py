@@ -0,0 +1,35 @@
+# Generated by Django 4.2.21 on 2026-10-18 00:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0064_client_profitability_delta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SAFTAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('month', 'Mês'), ('customer', 'Cliente'), ('tax_rate', 'Taxa de IVA'), ('doc_type', 'Tipo de Documento')], max_length=20, verbose_name='Dimensão')),
+                ('key', models.CharField(help_text='AAAA-MM, NIF do cliente, Código:Taxa ou tipo de documento.', max_length=100, verbose_name='Chave')),
+                ('label', models.CharField(blank=True, max_length=255, null=True, verbose_name='Descrição')),
+                ('document_count', models.IntegerField(default=0, verbose_name='Documentos')),
+                ('cancelled_count', models.IntegerField(default=0, verbose_name='Documentos Anulados')),
+                ('net_total', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Total Líquido')),
+                ('tax_total', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Total de Imposto')),
+                ('gross_total', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Total Bruto')),
+                ('saft_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aggregates', to='api.saftfile', verbose_name='Ficheiro SAFT')),
+            ],
+            options={
+                'verbose_name': 'Agregado SAFT',
+                'verbose_name_plural': 'Agregados SAFT',
+                'ordering': ['dimension', 'key'],
+                'unique_together': {('saft_file', 'dimension', 'key')},
+            },
+        ),
+    ]
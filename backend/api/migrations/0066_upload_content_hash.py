@@ -0,0 +1,27 @@
+# Generated by Django 4.2.21 on 2026-10-18 00:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0065_saft_aggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saftfile',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 do ficheiro enviado, calculado durante o upload.', max_length=64, null=True, verbose_name='Hash do Conteúdo'),
+        ),
+        migrations.AddField(
+            model_name='scannedinvoice',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 do ficheiro enviado, calculado durante o upload.', max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='saftfile',
+            index=models.Index(fields=['organization', 'content_hash'], name='api_saftfil_organiz_63d05b_idx'),
+        ),
+    ]
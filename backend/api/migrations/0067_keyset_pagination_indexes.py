@@ -0,0 +1,41 @@
+# Generated by Django 4.2.21 on 2026-10-18 00:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0066_upload_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientprofitability',
+            index=models.Index(fields=['year', 'month'], name='api_clientp_year_a1a24f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='organizationactionlog',
+            index=models.Index(fields=['organization', 'timestamp', 'id'], name='api_organiz_organiz_9b9d7a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['priority', 'id'], name='api_task_priorit_3958d4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['deadline', 'id'], name='api_task_deadlin_e47aab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['created_at', 'id'], name='api_task_created_bfd0aa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timeentry',
+            index=models.Index(fields=['date', 'id'], name='api_timeent_date_b9d852_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflownotification',
+            index=models.Index(fields=['user', 'is_archived', 'created_at', 'id'], name='api_workflo_user_id_b286e3_idx'),
+        ),
+    ]
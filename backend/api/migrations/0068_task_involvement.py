@@ -0,0 +1,49 @@
+# Generated by Django 4.2.21 on 2026-10-18 00:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Backfill from the three sources the old TaskManager.for_user query combined
+BACKFILL_SQL = """
+INSERT INTO api_taskinvolvement (task_id, user_id, role)
+SELECT id, assigned_to_id, 'primary' FROM api_task WHERE assigned_to_id IS NOT NULL
+UNION
+SELECT task_id, user_id, 'collaborator' FROM api_task_collaborators
+UNION
+SELECT t.id, u.id, 'workflow_step'
+FROM api_task t
+CROSS JOIN LATERAL jsonb_each_text(
+    CASE WHEN jsonb_typeof(t.workflow_step_assignments) = 'object' THEN t.workflow_step_assignments ELSE '{}'::jsonb END
+) vals
+JOIN auth_user u ON vals.value ~ '^[0-9]{1,18}$' AND u.id = vals.value::bigint
+ON CONFLICT DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0067_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskInvolvement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('primary', 'Responsável Principal'), ('collaborator', 'Colaborador'), ('workflow_step', 'Responsável de Passo')], max_length=20, verbose_name='Papel')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='involvements', to='api.task', verbose_name='Tarefa')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_involvements', to=settings.AUTH_USER_MODEL, verbose_name='Utilizador')),
+            ],
+            options={
+                'verbose_name': 'Envolvimento em Tarefa',
+                'verbose_name_plural': 'Envolvimentos em Tarefas',
+                'indexes': [models.Index(fields=['user', 'task'], name='api_taskinv_user_id_29a833_idx')],
+                'unique_together': {('task', 'user', 'role')},
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
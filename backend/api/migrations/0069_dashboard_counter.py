@@ -0,0 +1,41 @@
+# Generated by Django 4.2.21 on 2026-10-18 00:28
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0068_task_involvement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('open_tasks', 'Tarefas Abertas (por prazo)'), ('completed_tasks', 'Tarefas Concluídas'), ('minutes_tracked', 'Minutos Registados'), ('unprofitable_clients', 'Clientes Não Rentáveis'), ('profit_margin_total', 'Soma das Margens'), ('profit_margin_count', 'Clientes com Margem'), ('rebuilt', 'Reconstruído')], max_length=30, verbose_name='Métrica')),
+                ('day', models.DateField(verbose_name='Dia')),
+                ('value', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=18, verbose_name='Valor')),
+            ],
+            options={
+                'verbose_name': 'Contador do Dashboard',
+                'verbose_name_plural': 'Contadores do Dashboard',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timeentry',
+            index=models.Index(fields=['user', 'date'], name='api_timeent_user_id_3cc252_idx'),
+        ),
+        migrations.AddField(
+            model_name='dashboardcounter',
+            name='organization',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dashboard_counters', to='api.organization', verbose_name='Organização'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dashboardcounter',
+            unique_together={('organization', 'metric', 'day')},
+        ),
+    ]
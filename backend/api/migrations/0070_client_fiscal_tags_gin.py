@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 00:42
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0069_dashboard_counter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['fiscal_tags'], name='client_fiscal_tags_gin', opclasses=['jsonb_path_ops']),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.21 on 2026-10-18 00:45
+
+from django.db import migrations, models
+
+
+# When the current step began: latest step_advanced/workflow_assigned into it (what the
+# overdue and approval jobs used to look up per task), falling back to updated_at
+BACKFILL_SQL = """
+UPDATE api_task t
+SET current_step_entered_at = COALESCE(
+    (
+        SELECT MAX(h.created_at) FROM api_workflowhistory h
+        WHERE h.task_id = t.id AND h.to_step_id = t.current_workflow_step_id
+          AND h.action IN ('step_advanced', 'workflow_assigned')
+    ),
+    t.updated_at
+)
+WHERE t.current_workflow_step_id IS NOT NULL;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0070_client_fiscal_tags_gin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='current_step_entered_at',
+            field=models.DateTimeField(blank=True, help_text='Quando a tarefa entrou no passo atual (mantido em save/enter_workflow_step)', null=True, verbose_name='Entrada no Passo Atual'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('current_workflow_step__isnull', False), ('status__in', ['pending', 'in_progress'])), fields=['current_step_entered_at'], name='task_open_step_entered_idx'),
+        ),
+    ]
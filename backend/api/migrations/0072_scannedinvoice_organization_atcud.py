@@ -0,0 +1,41 @@
+# Generated by Django 4.2.21 on 2026-10-18 02:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BACKFILL_SQL = """
+UPDATE api_scannedinvoice i
+SET organization_id = b.organization_id
+FROM api_invoicebatch b
+WHERE b.id = i.batch_id AND i.organization_id IS NULL;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0071_task_current_step_entered_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scannedinvoice',
+            name='organization',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='scanned_invoices', to='api.organization'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='scannedinvoice',
+            name='organization',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='scanned_invoices', to='api.organization'),
+        ),
+        migrations.AlterField(
+            model_name='scannedinvoice',
+            name='atcud',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='scannedinvoice',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'COMPLETED')), fields=('organization', 'atcud'), name='unique_completed_atcud_per_organization'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from venv import logger
-from django.db import models
+from django.db import connection, models, transaction
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.indexes import GinIndex
 from django.contrib.auth.models import User
 import uuid
 from django.utils import timezone
@@ -10,10 +12,8 @@ import json
 from django.core.exceptions import ValidationError
 from django.db.models import Manager # <--- Make sure this is imported
 import logging
-from django.db.models import OuterRef, Exists, Q
-from django.db.models.expressions import RawSQL
-from django.db.models import Subquery
-from django.db.models.signals import post_save
+from django.db.models import OuterRef, Q
+from django.db.models.signals import post_save, pre_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
 
@@ -103,7 +103,33 @@ def generate_four_digit_id():
     """Generate a random 4-digit number (between 1000 and 9999)"""
     return random.randint(1000, 9999)
 
-class ClientManager(Manager):
+class ClientQuerySet(models.QuerySet):
+    def with_all_tags(self, tags):
+        """
+        Clientes que têm TODAS as tags indicadas: `fiscal_tags @> tags`, servido pelo
+        índice GIN de fiscal_tags. Sem tags devolve o queryset inalterado.
+        """
+        tags = [tag for tag in (tags or []) if tag]
+        return self.filter(fiscal_tags__contains=tags) if tags else self
+
+    def fiscal_tag_histogram(self, limit=None):
+        """{tag: número de clientes} dos clientes do queryset, da mais comum para a menos, calculado em SQL."""
+        subquery, params = self.order_by().values('fiscal_tags').query.sql_with_params()
+        sql = (
+            "SELECT tag, COUNT(*) FROM ("
+            f"{subquery}"
+            ") AS c, jsonb_array_elements_text("
+            "CASE WHEN jsonb_typeof(c.fiscal_tags) = 'array' THEN c.fiscal_tags ELSE '[]'::jsonb END"
+            ") AS tag GROUP BY tag ORDER BY 2 DESC, 1"
+        )
+        if limit:
+            sql += " LIMIT %s"
+            params = (*params, limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return dict(cursor.fetchall())
+
+class ClientManager(Manager.from_queryset(ClientQuerySet)):
     def for_user(self, user: User):
         """
         Returns a base queryset of clients the user is allowed to see.
@@ -173,40 +199,13 @@ class TaskManager(Manager):
             if profile.is_org_admin or profile.can_view_all_tasks:
                 return self.filter(client__organization=profile.organization)
             
-            # Regular users see tasks they are involved in
-            user_id_str = str(user.id)
-
-            # --- THE FIX IS HERE ---
-            # Correctly construct the subquery to check if the user is in the JSONField
-            is_workflow_assignee_subquery = Task.objects.filter(
-                pk=OuterRef('pk'), # Correlate with the outer Task query
-                workflow_step_assignments__contains={f'"{user_id_str}"': ''} # A simplified but effective check if user ID is a value.
-                                                                           # For more robust checking on values in a JSON object, raw SQL is still good.
-                                                                           # Let's use a corrected RawSQL approach that works with Exists.
-            ).annotate(
-                # This subquery is just to link to the outer one, the actual check is in the Exists filter
-                is_assigned=RawSQL("1", [])
-            )
-            # This is a more robust way to check for a value in a JSONB object, if the above `__contains` is not sufficient
-            is_assigned_via_json_subquery = Task.objects.filter(pk=OuterRef('pk')).annotate(
-                is_assigned=Exists(
-                    RawSQL(
-                        "SELECT 1 FROM jsonb_each_text(workflow_step_assignments) vals WHERE vals.value = %s",
-                        (user_id_str,)
-                    )
-                )
-            ).filter(is_assigned=True)
-
-            q_in_workflow = Q(id__in=Subquery(is_assigned_via_json_subquery.values('id')))
-            # --- END OF FIX ---
-            
-            # Combine all involvement conditions for the logged-in user
-            q_user_is_involved = Q(assigned_to=user) | Q(collaborators=user) | q_in_workflow
-            
-            # Return tasks in the user's organization that they are involved in
+            # Regular users see tasks they are involved in (primary, collaborator or
+            # workflow step assignee), read from the maintained TaskInvolvement index.
+            # A semi-join, so no DISTINCT is needed.
             return self.filter(
-                client__organization=profile.organization
-            ).filter(q_user_is_involved).distinct()
+                client__organization=profile.organization,
+                id__in=TaskInvolvement.objects.filter(user=user).values('task_id')
+            )
 
         except Profile.DoesNotExist:
             return self.none() # No profile, no tasks (unless superuser)
@@ -459,10 +458,24 @@ class Client(models.Model):
         verbose_name = "Cliente"
         verbose_name_plural = "Clientes"
         ordering = ["name"]
+        indexes = [
+            # Elegibilidade por tags (fiscal_tags @> [...]); jsonb_path_ops só serve @>, mas é mais pequeno
+            GinIndex(fields=['fiscal_tags'], name='client_fiscal_tags_gin', opclasses=['jsonb_path_ops']),
+        ]
         
     
     def __str__(self):
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Avença e estado gravados (DEFERRED se não foram carregados), para o sinal de rentabilidade
+        instance._saved_fee_state = instance.profitability_fee_state()
+        return instance
+
+    def profitability_fee_state(self):
+        return (self.__dict__.get('monthly_fee', models.DEFERRED), self.__dict__.get('is_active', models.DEFERRED))
        
 class TaskCategory(models.Model):
     """
@@ -630,6 +643,9 @@ class ClientProfitability(models.Model):
         verbose_name_plural = "Rentabilidades de Clientes"
         ordering = ["-year", "-month", "client__name"]
         unique_together = ["client", "year", "month"]  # Garante apenas um registro por cliente/mês
+        indexes = [
+            models.Index(fields=['year', 'month']),
+        ]
     
     def __str__(self):
         return f"{self.client.name} - {self.year}/{self.month:02d} - {'Rentável' if self.is_profitable else 'Não Rentável'}"
@@ -645,8 +661,45 @@ class ClientProfitability(models.Model):
             self.profit_margin = None
             
         self.is_profitable = self.profit > 0 if self.profit is not None else None
-        return self.profit  
-    
+        return self.profit
+
+class ClientProfitabilityDelta(models.Model):
+    """
+    Fila de alterações pendentes à rentabilidade de um cliente/mês.
+    Cada criação, alteração ou remoção de TimeEntry/Expense acrescenta aqui o seu
+    delta; um worker agrupa os deltas por cliente/mês e aplica-os a ClientProfitability.
+    """
+    client = models.ForeignKey(
+        Client,
+        on_delete=models.CASCADE,
+        related_name='profitability_deltas',
+        verbose_name="Cliente"
+    )
+    year = models.IntegerField(verbose_name="Ano")
+    month = models.IntegerField(verbose_name="Mês")
+    minutes_delta = models.IntegerField(default=0, verbose_name="Delta de Minutos")
+    time_cost_delta = models.DecimalField(
+        max_digits=16,
+        decimal_places=6,
+        default=Decimal('0'),
+        verbose_name="Delta do Custo do Tempo"
+    )
+    expenses_delta = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        verbose_name="Delta de Despesas"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Criado em")
+
+    class Meta:
+        verbose_name = "Delta de Rentabilidade"
+        verbose_name_plural = "Deltas de Rentabilidade"
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"{self.client_id} - {self.year}/{self.month:02d} ({self.minutes_delta:+d}min)"
+
 # Add this at the end of your models.py file
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -936,6 +989,12 @@ class Task(models.Model):
         verbose_name="Passo Atual do Fluxo",
         db_index=True # <-- ADD INDEX
     )
+    current_step_entered_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Entrada no Passo Atual",
+        help_text="Quando a tarefa entrou no passo atual (mantido em save/enter_workflow_step)"
+    )
     workflow_step_assignments = models.JSONField(
         default=dict,
         blank=True,
@@ -979,6 +1038,17 @@ class Task(models.Model):
         verbose_name = "Tarefa"
         verbose_name_plural = "Tarefas"
         ordering = ["priority", "deadline"]
+        indexes = [
+            # Keyset pagination keys (ordering column + id)
+            models.Index(fields=['priority', 'id']),
+            models.Index(fields=['deadline', 'id']),
+            models.Index(fields=['created_at', 'id']),
+            # Passos em atraso / aprovações pendentes: um range scan sobre as tarefas abertas com passo
+            models.Index(
+                fields=['current_step_entered_at'], name='task_open_step_entered_idx',
+                condition=Q(current_workflow_step__isnull=False, status__in=['pending', 'in_progress'])
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['source_scanned_invoice'],
@@ -991,6 +1061,22 @@ class Task(models.Model):
     def __str__(self):
         return f"{self.title} - {self.client.name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Passo a que current_step_entered_at se refere (DEFERRED se o campo não foi carregado)
+        instance._stamped_workflow_step_id = instance.__dict__.get('current_workflow_step_id', models.DEFERRED)
+        return instance
+
+    def enter_workflow_step(self, step, at=None):
+        """
+        Coloca a tarefa no passo (ou fora do workflow, com None) e marca a hora de entrada,
+        mesmo que o passo seja o mesmo (reatribuição do workflow). Não grava.
+        """
+        self.current_workflow_step = step
+        self.current_step_entered_at = (at or timezone.now()) if step else None
+        self._stamped_workflow_step_id = self.current_workflow_step_id
+
     def save(self, *args, **kwargs):
         # Se o status mudou para 'completed', registrar a data de conclusão
         if self.status == 'completed' and self.completed_at is None:
@@ -998,16 +1084,31 @@ class Task(models.Model):
         # Se o status mudou de 'completed', limpar a data de conclusão
         elif self.status != 'completed':
             self.completed_at = None
-            
+
+        # Mudanças de passo que não passaram por enter_workflow_step (ex.: API, criação com passo)
+        stamped_step_id = getattr(self, '_stamped_workflow_step_id', None)
+        if stamped_step_id is not models.DEFERRED:
+            if self.current_workflow_step_id is None:
+                self.current_step_entered_at = None
+            elif self.current_workflow_step_id != stamped_step_id or self.current_step_entered_at is None:
+                self.current_step_entered_at = timezone.now()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and {'current_workflow_step', 'current_workflow_step_id'} & set(update_fields):
+                kwargs['update_fields'] = {*update_fields, 'current_step_entered_at'}
+
         super(Task, self).save(*args, **kwargs)
+        self._stamped_workflow_step_id = self.current_workflow_step_id
 
     # ENHANCED: New methods for multi-user access control
-    def get_all_assigned_users(self):
+    def get_all_assigned_users(self, users_by_id=None):
         """
         Returns all users who have access to this task:
         - Primary assignee
         - Collaborators
         - Users assigned to workflow steps
+
+        `users_by_id` (id -> User) avoids the workflow step user query when the
+        users were already loaded for a whole page of tasks.
         """
         users = set()
         
@@ -1025,10 +1126,19 @@ class Task(models.Model):
                 if user_id and str(user_id).isdigit()
             ]
             if step_user_ids:
-                workflow_users = User.objects.filter(id__in=step_user_ids)
-                users.update(workflow_users)
+                if users_by_id is not None:
+                    users.update(users_by_id[int(user_id)] for user_id in step_user_ids if int(user_id) in users_by_id)
+                else:
+                    workflow_users = User.objects.filter(id__in=step_user_ids)
+                    users.update(workflow_users)
         
         return list(users)
+
+    def has_collaborator(self, user):
+        """Uses the prefetched collaborators when available (list responses) instead of a query."""
+        if 'collaborators' in getattr(self, '_prefetched_objects_cache', {}):
+            return any(collaborator.id == user.id for collaborator in self.collaborators.all())
+        return self.collaborators.filter(id=user.id).exists()
     
     def can_user_access_task(self, user):
         """
@@ -1039,7 +1149,7 @@ class Task(models.Model):
             return True
         
         # Collaborator
-        if self.collaborators.filter(id=user.id).exists():
+        if self.has_collaborator(user):
             return True
         
         # Workflow step assignment
@@ -1055,24 +1165,14 @@ class Task(models.Model):
     
     def get_user_role_in_task(self, user):
         """
-        Get the user's role in this task
+        Get the user's role in this task (from the TaskInvolvement index)
         Returns: 'primary', 'collaborator', 'workflow_step', None
         """
-        if self.assigned_to == user:
-            return 'primary'
-        
-        if self.collaborators.filter(id=user.id).exists():
-            return 'collaborator'
-        
-        if self.workflow_step_assignments:
-            assigned_user_ids = [
-                str(user_id) for user_id in self.workflow_step_assignments.values()
-                if user_id
-            ]
-            if str(user.id) in assigned_user_ids:
-                return 'workflow_step'
-        
-        return None
+        if 'involvements' in getattr(self, '_prefetched_objects_cache', {}):
+            roles = {involvement.role for involvement in self.involvements.all() if involvement.user_id == user.id}
+        else:
+            roles = set(self.involvements.filter(user=user).values_list('role', flat=True))
+        return TaskInvolvement.main_role(roles)
     
     def get_workflow_progress_data(self):
         """
@@ -1128,7 +1228,10 @@ class Task(models.Model):
         """Retorna os próximos passos disponíveis de forma eficiente."""
         if not self.current_workflow_step:
             if self.workflow:
-                first_steps = self.workflow.steps.filter(order=1)
+                if 'steps' in getattr(self.workflow, '_prefetched_objects_cache', {}):
+                    first_steps = [step for step in self.workflow.steps.all() if step.order == 1]
+                else:
+                    first_steps = self.workflow.steps.filter(order=1)
                 return [
                     {
                         'id': str(step.id), 
@@ -1154,6 +1257,99 @@ class Task(models.Model):
                 for step in next_steps
         ]
 
+class TaskInvolvement(models.Model):
+    """
+    Índice materializado de quem está envolvido em cada tarefa: responsável principal,
+    colaborador ou responsável de um passo do workflow (workflow_step_assignments).
+    Mantido pelos signals de Task e de Task.collaborators; o TaskManager.for_user lê
+    daqui com um join indexado em vez de percorrer o JSON de cada tarefa.
+    """
+    ROLE_CHOICES = [
+        ('primary', 'Responsável Principal'),
+        ('collaborator', 'Colaborador'),
+        ('workflow_step', 'Responsável de Passo'),
+    ]
+    # Ordem de precedência quando o utilizador tem mais do que um papel
+    ROLE_PRIORITY = ('primary', 'collaborator', 'workflow_step')
+
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='involvements', verbose_name="Tarefa")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='task_involvements', verbose_name="Utilizador")
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES, verbose_name="Papel")
+
+    class Meta:
+        verbose_name = "Envolvimento em Tarefa"
+        verbose_name_plural = "Envolvimentos em Tarefas"
+        unique_together = ('task', 'user', 'role')
+        indexes = [
+            models.Index(fields=['user', 'task']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.task_id} ({self.role})"
+
+    @classmethod
+    def main_role(cls, roles):
+        return next((role for role in cls.ROLE_PRIORITY if role in roles), None)
+
+    @staticmethod
+    def workflow_step_user_ids(task):
+        """IDs (existentes) dos utilizadores atribuídos a passos em workflow_step_assignments."""
+        ids = {
+            int(user_id) for user_id in (task.workflow_step_assignments or {}).values()
+            if user_id and str(user_id).isdigit()
+        }
+        return set(User.objects.filter(id__in=ids).values_list('id', flat=True)) if ids else set()
+
+    @classmethod
+    def sync_task(cls, task, roles=('primary', 'workflow_step')):
+        """
+        Acerta as linhas da tarefa para os papéis indicados, gravando só as diferenças.
+        Os colaboradores são mantidos diretamente pelo signal m2m_changed.
+        """
+        expected = set()
+        if 'primary' in roles and task.assigned_to_id:
+            expected.add((task.assigned_to_id, 'primary'))
+        if 'workflow_step' in roles:
+            expected.update((user_id, 'workflow_step') for user_id in cls.workflow_step_user_ids(task))
+        if 'collaborator' in roles:
+            expected.update(
+                (user_id, 'collaborator')
+                for user_id in Task.collaborators.through.objects.filter(task_id=task.pk).values_list('user_id', flat=True)
+            )
+
+        current = set(cls.objects.filter(task_id=task.pk, role__in=roles).values_list('user_id', 'role'))
+        stale = current - expected
+        if stale:
+            condition = Q()
+            for user_id, role in stale:
+                condition |= Q(user_id=user_id, role=role)
+            cls.objects.filter(condition, task_id=task.pk).delete()
+        missing = expected - current
+        if missing:
+            cls.objects.bulk_create(
+                [cls(task_id=task.pk, user_id=user_id, role=role) for user_id, role in missing],
+                ignore_conflicts=True
+            )
+
+    @classmethod
+    def add_for_new_tasks(cls, tasks):
+        """Linhas de tarefas criadas com bulk_create, que não dispara o post_save (sem colaboradores)."""
+        step_user_ids = {
+            task.pk: {
+                int(user_id) for user_id in (task.workflow_step_assignments or {}).values()
+                if user_id and str(user_id).isdigit()
+            }
+            for task in tasks
+        }
+        requested = set().union(*step_user_ids.values()) if step_user_ids else set()
+        existing = set(User.objects.filter(id__in=requested).values_list('id', flat=True)) if requested else set()
+        rows = []
+        for task in tasks:
+            if task.assigned_to_id:
+                rows.append(cls(task_id=task.pk, user_id=task.assigned_to_id, role='primary'))
+            rows.extend(cls(task_id=task.pk, user_id=user_id, role='workflow_step') for user_id in step_user_ids[task.pk] & existing)
+        cls.objects.bulk_create(rows, ignore_conflicts=True)
+
 class FiscalObligationDefinition(models.Model):
     PERIODICITY_CHOICES = [
         ('MONTHLY', 'Mensal'),
@@ -1378,6 +1574,7 @@ class WorkflowNotification(models.Model):
             models.Index(fields=['user', 'is_read', 'is_archived']), # <-- Add 'is_archived' for better query performance on the main list
             models.Index(fields=['task', 'notification_type']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['user', 'is_archived', 'created_at', 'id']),
         ]
     
     def __str__(self):
@@ -1489,7 +1686,11 @@ class TimeEntry(models.Model):
         verbose_name = "Registro de Tempo"
         verbose_name_plural = "Registros de Tempo"
         ordering = ["-date", "-created_at"]
-    
+        indexes = [
+            models.Index(fields=['date', 'id']),
+            models.Index(fields=['user', 'date']),
+        ]
+
     def __str__(self):
         step_info = f" - {self.workflow_step.name}" if self.workflow_step else ""
         return f"{self.client.name} - {self.minutes_spent}min - {self.date}{step_info}"
@@ -1986,6 +2187,26 @@ class FiscalSystemSettings(models.Model):
         
         return recipients
     
+class InvoiceBatchQuerySet(models.QuerySet):
+    def with_invoice_stats(self):
+        """
+        Anota invoice_count e invoices_<estado> (uma contagem por estado de ScannedInvoice,
+        em minúsculas), calculados em SQL com contagens condicionais sobre um único join.
+        """
+        counts = {'invoice_count': models.Count('invoices')}
+        for status, _ in ScannedInvoice.STATUS_CHOICES:
+            counts[f'invoices_{status.lower()}'] = models.Count('invoices', filter=Q(invoices__status=status))
+        return self.annotate(**counts)
+
+
+class ScannedInvoiceQuerySet(models.QuerySet):
+    def with_task_ids(self):
+        """Anota task_ids: lista dos ids das tarefas geradas pela fatura (ARRAY(subquery))."""
+        return self.annotate(task_ids=ArraySubquery(
+            Task.objects.filter(source_scanned_invoice=OuterRef('pk')).order_by().values('id')
+        ))
+
+
 # In api/models.py
 class InvoiceBatch(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -1994,6 +2215,8 @@ class InvoiceBatch(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     description = models.CharField(max_length=255, blank=True, null=True, verbose_name="Descrição do Lote")
 
+    objects = Manager.from_queryset(InvoiceBatchQuerySet)()
+
     class Meta:
         verbose_name = "Lote de Faturas"
         verbose_name_plural = "Lotes de Faturas"
@@ -2035,8 +2258,13 @@ class ScannedInvoice(models.Model):
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     batch = models.ForeignKey(InvoiceBatch, on_delete=models.CASCADE, related_name="invoices")
+    # Desnormalizado do lote: suporta a unicidade do ATCUD por organização sem o join
+    organization = models.ForeignKey(
+        'Organization', on_delete=models.CASCADE, related_name="scanned_invoices", editable=False
+    )
     original_file = models.FileField(upload_to='invoice_uploads/%Y/%m/')
     original_filename = models.CharField(max_length=255, blank=True, null=True)    
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True, help_text="SHA-256 do ficheiro enviado, calculado durante o upload.")
     # Status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING', db_index=True)
     processing_log = models.TextField(blank=True, null=True, help_text="Log de processamento ou mensagem de erro.")
@@ -2049,7 +2277,7 @@ class ScannedInvoice(models.Model):
     doc_type = models.CharField(max_length=5, choices=DOC_TYPE_CHOICES, blank=True, null=True)
     doc_date = models.DateField(null=True, blank=True)
     doc_uid = models.CharField(max_length=100, blank=True, null=True)
-    atcud = models.CharField(max_length=100, blank=True, null=True, unique=True)
+    atcud = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     taxable_amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
     vat_amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
     gross_total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
@@ -2060,13 +2288,33 @@ class ScannedInvoice(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = Manager.from_queryset(ScannedInvoiceQuerySet)()
+
     class Meta:
         verbose_name = "Fatura Digitalizada"
         verbose_name_plural = "Faturas Digitalizadas"
         ordering = ['-created_at']
+        constraints = [
+            # Deteção de duplicados pelo próprio UPDATE/INSERT, também entre workers em paralelo
+            models.UniqueConstraint(
+                fields=['organization', 'atcud'],
+                condition=Q(status='COMPLETED'),
+                name='unique_completed_atcud_per_organization',
+            ),
+        ]
 
     def __str__(self):
         return f"Fatura {self.atcud or self.id}"
+
+    def save(self, *args, **kwargs):
+        if self.organization_id is None and self.batch_id is not None:
+            self.organization_id = self.batch.organization_id
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def is_duplicate_atcud_error(cls, error: Exception) -> bool:
+        """Se o IntegrityError foi causado pela unique_completed_atcud_per_organization."""
+        return 'unique_completed_atcud_per_organization' in str(error)
     
 class SAFTFile(models.Model):
     """
@@ -2086,6 +2334,7 @@ class SAFTFile(models.Model):
     # File Storage
     file = models.FileField(upload_to='saft_files/%Y/%m/', verbose_name="Ficheiro SAFT")
     original_filename = models.CharField(max_length=255, verbose_name="Nome Original do Ficheiro")
+    content_hash = models.CharField(max_length=64, blank=True, null=True, verbose_name="Hash do Conteúdo", help_text="SHA-256 do ficheiro enviado, calculado durante o upload.")
     
     # Processing Status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING', db_index=True)
@@ -2109,10 +2358,44 @@ class SAFTFile(models.Model):
         verbose_name = "Ficheiro SAFT-PT"
         verbose_name_plural = "Ficheiros SAFT-PT"
         ordering = ['-uploaded_at']
+        indexes = [
+            models.Index(fields=['organization', 'content_hash']),
+        ]
 
     def __str__(self):
         return f"SAFT para {self.organization.name} ({self.fiscal_year or 'N/A'}) - {self.get_status_display()}"
 
+class SAFTAggregate(models.Model):
+    """
+    Agregados de um ficheiro SAF-T (por mês, cliente, taxa de IVA e tipo de documento),
+    extraídos durante o parsing para consulta sem voltar a ler o XML.
+    """
+    DIMENSION_CHOICES = [
+        ('month', 'Mês'),
+        ('customer', 'Cliente'),
+        ('tax_rate', 'Taxa de IVA'),
+        ('doc_type', 'Tipo de Documento'),
+    ]
+
+    saft_file = models.ForeignKey(SAFTFile, on_delete=models.CASCADE, related_name="aggregates", verbose_name="Ficheiro SAFT")
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES, verbose_name="Dimensão")
+    key = models.CharField(max_length=100, verbose_name="Chave", help_text="AAAA-MM, NIF do cliente, Código:Taxa ou tipo de documento.")
+    label = models.CharField(max_length=255, blank=True, null=True, verbose_name="Descrição")
+    document_count = models.IntegerField(default=0, verbose_name="Documentos")
+    cancelled_count = models.IntegerField(default=0, verbose_name="Documentos Anulados")
+    net_total = models.DecimalField(max_digits=16, decimal_places=2, default=0, verbose_name="Total Líquido")
+    tax_total = models.DecimalField(max_digits=16, decimal_places=2, default=0, verbose_name="Total de Imposto")
+    gross_total = models.DecimalField(max_digits=16, decimal_places=2, default=0, verbose_name="Total Bruto")
+
+    class Meta:
+        verbose_name = "Agregado SAFT"
+        verbose_name_plural = "Agregados SAFT"
+        unique_together = ('saft_file', 'dimension', 'key')
+        ordering = ['dimension', 'key']
+
+    def __str__(self):
+        return f"{self.get_dimension_display()} {self.key}: {self.gross_total}"
+
 class OrganizationActionLog(models.Model):
     organization = models.ForeignKey('Organization', on_delete=models.CASCADE, related_name='action_logs')
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='action_logs')
@@ -2122,10 +2405,50 @@ class OrganizationActionLog(models.Model):
     related_object_id = models.CharField(max_length=64, blank=True, null=True)
     related_object_type = models.CharField(max_length=64, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['organization', 'timestamp', 'id']),
+        ]
+
     def __str__(self):
         user_str = self.user.username if self.user else 'Desconhecido'
         return f"[{self.timestamp:%Y-%m-%d %H:%M}] {self.organization.name} - {user_str}: {self.action_type}"
 
+class DashboardCounter(models.Model):
+    """
+    Contadores do dashboard por organização, mantidos incrementalmente pelos sinais de
+    Task, TimeEntry e ClientProfitability (ver DashboardCounterService). Cada linha é um
+    valor de uma métrica num dia: tarefas abertas pelo dia do prazo, tarefas concluídas e
+    minutos registados por dia, e rentabilidade por mês (dia 1).
+    """
+    METRIC_CHOICES = [
+        ('open_tasks', 'Tarefas Abertas (por prazo)'),
+        ('completed_tasks', 'Tarefas Concluídas'),
+        ('minutes_tracked', 'Minutos Registados'),
+        ('unprofitable_clients', 'Clientes Não Rentáveis'),
+        ('profit_margin_total', 'Soma das Margens'),
+        ('profit_margin_count', 'Clientes com Margem'),
+        ('rebuilt', 'Reconstruído'),
+    ]
+
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='dashboard_counters',
+        verbose_name="Organização"
+    )
+    metric = models.CharField(max_length=30, choices=METRIC_CHOICES, verbose_name="Métrica")
+    day = models.DateField(verbose_name="Dia")
+    value = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0'), verbose_name="Valor")
+
+    class Meta:
+        verbose_name = "Contador do Dashboard"
+        verbose_name_plural = "Contadores do Dashboard"
+        unique_together = ('organization', 'metric', 'day')
+
+    def __str__(self):
+        return f"{self.organization_id} {self.metric} {self.day}: {self.value}"
+
 @receiver(post_save, sender=Task)
 def auto_dismiss_notifications_on_task_completion(sender, instance, created, **kwargs):
     """
@@ -2142,4 +2465,118 @@ def auto_dismiss_notifications_on_task_completion(sender, instance, created, **k
             notif.is_read = True
             notif.is_archived = True
             notif.read_at = now
-            notif.save(update_fields=['is_read', 'is_archived', 'read_at'])
\ No newline at end of file
+            notif.save(update_fields=['is_read', 'is_archived', 'read_at'])
+
+@receiver(pre_save, sender=WorkflowNotification)
+def snapshot_notification_counter_state(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Guarda o estado anterior de uma notificação para o delta dos contadores de não lidas."""
+    if raw:
+        return
+    from .services.notification_counter_service import NotificationCounterService
+    NotificationCounterService.snapshot(instance, update_fields)
+
+@receiver(post_save, sender=WorkflowNotification)
+def update_notification_counters_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    from .services.notification_counter_service import NotificationCounterService
+    NotificationCounterService.record_change(instance)
+
+@receiver(pre_save, sender=TimeEntry)
+@receiver(pre_save, sender=Expense)
+def snapshot_profitability_state(sender, instance, **kwargs):
+    """Guarda o estado anterior de um TimeEntry/Expense para calcular o delta de rentabilidade."""
+    from .services.profitability_service import ProfitabilityDeltaQueue
+    ProfitabilityDeltaQueue.snapshot(instance)
+
+@receiver(post_save, sender=TimeEntry)
+@receiver(post_save, sender=Expense)
+def enqueue_profitability_delta_on_save(sender, instance, created, **kwargs):
+    from .services.profitability_service import ProfitabilityDeltaQueue
+    ProfitabilityDeltaQueue.enqueue_for_instance(instance)
+
+@receiver(post_delete, sender=TimeEntry)
+@receiver(post_delete, sender=Expense)
+def enqueue_profitability_delta_on_delete(sender, instance, **kwargs):
+    from .services.profitability_service import ProfitabilityDeltaQueue
+    ProfitabilityDeltaQueue.enqueue_for_instance(instance, deleted=True)
+
+@receiver(post_save, sender=Client)
+def refresh_profitability_on_client_fee_change(sender, instance, created, update_fields=None, **kwargs):
+    """Uma avença nova ou alterada é refletida no mês corrente sem esperar pela reconciliação."""
+    if update_fields is not None and not {'monthly_fee', 'is_active'} & set(update_fields):
+        return
+    saved = getattr(instance, '_saved_fee_state', None)
+    instance._saved_fee_state = instance.profitability_fee_state()
+    # Um save completo sem mudança na avença nem no estado não mexe na rentabilidade
+    if not created and saved == instance._saved_fee_state and models.DEFERRED not in saved:
+        return
+    if not instance.is_active:
+        return
+    from .services.profitability_service import ProfitabilityDeltaQueue
+    today = timezone.now().date()
+    ProfitabilityDeltaQueue.enqueue([(instance.id, today.year, today.month, 0, Decimal('0'), Decimal('0'))], touch=True)
+
+@receiver(post_save, sender=Task)
+def sync_task_involvements(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Mantém o TaskInvolvement quando muda o responsável ou os responsáveis dos passos."""
+    if raw or (update_fields is not None and not {'assigned_to', 'workflow_step_assignments'} & set(update_fields)):
+        return
+    TaskInvolvement.sync_task(instance)
+
+@receiver(m2m_changed, sender=Task.collaborators.through)
+def sync_collaborator_involvements(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # reverse=True: user.collaborative_tasks.add(...) (instance é o User, pk_set são tarefas)
+    owner = {'user_id': instance.pk} if reverse else {'task_id': instance.pk}
+    other = 'task_id' if reverse else 'user_id'
+    if action == 'post_add' and pk_set:
+        TaskInvolvement.objects.bulk_create(
+            [TaskInvolvement(role='collaborator', **owner, **{other: pk}) for pk in pk_set],
+            ignore_conflicts=True
+        )
+    elif action == 'post_remove' and pk_set:
+        TaskInvolvement.objects.filter(role='collaborator', **owner, **{f'{other}__in': pk_set}).delete()
+    elif action == 'post_clear':
+        TaskInvolvement.objects.filter(role='collaborator', **owner).delete()
+
+@receiver(pre_save, sender=Task)
+@receiver(pre_save, sender=TimeEntry)
+def snapshot_dashboard_state(sender, instance, raw=False, **kwargs):
+    """Guarda o estado anterior de uma Task/TimeEntry para o delta dos contadores do dashboard."""
+    if raw:
+        return
+    from .services.dashboard_counter_service import DashboardCounterService
+    DashboardCounterService.snapshot(instance)
+
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=TimeEntry)
+def update_dashboard_counters_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    from .services.dashboard_counter_service import DashboardCounterService
+    DashboardCounterService.record_change(instance)
+
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=TimeEntry)
+def update_dashboard_counters_on_delete(sender, instance, **kwargs):
+    from .services.dashboard_counter_service import DashboardCounterService
+    DashboardCounterService.record_change(instance, deleted=True)
+
+@receiver(post_save, sender=ClientProfitability)
+@receiver(post_delete, sender=ClientProfitability)
+def refresh_dashboard_profitability(sender, instance, **kwargs):
+    """Os registos gravados em bloco (ProfitabilityEngine/ProfitabilityDeltaQueue) fazem o mesmo explicitamente."""
+    if kwargs.get('raw'):
+        return
+    from .services.dashboard_counter_service import DashboardCounterService
+    DashboardCounterService.schedule_profitability_refresh([(instance.year, instance.month)], [instance.client_id])
+
+@receiver(post_save, sender=NotificationTemplate)
+@receiver(post_delete, sender=NotificationTemplate)
+def invalidate_notification_templates(sender, instance, **kwargs):
+    """Limpa já a cache deste processo; a versão partilhada só muda depois do commit."""
+    from .services.notification_template_service import NotificationTemplateRegistry
+    NotificationTemplateRegistry.invalidate(instance.organization_id, shared=False)
+    transaction.on_commit(lambda: NotificationTemplateRegistry.invalidate(instance.organization_id))
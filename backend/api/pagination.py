@@ -0,0 +1,225 @@
+# api/pagination.py
+
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import uuid
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Keyset (cursor) pagination that follows the ordering the view already applied.
+
+    The ordering of the queryset (from the view's `ordering` parameter or the model's
+    Meta.ordering) is completed with the primary key as a tie-breaker, and the cursor
+    holds the values of every ordering column of the last row. The next page is
+    fetched with a `WHERE (a, b, id) > (...)` style filter instead of an OFFSET, so
+    the cost of a page does not grow with its position in the table.
+
+    Query parameters: `cursor`, and `page_size` (or `limit`, used by the frontend).
+    """
+    page_size = 100
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_params = ('page_size', 'limit')
+    invalid_cursor_message = 'Cursor inválido.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+
+        position, reverse = self.decode_cursor(request)
+        ordering = self.reversed_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*self.order_expressions(ordering))
+        if position is not None:
+            queryset = queryset.filter(self.after_position(queryset.model, ordering, position))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Coming from a cursor means there are rows on the other side of this page
+        self.has_next = has_more if not reverse else True
+        self.has_previous = (position is not None) if not reverse else has_more
+        self.first_position = self.row_position(rows[0]) if rows else None
+        self.last_position = self.row_position(rows[-1]) if rows else None
+        if not rows and position is not None:
+            # Empty page: keep the cursor position so the user can come back
+            self.first_position = self.last_position = position
+            self.has_next, self.has_previous = reverse, not reverse
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('page_size', self.page_size),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'page_size': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        for param in self.page_size_query_params:
+            value = request.query_params.get(param)
+            if value:
+                try:
+                    size = int(value)
+                except ValueError:
+                    continue
+                if size > 0:
+                    return min(size, self.max_page_size)
+        return self.page_size
+
+    # --- Ordering ---
+
+    def get_ordering(self, queryset):
+        """Ordering of the queryset as field paths, always ending with the primary key."""
+        ordering = list(queryset.query.order_by) or (
+            list(queryset.model._meta.ordering) if queryset.query.default_ordering else []
+        )
+        pk_name = queryset.model._meta.pk.name
+        fields = []
+        for item in ordering:
+            if not isinstance(item, str) or item == '?':
+                # Expressions cannot be turned into a cursor; fall back to the primary key
+                return [f'-{pk_name}']
+            descending = item.startswith('-')
+            name = item.lstrip('-')
+            name = pk_name if name == 'pk' else name
+            fields.append(('-' if descending else '') + name)
+            if name == pk_name:
+                # The primary key is unique, later columns never decide the order
+                return fields
+        # Same direction as the last column so a single index scan can serve the page
+        descending = bool(fields) and fields[-1].startswith('-')
+        fields.append(('-' if descending else '') + pk_name)
+        return fields
+
+    @staticmethod
+    def reversed_ordering(ordering):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+    @staticmethod
+    def order_expressions(ordering):
+        # NULLs sort last ascending and first descending (the PostgreSQL default), as after_position assumes
+        return [
+            F(field[1:]).desc(nulls_first=True) if field.startswith('-') else F(field).asc(nulls_last=True)
+            for field in ordering
+        ]
+
+    @staticmethod
+    def _is_nullable(model, path):
+        for part in path.split('__'):
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return True
+            if field.null:
+                return True
+            if field.is_relation:
+                model = field.related_model
+        return False
+
+    @classmethod
+    def after_position(cls, model, ordering, position):
+        """
+        Rows strictly after `position` in `ordering`:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND id > z).
+        """
+        condition = Q(pk__in=[])
+        equal_so_far = Q()
+        for field, value in zip(ordering, position):
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            if value is None:
+                after = Q(**{f'{name}__isnull': False}) if descending else Q(pk__in=[])
+                equal = Q(**{f'{name}__isnull': True})
+            else:
+                after = Q(**{f'{name}__lt' if descending else f'{name}__gt': value})
+                if not descending and cls._is_nullable(model, name):
+                    after |= Q(**{f'{name}__isnull': True})
+                equal = Q(**{name: value})
+            condition |= equal_so_far & after
+            equal_so_far &= equal
+
+        # Redundant range on the leading column lets the database start an index scan at the cursor
+        leading, value = ordering[0], position[0]
+        name = leading.lstrip('-')
+        if value is not None and not cls._is_nullable(model, name):
+            condition &= Q(**{f'{name}__lte' if leading.startswith('-') else f'{name}__gte': value})
+        return condition
+
+    # --- Cursor encoding ---
+
+    def row_position(self, row):
+        position = []
+        for field in self.ordering:
+            value = row
+            for part in field.lstrip('-').split('__'):
+                value = getattr(value, part, None) if value is not None else None
+            position.append(self._encode_value(value))
+        return position
+
+    @staticmethod
+    def _encode_value(value):
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, (uuid.UUID, decimal.Decimal)):
+            return str(value)
+        if hasattr(value, 'pk'):
+            return KeysetCursorPagination._encode_value(value.pk)
+        return value
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position, reverse = payload['p'], bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            # Ordering changed since the cursor was issued
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_position is None:
+            return None
+        return self.encode_cursor(self.first_position, reverse=True)
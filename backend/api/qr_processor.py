@@ -1,21 +1,41 @@
 # Updated qr_processor.py - Fix the process_image method to handle bytes
 
 import cv2
+import fitz  # PyMuPDF
 import numpy as np
+import os
 from PIL import Image, ImageEnhance
 import pyzbar.pyzbar as pyzbar
 import io
 import base64
 import re
-from typing import Dict, Optional, List, Tuple
+from typing import Callable, Dict, Iterator, Optional, List, Tuple
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 class EnhancedQRProcessor:
     """Enhanced QR Code processor for Portuguese invoice receipts."""
     
-    def __init__(self):
+    # Tempo máximo (segundos) gasto a procurar um QR Code numa imagem
+    DEFAULT_TIME_BUDGET = 8.0
+    # Lado máximo da versão reduzida usada nas primeiras tentativas
+    DOWNSCALE_MAX_SIDE = 1200
+    # Margem (fração do lado do QR) à volta da região detetada pelo OpenCV
+    ROI_MARGIN = 0.25
+
+    # PDFs: DPI de renderização, limite de píxeis por renderização e fração inferior da página
+    PDF_RENDER_DPI = 200
+    PDF_MAX_RENDER_PIXELS = 12_000_000
+    PDF_BOTTOM_FRACTION = 0.4
+    PDF_MAX_PAGES = 20
+    PDF_MIN_IMAGE_SIDE = 60
+    # O orçamento de um PDF é um múltiplo do orçamento por imagem
+    PDF_BUDGET_FACTOR = 3
+
+    def __init__(self, time_budget: Optional[float] = None):
+        self.time_budget = self.DEFAULT_TIME_BUDGET if time_budget is None else time_budget
         self.qr_patterns = {
             # Portuguese AT QR Code pattern
             'atcud': r'([A-Z0-9]{8}-[0-9]+)',
@@ -24,135 +44,199 @@ class EnhancedQRProcessor:
             'date': r'(\d{4}-\d{2}-\d{2})',
             'doc_type': r'(FS|FT|FR|ND|NC)',
         }
-    
-    def preprocess_image(self, image: np.ndarray) -> List[np.ndarray]:
-        """
-        Create multiple preprocessed versions of the image to improve QR detection.
-        """
-        processed_images = []
-        
-        # Original image
-        processed_images.append(image)
-        
-        # Convert to grayscale if not already
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = image.copy()
-        
-        processed_images.append(gray)
-        
-        # Apply different enhancement techniques
-        techniques = [
-            # 1. Histogram equalization
-            lambda img: cv2.equalizeHist(img),
-            
-            # 2. CLAHE (Contrast Limited Adaptive Histogram Equalization)
-            lambda img: cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8)).apply(img),
-            
-            # 3. Gaussian blur + threshold
-            lambda img: cv2.threshold(cv2.GaussianBlur(img, (5, 5), 0), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1],
-            
-            # 4. Adaptive threshold
-            lambda img: cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2),
-            
-            # 5. Morphological operations
-            lambda img: cv2.morphologyEx(
+
+    def _enhancement_techniques(self) -> List[Tuple[str, Callable[[np.ndarray], np.ndarray]]]:
+        """Técnicas de realce aplicadas a uma imagem em tons de cinzento, da mais barata para a mais cara."""
+        return [
+            ('equalize', lambda img: cv2.equalizeHist(img)),
+            ('clahe', lambda img: cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8)).apply(img)),
+            ('otsu', lambda img: cv2.threshold(cv2.GaussianBlur(img, (5, 5), 0), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]),
+            ('adaptive', lambda img: cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)),
+            ('contrast', lambda img: cv2.convertScaleAbs(img, alpha=1.5, beta=30)),
+            ('gamma_0.7', lambda img: self._adjust_gamma(img, 0.7)),
+            ('gamma_1.3', lambda img: self._adjust_gamma(img, 1.3)),
+            ('morph_close', lambda img: cv2.morphologyEx(
                 cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2),
                 cv2.MORPH_CLOSE,
                 cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-            ),
-            
-            # 6. Bilateral filter + threshold
-            lambda img: cv2.threshold(cv2.bilateralFilter(img, 11, 17, 17), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1],
-            
-            # 7. Contrast enhancement
-            lambda img: cv2.convertScaleAbs(img, alpha=1.5, beta=30),
-            
-            # 8. Gamma correction
-            lambda img: self._adjust_gamma(img, 0.7),
-            lambda img: self._adjust_gamma(img, 1.3),
+            )),
+            ('bilateral_otsu', lambda img: cv2.threshold(cv2.bilateralFilter(img, 11, 17, 17), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]),
         ]
-        
-        for technique in techniques:
+
+    def preprocess_image(self, image: np.ndarray) -> List[np.ndarray]:
+        """
+        Create multiple preprocessed versions of the image to improve QR detection.
+        Computes every variant upfront; detect_qr_codes uses the lazy staged pipeline instead.
+        """
+        gray = self._to_gray(image)
+        processed_images = [image, gray]
+        for name, technique in self._enhancement_techniques():
             try:
-                enhanced = technique(gray)
-                processed_images.append(enhanced)
+                processed_images.append(technique(gray))
             except Exception as e:
-                logger.debug(f"Enhancement technique failed: {e}")
-                continue
-        
+                logger.debug(f"Enhancement technique {name} failed: {e}")
         return processed_images
-    
+
     def _adjust_gamma(self, image: np.ndarray, gamma: float = 1.0) -> np.ndarray:
         """Apply gamma correction to the image."""
         inv_gamma = 1.0 / gamma
         table = np.array([((i / 255.0) ** inv_gamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
         return cv2.LUT(image, table)
-    
-    def detect_qr_codes(self, image: np.ndarray) -> List[str]:
+
+    @staticmethod
+    def _to_gray(image: np.ndarray) -> np.ndarray:
+        if len(image.shape) == 3:
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
+
+    @staticmethod
+    def _resize(image: np.ndarray, scale: float) -> np.ndarray:
+        height, width = image.shape[:2]
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+        return cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=interpolation)
+
+    @staticmethod
+    def _rotate(image: np.ndarray, rotation: int) -> np.ndarray:
+        codes = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+        return cv2.rotate(image, codes[rotation]) if rotation in codes else image
+
+    @staticmethod
+    def is_atcud_payload(qr_data: str) -> bool:
+        """QR Code da AT: campos separados por '*' com NIF do emitente (A:) e ATCUD (H:)."""
+        return 'A:' in qr_data and 'H:' in qr_data and '*' in qr_data
+
+    @staticmethod
+    def _decode(image: np.ndarray) -> List[str]:
+        """Descodifica os QR Codes de uma imagem, tentando codificações alternativas a UTF-8."""
+        decoded = []
+        for qr in pyzbar.decode(image):
+            for encoding in ('utf-8', 'latin-1', 'cp1252'):
+                try:
+                    qr_data = qr.data.decode(encoding)
+                    break
+                except UnicodeDecodeError:
+                    continue
+            else:
+                continue
+            if qr_data and qr_data not in decoded:
+                decoded.append(qr_data)
+        return decoded
+
+    def _locate_qr_region(self, gray: np.ndarray, scale: float) -> Optional[Tuple[int, int, int, int]]:
         """
-        Detect and decode QR codes from an image using multiple preprocessing techniques.
+        Localiza o QR Code com o detetor do OpenCV numa versão reduzida (`scale`) e devolve
+        a região (x0, y0, x1, y1) correspondente na imagem original, com margem.
         """
-        qr_data_list = []
-        processed_images = self.preprocess_image(image)
-        
-        for i, processed_img in enumerate(processed_images):
-            try:
-                # Try different scales and rotations
-                scales = [1.0, 0.8, 1.2, 0.6, 1.5]
-                rotations = [0, 90, 180, 270]
-                
-                for scale in scales:
-                    for rotation in rotations:
-                        test_img = processed_img.copy()
-                        
-                        # Scale the image
-                        if scale != 1.0:
-                            height, width = test_img.shape[:2]
-                            new_width = int(width * scale)
-                            new_height = int(height * scale)
-                            test_img = cv2.resize(test_img, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
-                        
-                        # Rotate the image
-                        if rotation != 0:
-                            height, width = test_img.shape[:2]
-                            center = (width // 2, height // 2)
-                            rotation_matrix = cv2.getRotationMatrix2D(center, rotation, 1.0)
-                            test_img = cv2.warpAffine(test_img, rotation_matrix, (width, height))
-                        
-                        # Decode QR codes
-                        qr_codes = pyzbar.decode(test_img)
-                        
-                        for qr in qr_codes:
-                            try:
-                                qr_data = qr.data.decode('utf-8')
-                                if qr_data and qr_data not in qr_data_list:
-                                    qr_data_list.append(qr_data)
-                                    logger.info(f"QR Code found with preprocessing {i}, scale {scale}, rotation {rotation}: {qr_data[:50]}...")
-                            except UnicodeDecodeError:
-                                try:
-                                    # Try different encodings
-                                    for encoding in ['latin-1', 'cp1252', 'iso-8859-1']:
-                                        qr_data = qr.data.decode(encoding)
-                                        if qr_data and qr_data not in qr_data_list:
-                                            qr_data_list.append(qr_data)
-                                            break
-                                except:
-                                    continue
-                        
-                        # If we found QR codes, we can break early for efficiency
-                        if qr_data_list:
-                            break
-                    if qr_data_list:
-                        break
-                        
-            except Exception as e:
-                logger.debug(f"QR detection failed for preprocessing {i}: {e}")
-                continue
-        
+        small = gray if scale == 1.0 else self._resize(gray, scale)
+        found, points = cv2.QRCodeDetector().detect(small)
+        if not found or points is None:
+            return None
+        points = np.asarray(points).reshape(-1, 2) / scale
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0)
+        margin = max(x1 - x0, y1 - y0) * self.ROI_MARGIN
+        height, width = gray.shape[:2]
+        region = (
+            int(max(0, x0 - margin)), int(max(0, y0 - margin)),
+            int(min(width, x1 + margin)), int(min(height, y1 + margin)),
+        )
+        if region[2] - region[0] < 10 or region[3] - region[1] < 10:
+            return None
+        return region
+
+    def _decode_stages(self, image: np.ndarray) -> Iterator[Tuple[str, Callable[[], Optional[np.ndarray]]]]:
+        """
+        Tentativas de descodificação por ordem crescente de custo. Cada imagem é calculada
+        só quando a tentativa é executada, pelo que uma leitura bem-sucedida no início
+        evita todo o trabalho de realce seguinte.
+        """
+        gray = self._to_gray(image)
+        height, width = gray.shape[:2]
+        downscale = min(1.0, self.DOWNSCALE_MAX_SIDE / float(max(height, width)))
+
+        # 1. Leitura direta em tons de cinzento (versão reduzida primeiro quando a imagem é grande)
+        if downscale < 1.0:
+            yield f'gray@{downscale:.2f}', lambda: self._resize(gray, downscale)
+        yield 'gray@1.00', lambda: gray
+
+        # 2. Região de interesse localizada pelo OpenCV, recortada da resolução original
+        region = self._locate_qr_region(gray, downscale)
+        if region is None and downscale < 1.0:
+            # QR Codes pequenos podem perder-se na versão reduzida
+            region = self._locate_qr_region(gray, 1.0)
+        if region is not None:
+            x0, y0, x1, y1 = region
+            roi = gray[y0:y1, x0:x1]
+            yield f'roi[{x0},{y0},{x1},{y1}]', lambda: roi
+            # QR Codes pequenos leem melhor ampliados
+            if max(roi.shape[:2]) < 400:
+                yield 'roi@2.00', lambda: self._resize(roi, 2.0)
+        else:
+            roi = None
+
+        # 3. Realces, aplicados à região de interesse quando existe (muito mais pequena)
+        target = roi if roi is not None else (self._resize(gray, downscale) if downscale < 1.0 else gray)
+        target_name = 'roi' if roi is not None else 'gray'
+        for name, technique in self._enhancement_techniques():
+            yield f'{target_name}+{name}', lambda technique=technique: technique(target)
+
+        # 4. Rotações e escalas da imagem completa, por último
+        for rotation in (90, 180, 270):
+            yield f'gray@rot{rotation}', lambda rotation=rotation: self._rotate(gray, rotation)
+        for scale in (0.6, 1.5):
+            if downscale < 1.0 and scale > 1.0:
+                continue  # Ampliar uma imagem já grande é o passo mais caro e raramente ajuda
+            yield f'gray@{scale:.2f}', lambda scale=scale: self._resize(gray, scale)
+        if roi is not None:
+            # Realces na imagem completa, caso a região detetada não seja o QR da AT
+            for name, technique in self._enhancement_techniques():
+                yield f'gray+{name}', lambda technique=technique: technique(gray)
+
+    def detect_qr_codes(self, image: np.ndarray, processing_log: Optional[List[str]] = None,
+                        time_budget: Optional[float] = None) -> List[str]:
+        """
+        Detect and decode QR codes from an image using a staged, cost-ordered pipeline.
+
+        Stops at the first QR code with an ATCUD payload (A:/H: fields) or when the
+        per-image time budget runs out. Each attempt is appended to `processing_log`.
+        """
+        budget = self.time_budget if time_budget is None else time_budget
+        started = time.perf_counter()
+        deadline = started + budget if budget else None
+        qr_data_list: List[str] = []
+        attempts = 0
+
+        def log(message: str):
+            if processing_log is not None:
+                processing_log.append(message)
+
+        try:
+            stages = self._decode_stages(image)
+            for label, build_image in stages:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    log(f"Orçamento de tempo ({budget:.1f}s) esgotado após {attempts} tentativas")
+                    break
+                attempts += 1
+                attempt_started = time.perf_counter()
+                try:
+                    found = self._decode(build_image())
+                except Exception as e:
+                    log(f"Tentativa {attempts} [{label}]: erro ({e})")
+                    continue
+                elapsed_ms = (time.perf_counter() - attempt_started) * 1000
+                new_codes = [qr_data for qr_data in found if qr_data not in qr_data_list]
+                qr_data_list.extend(new_codes)
+                log(f"Tentativa {attempts} [{label}]: {len(new_codes)} QR Code(s) em {elapsed_ms:.0f}ms")
+                if any(self.is_atcud_payload(qr_data) for qr_data in new_codes):
+                    logger.info(f"ATCUD QR Code found at attempt {attempts} [{label}]")
+                    break
+        except Exception as e:
+            logger.debug(f"QR detection pipeline failed: {e}")
+            log(f"Erro na deteção de QR Codes: {e}")
+
+        log(f"Deteção concluída em {(time.perf_counter() - started) * 1000:.0f}ms ({attempts} tentativas)")
         return qr_data_list
-    
+
     def parse_portuguese_qr_data(self, qr_data: str) -> Dict:
         """
         Parse Portuguese AT (Autoridade Tributária) QR code data.
@@ -314,47 +398,218 @@ class EnhancedQRProcessor:
                 return result
             
             # Detect QR codes
-            qr_data_list = self.detect_qr_codes(image)
-            
-            result['qr_codes_found'] = len(qr_data_list)
-            result['raw_qr_data'] = qr_data_list
-            
-            if not qr_data_list:
-                result['processing_log'].append("Nenhum QR Code encontrado na imagem")
-                return result
-            
-            # Process each QR code found
-            for i, qr_data in enumerate(qr_data_list):
-                result['processing_log'].append(f"QR Code {i+1} encontrado: {qr_data[:100]}...")
-                
-                # Check if it looks like a Portuguese ATCUD QR code
-                if 'A:' in qr_data and 'H:' in qr_data and '*' in qr_data:
-                    result['processing_log'].append(f"QR Code {i+1} parece ser um código ATCUD português")
-                    
-                    # Try to parse as Portuguese invoice QR
-                    parsed_data = self.parse_portuguese_qr_data(qr_data)
-                    
-                    if parsed_data and ('atcud' in parsed_data or 'gross_total' in parsed_data):
-                        # Use the first successfully parsed QR code
-                        if not result['invoice_data']:
-                            result['invoice_data'] = parsed_data
-                            result['processing_log'].append(f"Dados extraídos com sucesso do QR Code {i+1}")
-                            result['processing_log'].append(f"ATCUD: {parsed_data.get('atcud', 'N/A')}")
-                            result['processing_log'].append(f"Total: {parsed_data.get('gross_total', 'N/A')}€")
-                        break
-                    else:
-                        result['processing_log'].append(f"QR Code {i+1} não contém dados válidos de fatura")
-                else:
-                    result['processing_log'].append(f"QR Code {i+1} não é um código ATCUD português válido")
-            
-            if not result['invoice_data'] and qr_data_list:
-                # If no structured data was extracted, store the raw QR data
-                result['invoice_data'] = {'raw_qr_code_data': qr_data_list[0]}
-                result['processing_log'].append("QR Code encontrado mas formato não reconhecido")
+            qr_data_list = self.detect_qr_codes(image, processing_log=result['processing_log'])
+            self._interpret_qr_codes(qr_data_list, result)
             
         except Exception as e:
             error_msg = f"Erro no processamento: {str(e)}"
             result['processing_log'].append(error_msg)
             logger.error(error_msg)
         
-        return result
\ No newline at end of file
+        return result
+
+    def _interpret_qr_codes(self, qr_data_list: List[str], result: Dict) -> Dict:
+        """Preenche result['invoice_data'] a partir do primeiro QR Code ATCUD válido."""
+        result['qr_codes_found'] = len(qr_data_list)
+        result['raw_qr_data'] = qr_data_list
+        
+        if not qr_data_list:
+            result['processing_log'].append("Nenhum QR Code encontrado na imagem")
+            return result
+        
+        # Process each QR code found
+        for i, qr_data in enumerate(qr_data_list):
+            result['processing_log'].append(f"QR Code {i+1} encontrado: {qr_data[:100]}...")
+            
+            # Check if it looks like a Portuguese ATCUD QR code
+            if self.is_atcud_payload(qr_data):
+                result['processing_log'].append(f"QR Code {i+1} parece ser um código ATCUD português")
+                
+                # Try to parse as Portuguese invoice QR
+                parsed_data = self.parse_portuguese_qr_data(qr_data)
+                
+                if parsed_data and ('atcud' in parsed_data or 'gross_total' in parsed_data):
+                    # Use the first successfully parsed QR code
+                    if not result['invoice_data']:
+                        result['invoice_data'] = parsed_data
+                        result['processing_log'].append(f"Dados extraídos com sucesso do QR Code {i+1}")
+                        result['processing_log'].append(f"ATCUD: {parsed_data.get('atcud', 'N/A')}")
+                        result['processing_log'].append(f"Total: {parsed_data.get('gross_total', 'N/A')}€")
+                    break
+                else:
+                    result['processing_log'].append(f"QR Code {i+1} não contém dados válidos de fatura")
+            else:
+                result['processing_log'].append(f"QR Code {i+1} não é um código ATCUD português válido")
+        
+        if not result['invoice_data'] and qr_data_list:
+            # If no structured data was extracted, store the raw QR data
+            result['invoice_data'] = {'raw_qr_code_data': qr_data_list[0]}
+            result['processing_log'].append("QR Code encontrado mas formato não reconhecido")
+        return result
+
+    @staticmethod
+    def detect_file_type(header: bytes, filename: Optional[str] = None) -> str:
+        """Devolve 'pdf' ou 'image' a partir dos primeiros bytes (e, em último caso, da extensão)."""
+        if header.lstrip()[:5] == b'%PDF-':
+            return 'pdf'
+        if filename and filename.lower().endswith('.pdf'):
+            return 'pdf'
+        return 'image'
+
+    def process_file(self, file_input, filename: Optional[str] = None) -> Dict:
+        """
+        Ponto de entrada único para ficheiros de faturas (imagem ou PDF).
+
+        Aceita bytes ou um ficheiro aberto em modo binário. PDFs seguem o caminho nativo
+        (process_pdf); imagens seguem process_image.
+        """
+        if isinstance(file_input, (bytes, bytearray)):
+            header = bytes(file_input[:1024])
+        else:
+            header = file_input.read(1024)
+            file_input.seek(0)
+
+        if self.detect_file_type(header, filename) == 'pdf':
+            return self.process_pdf(file_input)
+
+        image_bytes = file_input if isinstance(file_input, (bytes, bytearray)) else file_input.read()
+        return self.process_image(bytes(image_bytes))
+
+    @staticmethod
+    def _open_pdf(file_input):
+        """
+        Abre o PDF sem o materializar: quando o armazenamento é local, o MuPDF lê as
+        páginas diretamente do disco à medida que são carregadas.
+        """
+        if isinstance(file_input, (bytes, bytearray)):
+            return fitz.open(stream=bytes(file_input), filetype="pdf")
+        path = getattr(file_input, 'name', None)
+        if isinstance(path, str) and os.path.isfile(path):
+            return fitz.open(path, filetype="pdf")
+        return fitz.open(stream=file_input.read(), filetype="pdf")
+
+    @staticmethod
+    def _pixmap_to_array(pixmap) -> np.ndarray:
+        array = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+        return array[:, :, 0].copy() if pixmap.n == 1 else cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+
+    def _page_order(self, page_count: int) -> List[int]:
+        """Última página primeiro: o QR Code da AT está normalmente no fim do documento."""
+        return list(range(page_count - 1, -1, -1))[:self.PDF_MAX_PAGES]
+
+    def _pdf_embedded_images(self, document) -> Iterator[Tuple[str, np.ndarray]]:
+        """Imagens embebidas no PDF, página a página (da última para a primeira)."""
+        seen = set()
+        for page_number in self._page_order(document.page_count):
+            page = document.load_page(page_number)
+            for image_info in page.get_images(full=True):
+                xref, width, height = image_info[0], image_info[2], image_info[3]
+                if xref in seen or min(width, height) < self.PDF_MIN_IMAGE_SIDE:
+                    continue
+                seen.add(xref)
+                try:
+                    pixmap = fitz.Pixmap(document, xref)
+                    if pixmap.alpha or pixmap.n not in (1, 3):
+                        pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+                    yield f"página {page_number + 1}, imagem {xref}", self._pixmap_to_array(pixmap)
+                except Exception as e:
+                    logger.debug(f"Could not extract PDF image {xref}: {e}")
+            page = None  # Liberta a página antes de carregar a seguinte
+
+    def _pdf_rendered_regions(self, document) -> Iterator[Tuple[str, np.ndarray]]:
+        """
+        Renderiza, página a página, primeiro a faixa inferior onde está o QR Code da AT
+        e só depois a página completa, com DPI limitado para conter a memória.
+        """
+        for page_number in self._page_order(document.page_count):
+            page = document.load_page(page_number)
+            rect = page.rect
+            bottom = fitz.Rect(rect.x0, rect.y1 - rect.height * self.PDF_BOTTOM_FRACTION, rect.x1, rect.y1)
+            for label, clip in ((f"página {page_number + 1}, rodapé", bottom), (f"página {page_number + 1}, completa", rect)):
+                # Limita o número de píxeis renderizados mesmo em páginas de grande formato
+                max_dpi = 72.0 * (self.PDF_MAX_RENDER_PIXELS / max(1.0, clip.width * clip.height)) ** 0.5
+                dpi = int(max(72, min(self.PDF_RENDER_DPI, max_dpi)))
+                pixmap = page.get_pixmap(dpi=dpi, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+                yield f"{label} @ {dpi}dpi", self._pixmap_to_array(pixmap)
+            page = None
+
+    def process_pdf(self, file_input) -> Dict:
+        """
+        Extrai os dados da fatura de um PDF sem o rasterizar por inteiro:
+        1. imagens embebidas (faturas digitalizadas), da última página para a primeira;
+        2. renderização da faixa inferior de cada página e, se necessário, da página completa.
+        Termina no primeiro QR Code ATCUD encontrado ou quando o orçamento de tempo se esgota.
+        """
+        result = {
+            'qr_codes_found': 0,
+            'invoice_data': {},
+            'raw_qr_data': [],
+            'processing_log': []
+        }
+        log = result['processing_log']
+        deadline = time.perf_counter() + self.time_budget * self.PDF_BUDGET_FACTOR if self.time_budget else None
+        qr_data_list: List[str] = []
+
+        try:
+            document = self._open_pdf(file_input)
+        except Exception as e:
+            log.append(f"Erro ao abrir o PDF: {e}")
+            return result
+
+        try:
+            log.append(f"PDF com {document.page_count} página(s)")
+            for stage_name, candidates in (
+                ('imagens embebidas', self._pdf_embedded_images(document)),
+                ('renderização', self._pdf_rendered_regions(document)),
+            ):
+                log.append(f"PDF: a procurar QR Code em {stage_name}")
+                for label, image in candidates:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            break
+                    if float(image.std()) < 2.0:
+                        log.append(f"PDF: {label} sem conteúdo, ignorada")
+                        continue
+                    log.append(f"PDF: {label} ({image.shape[1]}x{image.shape[0]})")
+                    budget = min(self.time_budget, remaining) if remaining is not None else None
+                    for qr_data in self.detect_qr_codes(image, processing_log=log, time_budget=budget):
+                        if qr_data not in qr_data_list:
+                            qr_data_list.append(qr_data)
+                    if any(self.is_atcud_payload(qr_data) for qr_data in qr_data_list):
+                        break
+                if any(self.is_atcud_payload(qr_data) for qr_data in qr_data_list):
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    log.append("Orçamento de tempo do PDF esgotado")
+                    break
+
+            self._interpret_qr_codes(qr_data_list, result)
+        except Exception as e:
+            error_msg = f"Erro no processamento do PDF: {str(e)}"
+            log.append(error_msg)
+            logger.error(error_msg)
+        finally:
+            document.close()
+
+        return result
+
+
+# Processador reutilizado por cada processo do pool de descodificação em lote
+_worker_processor: Optional[EnhancedQRProcessor] = None
+
+
+def decode_invoice_source(source, filename: Optional[str] = None, time_budget: Optional[float] = None) -> Dict:
+    """
+    Descodifica um ficheiro de fatura (caminho local ou bytes) num processo do pool.
+    Função de módulo, sem dependências do Django, para poder ser enviada a outro processo.
+    """
+    global _worker_processor
+    budget = EnhancedQRProcessor.DEFAULT_TIME_BUDGET if time_budget is None else time_budget
+    if _worker_processor is None or _worker_processor.time_budget != budget:
+        _worker_processor = EnhancedQRProcessor(time_budget=budget)
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return _worker_processor.process_file(f, filename=filename)
+    return _worker_processor.process_file(source, filename=filename)
@@ -5,6 +5,7 @@ from .models import Organization, Client,GeneratedReport,SAFTFile, NotificationS
 import json
 from django.db import models
 from django.db.models import Sum, Exists, OuterRef # Import Exists
+from django.db.models import Prefetch, prefetch_related_objects
 import logging
 from .models import FiscalSystemSettings, ScannedInvoice, InvoiceBatch
 from django.utils import timezone
@@ -13,6 +14,28 @@ from django.utils import timezone
 logger = logging.getLogger(__name__)
 
 
+class SparseFieldsetMixin:
+    """
+    Suporta `?fields=id,title,...` nos pedidos de leitura: os campos não pedidos são
+    removidos do serializer antes da serialização, por isso os SerializerMethodField
+    caros (workflow_progress, assignment_summary, ...) nem chegam a ser calculados.
+    O `id` é sempre devolvido.
+    """
+    sparse_fields_param = 'fields'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            return
+        requested = request.query_params.get(self.sparse_fields_param)
+        if not requested:
+            return
+        allowed = {name.strip() for name in requested.split(',') if name.strip()} | {'id'}
+        for name in set(self.fields) - allowed:
+            self.fields.pop(name)
+
+
 class GeneratedReportSerializer(serializers.ModelSerializer):
     organization_name = serializers.ReadOnlyField(source='organization.name', allow_null=True)
     generated_by_username = serializers.ReadOnlyField(source='generated_by.username', allow_null=True)
@@ -56,21 +79,23 @@ class ScannedInvoiceSerializer(serializers.ModelSerializer):
 
     def get_generated_task_ids(self, obj):
         """Returns a list of task IDs linked to this invoice."""
-        if hasattr(obj, 'generated_tasks') and obj.generated_tasks.all()._result_cache is not None:
-            return [str(task.id) for task in obj.generated_tasks.all()]
-        else:
-            return list(obj.generated_tasks.values_list('id', flat=True))
+        # Annotated by ScannedInvoiceQuerySet.with_task_ids (no query per invoice)
+        if hasattr(obj, 'task_ids'):
+            return [str(task_id) for task_id in obj.task_ids or []]
+        return [str(task_id) for task_id in obj.generated_tasks.values_list('id', flat=True)]
 
     def get_has_tasks(self, obj):
         """Returns True if this invoice has any associated tasks."""
-        if hasattr(obj, 'generated_tasks'):
-            if obj.generated_tasks.all()._result_cache is not None:
-                return len(obj.generated_tasks.all()) > 0
-            else:
-                return obj.generated_tasks.exists()
-        return False
-
-class InvoiceBatchSerializer(serializers.ModelSerializer):
+        if hasattr(obj, 'task_ids'):
+            return bool(obj.task_ids)
+        return obj.generated_tasks.exists()
+
+class InvoiceBatchSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Os contadores vêm das anotações de InvoiceBatchQuerySet.with_invoice_stats. A listagem
+    do InvoiceBatchViewSet omite as faturas (contexto `include_invoices`) e só as inclui
+    com `?fields=...,invoices`; o detalhe do lote devolve-as sempre.
+    """
     invoices = ScannedInvoiceSerializer(many=True, read_only=True)
     invoice_count = serializers.SerializerMethodField()
     status_summary = serializers.SerializerMethodField()
@@ -84,35 +109,26 @@ class InvoiceBatchSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'organization', 'uploaded_by', 'uploaded_by_username', 'created_at']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.context.get('include_invoices', True):
+            self.fields.pop('invoices', None)
+
     def get_invoice_count(self, obj):
         """Get the count of invoices in this batch."""
-        try:
-            # Use prefetched data if available
-            if hasattr(obj, '_prefetched_objects_cache') and 'invoices' in obj._prefetched_objects_cache:
-                return len(obj.invoices.all())
-            else:
-                return obj.invoices.count()
-        except Exception:
-            return 0
+        if hasattr(obj, 'invoice_count'):
+            return obj.invoice_count
+        return obj.invoices.count()
 
     def get_status_summary(self, obj):
         """Get a summary of invoice statuses in this batch."""
-        try:
-            # Use prefetched data if available
-            if hasattr(obj, '_prefetched_objects_cache') and 'invoices' in obj._prefetched_objects_cache:
-                invoices = obj.invoices.all()
-                status_counts = {}
-                for invoice in invoices:
-                    status = invoice.status
-                    status_counts[status] = status_counts.get(status, 0) + 1
-                return [{'status': status, 'count': count} for status, count in status_counts.items()]
-            else:
-                # Fallback to database query
-                summary = obj.invoices.values('status').annotate(count=Count('status')).order_by('status')
-                return list(summary)
-        except Exception as e:
-            # If there's any error, return empty list
-            return []
+        if hasattr(obj, 'invoice_count'):
+            summary = [
+                {'status': status, 'count': getattr(obj, f'invoices_{status.lower()}')}
+                for status, _ in ScannedInvoice.STATUS_CHOICES
+            ]
+            return sorted((item for item in summary if item['count']), key=lambda item: item['status'])
+        return list(obj.invoices.values('status').annotate(count=Count('status')).order_by('status'))
     
 class SAFTFileSerializer(serializers.ModelSerializer):
     uploaded_by_username = serializers.ReadOnlyField(source='uploaded_by.username')
@@ -325,7 +341,20 @@ class WorkflowStepSerializer(serializers.ModelSerializer):
             'total_time_spent', 'is_approved', 'previous_steps_info'
         ]
     
-class TaskSerializer(serializers.ModelSerializer):
+class TaskListSerializer(serializers.ListSerializer):
+    """
+    List mode of TaskSerializer: loads everything the per-task method fields need
+    for the whole page up front (TaskSerializer.prepare_batch), so the number of
+    queries does not depend on the page size.
+    """
+
+    def to_representation(self, data):
+        tasks = list(data.all() if isinstance(data, models.Manager) else data)
+        self.child.prepare_batch(tasks)
+        return [self.child.to_representation(task) for task in tasks]
+
+
+class TaskSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     # Direct lookups, made efficient by `select_related` in the ViewSet.
     client_name = serializers.CharField(source='client.name', read_only=True)
     category_name = serializers.CharField(source='category.name', read_only=True, allow_null=True)
@@ -372,6 +401,59 @@ class TaskSerializer(serializers.ModelSerializer):
             'id', 'created_at', 'updated_at', 'completed_at', 
             'has_pending_notifications', 'notifications_count', 'latest_notification'
         ]
+        list_serializer_class = TaskListSerializer
+
+    # Fields that need each of the page-level lookups in prepare_batch
+    BATCH_COLLABORATOR_FIELDS = {'collaborators', 'collaborators_info', 'all_assigned_users', 'assignment_summary'}
+    BATCH_STEP_USER_FIELDS = {'all_assigned_users', 'assignment_summary'}
+
+    def prepare_batch(self, tasks):
+        """
+        Loads, for a page of tasks, the collaborators and involvement roles, the steps of
+        each workflow, the workflow history, the next-step graph of the current steps, the
+        users referenced in workflow_step_assignments and the latest notification, only
+        for the fields present in the response (sparse fieldsets skip the rest).
+        """
+        self._step_users = None
+        self._latest_notifications = None
+        if not tasks:
+            return
+        fields = set(self.fields)
+
+        lookups = []
+        if fields & self.BATCH_COLLABORATOR_FIELDS:
+            lookups.append('collaborators')
+        if 'all_assigned_users' in fields:
+            # Roles for get_user_role_in_task
+            lookups.append('involvements')
+        if fields & {'workflow_progress', 'available_next_steps'}:
+            lookups.append(Prefetch('workflow__steps', queryset=WorkflowStep.objects.select_related('assign_to').order_by('order')))
+        if 'workflow_progress' in fields:
+            lookups.append(Prefetch('workflow_history', queryset=WorkflowHistory.objects.only('id', 'task_id', 'action', 'from_step_id')))
+        if 'available_next_steps' in fields:
+            lookups.append(Prefetch('current_workflow_step__next_steps', queryset=WorkflowStep.objects.select_related('assign_to')))
+        if lookups:
+            prefetch_related_objects(tasks, *lookups)
+
+        if fields & self.BATCH_STEP_USER_FIELDS:
+            user_ids = {
+                int(user_id)
+                for task in tasks if task.workflow_step_assignments
+                for user_id in task.workflow_step_assignments.values()
+                if user_id and str(user_id).isdigit()
+            }
+            self._step_users = User.objects.in_bulk(user_ids) if user_ids else {}
+
+        if 'latest_notification' in fields:
+            # DISTINCT ON (task_id): one row per task, the most recent
+            self._latest_notifications = {
+                notification.task_id: notification
+                for notification in WorkflowNotification.objects.filter(task__in=tasks)
+                .order_by('task_id', '-created_at').distinct('task_id')
+            }
+
+    def _assigned_users(self, obj):
+        return obj.get_all_assigned_users(users_by_id=getattr(self, '_step_users', None))
 
     def get_collaborators_info(self, obj):
         """Returns detailed info about collaborators (efficient with prefetch)."""
@@ -394,7 +476,7 @@ class TaskSerializer(serializers.ModelSerializer):
     def get_all_assigned_users(self, obj):
         """Returns all users assigned to this task in any capacity."""
         try:
-            all_users = obj.get_all_assigned_users()
+            all_users = self._assigned_users(obj)
             return [
                 {
                     'id': user.id,
@@ -437,7 +519,7 @@ class TaskSerializer(serializers.ModelSerializer):
                 summary['workflow_assignees_count'] = len(unique_workflow_users)
 
             # Total count
-            all_users = obj.get_all_assigned_users()
+            all_users = self._assigned_users(obj)
             summary['total_assigned_users'] = len(all_users)
             summary['has_multiple_assignees'] = len(all_users) > 1
 
@@ -460,9 +542,15 @@ class TaskSerializer(serializers.ModelSerializer):
         return obj.get_available_next_steps()
 
     def get_latest_notification(self, obj):
-        """Gets the latest notification from the prefetched set (efficient)."""
-        if hasattr(obj, 'workflow_notifications') and obj.workflow_notifications.all():
+        """Gets the latest notification from the page-level lookup or the prefetched set."""
+        latest_notifications = getattr(self, '_latest_notifications', None)
+        if latest_notifications is not None:
+            latest = latest_notifications.get(obj.id)
+        elif hasattr(obj, 'workflow_notifications') and obj.workflow_notifications.all():
             latest = obj.workflow_notifications.all()[0]
+        else:
+            latest = None
+        if latest is not None:
             return {
                 'id': latest.id, 'type': latest.notification_type,
                 'title': latest.title, 'created_at': latest.created_at,
@@ -571,7 +659,7 @@ class NotificationSummarySerializer(serializers.ModelSerializer):
         return 'blue'
 
 
-class TimeEntrySerializer(serializers.ModelSerializer):
+class TimeEntrySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user_name = serializers.ReadOnlyField(source='user.username')
     client_name = serializers.ReadOnlyField(source='client.name')
     task_title = serializers.ReadOnlyField(source='task.title', allow_null=True)
@@ -601,7 +689,7 @@ class ExpenseSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class ClientProfitabilitySerializer(serializers.ModelSerializer):
+class ClientProfitabilitySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     client_name = serializers.ReadOnlyField(source='client.name')
     
     class Meta:
@@ -670,7 +758,7 @@ class NotificationSettingsSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError(f"O valor para {k} deve ser booleano")
         return value
 
-class WorkflowNotificationSerializer(serializers.ModelSerializer):
+class WorkflowNotificationSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user_name = serializers.ReadOnlyField(source='user.username')
     task_title = serializers.ReadOnlyField(source='task.title')
     task_client_name = serializers.ReadOnlyField(source='task.client.name')
@@ -846,7 +934,7 @@ class FiscalStatsSerializer(serializers.Serializer):
     by_month = serializers.DictField()
     organization_info = serializers.DictField(required=False)
 
-class OrganizationActionLogSerializer(serializers.ModelSerializer):
+class OrganizationActionLogSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     organization = serializers.StringRelatedField(read_only=True)
 
@@ -76,18 +76,15 @@ class AIContextService:
             for client in top_clients
         ]
         
-        # Estatísticas de tags fiscais
-        fiscal_tags_stats = {}
-        for client in clients_qs:
-            for tag in (client.fiscal_tags or []):
-                fiscal_tags_stats[tag] = fiscal_tags_stats.get(tag, 0) + 1
+        # Estatísticas de tags fiscais (agregadas na base de dados)
+        common_fiscal_tags = clients_qs.fiscal_tag_histogram(limit=5)
         
         return {
             "total_active": total_clients,
             "with_monthly_fee": clients_with_fee,
             "without_fee": total_clients - clients_with_fee,
             "top_3_by_revenue": top_clients_data,
-            "common_fiscal_tags": dict(sorted(fiscal_tags_stats.items(), key=lambda x: x[1], reverse=True)[:5])
+            "common_fiscal_tags": common_fiscal_tags
         }
     
     @staticmethod
@@ -210,7 +207,7 @@ class AIContextService:
             clients_qs = clients_qs.exclude(monthly_fee__lte=0)
         
         if filters.get('fiscal_tag'):
-            clients_qs = clients_qs.filter(fiscal_tags__contains=[filters['fiscal_tag']])
+            clients_qs = clients_qs.with_all_tags([filters['fiscal_tag']])
         
         if filters.get('unprofitable'):
             # Clientes não rentáveis no último mês
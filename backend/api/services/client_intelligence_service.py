@@ -0,0 +1,254 @@
+# api/services/client_intelligence_service.py
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+from django.contrib.auth.models import User
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from ..models import Client, ClientProfitability, Profile, Task, WorkflowNotification
+from .compliance_monitor_service import ComplianceMonitor
+from .financial_health_service import FinancialHealthService
+from .notification_service import NotificationService
+from .revenue_service import RevenueService
+from .saft_analytics_service import SAFTAnalyticsService
+
+logger = logging.getLogger(__name__)
+
+# (user_id, notification_type, title, message, client_id)
+Alert = Tuple[int, str, str, str, str]
+
+OPEN_STATUSES = ('pending', 'in_progress')
+
+
+class ClientIntelligenceService:
+    """
+    Trabalho noturno de inteligência de clientes, numa única passagem por organização.
+
+    Substitui os quatro ciclos cliente a cliente (health score/churn, compliance,
+    oportunidades de receita e anomalias). Os factos de cada bloco de clientes são
+    carregados com agregações agrupadas (margens dos últimos 12 meses, contagens de
+    tarefas atrasadas, tarefas fiscais atrasadas, consultoria no ano, faturação SAF-T),
+    os resultados são gravados com um bulk_update e os alertas saem num único lote,
+    sem duplicados nem repetições das últimas 24 horas.
+    """
+
+    CHUNK_SIZE = 500
+    MARGIN_HISTORY = 12
+    RECENT_THRESHOLD_HOURS = 24
+    UPDATE_FIELDS = ['financial_health_score', 'churn_risk', 'compliance_risks', 'revenue_opportunities']
+
+    @classmethod
+    def run_for_organization(cls, organization_id, chunk_size: Optional[int] = None) -> Dict:
+        """Avalia todos os clientes ativos da organização e emite os alertas resultantes."""
+        now = timezone.now()
+        chunk_size = chunk_size or cls.CHUNK_SIZE
+        admin_ids = list(Profile.objects.filter(
+            organization_id=organization_id, is_org_admin=True, user__is_active=True
+        ).values_list('user_id', flat=True))
+
+        report = {'clients_updated': 0, 'alerts': 0, 'notifications_created': 0}
+        alerts: List[Alert] = []
+        clients = Client.objects.filter(organization_id=organization_id, is_active=True).select_related(
+            'account_manager'
+        ).only('id', 'name', 'nif', 'monthly_fee', 'fiscal_tags', 'organization', 'account_manager', 'account_manager__is_active')
+        last_id = None
+        while True:
+            chunk_query = clients.order_by('id')
+            if last_id is not None:
+                chunk_query = chunk_query.filter(id__gt=last_id)
+            chunk = list(chunk_query[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            facts = cls.load_facts(organization_id, chunk, now)
+            for client in chunk:
+                client_alerts = cls.evaluate(client, facts[client.id], now)
+                recipients = cls._recipients(client, admin_ids)
+                alerts.extend(
+                    (user_id, notification_type, title, message, str(client.id))
+                    for notification_type, title, message in client_alerts
+                    for user_id in recipients
+                )
+            Client.objects.bulk_update(chunk, cls.UPDATE_FIELDS, batch_size=chunk_size)
+            report['clients_updated'] += len(chunk)
+
+        report['alerts'] = len(alerts)
+        report['notifications_created'] = cls.emit(alerts, now)
+        logger.info(
+            f"Inteligência de clientes ({organization_id}): {report['clients_updated']} clientes, "
+            f"{report['alerts']} alertas, {report['notifications_created']} notificações"
+        )
+        return report
+
+    # --- Factos ---
+
+    @classmethod
+    def load_facts(cls, organization_id, clients: List[Client], now) -> Dict:
+        """Factos de um bloco de clientes, com um número fixo de queries."""
+        client_ids = [client.id for client in clients]
+        facts = {
+            client_id: {
+                'margins': [], 'overdue': 0, 'fiscal_overdue': 0, 'weekly_overdue': [0, 0, 0, 0],
+                'fiscal_overdue_tasks': [], 'has_consulting_task': False, 'monthly_revenue': [],
+            }
+            for client_id in client_ids
+        }
+
+        # Margens dos últimos 12 meses, da mais recente para a mais antiga
+        for client_id, margin in ClientProfitability.objects.filter(client_id__in=client_ids).annotate(
+            position=Window(RowNumber(), partition_by=[F('client_id')], order_by=[F('year').desc(), F('month').desc()])
+        ).filter(position__lte=cls.MARGIN_HISTORY).order_by('client_id', 'position').values_list(
+            'client_id', 'profit_margin'
+        ):
+            facts[client_id]['margins'].append(margin)
+
+        # Tarefas atrasadas (todas e fiscais) e o histograma das últimas quatro semanas
+        week_filters = {}
+        for weeks_ago in range(1, 5):
+            week_start = now - timedelta(weeks=weeks_ago)
+            week_filters[f'week_{weeks_ago}'] = Count(
+                'id', filter=Q(deadline__gte=week_start, deadline__lt=week_start + timedelta(days=7))
+            )
+        for row in Task.objects.filter(client_id__in=client_ids, status__in=OPEN_STATUSES).values('client_id').annotate(
+            overdue=Count('id', filter=Q(deadline__lt=now)),
+            fiscal_overdue=Count('id', filter=Q(deadline__lt=now, source_fiscal_obligation__isnull=False)),
+            **week_filters
+        ).order_by():
+            client_facts = facts[row['client_id']]
+            client_facts['overdue'] = row['overdue']
+            client_facts['fiscal_overdue'] = row['fiscal_overdue']
+            client_facts['weekly_overdue'] = [row[f'week_{weeks_ago}'] for weeks_ago in range(1, 5)]
+
+        for row in Task.objects.filter(
+            client_id__in=client_ids, status__in=OPEN_STATUSES,
+            source_fiscal_obligation__isnull=False, deadline__lt=now
+        ).values('id', 'client_id', 'title', 'deadline', 'source_fiscal_obligation__name'):
+            facts[row['client_id']]['fiscal_overdue_tasks'].append(row)
+
+        irs_client_ids = [client.id for client in clients if 'IRS' in (client.fiscal_tags or [])]
+        if irs_client_ids:
+            for client_id in Task.objects.filter(
+                client_id__in=irs_client_ids, category__name__icontains='Consultoria', created_at__year=now.year
+            ).values_list('client_id', flat=True).distinct():
+                facts[client_id]['has_consulting_task'] = True
+
+        # Faturação mensal do último SAF-T de cada NIF
+        by_tax_id = SAFTAnalyticsService.latest_files_by_tax_id(organization_id, [client.nif for client in clients])
+        if by_tax_id:
+            months = SAFTAnalyticsService.monthly_revenue_by_file(saft_file.id for saft_file in by_tax_id.values())
+            for client in clients:
+                saft_file = by_tax_id.get(client.nif)
+                if saft_file is not None:
+                    facts[client.id]['monthly_revenue'] = months.get(saft_file.id, [])
+        return facts
+
+    # --- Avaliação ---
+
+    @classmethod
+    def evaluate(cls, client: Client, facts: Dict, now) -> List[Tuple[str, str, str]]:
+        """
+        Atualiza os campos calculados do cliente (sem gravar) e devolve os alertas
+        como (notification_type, título, mensagem).
+        """
+        margins = facts['margins']
+        last_margin = margins[0] if margins else None
+
+        client.financial_health_score = FinancialHealthService.health_score(
+            FinancialHealthService.profitability_score(last_margin),
+            FinancialHealthService.compliance_score(facts['fiscal_overdue']),
+            FinancialHealthService.cash_flow_score(facts['monthly_revenue'], client.monthly_fee),
+        )
+        client.churn_risk = FinancialHealthService.churn_risk(margins[:6], facts['overdue'])
+        client.compliance_risks = [
+            ComplianceMonitor.overdue_fiscal_task_risk(
+                row['id'], row['title'], row['deadline'], row['source_fiscal_obligation__name'], now.date()
+            )
+            for row in facts['fiscal_overdue_tasks']
+        ]
+        client.revenue_opportunities = (
+            RevenueService.fee_review_opportunities(last_margin)
+            + RevenueService.service_gap_opportunities(client.fiscal_tags, facts['has_consulting_task'])
+        )
+
+        alerts = []
+        if client.churn_risk in ('HIGH', 'MEDIUM'):
+            alerts.append((
+                'client_churn_risk',
+                f"Alerta: Risco de churn {client.churn_risk.lower()} para {client.name}",
+                f"O cliente {client.name} apresenta risco {client.churn_risk.lower()} de churn.",
+            ))
+        for risk in client.compliance_risks:
+            if risk.get('severity') == 'high':
+                alerts.append(('client_compliance_risk', risk['title'], risk.get('details', '')))
+        for opportunity in client.revenue_opportunities:
+            alerts.append(('client_revenue_opportunity', opportunity['title'], opportunity.get('details', '')))
+        alerts.extend(cls.detect_anomalies(client, margins, facts['weekly_overdue']))
+        return alerts
+
+    @staticmethod
+    def detect_anomalies(client: Client, margins: List, weekly_overdue: List[int]) -> List[Tuple[str, str, str]]:
+        """Queda de mais de 30% da margem média e pico de tarefas atrasadas na última semana."""
+        anomalies = []
+        known_margins = [margin for margin in margins if margin is not None]
+        if len(known_margins) >= 6:
+            avg_recent = sum(known_margins[:3]) / 3
+            avg_past = sum(known_margins[3:]) / len(known_margins[3:])
+            if avg_past > 0 and avg_recent < avg_past * Decimal('0.7'):
+                anomalies.append((
+                    'client_anomaly_detected',
+                    f"Alerta preditivo: Queda de margem de lucro em {client.name}",
+                    f"A margem de lucro média caiu de {avg_past:.1f}% para {avg_recent:.1f}% nos últimos meses para o cliente {client.name}.",
+                ))
+
+        recent, previous = weekly_overdue[0], weekly_overdue[1:]
+        avg_past = sum(previous) / len(previous)
+        if avg_past > 0 and recent > avg_past * 2:
+            anomalies.append((
+                'client_anomaly_detected',
+                f"Alerta preditivo: Pico de tarefas atrasadas em {client.name}",
+                f"O número de tarefas atrasadas para {client.name} subiu de média {avg_past:.1f} para {recent} na última semana.",
+            ))
+        return anomalies
+
+    @staticmethod
+    def _recipients(client: Client, admin_ids: List[int]) -> List[int]:
+        """Gestor de conta ativo ou, na falta dele, os administradores da organização."""
+        if client.account_manager_id and client.account_manager.is_active:
+            return [client.account_manager_id]
+        return admin_ids
+
+    # --- Notificações ---
+
+    @classmethod
+    def emit(cls, alerts: Iterable[Alert], now) -> int:
+        """
+        Emite os alertas como um lote: repetições dentro do lote e alertas com o mesmo
+        utilizador, tipo e título nas últimas 24 horas são descartados (uma query).
+        """
+        unique = {}
+        for user_id, notification_type, title, message, client_id in alerts:
+            unique.setdefault((user_id, notification_type, title), (message, client_id))
+        if not unique:
+            return 0
+
+        recent = set(WorkflowNotification.objects.filter(
+            user_id__in={key[0] for key in unique},
+            notification_type__in={key[1] for key in unique},
+            created_at__gte=now - timedelta(hours=cls.RECENT_THRESHOLD_HOURS),
+        ).values_list('user_id', 'notification_type', 'title'))
+
+        pending = [(key, value) for key, value in unique.items() if key not in recent]
+        users = User.objects.in_bulk({key[0] for key, _ in pending}) if pending else {}
+        return len(NotificationService.create_notifications_bulk(
+            {
+                'user': users[user_id], 'notification_type': notification_type,
+                'title': title, 'message': message, 'metadata': {'client_id': client_id},
+            }
+            for (user_id, notification_type, title), (message, client_id) in pending
+            if user_id in users
+        ))
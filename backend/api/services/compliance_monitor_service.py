@@ -36,13 +36,20 @@ class ComplianceMonitor:
             deadline__lt=timezone.now()
         ).select_related('source_fiscal_obligation')
 
+        today = timezone.now().date()
         for task in overdue_tasks:
-            days_overdue = (timezone.now().date() - task.deadline.date()).days
-            risks.append({
-                'type': 'OVERDUE_FISCAL_TASK',
-                'severity': 'high',
-                'title': f"Obrigação Atrasada: {task.source_fiscal_obligation.name}",
-                'details': f"A tarefa '{task.title}' está {days_overdue} dias atrasada. Prazo era {task.deadline.strftime('%d/%m/%Y')}.",
-                'task_id': str(task.id)
-            })
-        return risks
\ No newline at end of file
+            risks.append(ComplianceMonitor.overdue_fiscal_task_risk(
+                task.id, task.title, task.deadline, task.source_fiscal_obligation.name, today
+            ))
+        return risks
+
+    @staticmethod
+    def overdue_fiscal_task_risk(task_id, title: str, deadline, obligation_name: str, today) -> dict:
+        days_overdue = (today - deadline.date()).days
+        return {
+            'type': 'OVERDUE_FISCAL_TASK',
+            'severity': 'high',
+            'title': f"Obrigação Atrasada: {obligation_name}",
+            'details': f"A tarefa '{title}' está {days_overdue} dias atrasada. Prazo era {deadline.strftime('%d/%m/%Y')}.",
+            'task_id': str(task_id)
+        }
\ No newline at end of file
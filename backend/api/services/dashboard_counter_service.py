@@ -0,0 +1,375 @@
+# api/services/dashboard_counter_service.py
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from ..models import Client, ClientProfitability, DashboardCounter, Organization, Task, TimeEntry
+
+logger = logging.getLogger(__name__)
+
+Contribution = Tuple[str, date, Decimal]
+
+OPEN_STATUSES = ('pending', 'in_progress')
+# Tarefas abertas sem prazo nunca estão atrasadas nem vencem hoje
+UNDATED = date.max
+# Dia para onde o rollover consolida os prazos já passados
+OVERDUE_BUCKET = date.min
+# Dias de histórico mantidos para conclusões e minutos (o dashboard usa 7)
+HISTORY_DAYS = 31
+PROFITABILITY_METRICS = ('unprofitable_clients', 'profit_margin_total', 'profit_margin_count')
+
+
+class DashboardCounterService:
+    """
+    Contadores do dashboard por organização (DashboardCounter).
+
+    Os sinais de Task e TimeEntry calculam a diferença entre o estado anterior e o
+    novo e, após o commit, somam-na aos contadores (upsert com value = value + delta).
+    As métricas de rentabilidade do mês são recalculadas a partir de ClientProfitability
+    sempre que os registos mudam. O rollover da meia-noite consolida os prazos passados
+    e apaga o histórico antigo; a reconstrução semanal corrige alterações que não passem
+    pelos sinais (ex.: queryset.update()).
+
+    A leitura do dashboard é uma agregação sobre as linhas da organização, sem tocar nas
+    tabelas de tarefas e registos de tempo.
+    """
+
+    TASK_SNAPSHOT_ATTR = '_dashboard_task_snapshot'
+    TIME_ENTRY_SNAPSHOT_ATTR = '_dashboard_time_entry_snapshot'
+
+    # --- Estado e contribuições ---
+
+    @staticmethod
+    def _local_date(value) -> Optional[date]:
+        if value is None:
+            return None
+        if not isinstance(value, datetime):
+            return value
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.date()
+
+    @staticmethod
+    def _organization_id(instance, previous: Optional[Dict]):
+        if previous is not None and previous['client_id'] == instance.client_id:
+            return previous['organization_id']
+        if type(instance).client.is_cached(instance):
+            return instance.client.organization_id
+        return Client.objects.filter(id=instance.client_id).values_list('organization_id', flat=True).first()
+
+    @classmethod
+    def _task_contributions(cls, state: Optional[Dict]) -> List[Contribution]:
+        if state is None or state['organization_id'] is None:
+            return []
+        contributions = []
+        if state['status'] in OPEN_STATUSES:
+            contributions.append(('open_tasks', cls._local_date(state['deadline']) or UNDATED, Decimal('1')))
+        elif state['status'] == 'completed' and state['completed_at'] is not None:
+            contributions.append(('completed_tasks', cls._local_date(state['completed_at']), Decimal('1')))
+        return contributions
+
+    @staticmethod
+    def _time_entry_contributions(state: Optional[Dict]) -> List[Contribution]:
+        if state is None or state['organization_id'] is None or not state['minutes']:
+            return []
+        return [('minutes_tracked', state['date'], Decimal(state['minutes']))]
+
+    @classmethod
+    def _task_state(cls, task, previous: Optional[Dict] = None) -> Dict:
+        return {
+            'client_id': task.client_id,
+            'organization_id': cls._organization_id(task, previous),
+            'status': task.status,
+            'deadline': task.deadline,
+            'completed_at': task.completed_at,
+        }
+
+    @classmethod
+    def _time_entry_state(cls, entry, previous: Optional[Dict] = None) -> Dict:
+        return {
+            'client_id': entry.client_id,
+            'organization_id': cls._organization_id(entry, previous),
+            'date': entry.date,
+            'minutes': entry.minutes_spent or 0,
+        }
+
+    @classmethod
+    def snapshot(cls, instance) -> None:
+        """Chamado em pre_save: guarda na instância o estado atualmente gravado."""
+        previous = None
+        if not instance._state.adding:
+            if isinstance(instance, Task):
+                fields = ('client_id', 'client__organization_id', 'status', 'deadline', 'completed_at')
+            else:
+                fields = ('client_id', 'client__organization_id', 'date', 'minutes_spent')
+            previous = type(instance).objects.filter(pk=instance.pk).values(*fields).first()
+            if previous is not None:
+                previous['organization_id'] = previous.pop('client__organization_id')
+                if 'minutes_spent' in previous:
+                    previous['minutes'] = previous.pop('minutes_spent') or 0
+        attr = cls.TASK_SNAPSHOT_ATTR if isinstance(instance, Task) else cls.TIME_ENTRY_SNAPSHOT_ATTR
+        setattr(instance, attr, previous)
+
+    @classmethod
+    def record_change(cls, instance, deleted: bool = False) -> None:
+        """Soma aos contadores a diferença causada por gravar ou remover uma Task/TimeEntry."""
+        is_task = isinstance(instance, Task)
+        contributions = cls._task_contributions if is_task else cls._time_entry_contributions
+        state_of = cls._task_state if is_task else cls._time_entry_state
+        previous = getattr(instance, cls.TASK_SNAPSHOT_ATTR if is_task else cls.TIME_ENTRY_SNAPSHOT_ATTR, None)
+        try:
+            if deleted:
+                removed, added = state_of(instance, previous), None
+            else:
+                removed, added = previous, state_of(instance, previous)
+                if removed == added:
+                    return
+            deltas = defaultdict(Decimal)
+            for state, sign in ((removed, -1), (added, 1)):
+                for metric, day, value in contributions(state):
+                    deltas[(state['organization_id'], metric, day)] += sign * value
+        except Exception as e:
+            logger.error(f"Erro ao calcular o delta do dashboard para {instance.pk}: {e}", exc_info=True)
+            return
+        # Só depois do commit: um rollback não deixa o contador desviado e o lock da linha é curto
+        transaction.on_commit(lambda: cls.increment(deltas))
+
+    @classmethod
+    def record_created(cls, instances: Iterable) -> None:
+        """record_change para Tasks/TimeEntries criadas com bulk_create, que não dispara signals."""
+        deltas = defaultdict(Decimal)
+        try:
+            for instance in instances:
+                is_task = isinstance(instance, Task)
+                state = (cls._task_state if is_task else cls._time_entry_state)(instance)
+                for metric, day, value in (cls._task_contributions if is_task else cls._time_entry_contributions)(state):
+                    deltas[(state['organization_id'], metric, day)] += value
+        except Exception as e:
+            logger.error(f"Erro ao calcular o delta do dashboard para registos criados em bloco: {e}", exc_info=True)
+            return
+        if deltas:
+            transaction.on_commit(lambda: cls.increment(deltas))
+
+    # --- Escrita ---
+
+    @staticmethod
+    def _upsert(rows: List[Tuple], accumulate: bool) -> None:
+        """INSERT ... ON CONFLICT das linhas (organization_id, metric, day, value), por ordem fixa."""
+        if not rows:
+            return
+        table = connection.ops.quote_name(DashboardCounter._meta.db_table)
+        update = f"{table}.value + EXCLUDED.value" if accumulate else "EXCLUDED.value"
+        placeholders = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+        params = [value for row in sorted(rows, key=lambda row: row[:3]) for value in row]
+        organizations = connection.ops.quote_name(Organization._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Linhas de organizações entretanto removidas são ignoradas
+            cursor.execute(
+                f"INSERT INTO {table} (organization_id, metric, day, value) "
+                f"SELECT v.organization_id, v.metric, v.day, v.value "
+                f"FROM (VALUES {placeholders}) AS v (organization_id, metric, day, value) "
+                f"WHERE EXISTS (SELECT 1 FROM {organizations} o WHERE o.id = v.organization_id) "
+                f"ON CONFLICT (organization_id, metric, day) DO UPDATE SET value = {update}",
+                params
+            )
+
+    @classmethod
+    def increment(cls, deltas: Dict[Tuple, Decimal]) -> int:
+        """Soma os deltas {(organization_id, métrica, dia): valor}; histórico fora da janela é ignorado."""
+        cutoff = timezone.localdate() - timedelta(days=HISTORY_DAYS)
+        rows = [
+            (organization_id, metric, day, value)
+            for (organization_id, metric, day), value in deltas.items()
+            if value and (metric == 'open_tasks' or day >= cutoff)
+        ]
+        try:
+            cls._upsert(rows, accumulate=True)
+        except Exception as e:
+            # A reconstrução semanal corrige qualquer delta perdido
+            logger.error(f"Erro ao atualizar contadores do dashboard: {e}", exc_info=True)
+            return 0
+        return len(rows)
+
+    @staticmethod
+    def _month_start(year: int, month: int) -> date:
+        return date(year, month, 1)
+
+    @classmethod
+    def refresh_profitability(cls, periods: Iterable[Tuple[int, int]], client_ids: Optional[Iterable] = None,
+                              organization_ids: Optional[Iterable] = None) -> int:
+        """
+        Recalcula as métricas de rentabilidade das organizações dos clientes indicados (ou das
+        organizações indicadas) nos períodos (ano, mês). Uma agregação por organização e mês.
+        """
+        periods = {(int(year), int(month)) for year, month in periods}
+        organization_ids = set(organization_ids or [])
+        if client_ids is not None:
+            organization_ids |= set(
+                Client.objects.filter(id__in=list(client_ids)).values_list('organization_id', flat=True)
+            )
+        if not periods or not organization_ids:
+            return 0
+
+        totals = {
+            (row['client__organization_id'], row['year'], row['month']): row
+            for row in ClientProfitability.objects.filter(
+                client__organization_id__in=organization_ids,
+                year__in={year for year, _ in periods},
+                month__in={month for _, month in periods},
+            ).values('client__organization_id', 'year', 'month').annotate(
+                unprofitable=Count('id', filter=Q(is_profitable=False)),
+                margin_total=Sum('profit_margin'),
+                margin_count=Count('profit_margin'),
+            )
+        }
+        rows = []
+        for organization_id in organization_ids:
+            for year, month in periods:
+                row = totals.get((organization_id, year, month), {})
+                day = cls._month_start(year, month)
+                rows += [
+                    (organization_id, 'unprofitable_clients', day, Decimal(row.get('unprofitable') or 0)),
+                    (organization_id, 'profit_margin_total', day, row.get('margin_total') or Decimal('0')),
+                    (organization_id, 'profit_margin_count', day, Decimal(row.get('margin_count') or 0)),
+                ]
+        cls._upsert(rows, accumulate=False)
+        return len(rows)
+
+    @classmethod
+    def schedule_profitability_refresh(cls, periods: Iterable[Tuple[int, int]], client_ids: Iterable) -> None:
+        """Recalcula as métricas de rentabilidade depois do commit da transação atual."""
+        periods, client_ids = list(periods), list(client_ids)
+
+        def refresh():
+            try:
+                cls.refresh_profitability(periods, client_ids=client_ids)
+            except Exception as e:
+                logger.error(f"Erro ao atualizar a rentabilidade do dashboard: {e}", exc_info=True)
+
+        transaction.on_commit(refresh)
+
+    @staticmethod
+    def _profitability_periods(today: date) -> List[Tuple[int, int]]:
+        previous = today.replace(day=1) - timedelta(days=1)
+        return [(today.year, today.month), (previous.year, previous.month)]
+
+    @classmethod
+    def rebuild(cls, organization_id) -> int:
+        """Recalcula todos os contadores da organização a partir das tabelas de origem."""
+        today = timezone.localdate()
+        cutoff = today - timedelta(days=HISTORY_DAYS)
+        rows = defaultdict(Decimal)
+
+        tasks = Task.objects.filter(client__organization_id=organization_id)
+        for row in tasks.filter(status__in=OPEN_STATUSES).annotate(
+            day=TruncDate('deadline')
+        ).values('day').annotate(total=Count('id')).order_by():
+            day = row['day'] or UNDATED
+            rows[('open_tasks', OVERDUE_BUCKET if day < today else day)] += row['total']
+        for row in tasks.filter(status='completed', completed_at__date__gte=cutoff).annotate(
+            day=TruncDate('completed_at')
+        ).values('day').annotate(total=Count('id')).order_by():
+            rows[('completed_tasks', row['day'])] += row['total']
+        for row in TimeEntry.objects.filter(
+            client__organization_id=organization_id, date__gte=cutoff
+        ).values('date').annotate(total=Sum('minutes_spent')).order_by():
+            rows[('minutes_tracked', row['date'])] += row['total'] or 0
+
+        with transaction.atomic():
+            # Serializa reconstruções concorrentes da mesma organização
+            Organization.objects.select_for_update().filter(id=organization_id).exists()
+            DashboardCounter.objects.filter(organization_id=organization_id).delete()
+            DashboardCounter.objects.bulk_create([
+                DashboardCounter(organization_id=organization_id, metric=metric, day=day, value=value)
+                for (metric, day), value in rows.items() if value
+            ] + [DashboardCounter(organization_id=organization_id, metric='rebuilt', day=today, value=1)])
+            written = cls.refresh_profitability(cls._profitability_periods(today), organization_ids=[organization_id])
+        return len(rows) + written
+
+    @classmethod
+    def rollover(cls) -> Dict:
+        """
+        Trabalho da meia-noite: consolida as tarefas abertas com prazo já passado num único
+        contador por organização e apaga o histórico fora da janela. Não altera os totais.
+        """
+        today = timezone.localdate()
+        cutoff = today - timedelta(days=HISTORY_DAYS)
+        table = connection.ops.quote_name(DashboardCounter._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH moved AS ("
+                f"  DELETE FROM {table} WHERE metric = 'open_tasks' AND day < %s AND day > %s"
+                f"  RETURNING organization_id, value"
+                f") INSERT INTO {table} (organization_id, metric, day, value) "
+                f"SELECT organization_id, 'open_tasks', %s, SUM(value) FROM moved GROUP BY organization_id "
+                f"ON CONFLICT (organization_id, metric, day) DO UPDATE SET value = {table}.value + EXCLUDED.value",
+                [today, OVERDUE_BUCKET, OVERDUE_BUCKET]
+            )
+            folded = cursor.rowcount
+            pruned, _ = DashboardCounter.objects.filter(
+                Q(metric__in=('completed_tasks', 'minutes_tracked'), day__lt=cutoff)
+                | Q(metric__in=PROFITABILITY_METRICS, day__lt=cls._month_start(*cls._profitability_periods(today)[1]))
+            ).delete()
+        logger.info(f"Rollover dos contadores do dashboard: {folded} organizações consolidadas, {pruned} linhas apagadas")
+        return {'organizations_folded': folded, 'rows_pruned': pruned}
+
+    # --- Leitura ---
+
+    @classmethod
+    def organization_summary(cls, organization_id) -> Dict:
+        """Totais do dashboard de uma organização (reconstrói os contadores na primeira leitura)."""
+        today = timezone.localdate()
+        week_ago = today - timedelta(days=7)
+        month_start = today.replace(day=1)
+        totals = DashboardCounter.objects.filter(organization_id=organization_id).aggregate(
+            active_tasks=Sum('value', filter=Q(metric='open_tasks')),
+            overdue_tasks=Sum('value', filter=Q(metric='open_tasks', day__lt=today)),
+            today_tasks=Sum('value', filter=Q(metric='open_tasks', day=today)),
+            completed_tasks_week=Sum('value', filter=Q(metric='completed_tasks', day__gte=week_ago)),
+            time_tracked_today=Sum('value', filter=Q(metric='minutes_tracked', day=today)),
+            time_tracked_week=Sum('value', filter=Q(metric='minutes_tracked', day__gte=week_ago)),
+            unprofitable_clients=Sum('value', filter=Q(metric='unprofitable_clients', day=month_start)),
+            margin_total=Sum('value', filter=Q(metric='profit_margin_total', day=month_start)),
+            margin_count=Sum('value', filter=Q(metric='profit_margin_count', day=month_start)),
+            rebuilt=Count('id', filter=Q(metric='rebuilt')),
+        )
+        if not totals.pop('rebuilt'):
+            cls.rebuild(organization_id)
+            return cls.organization_summary(organization_id)
+
+        margin_total, margin_count = totals.pop('margin_total'), totals.pop('margin_count')
+        summary = {key: int(value or 0) for key, value in totals.items()}
+        summary['average_profit_margin'] = float(margin_total / margin_count) if margin_count else 0
+        return summary
+
+    @staticmethod
+    def user_task_summary(tasks_qs) -> Dict:
+        """Parte das tarefas visíveis a um utilizador sem acesso a toda a organização."""
+        today = timezone.localdate()
+        week_ago = today - timedelta(days=7)
+        stats = tasks_qs.aggregate(
+            active_tasks=Count('id', filter=Q(status__in=OPEN_STATUSES)),
+            overdue_tasks=Count('id', filter=Q(deadline__date__lt=today, status__in=OPEN_STATUSES)),
+            today_tasks=Count('id', filter=Q(deadline__date=today, status__in=OPEN_STATUSES)),
+            completed_tasks_week=Count('id', filter=Q(status='completed', completed_at__date__gte=week_ago)),
+        )
+        return {key: value or 0 for key, value in stats.items()}
+
+    @staticmethod
+    def user_time_summary(user, organization_id) -> Dict:
+        """Minutos registados pelo próprio utilizador (índice user/date)."""
+        today = timezone.localdate()
+        stats = TimeEntry.objects.filter(
+            user=user, client__organization_id=organization_id, date__gte=today - timedelta(days=7)
+        ).aggregate(
+            time_tracked_today=Sum('minutes_spent', filter=Q(date=today)),
+            time_tracked_week=Sum('minutes_spent'),
+        )
+        return {key: value or 0 for key, value in stats.items()}
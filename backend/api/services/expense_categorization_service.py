@@ -1,38 +1,319 @@
-# api/services/expense_categorization_service.py (NEW FILE)
-from ..gemini_service import GeminiService
+# api/services/expense_categorization_service.py
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Tuple
 import json
 import logging
 
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from ..models import Expense, ScannedInvoice
+from .gemini_service import GeminiService
+
 logger = logging.getLogger(__name__)
 
+
 class ExpenseCategorizationService:
-    @staticmethod
-    def categorize_from_invoice(invoice):
-        """Uses Gemini to suggest an expense category based on invoice data."""
-        if not invoice.nif_emitter and not invoice.raw_qr_code_data:
-            return "Outras Despesas" # Not enough info
-
-        prompt_text = (
-            "You are an expert Portuguese accountant. Based on the following invoice data, "
-            "suggest the most likely expense category from this list: "
-            "['COMBUSTÍVEL', 'REFEIÇÕES E ESTADIAS', 'MARKETING', 'SOFTWARE E TI', "
-            "'FORNECEDORES', 'RENDA', 'COMUNICAÇÕES', 'SEGUROS', 'OUTRAS DESPESAS']. "
-            "Return only the category name in uppercase.\n\n"
-            f"NIF do Emissor: {invoice.nif_emitter}\n"
-            f"Dados do QR Code: {invoice.raw_qr_code_data}\n\n"
-            "Categoria Sugerida:"
+    """
+    Categorização das despesas criadas a partir de faturas digitalizadas.
+
+    A decisão é quase sempre a mesma por NIF emitente, por isso há um nível local
+    antes do Gemini:
+    1. Memória NIF emitente → categoria da organização, construída a partir das
+       despesas anteriores e das correções dos utilizadores (ScannedInvoice.edited_data
+       e despesas recategorizadas), que pesam mais do que as categorizações automáticas.
+    2. Classificador sobre os campos do QR Code (tipo de documento, taxa de IVA
+       dominante, escalão do valor), aprendido com as despesas da organização.
+    Só os emitentes desconhecidos vão ao Gemini, fora do worker de descodificação:
+    as despesas ficam sem categoria e o categorize_pending_expenses_task (com
+    debounce) envia vários emitentes num único prompt.
+    """
+
+    CATEGORIES = [
+        'COMBUSTÍVEL', 'REFEIÇÕES E ESTADIAS', 'MARKETING', 'SOFTWARE E TI',
+        'FORNECEDORES', 'RENDA', 'COMUNICAÇÕES', 'SEGUROS', 'OUTRAS DESPESAS'
+    ]
+    DEFAULT_CATEGORY = 'OUTRAS DESPESAS'
+
+    MODEL_CACHE_KEY = 'expense_category_model_{organization_id}'
+    MODEL_CACHE_TIMEOUT = 60 * 60
+    SCHEDULE_CACHE_KEY = 'expense_categorization_scheduled_{organization_id}'
+    DEBOUNCE_SECONDS = 10
+
+    # Uma correção manual vale tantas categorizações automáticas
+    CORRECTION_WEIGHT = 10
+    PROFILE_SAMPLE_SIZE = 5000
+    PROFILE_MIN_SAMPLES = 3
+    PROFILE_MIN_SHARE = 0.75
+    LLM_BATCH_SIZE = 30
+
+    # Bases tributáveis do QR Code da AT: I2 isenta, I3 reduzida, I5 intermédia, I7 normal
+    QR_TAXABLE_BASES = {'I2': 'isenta', 'I3': 'reduzida', 'I5': 'intermedia', 'I7': 'normal'}
+    AMOUNT_BANDS = [(Decimal('20'), 'ate_20'), (Decimal('100'), 'ate_100'), (Decimal('1000'), 'ate_1000')]
+
+    @classmethod
+    def categorize_from_invoice(cls, invoice) -> str:
+        """Categoria de uma única fatura (nível local e, para emitentes desconhecidos, o Gemini)."""
+        return cls.categorize_invoices([invoice]).get(invoice.id, cls.DEFAULT_CATEGORY)
+
+    @classmethod
+    def categorize_locally(cls, invoice, model: Optional[Dict] = None) -> Optional[str]:
+        """Categoria a partir da memória por NIF ou do classificador local; None se for desconhecida."""
+        if model is None:
+            model = cls.get_model(invoice.organization_id)
+        nif = cls._invoice_value(invoice, 'nif_emitter')
+        if nif and nif in model['nifs']:
+            return model['nifs'][nif]
+        return cls.classify(invoice, model['profiles'])
+
+    @classmethod
+    def categorize_invoices(cls, invoices: Iterable) -> Dict:
+        """
+        Categoriza várias faturas da mesma organização: primeiro localmente e depois
+        com um prompt por cada LLM_BATCH_SIZE emitentes desconhecidos.
+
+        Returns:
+            Dict id da fatura → categoria
+        """
+        invoices = list(invoices)
+        if not invoices:
+            return {}
+        organization_id = invoices[0].organization_id
+        model = cls.get_model(organization_id)
+        categories, unknown = {}, {}
+        for invoice in invoices:
+            category = cls.categorize_locally(invoice, model)
+            if category:
+                categories[invoice.id] = category
+            elif not invoice.nif_emitter and not invoice.raw_qr_code_data:
+                categories[invoice.id] = cls.DEFAULT_CATEGORY  # Not enough info
+            else:
+                unknown.setdefault(cls._invoice_value(invoice, 'nif_emitter') or invoice.id, []).append(invoice)
+
+        if unknown:
+            # Uma fatura representativa por emitente
+            representatives = [group[0] for group in unknown.values()]
+            suggested = cls._categorize_with_llm(representatives)
+            learned = {}
+            for key, group in unknown.items():
+                category = suggested.get(group[0].id) or cls.DEFAULT_CATEGORY
+                for invoice in group:
+                    categories[invoice.id] = category
+                if group[0].id in suggested and isinstance(key, str):
+                    learned[key] = category
+            cls._remember(organization_id, learned)
+        return categories
+
+    @classmethod
+    def categorize_pending(cls, organization_id) -> int:
+        """Categoriza as despesas automáticas ainda sem categoria de uma organização."""
+        expenses = list(
+            Expense.objects.filter(
+                source_scanned_invoice__organization_id=organization_id,
+                is_auto_categorized=True, category__isnull=True,
+            ).select_related('source_scanned_invoice')
         )
+        if not expenses:
+            return 0
+        categories = cls.categorize_invoices([expense.source_scanned_invoice for expense in expenses])
+        for expense in expenses:
+            expense.category = categories.get(expense.source_scanned_invoice_id, cls.DEFAULT_CATEGORY)
+        Expense.objects.bulk_update(expenses, ['category'], batch_size=500)
+        return len(expenses)
 
+    @classmethod
+    def schedule_pending(cls, organization_id) -> None:
+        """Agenda a categorização das despesas pendentes, no máximo uma vez por janela de debounce."""
+        from ..tasks import categorize_pending_expenses_task
+        try:
+            if cache.add(cls.SCHEDULE_CACHE_KEY.format(organization_id=organization_id), True,
+                         timeout=cls.DEBOUNCE_SECONDS * 6):
+                categorize_pending_expenses_task.apply_async(args=[str(organization_id)], countdown=cls.DEBOUNCE_SECONDS)
+        except Exception as e:
+            logger.warning(f"Não foi possível agendar a categorização de despesas da organização {organization_id}: {e}")
+
+    @classmethod
+    def record_correction(cls, invoice, category: str) -> None:
+        """Correção manual da categoria de uma fatura: atualiza a despesa e a memória por NIF."""
+        category = (category or '').strip().upper()
+        if category not in cls.CATEGORIES:
+            return
+        Expense.objects.filter(source_scanned_invoice=invoice).update(category=category, is_auto_categorized=False)
+        organization_id = invoice.organization_id
+        transaction.on_commit(lambda: cls.invalidate(organization_id))
+
+    @classmethod
+    def invalidate(cls, organization_id) -> None:
+        cache.delete(cls.MODEL_CACHE_KEY.format(organization_id=organization_id))
+
+    # --- Modelo local ---
+
+    @classmethod
+    def get_model(cls, organization_id) -> Dict:
+        """Memória por NIF e perfis do classificador da organização (em cache)."""
+        key = cls.MODEL_CACHE_KEY.format(organization_id=organization_id)
+        model = cache.get(key)
+        if model is None:
+            model = cls.build_model(organization_id)
+            cache.set(key, model, timeout=cls.MODEL_CACHE_TIMEOUT)
+        return model
+
+    @classmethod
+    def build_model(cls, organization_id) -> Dict:
+        expenses = Expense.objects.filter(
+            source_scanned_invoice__organization_id=organization_id, category__in=cls.CATEGORIES
+        )
+        scores: Dict[str, Counter] = {}
+        for nif, category, total, manual in expenses.exclude(
+            source_scanned_invoice__nif_emitter__isnull=True
+        ).values_list('source_scanned_invoice__nif_emitter', 'category').annotate(
+            total=Count('id'), manual=Count('id', filter=Q(is_auto_categorized=False))
+        ).order_by():
+            scores.setdefault(nif, Counter())[category] += (total - manual) + manual * cls.CORRECTION_WEIGHT
+
+        # Correções feitas na revisão da fatura (o NIF também pode ter sido corrigido)
+        for nif, edited_data in ScannedInvoice.objects.filter(
+            organization_id=organization_id, edited_data__has_key='category'
+        ).values_list('nif_emitter', 'edited_data'):
+            category = str(edited_data.get('category') or '').strip().upper()
+            nif = edited_data.get('nif_emitter') or nif
+            if nif and category in cls.CATEGORIES:
+                scores.setdefault(nif, Counter())[category] += cls.CORRECTION_WEIGHT
+
+        profiles: Dict[Tuple, Counter] = {}
+        for doc_type, raw_qr, gross_total, category in expenses.exclude(category=cls.DEFAULT_CATEGORY).order_by(
+            '-created_at'
+        ).values_list(
+            'source_scanned_invoice__doc_type', 'source_scanned_invoice__raw_qr_code_data',
+            'source_scanned_invoice__gross_total', 'category'
+        )[:cls.PROFILE_SAMPLE_SIZE]:
+            features = cls.features(doc_type, raw_qr, gross_total)
+            if cls._informative(features):
+                profiles.setdefault(features, Counter())[category] += 1
+
+        return {
+            'nifs': {nif: counter.most_common(1)[0][0] for nif, counter in scores.items()},
+            'profiles': profiles,
+        }
+
+    @classmethod
+    def _remember(cls, organization_id, learned: Dict[str, str]) -> None:
+        """Acrescenta à memória em cache as categorias sugeridas pelo Gemini."""
+        if not learned:
+            return
+        key = cls.MODEL_CACHE_KEY.format(organization_id=organization_id)
+        model = cache.get(key)
+        if model is not None:
+            model['nifs'].update(learned)
+            cache.set(key, model, timeout=cls.MODEL_CACHE_TIMEOUT)
+
+    @classmethod
+    def classify(cls, invoice, profiles: Dict) -> Optional[str]:
+        features = cls.features(
+            cls._invoice_value(invoice, 'doc_type'), invoice.raw_qr_code_data,
+            cls._invoice_value(invoice, 'gross_total'),
+        )
+        counter = profiles.get(features) if cls._informative(features) else None
+        if counter:
+            category, count = counter.most_common(1)[0]
+            if count >= cls.PROFILE_MIN_SAMPLES and count / sum(counter.values()) >= cls.PROFILE_MIN_SHARE:
+                return category
+        # Sem histórico: a taxa intermédia aplica-se sobretudo à restauração
+        if features[1] == 'intermedia':
+            return 'REFEIÇÕES E ESTADIAS'
+        return None
+
+    @classmethod
+    def features(cls, doc_type, raw_qr_code_data, gross_total) -> Tuple[str, str, str]:
+        """(tipo de documento, taxa de IVA com maior base tributável, escalão do valor)"""
+        bases = {}
+        for part in (raw_qr_code_data or '').split('*'):
+            key, _, value = part.partition(':')
+            if key in cls.QR_TAXABLE_BASES:
+                amount = cls._decimal(value)
+                if amount:
+                    bases[cls.QR_TAXABLE_BASES[key]] = amount
+        dominant_rate = max(bases, key=bases.get) if bases else 'desconhecida'
+
+        amount = cls._decimal(gross_total)
+        amount_band = 'desconhecido'
+        if amount is not None:
+            amount_band = next((band for limit, band in cls.AMOUNT_BANDS if abs(amount) < limit), 'acima_1000')
+        return (doc_type or 'OT', dominant_rate, amount_band)
+
+    @staticmethod
+    def _informative(features: Tuple[str, str, str]) -> bool:
+        """Só o tipo de documento, sem taxas nem valor, não chega para classificar."""
+        return features[1] != 'desconhecida' or features[2] != 'desconhecido'
+
+    @staticmethod
+    def _decimal(value) -> Optional[Decimal]:
+        if value in (None, ''):
+            return None
+        try:
+            return Decimal(str(value))
+        except (InvalidOperation, ValueError):
+            return None
+
+    @staticmethod
+    def _invoice_value(invoice, field):
+        """Valor do campo com as correções do utilizador por cima dos dados do QR Code."""
+        edited = (invoice.edited_data or {}).get(field)
+        return edited if edited not in (None, '') else getattr(invoice, field)
+
+    # --- Gemini ---
+
+    @classmethod
+    def _categorize_with_llm(cls, invoices: List) -> Dict:
+        """Categorias sugeridas pelo Gemini, com um prompt por cada LLM_BATCH_SIZE faturas."""
+        suggested = {}
         try:
             gemini = GeminiService()
-            # Use a simpler, non-conversational generation for this specific task
-            category = gemini.generate_text_response(prompt_text) # Assumes a method for single-turn generation
-            # Clean up the response to ensure it's just the category name
-            valid_categories = ['COMBUSTÍVEL', 'REFEIÇÕES E ESTADIAS', 'MARKETING', 'SOFTWARE E TI', 'FORNECEDORES', 'RENDA', 'COMUNICAÇÕES', 'SEGUROS', 'OUTRAS DESPESAS']
-            cleaned_category = category.strip().upper()
-            if cleaned_category in valid_categories:
-                return cleaned_category
-            return "OUTRAS DESPESAS"
         except Exception as e:
-            logger.error(f"Error categorizing expense for invoice {invoice.id}: {e}")
-            return "OUTRAS DESPESAS"
\ No newline at end of file
+            logger.error(f"Gemini indisponível para categorizar despesas: {e}")
+            return suggested
+        for start in range(0, len(invoices), cls.LLM_BATCH_SIZE):
+            chunk = invoices[start:start + cls.LLM_BATCH_SIZE]
+            try:
+                response = gemini.generate_conversational_response([{"text": cls._build_prompt(chunk)}])
+                suggested.update(cls._parse_llm_response(response, chunk))
+            except Exception as e:
+                logger.error(f"Error categorizing {len(chunk)} invoices with Gemini: {e}")
+        return suggested
+
+    @classmethod
+    def _build_prompt(cls, invoices: List) -> str:
+        lines = [
+            "You are an expert Portuguese accountant. For each invoice below, suggest the most likely "
+            f"expense category from this list: {cls.CATEGORIES}. "
+            'Return only a JSON object mapping each invoice number to the category name in uppercase, '
+            'e.g. {"1": "COMBUSTÍVEL"}.',
+            "",
+        ]
+        for index, invoice in enumerate(invoices, 1):
+            lines.append(
+                f"{index}. NIF do Emissor: {cls._invoice_value(invoice, 'nif_emitter')} | "
+                f"Tipo: {cls._invoice_value(invoice, 'doc_type')} | "
+                f"Total: {cls._invoice_value(invoice, 'gross_total')} | "
+                f"Dados do QR Code: {invoice.raw_qr_code_data}"
+            )
+        return '\n'.join(lines)
+
+    @classmethod
+    def _parse_llm_response(cls, response: Optional[str], invoices: List) -> Dict:
+        if not response or '{' not in response:
+            logger.warning(f"Resposta do Gemini sem categorias: {response!r:.200}")
+            return {}
+        try:
+            data = json.loads(response[response.index('{'):response.rindex('}') + 1])
+        except ValueError:
+            logger.warning(f"Resposta do Gemini inválida: {response!r:.200}")
+            return {}
+        suggested = {}
+        for index, invoice in enumerate(invoices, 1):
+            category = str(data.get(str(index), '')).strip().upper()
+            if category in cls.CATEGORIES:
+                suggested[invoice.id] = category
+        return suggested
@@ -1,6 +1,7 @@
 # api/services/financial_health_service.py (NEW FILE)
 
 from ..models import Client, ClientProfitability, Task
+from .saft_analytics_service import SAFTAnalyticsService
 from django.utils import timezone
 from decimal import Decimal
 
@@ -8,22 +9,22 @@ class FinancialHealthService:
     @staticmethod
     def calculate_for_client(client: Client) -> int:
         """Calculates and returns the financial health score for a single client."""
-        # Weighted average: 40% Profitability, 30% Compliance, 30% Cash Flow Proxy
-        profitability = FinancialHealthService._calculate_profitability_score(client)
-        compliance = FinancialHealthService._calculate_compliance_score(client)
-        cash_flow = FinancialHealthService._calculate_cash_flow_score(client)
-
-        score = int((profitability * 0.4) + (compliance * 0.3) + (cash_flow * 0.3))
-        return max(0, min(100, score)) # Clamp score between 0 and 100
+        return FinancialHealthService.health_score(
+            FinancialHealthService._calculate_profitability_score(client),
+            FinancialHealthService._calculate_compliance_score(client),
+            FinancialHealthService._calculate_cash_flow_score(client),
+        )
 
     @staticmethod
     def _calculate_profitability_score(client: Client) -> int:
         # Score based on recent profitability margin
         last_profit_record = ClientProfitability.objects.filter(client=client).order_by('-year', '-month').first()
-        if not last_profit_record or last_profit_record.profit_margin is None:
-            return 50 # Neutral score if no data
+        return FinancialHealthService.profitability_score(last_profit_record.profit_margin if last_profit_record else None)
 
-        margin = last_profit_record.profit_margin
+    @staticmethod
+    def profitability_score(margin) -> int:
+        if margin is None:
+            return 50 # Neutral score if no data
         if margin > 30: return 100
         if margin > 15: return 80
         if margin > 5: return 60
@@ -39,7 +40,10 @@ class FinancialHealthService:
             status__in=['pending', 'in_progress'],
             deadline__lt=timezone.now()
         ).count()
+        return FinancialHealthService.compliance_score(overdue_fiscal_tasks)
 
+    @staticmethod
+    def compliance_score(overdue_fiscal_tasks: int) -> int:
         if overdue_fiscal_tasks == 0: return 100
         if overdue_fiscal_tasks == 1: return 60
         if overdue_fiscal_tasks <= 3: return 30
@@ -47,49 +51,93 @@ class FinancialHealthService:
 
     @staticmethod
     def _calculate_cash_flow_score(client: Client) -> int:
-        # Simple proxy for cash flow using monthly fee and last SAFT summary
-        # V1: A simple score based on revenue size. This can be improved later.
-        fee = client.monthly_fee or Decimal('0.0')
+        # Uses the monthly revenue of the client's latest SAF-T (stored aggregates);
+        # falls back to a proxy based on the monthly fee when there is none.
+        saft_file = SAFTAnalyticsService.latest_file_for_client(client)
+        months = SAFTAnalyticsService.monthly_revenue(saft_file) if saft_file else []
+        return FinancialHealthService.cash_flow_score(months, client.monthly_fee)
+
+    @staticmethod
+    def cash_flow_score(months, monthly_fee) -> int:
+        if len(months) >= 3:
+            return FinancialHealthService._score_from_monthly_revenue(months)
+
+        fee = monthly_fee or Decimal('0.0')
         if fee > 500: return 90
         if fee > 200: return 75
         if fee > 50: return 60
         return 40
 
     @staticmethod
-    def calculate_churn_risk(client: Client) -> str:
-        """Calculates the churn risk for a single client."""
-        score = 0
-        reasons = []
+    def health_score(profitability: int, compliance: int, cash_flow: int) -> int:
+        # Weighted average: 40% Profitability, 30% Compliance, 30% Cash Flow Proxy
+        score = int((profitability * 0.4) + (compliance * 0.3) + (cash_flow * 0.3))
+        return max(0, min(100, score)) # Clamp score between 0 and 100
 
-        # Factor 1: Profitability Trend (very important)
-        last_six_months_profit = ClientProfitability.objects.filter(
-            client=client
-        ).order_by('-year', '-month')[:6].values_list('profit_margin', flat=True)
+    @staticmethod
+    def _score_from_monthly_revenue(months) -> int:
+        """Trend of the last 3 months vs the previous ones, penalised by cancelled documents."""
+        revenues = [month['net_total'] for month in months]
+        recent = sum(revenues[-3:]) / 3
+        previous = revenues[:-3]
+        baseline = sum(previous) / len(previous) if previous else recent
 
-        if len(last_six_months_profit) >= 3:
-            recent_avg = sum(last_six_months_profit[:3]) / 3
-            older_avg = sum(last_six_months_profit[3:]) / len(last_six_months_profit[3:])
-            if recent_avg < (older_avg * 0.8): # If recent profit dropped by 20%
-                score += 4
-                reasons.append("Margem de lucro em queda.")
+        if recent <= 0:
+            score = 10
+        elif baseline <= 0:
+            score = 70
+        else:
+            ratio = recent / baseline
+            if ratio >= Decimal('1.1'): score = 95
+            elif ratio >= Decimal('0.95'): score = 80
+            elif ratio >= Decimal('0.8'): score = 60
+            elif ratio >= Decimal('0.6'): score = 40
+            else: score = 20
 
-        # Factor 2: Overdue Tasks (indicates problems)
+        cancelled = sum(month['cancelled_count'] for month in months[-3:])
+        if cancelled > 10: score -= 15
+        elif cancelled > 3: score -= 5
+        return max(0, min(100, score))
+
+    @staticmethod
+    def calculate_churn_risk(client: Client) -> str:
+        """Calculates the churn risk for a single client."""
+        recent_margins = list(ClientProfitability.objects.filter(
+            client=client
+        ).order_by('-year', '-month')[:6].values_list('profit_margin', flat=True))
         overdue_tasks_count = Task.objects.filter(
             client=client,
             status__in=['pending', 'in_progress'],
             deadline__lt=timezone.now()
         ).count()
+        return FinancialHealthService.churn_risk(recent_margins, overdue_tasks_count)
+
+    @staticmethod
+    def churn_risk(recent_margins, overdue_tasks_count: int) -> str:
+        """
+        Churn risk from the latest monthly margins (newest first, up to 6) and the
+        number of overdue tasks. Months without a margin are ignored in the trend.
+        """
+        score = 0
+
+        # Factor 1: Profitability Trend (very important)
+        margins = [margin for margin in recent_margins[:6] if margin is not None]
+        if len(margins) > 3:
+            recent_avg = sum(margins[:3]) / 3
+            older_avg = sum(margins[3:]) / len(margins[3:])
+            if recent_avg < (older_avg * Decimal('0.8')): # If recent profit dropped by 20%
+                score += 4
+
+        # Factor 2: Overdue Tasks (indicates problems)
         if overdue_tasks_count > 2:
             score += 3
-            reasons.append(f"{overdue_tasks_count} tarefas importantes atrasadas.")
-        
+
         # Factor 3: Fee vs. Effort (is the client paying too little for the work?)
-        last_profit_record = ClientProfitability.objects.filter(client=client).order_by('-year', '-month').first()
-        if last_profit_record and last_profit_record.profit_margin is not None and last_profit_record.profit_margin < 10:
+        last_margin = recent_margins[0] if recent_margins else None
+        if last_margin is not None and last_margin < 10:
             score += 2
-            reasons.append("Margem de lucro muito baixa.")
 
         # Determine final risk level
         if score >= 6: return 'HIGH'
         if score >= 3: return 'MEDIUM'
-        return 'LOW'
\ No newline at end of file
+        return 'LOW'
@@ -2,7 +2,6 @@
 from django.utils import timezone
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from django.db import transaction
 from django.db.models import Q
 import logging
 from typing import List, Dict, Any, Optional
@@ -14,9 +13,10 @@ from ..models import (
     Client, 
     Profile,
     Organization,
-    WorkflowHistory
+    WorkflowStep
 )
 from .notification_service import NotificationService
+from .task_bulk_service import TaskBulkService
 
 logger = logging.getLogger(__name__)
 
@@ -27,8 +27,11 @@ class FiscalObligationGenerator:
     baseadas nas definições criadas e nas tags dos clientes.
     """
     
+    PLAN_BATCH_SIZE = 500
+
     @classmethod
-    def generate_obligations_for_period(cls, year: int, month: int, organization: Optional[Organization] = None) -> Dict[str, Any]:
+    def generate_obligations_for_period(cls, year: int, month: int, organization: Optional[Organization] = None,
+                                        dry_run: bool = False) -> Dict[str, Any]:
         """
         Gera obrigações para um período específico.
         
@@ -36,139 +39,293 @@ class FiscalObligationGenerator:
             year: Ano para gerar obrigações
             month: Mês para gerar obrigações
             organization: Organização específica (None para todas)
+            dry_run: Não grava nada; as estatísticas incluem o 'plan' do que seria criado
         
         Returns:
             Dict com estatísticas da geração
         """
-        logger.info(f"Iniciando geração de obrigações para {month:02d}/{year} - Org: {organization.name if organization else 'Todas'}")
-        
-        stats = {
-            'period': f"{month:02d}/{year}",
-            'organization': organization.name if organization else 'Todas',
-            'definitions_processed': 0,
-            'clients_processed': 0,
-            'tasks_created': 0,
-            'tasks_skipped': 0,
-            'errors': []
-        }
-        
-        try:
-            # Buscar definições ativas
-            definitions_query = FiscalObligationDefinition.objects.filter(is_active=True)
-            if organization:
-                # Incluir definições globais (sem organização) e da organização específica
-                definitions_query = definitions_query.filter(
-                    Q(organization__isnull=True) | Q(organization=organization)
-                )
-            
-            definitions = definitions_query.select_related('default_task_category', 'default_workflow')
-            
-            for definition in definitions:
-                stats['definitions_processed'] += 1
-                
-                try:
-                    # Verificar se a definição se aplica a este período
-                    if not cls._should_generate_for_period(definition, year, month):
-                        logger.debug(f"Definição {definition.name} não se aplica ao período {month:02d}/{year}")
-                        continue
-                    
-                    # Buscar clientes elegíveis
-                    eligible_clients = cls._get_eligible_clients(definition, organization)
-                    
-                    for client in eligible_clients:
-                        stats['clients_processed'] += 1
-                        
-                        try:
-                            # Calcular deadline e verificar se deve gerar
-                            deadline_info = cls._calculate_deadline(definition, year, month)
-                            if not deadline_info:
-                                stats['tasks_skipped'] += 1
-                                continue
-                            
-                            # Verificar se já existe tarefa para este período
-                            period_key = cls._generate_period_key(definition, year, month)
-                            existing_task = Task.objects.filter(
-                                client=client,
-                                source_fiscal_obligation=definition,
-                                obligation_period_key=period_key
-                            ).first()
-                            
-                            if existing_task:
-                                logger.debug(f"Tarefa já existe para {client.name} - {definition.name} - {period_key}")
-                                stats['tasks_skipped'] += 1
-                                continue
-                            
-                            # Verificar se está dentro do período de geração
-                            if not cls._should_generate_now(deadline_info['deadline'], definition.generation_trigger_offset_days):
-                                stats['tasks_skipped'] += 1
-                                continue
-                            
-                            # Criar a tarefa
-                            task = cls._create_obligation_task(
-                                definition=definition,
-                                client=client,
-                                deadline_info=deadline_info,
-                                period_key=period_key,
-                                year=year,
-                                month=month
-                            )
-                            
-                            if task:
-                                stats['tasks_created'] += 1
-                                logger.info(f"Tarefa criada: {task.title} para {client.name}")
-                                
-                                # Notificar se aplicável
-                                try:
-                                    cls._notify_task_creation(task, definition)
-                                except Exception as e:
-                                    logger.error(f"Erro ao notificar criação da tarefa {task.id}: {e}")
-                            
-                        except Exception as e:
-                            error_msg = f"Erro ao processar cliente {client.name} para definição {definition.name}: {e}"
-                            logger.error(error_msg)
-                            stats['errors'].append(error_msg)
-                            
-                except Exception as e:
-                    error_msg = f"Erro ao processar definição {definition.name}: {e}"
-                    logger.error(error_msg)
-                    stats['errors'].append(error_msg)
-            
-            logger.info(f"Geração concluída: {stats['tasks_created']} tarefas criadas, {stats['tasks_skipped']} ignoradas")
-            
-        except Exception as e:
-            error_msg = f"Erro geral na geração de obrigações: {e}"
-            logger.error(error_msg)
-            stats['errors'].append(error_msg)
-        
-        return stats
+        return cls.generate_for_periods([(year, month)], organization, dry_run)[0]
     
     @classmethod
-    def generate_for_current_period(cls, organization: Optional[Organization] = None) -> Dict[str, Any]:
+    def generate_for_current_period(cls, organization: Optional[Organization] = None, dry_run: bool = False) -> Dict[str, Any]:
         """Gera obrigações para o período atual."""
         now = timezone.now()
-        return cls.generate_obligations_for_period(now.year, now.month, organization)
+        return cls.generate_obligations_for_period(now.year, now.month, organization, dry_run)
     
     @classmethod
-    def generate_for_next_months(cls, months_ahead: int = 3, organization: Optional[Organization] = None) -> List[Dict[str, Any]]:
+    def generate_for_next_months(cls, months_ahead: int = 3, organization: Optional[Organization] = None,
+                                 dry_run: bool = False) -> List[Dict[str, Any]]:
         """
         Gera obrigações para os próximos N meses.
         
         Args:
             months_ahead: Quantidade de meses futuros para gerar
             organization: Organização específica
+            dry_run: Apenas planear (ver generate_for_periods)
         
         Returns:
             Lista com estatísticas de cada mês processado
         """
-        results = []
         now = timezone.now()
-        
+        periods = []
         for i in range(months_ahead + 1):  # +1 para incluir o mês atual
             target_date = now + relativedelta(months=i)
-            result = cls.generate_obligations_for_period(target_date.year, target_date.month, organization)
-            results.append(result)
-        
-        return results
+            periods.append((target_date.year, target_date.month))
+        return cls.generate_for_periods(periods, organization, dry_run)
+    
+    @classmethod
+    def generate_for_periods(cls, periods: List[tuple], organization: Optional[Organization] = None,
+                             dry_run: bool = False) -> List[Dict[str, Any]]:
+        """
+        Gera as obrigações de vários períodos (ano, mês) de uma só vez.
+
+        O deadline é calculado uma vez por definição e período, os clientes elegíveis são
+        lidos com uma query por conjunto de tags (filtrado em SQL), as tarefas já existentes
+        (cliente, definição, chave do período) são lidas numa query e as em falta são
+        criadas com bulk_create (o unique_together da Task resolve gerações concorrentes).
+        As notificações saem num único lote no fim.
+
+        Returns:
+            Lista com as estatísticas de cada período, pela ordem recebida
+        """
+        stats_by_period = {}
+        for year, month in periods:
+            stats_by_period[(year, month)] = {
+                'period': f"{month:02d}/{year}",
+                'organization': organization.name if organization else 'Todas',
+                'definitions_processed': 0,
+                'clients_processed': 0,
+                'tasks_created': 0,
+                'tasks_skipped': 0,
+                'errors': []
+            }
+            if dry_run:
+                stats_by_period[(year, month)]['plan'] = []
+        logger.info(
+            f"Iniciando geração de obrigações para {', '.join(s['period'] for s in stats_by_period.values())} "
+            f"- Org: {organization.name if organization else 'Todas'}{' (simulação)' if dry_run else ''}"
+        )
+
+        try:
+            plan = cls.plan_obligations(list(stats_by_period), organization, stats_by_period)
+            if dry_run:
+                for item in plan:
+                    stats_by_period[item['period']]['plan'].append(cls._describe_planned_task(item))
+            else:
+                cls._create_planned_tasks(plan, stats_by_period)
+        except Exception as e:
+            error_msg = f"Erro geral na geração de obrigações: {e}"
+            logger.error(error_msg, exc_info=True)
+            for stats in stats_by_period.values():
+                stats['errors'].append(error_msg)
+
+        for stats in stats_by_period.values():
+            logger.info(f"Geração {stats['period']} concluída: {stats['tasks_created']} tarefas criadas, {stats['tasks_skipped']} ignoradas")
+        return list(stats_by_period.values())
+
+    @classmethod
+    def plan_obligations(cls, periods: List[tuple], organization: Optional[Organization] = None,
+                         stats_by_period: Optional[Dict] = None) -> List[Dict[str, Any]]:
+        """
+        Tarefas em falta para os períodos, sem gravar nada. Cada item tem o período,
+        a definição, o cliente, o deadline_info, a chave do período e o título.
+        As estatísticas (definições, clientes, ignoradas, erros) são somadas em `stats_by_period`.
+        """
+        if stats_by_period is None:
+            stats_by_period = {
+                period: {'definitions_processed': 0, 'clients_processed': 0, 'tasks_skipped': 0, 'errors': []}
+                for period in periods
+            }
+
+        definitions_query = FiscalObligationDefinition.objects.filter(is_active=True)
+        if organization:
+            # Incluir definições globais (sem organização) e da organização específica
+            definitions_query = definitions_query.filter(
+                Q(organization__isnull=True) | Q(organization=organization)
+            )
+        definitions = list(definitions_query.select_related('default_task_category', 'default_workflow'))
+
+        candidates = []
+        eligible_by_scope = {}  # (organização, tags) -> clientes, partilhado entre definições e períodos
+        for year, month in periods:
+            stats = stats_by_period[(year, month)]
+            for definition in definitions:
+                stats['definitions_processed'] += 1
+                try:
+                    # Verificar se a definição se aplica a este período
+                    if not cls._should_generate_for_period(definition, year, month):
+                        logger.debug(f"Definição {definition.name} não se aplica ao período {month:02d}/{year}")
+                        continue
+
+                    eligible_clients = cls._get_eligible_clients(definition, organization, eligible_by_scope)
+                    stats['clients_processed'] += len(eligible_clients)
+
+                    # O deadline só depende da definição e do período
+                    deadline_info = cls._calculate_deadline(definition, year, month)
+                    if not deadline_info or not cls._should_generate_now(
+                        deadline_info['deadline'], definition.generation_trigger_offset_days
+                    ):
+                        stats['tasks_skipped'] += len(eligible_clients)
+                        continue
+
+                    period_key = cls._generate_period_key(definition, year, month)
+                    candidates.extend(
+                        ((year, month), definition, client, deadline_info, period_key)
+                        for client in eligible_clients
+                    )
+                except Exception as e:
+                    error_msg = f"Erro ao processar definição {definition.name}: {e}"
+                    logger.error(error_msg)
+                    stats['errors'].append(error_msg)
+
+        if not candidates:
+            return []
+
+        # Tarefas já existentes (cliente, definição, chave do período), numa query
+        existing_query = Task.objects.filter(
+            source_fiscal_obligation_id__in={definition.id for _, definition, _, _, _ in candidates},
+            obligation_period_key__in={period_key for _, _, _, _, period_key in candidates},
+        )
+        if organization:
+            existing_query = existing_query.filter(client__organization=organization)
+        existing = set(existing_query.values_list('client_id', 'source_fiscal_obligation_id', 'obligation_period_key'))
+
+        plan = []
+        for period, definition, client, deadline_info, period_key in candidates:
+            key = (client.id, definition.id, period_key)
+            if key in existing:
+                # Já existe, ou outro período desta geração já a planeou (ex.: mesmo trimestre)
+                logger.debug(f"Tarefa já existe para {client.name} - {definition.name} - {period_key}")
+                stats_by_period[period]['tasks_skipped'] += 1
+                continue
+            existing.add(key)
+            try:
+                title = cls._generate_task_title(definition, client, deadline_info, *period)
+            except Exception as e:
+                error_msg = f"Erro ao processar cliente {client.name} para definição {definition.name}: {e}"
+                logger.error(error_msg)
+                stats_by_period[period]['errors'].append(error_msg)
+                continue
+            plan.append({
+                'period': period,
+                'definition': definition,
+                'client': client,
+                'deadline_info': deadline_info,
+                'period_key': period_key,
+                'title': title,
+            })
+        return plan
+
+    @classmethod
+    def _get_eligible_clients(cls, definition: FiscalObligationDefinition, organization: Optional[Organization] = None,
+                              cache: Optional[Dict] = None) -> List[Client]:
+        """
+        Clientes ativos elegíveis para uma definição: têm TODAS as tags da definição
+        (sem tags ou com 'ALL' aplica-se a todos). A correspondência é feita em SQL
+        (fiscal_tags @> tags, com índice GIN); `cache` reutiliza o resultado para
+        definições com o mesmo âmbito e as mesmas tags.
+        """
+        required_tags = definition.applies_to_client_tags or []
+        tags = () if 'ALL' in required_tags else tuple(sorted(set(required_tags)))
+        scope = organization.id if organization else definition.organization_id
+        key = (scope, tags)
+        if cache is not None and key in cache:
+            return cache[key]
+
+        clients_query = Client.objects.filter(is_active=True).with_all_tags(tags)
+        if scope:
+            clients_query = clients_query.filter(organization_id=scope)
+        clients = list(clients_query.select_related('organization', 'account_manager'))
+        if cache is not None:
+            cache[key] = clients
+        return clients
+
+    @staticmethod
+    def _describe_planned_task(item: Dict[str, Any]) -> Dict[str, Any]:
+        """Item do plano de uma simulação (dry run), serializável."""
+        client, definition = item['client'], item['definition']
+        return {
+            'client_id': str(client.id),
+            'client_name': client.name,
+            'definition_id': str(definition.id),
+            'definition_name': definition.name,
+            'period_key': item['period_key'],
+            'period_description': item['deadline_info']['period_description'],
+            'deadline': item['deadline_info']['deadline'].isoformat(),
+            'title': item['title'],
+            'assigned_to': client.account_manager.username if client.account_manager else None,
+        }
+
+    @classmethod
+    def _create_planned_tasks(cls, plan: List[Dict[str, Any]], stats_by_period: Dict) -> None:
+        """Cria as tarefas do plano em blocos, com o histórico, os índices e as notificações."""
+        first_steps = {}
+        workflow_ids = {
+            item['definition'].default_workflow_id for item in plan
+            if item['definition'].default_workflow and item['definition'].default_workflow.is_active
+        }
+        for step in WorkflowStep.objects.filter(workflow_id__in=workflow_ids).order_by('workflow_id', 'order'):
+            first_steps.setdefault(step.workflow_id, step)
+
+        notifications = []
+        org_admins = {}  # organization_id -> administradores ativos
+        for start in range(0, len(plan), cls.PLAN_BATCH_SIZE):
+            batch = plan[start:start + cls.PLAN_BATCH_SIZE]
+            tasks = [cls._build_obligation_task(item, first_steps) for item in batch]
+            try:
+                inserted = {task.pk for task in TaskBulkService.insert(
+                    tasks,
+                    history_comment=lambda task: (
+                        f"Workflow '{task.workflow.name}' atribuído automaticamente pela obrigação fiscal "
+                        f"'{task.source_fiscal_obligation.name}'"
+                    ),
+                )}
+            except Exception as e:
+                error_msg = f"Erro ao criar {len(tasks)} tarefas de obrigações fiscais: {e}"
+                logger.error(error_msg, exc_info=True)
+                for period in {item['period'] for item in batch}:
+                    stats_by_period[period]['errors'].append(error_msg)
+                continue
+
+            for item, task in zip(batch, tasks):
+                stats = stats_by_period[item['period']]
+                if task.pk not in inserted:
+                    # Criada entretanto por outra geração
+                    stats['tasks_skipped'] += 1
+                    continue
+                stats['tasks_created'] += 1
+                logger.info(f"Tarefa criada: {task.title} para {task.client.name}")
+                try:
+                    notifications.extend(cls._task_creation_notifications(task, item['definition'], org_admins))
+                except Exception as e:
+                    logger.error(f"Erro ao notificar criação da tarefa {task.id}: {e}")
+
+        # Notificações enviadas num só lote no fim da geração
+        NotificationService.create_notifications_bulk(notifications)
+
+    @classmethod
+    def _build_obligation_task(cls, item: Dict[str, Any], first_steps: Dict) -> Task:
+        """Task (por gravar) de um item do plano, com o workflow da definição se estiver ativo."""
+        definition, client = item['definition'], item['client']
+        task = Task(
+            title=item['title'],
+            description=cls._generate_task_description(definition, client, item['deadline_info'], item['period_key']),
+            client=client,
+            category=definition.default_task_category,
+            assigned_to=client.account_manager,  # Usar gestor de conta do cliente
+            status='pending',
+            priority=definition.default_priority,
+            deadline=item['deadline_info']['deadline'],
+            source_fiscal_obligation=definition,
+            obligation_period_key=item['period_key'],
+            created_by=None  # Sistema automático
+        )
+        workflow = definition.default_workflow
+        first_step = first_steps.get(workflow.id) if workflow and workflow.is_active else None
+        if first_step:
+            task.workflow = workflow
+            task.enter_workflow_step(first_step)
+        return task
     
     @classmethod
     def _should_generate_for_period(cls, definition: FiscalObligationDefinition, year: int, month: int) -> bool:
@@ -241,42 +398,6 @@ class FiscalObligationGenerator:
         
         return False # Should not be reached if all periodicities are handled
     
-    @classmethod
-    def _get_eligible_clients(cls, definition: FiscalObligationDefinition, organization: Optional[Organization] = None) -> List[Client]:
-        """
-        Busca clientes elegíveis para uma definição fiscal.
-        """
-        # Filtro base: clientes ativos
-        clients_query = Client.objects.filter(is_active=True)
-        
-        # Filtro por organização
-        if organization:
-            clients_query = clients_query.filter(organization=organization)
-        elif definition.organization:
-            clients_query = clients_query.filter(organization=definition.organization)
-        
-        if definition.applies_to_client_tags:
-            if not definition.applies_to_client_tags or 'ALL' in definition.applies_to_client_tags:
-                # If 'ALL' is present or list is empty, it applies to all clients within the organization scope.
-                return list(clients_query.select_related('organization', 'account_manager'))
-            
-            eligible_clients = []
-            # Pre-fetch fiscal_tags if it becomes a performance issue, though JSONField is generally okay for moderate use.
-            for client in clients_query.select_related('organization', 'account_manager'):
-                client_tags = client.fiscal_tags or [] # Ensure it's a list
-                # Check if *any* of the definition's required tags are present in the client's tags.
-                # Or should it be *all* required tags? The help text "Lista de tags que o cliente DEVE ter"
-                # implies an AND condition (client must have ALL listed tags).
-                # Current logic is OR (client must have AT LEAST ONE of the listed tags).
-                # Let's assume it's "client must have ALL tags from applies_to_client_tags"
-                if all(tag in client_tags for tag in definition.applies_to_client_tags):
-                    eligible_clients.append(client)
-            
-            return eligible_clients
-        
-        # No tags specified on definition, applies to all clients in scope
-        return list(clients_query.select_related('organization', 'account_manager'))
-    
     @classmethod
     def _calculate_deadline(cls, definition: FiscalObligationDefinition, year: int, month: int) -> Optional[Dict[str, Any]]:
         """
@@ -458,74 +579,6 @@ class FiscalObligationGenerator:
         else:
             return f"{year}-{month:02d}-OTHER"
     
-    @classmethod
-    @transaction.atomic
-    def _create_obligation_task(
-        cls, 
-        definition: FiscalObligationDefinition,
-        client: Client,
-        deadline_info: Dict[str, Any],
-        period_key: str,
-        year: int,
-        month: int
-    ) -> Optional[Task]:
-        """
-        Cria uma tarefa de obrigação fiscal.
-        """
-        try:
-            # Gerar título da tarefa usando o template
-            task_title = cls._generate_task_title(
-                definition, client, deadline_info, year, month
-            )
-            
-            # Descrição da tarefa
-            task_description = cls._generate_task_description(
-                definition, client, deadline_info, period_key
-            )
-            
-            # Determinar quem será atribuído
-            assigned_to = client.account_manager  # Usar gestor de conta do cliente
-            
-            # Criar a tarefa
-            task = Task.objects.create(
-                title=task_title,
-                description=task_description,
-                client=client,
-                category=definition.default_task_category,
-                assigned_to=assigned_to,
-                status='pending',
-                priority=definition.default_priority,
-                deadline=deadline_info['deadline'],
-                source_fiscal_obligation=definition,
-                obligation_period_key=period_key,
-                created_by=None  # Sistema automático
-            )
-            
-            # Atribuir workflow se definido
-            if definition.default_workflow and definition.default_workflow.is_active:
-                first_step = definition.default_workflow.steps.order_by('order').first()
-                if first_step:
-                    task.workflow = definition.default_workflow
-                    task.current_workflow_step = first_step
-                    task.save(update_fields=['workflow', 'current_workflow_step'])
-                    
-                    # Registrar no histórico
-                    WorkflowHistory.objects.create(
-                        task=task,
-                        from_step=None,
-                        to_step=first_step,
-                        changed_by=None,  # Sistema
-                        action='workflow_assigned',
-                        comment=f"Workflow '{definition.default_workflow.name}' atribuído automaticamente pela obrigação fiscal '{definition.name}'"
-                    )
-            
-            logger.info(f"Tarefa criada: {task.title} (ID: {task.id}) para {client.name}")
-            return task
-            
-        except Exception as e:
-            logger.error(f"Erro ao criar tarefa para {definition.name} - {client.name}: {e}")
-            return None
-    
     @classmethod
     def _generate_task_title(
         cls, 
@@ -594,46 +647,50 @@ class FiscalObligationGenerator:
         return "\n\n".join(description_parts)
     
     @classmethod
-    def _notify_task_creation(cls, task: Task, definition: FiscalObligationDefinition):
+    def _task_creation_notifications(cls, task: Task, definition: FiscalObligationDefinition,
+                                     org_admins: Optional[Dict] = None) -> List[Dict]:
         """
-        Envia notificações sobre a criação da tarefa.
+        Notificações sobre a criação da tarefa, como intenções para
+        NotificationService.create_notifications_bulk. `org_admins` guarda os
+        administradores já carregados por organização.
         """
         if not task.assigned_to:
-            return
-        
-        try:
-            # Notificar o responsável
-            NotificationService.create_notification(
-                user=task.assigned_to,
-                task=task,
-                workflow_step=task.current_workflow_step,
-                notification_type='workflow_assigned' if task.workflow else 'step_ready',
-                title=f"Nova obrigação fiscal: {definition.name}",
-                message=f"Uma nova tarefa de obrigação fiscal foi criada para o cliente {task.client.name}. Prazo: {task.deadline.strftime('%d/%m/%Y')}",
-                priority='normal'
-            )
-            
-            # Notificar admin da organização se configurado
-            if task.client.organization:
-                org_admins = Profile.objects.filter(
-                    organization=task.client.organization,
-                    is_org_admin=True,
-                    user__is_active=True
-                ).exclude(user=task.assigned_to)
-                
-                for admin_profile in org_admins:
-                    NotificationService.create_notification(
-                        user=admin_profile.user,
-                        task=task,
-                        workflow_step=None,
-                        notification_type='manual_reminder',
-                        title=f"Nova obrigação fiscal gerada: {definition.name}",
-                        message=f"Sistema gerou automaticamente uma tarefa de {definition.name} para {task.client.name}, atribuída a {task.assigned_to.username if task.assigned_to else 'Não atribuído'}.",
-                        priority='low'
-                    )
-            
-        except Exception as e:
-            logger.error(f"Erro ao notificar criação da tarefa {task.id}: {e}")
+            return []
+
+        # Notificar o responsável
+        notifications = [{
+            'user': task.assigned_to,
+            'task': task,
+            'workflow_step': task.current_workflow_step,
+            'notification_type': 'workflow_assigned' if task.workflow else 'step_ready',
+            'title': f"Nova obrigação fiscal: {definition.name}",
+            'message': f"Uma nova tarefa de obrigação fiscal foi criada para o cliente {task.client.name}. Prazo: {task.deadline.strftime('%d/%m/%Y')}",
+            'priority': 'normal',
+        }]
+
+        # Notificar admin da organização se configurado
+        organization_id = task.client.organization_id
+        if organization_id:
+            org_admins = {} if org_admins is None else org_admins
+            if organization_id not in org_admins:
+                org_admins[organization_id] = [
+                    profile.user for profile in Profile.objects.filter(
+                        organization_id=organization_id, is_org_admin=True, user__is_active=True
+                    ).select_related('user')
+                ]
+            for admin_user in org_admins[organization_id]:
+                if admin_user.id == task.assigned_to_id:
+                    continue
+                notifications.append({
+                    'user': admin_user,
+                    'task': task,
+                    'workflow_step': None,
+                    'notification_type': 'manual_reminder',
+                    'title': f"Nova obrigação fiscal gerada: {definition.name}",
+                    'message': f"Sistema gerou automaticamente uma tarefa de {definition.name} para {task.client.name}, atribuída a {task.assigned_to.username if task.assigned_to else 'Não atribuído'}.",
+                    'priority': 'low',
+                })
+        return notifications
     
     @classmethod
     def clean_old_pending_obligations(cls, days_old: int = 30, organization: Optional[Organization] = None):
@@ -662,20 +719,19 @@ class FiscalObligationGenerator:
             logger.info(f"Removendo {count} tarefas obsoletas de obrigações fiscais")
             
             # Notificar responsáveis antes de remover
-            for task in obsolete_tasks[:50]:  # Limitar notificações
-                if task.assigned_to:
-                    try:
-                        NotificationService.create_notification(
-                            user=task.assigned_to,
-                            task=task,
-                            workflow_step=None,
-                            notification_type='manual_reminder',
-                            title=f"Tarefa obsoleta removida: {task.title}",
-                            message=f"A tarefa '{task.title}' foi removida automaticamente por estar {days_old} dias em atraso. Verifique se ainda é necessária.",
-                            priority='low'
-                        )
-                    except Exception as e:
-                        logger.error(f"Erro ao notificar remoção da tarefa {task.id}: {e}")
+            NotificationService.create_notifications_bulk(
+                {
+                    'user': task.assigned_to,
+                    'task': task,
+                    'workflow_step': None,
+                    'notification_type': 'manual_reminder',
+                    'title': f"Tarefa obsoleta removida: {task.title}",
+                    'message': f"A tarefa '{task.title}' foi removida automaticamente por estar {days_old} dias em atraso. Verifique se ainda é necessária.",
+                    'priority': 'low',
+                }
+                for task in obsolete_tasks.select_related('assigned_to')[:50]  # Limitar notificações
+                if task.assigned_to
+            )
             
             # Remover as tarefas
             obsolete_tasks.delete()
@@ -0,0 +1,636 @@
+# api/services/invoice_batch_service.py
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from ..models import Client, Expense, InvoiceBatch, ScannedInvoice, Task, TaskCategory, WorkflowStep
+from ..qr_processor import decode_invoice_source
+from .expense_categorization_service import ExpenseCategorizationService
+from .notification_service import NotificationService
+from .profitability_service import ProfitabilityDeltaQueue
+from .task_bulk_service import TaskBulkService
+from .upload_dedup_service import UploadDedupService
+
+logger = logging.getLogger(__name__)
+
+
+class InvoiceBatchProcessor:
+    """
+    Processamento de um InvoiceBatch inteiro numa única tarefa.
+
+    A descodificação dos QR Codes (OpenCV/zbar, limitada pelo CPU) corre num pool de
+    processos com um worker por núcleo. A deteção de duplicados usa um único conjunto
+    pré-carregado com os ATCUD já concluídos da organização, os resultados são gravados
+    com bulk_update em blocos e o progresso é publicado na cache para o batch_status.
+    """
+
+    PROGRESS_CACHE_KEY = 'invoice_batch_progress_{batch_id}'
+    PROGRESS_TIMEOUT = 60 * 60 * 24
+    # A partir deste número de ficheiros o upload usa o processamento em lote
+    MIN_FILES_FOR_POOL = 5
+    PERSIST_EVERY = 25
+    UPDATE_FIELDS = [
+        'status', 'processing_log', 'raw_qr_code_data', 'nif_emitter', 'nif_acquirer',
+        'country_code', 'doc_type', 'doc_date', 'doc_uid', 'atcud',
+        'taxable_amount', 'vat_amount', 'gross_total',
+    ]
+
+    @staticmethod
+    def pool_size() -> int:
+        """Número de processos do pool: INVOICE_DECODE_WORKERS ou os núcleos disponíveis."""
+        configured = getattr(settings, 'INVOICE_DECODE_WORKERS', None)
+        if configured:
+            return max(1, int(configured))
+        try:
+            return max(1, len(os.sched_getaffinity(0)))
+        except AttributeError:
+            return max(1, os.cpu_count() or 1)
+
+    @staticmethod
+    def apply_decode_result(invoice: ScannedInvoice, result: Dict) -> None:
+        """
+        Copia para a fatura (sem gravar) os dados extraídos do QR Code e define o estado.
+        O registo das tentativas de descodificação é mantido no processing_log.
+        """
+        parsed_data = result.get('invoice_data', {})
+        decode_log = '\n'.join(result.get('processing_log', []))
+
+        # Map the extracted data to model fields
+        for field in ('nif_emitter', 'nif_acquirer', 'country_code', 'doc_type', 'doc_uid', 'atcud',
+                      'taxable_amount', 'vat_amount', 'gross_total'):
+            if field in parsed_data:
+                setattr(invoice, field, parsed_data[field])
+        if 'doc_date' in parsed_data:
+            # Handle date conversion if it's a string
+            doc_date = parsed_data['doc_date']
+            if isinstance(doc_date, str):
+                for date_format in ('%Y-%m-%d', '%d-%m-%Y'):
+                    try:
+                        invoice.doc_date = datetime.strptime(doc_date, date_format).date()
+                        break
+                    except ValueError:
+                        continue
+                else:
+                    logger.warning(f"Could not parse date: {doc_date}")
+            else:
+                invoice.doc_date = doc_date
+
+        # Store raw QR data
+        if 'raw_qr_code_data' in parsed_data:
+            invoice.raw_qr_code_data = parsed_data['raw_qr_code_data']
+        elif result.get('raw_qr_data'):
+            invoice.raw_qr_code_data = result['raw_qr_data'][0]
+
+        # Set status based on results
+        if parsed_data and any(key in parsed_data for key in ['atcud', 'gross_total', 'nif_emitter']):
+            invoice.status = 'COMPLETED'
+            summary = "Dados extraídos com sucesso do QR Code."
+        else:
+            invoice.status = 'REVIEW'  # Needs manual review
+            summary = "QR Code encontrado mas alguns dados podem precisar de revisão."
+        invoice.processing_log = f"{summary}\n{decode_log}" if decode_log else summary
+
+    @classmethod
+    def get_progress(cls, batch_id) -> Optional[Dict]:
+        return cache.get(cls.PROGRESS_CACHE_KEY.format(batch_id=batch_id))
+
+    @classmethod
+    def _publish_progress(cls, batch_id, progress: Dict) -> None:
+        progress['updated_at'] = timezone.now().isoformat()
+        try:
+            cache.set(cls.PROGRESS_CACHE_KEY.format(batch_id=batch_id), progress, timeout=cls.PROGRESS_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Não foi possível publicar o progresso do lote {batch_id}: {e}")
+
+    @staticmethod
+    def _decode_source(invoice: ScannedInvoice):
+        """Caminho local quando o armazenamento o permite (o worker lê o ficheiro); caso contrário, bytes."""
+        try:
+            path = default_storage.path(invoice.original_file.name)
+            if os.path.isfile(path):
+                return path
+        except NotImplementedError:
+            pass
+        with default_storage.open(invoice.original_file.name, 'rb') as f:
+            return f.read()
+
+    @classmethod
+    def _decode_all(cls, invoices: List[ScannedInvoice], time_budget: Optional[float], organization_id=None):
+        """
+        Gera (fatura, resultado) à medida que os ficheiros são descodificados no pool.
+        Só workers × 2 ficheiros estão em curso de cada vez, para limitar a memória.
+        Sem pool disponível, descodifica no próprio processo. Ficheiros idênticos a outros
+        já descodificados na organização reutilizam o resultado em cache, sem ir ao pool.
+        """
+        to_decode = []
+        for invoice in invoices:
+            cached = UploadDedupService.cached_decode_result(organization_id, invoice.content_hash)
+            if cached is not None:
+                yield invoice, UploadDedupService.reused_result(cached)
+            else:
+                to_decode.append(invoice)
+        invoices = to_decode
+        if not invoices:
+            return
+
+        workers = min(cls.pool_size(), len(invoices))
+        try:
+            executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        except Exception as e:
+            logger.warning(f"Pool de descodificação indisponível, a processar sequencialmente: {e}")
+            executor = None
+
+        if executor is None:
+            for invoice in invoices:
+                try:
+                    yield invoice, decode_invoice_source(cls._decode_source(invoice), invoice.original_filename, time_budget)
+                except Exception as e:
+                    yield invoice, e
+            return
+
+        with executor:
+            pending = {}
+            queue = iter(invoices)
+            while True:
+                while len(pending) < workers * 2:
+                    invoice = next(queue, None)
+                    if invoice is None:
+                        break
+                    try:
+                        future = executor.submit(
+                            decode_invoice_source, cls._decode_source(invoice), invoice.original_filename, time_budget
+                        )
+                    except Exception as e:
+                        yield invoice, e
+                        continue
+                    pending[future] = invoice
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    invoice = pending.pop(future)
+                    try:
+                        yield invoice, future.result()
+                    except Exception as e:
+                        yield invoice, e
+
+    @classmethod
+    def process_batch(cls, batch_id, time_budget: Optional[float] = None) -> Dict:
+        """
+        Descodifica e grava todas as faturas pendentes de um lote.
+
+        Returns:
+            Dict com os totais (processed, completed, review, duplicates, errors)
+        """
+        batch = InvoiceBatch.objects.select_related('organization').get(id=batch_id)
+        invoices = list(batch.invoices.filter(status='PENDING'))
+        progress = {
+            'status': 'processing',
+            'total': len(invoices),
+            'processed': 0,
+            'completed': 0,
+            'review': 0,
+            'duplicates': 0,
+            'errors': 0,
+            'workers': min(cls.pool_size(), len(invoices)) or 1,
+            'started_at': timezone.now().isoformat(),
+        }
+        if not invoices:
+            progress['status'] = 'done'
+            cls._publish_progress(batch_id, progress)
+            return progress
+
+        ScannedInvoice.objects.filter(id__in=[invoice.id for invoice in invoices]).update(status='PROCESSING')
+        cls._publish_progress(batch_id, progress)
+
+        # ATCUD já concluídos na organização; as faturas concluídas neste lote também entram no conjunto
+        completed_atcuds = dict(
+            ScannedInvoice.objects.filter(
+                organization=batch.organization, status='COMPLETED', atcud__isnull=False
+            ).values_list('atcud', 'id')
+        )
+
+        to_save: List[ScannedInvoice] = []
+        for invoice, result in cls._decode_all(invoices, time_budget, batch.organization_id):
+            if isinstance(result, Exception):
+                logger.error(f"Error decoding invoice {invoice.id} in batch {batch_id}: {result}")
+                invoice.status = 'ERROR'
+                invoice.processing_log = f"Ocorreu um erro inesperado: {result}"
+                progress['errors'] += 1
+            else:
+                UploadDedupService.store_decode_result(batch.organization_id, invoice.content_hash, result)
+                atcud_code = result.get('invoice_data', {}).get('atcud')
+                if not atcud_code:
+                    invoice.status = 'ERROR'
+                    invoice.processing_log = (
+                        '\n'.join(result.get('processing_log', []))
+                        or "Não foi possível encontrar ou ler um QR Code ATCUD válido no ficheiro."
+                    )
+                    progress['errors'] += 1
+                elif atcud_code in completed_atcuds:
+                    invoice.status = 'ERROR'
+                    invoice.processing_log = (
+                        f"Fatura duplicada. O ATCUD '{atcud_code}' já existe no sistema "
+                        f"(Fatura ID: {completed_atcuds[atcud_code]})."
+                    )
+                    progress['duplicates'] += 1
+                else:
+                    cls.apply_decode_result(invoice, result)
+                    if invoice.status == 'COMPLETED':
+                        completed_atcuds[atcud_code] = invoice.id
+                        progress['completed'] += 1
+                    else:
+                        progress['review'] += 1
+
+            to_save.append(invoice)
+            progress['processed'] += 1
+            if len(to_save) >= cls.PERSIST_EVERY:
+                cls._persist(to_save, progress)
+                cls.create_follow_ups(to_save, batch)
+                to_save = []
+                cls._publish_progress(batch_id, progress)
+
+        cls._persist(to_save, progress)
+        cls.create_follow_ups(to_save, batch)
+        progress['status'] = 'done'
+        progress['finished_at'] = timezone.now().isoformat()
+        cls._publish_progress(batch_id, progress)
+        logger.info(
+            f"Batch {batch_id} processed: {progress['completed']} completed, {progress['review']} review, "
+            f"{progress['duplicates']} duplicates, {progress['errors']} errors"
+        )
+        return progress
+
+    @classmethod
+    def _persist(cls, invoices: List[ScannedInvoice], progress: Dict) -> None:
+        """
+        Grava um bloco com bulk_update. Se outro worker concluiu entretanto uma fatura
+        com o mesmo ATCUD, a restrição unique_completed_atcud_per_organization rejeita o
+        bloco e as faturas são gravadas uma a uma, marcando as duplicadas.
+        """
+        if not invoices:
+            return
+        try:
+            with transaction.atomic():
+                ScannedInvoice.objects.bulk_update(invoices, cls.UPDATE_FIELDS, batch_size=500)
+            return
+        except IntegrityError as e:
+            if not ScannedInvoice.is_duplicate_atcud_error(e):
+                raise
+        for invoice in invoices:
+            try:
+                with transaction.atomic():
+                    invoice.save(update_fields=cls.UPDATE_FIELDS)
+            except IntegrityError as e:
+                if not ScannedInvoice.is_duplicate_atcud_error(e):
+                    raise
+                progress['completed'] -= 1
+                progress['duplicates'] += 1
+                invoice.status = 'ERROR'
+                invoice.processing_log = f"Fatura duplicada. O ATCUD '{invoice.atcud}' já se encontra registado."
+                invoice.atcud = None
+                invoice.save(update_fields=cls.UPDATE_FIELDS)
+
+    @classmethod
+    def create_follow_ups(cls, invoices: List[ScannedInvoice], batch: InvoiceBatch) -> None:
+        """
+        Despesa (categorizada pelo nível local) e tarefa de lançamento das faturas
+        concluídas, em bloco: o modelo de categorização e o mapa NIF → cliente são
+        carregados uma única vez e despesas e tarefas entram com bulk_create. Os
+        emitentes desconhecidos ficam para o categorize_pending_expenses_task, agendado
+        uma única vez. Faturas que já têm despesa são ignoradas.
+        """
+        invoices = [invoice for invoice in invoices if invoice.status == 'COMPLETED']
+        if not invoices:
+            return
+        existing = set(
+            Expense.objects.filter(source_scanned_invoice__in=invoices)
+            .values_list('source_scanned_invoice_id', flat=True)
+        )
+        invoices = [invoice for invoice in invoices if invoice.id not in existing]
+        if not invoices:
+            return
+
+        try:
+            model = ExpenseCategorizationService.get_model(batch.organization_id)
+            clients_by_nif = {}
+            for client in Client.objects.filter(
+                organization_id=batch.organization_id,
+                nif__in={invoice.nif_acquirer for invoice in invoices if invoice.nif_acquirer},
+            ).order_by('name'):
+                clients_by_nif.setdefault(client.nif, client)
+
+            expenses, tasks, incomplete = [], [], []
+            for invoice in invoices:
+                if invoice.gross_total is None or invoice.doc_date is None:
+                    incomplete.append(invoice)
+                    continue
+                category = ExpenseCategorizationService.categorize_locally(invoice, model)
+                client = clients_by_nif.get(invoice.nif_acquirer) if invoice.nif_acquirer else None
+                expenses.append(Expense(
+                    client=client,  # Link to client if NIF matches
+                    amount=invoice.gross_total,
+                    description=f"Fatura de {invoice.original_filename}",
+                    category=category,
+                    date=invoice.doc_date,
+                    is_auto_categorized=True,
+                    source_scanned_invoice=invoice,
+                ))
+                if client:
+                    tasks.append(Task(
+                        client=client,
+                        title=f"Lançamento Contabilístico - Fatura {invoice.atcud}",
+                        description=(
+                            f"Realizar o lançamento contabilístico da fatura de {invoice.original_filename}.\n"
+                            f"Valor: {invoice.gross_total}€\n"
+                            f"NIF Emissor: {invoice.nif_emitter}\n"
+                            f"Categoria Sugerida: {category or 'Por categorizar'}"
+                        ),
+                        # Assign to the client's account manager or to whoever uploaded the batch
+                        assigned_to_id=client.account_manager_id or batch.uploaded_by_id,
+                        priority=4,  # Low priority by default
+                    ))
+
+            with transaction.atomic():
+                Expense.objects.bulk_create(expenses, batch_size=500)
+                # bulk_create não dispara os signals de rentabilidade
+                ProfitabilityDeltaQueue.enqueue_for_created(expenses)
+                TaskBulkService.insert(tasks)
+        except Exception as e:
+            logger.error(f"Error in post-processing for {len(invoices)} invoices of batch {batch.id}: {e}", exc_info=True)
+            # The invoice data is already saved; only the automation is reported
+            cls._append_log(invoices, f"\nErro na automação pós-processamento: {e}")
+            return
+
+        if incomplete:
+            cls._append_log(incomplete, "\nDespesa não criada: a fatura não tem valor total ou data.")
+        if any(expense.category is None for expense in expenses):
+            ExpenseCategorizationService.schedule_pending(batch.organization_id)
+        logger.info(
+            f"Batch {batch.id}: {len(expenses)} expenses and {len(tasks)} bookkeeping tasks created from invoices"
+        )
+
+    @staticmethod
+    def _append_log(invoices: List[ScannedInvoice], message: str) -> None:
+        ScannedInvoice.objects.filter(id__in=[invoice.id for invoice in invoices]).update(
+            processing_log=Concat('processing_log', Value(message))
+        )
+        for invoice in invoices:
+            invoice.processing_log = (invoice.processing_log or '') + message
+
+
+class InvoiceBatchTaskCreator:
+    """
+    Criação das tarefas de lançamento das faturas de um lote (create_batch_tasks).
+
+    Categoria, responsável, workflow e primeiro passo são resolvidos uma única vez; o
+    cliente de cada fatura sai de um dicionário NIF → cliente pré-carregado e o acesso
+    do utilizador de um conjunto de ids. As tarefas e o histórico de workflow entram
+    com bulk_create em blocos, cada um na sua transação. Lotes com ASYNC_THRESHOLD
+    ou mais faturas correm em create_invoice_batch_tasks_task, com o progresso
+    publicado na cache para o batch_status.
+    """
+
+    BULK_BATCH_SIZE = 500
+    ASYNC_THRESHOLD = 200
+    PROGRESS_CACHE_KEY = 'invoice_batch_task_creation_{batch_id}'
+    PROGRESS_TIMEOUT = 60 * 60 * 24
+
+    def __init__(self, batch: InvoiceBatch, user: User, task_data: Optional[Dict] = None):
+        self.batch = batch
+        self.user = user
+        self.profile = user.profile
+        self.task_data = task_data or {}
+        self.title_template = self.task_data.get('title', 'Lançar Fatura: {invoice_ref}')
+        self.description_template = self.task_data.get('description', '')
+        self.resolve()
+
+    @staticmethod
+    def eligible_invoices(batch: InvoiceBatch, invoice_ids: Optional[List] = None):
+        """Faturas concluídas do lote que ainda não deram origem a uma tarefa."""
+        invoices = batch.invoices.filter(status='COMPLETED').exclude(generated_tasks__isnull=False)
+        if invoice_ids:
+            invoices = invoices.filter(id__in=invoice_ids)
+        return invoices.order_by('created_at')
+
+    def resolve(self) -> None:
+        """Carrega clientes, acessos, categoria, responsável e workflow (número fixo de queries)."""
+        organization = self.profile.organization
+        clients = list(Client.objects.filter(organization=organization, is_active=True).order_by('name'))
+        self.clients_by_id = {str(client.id): client for client in clients}
+        self.clients_by_nif = {}
+        for client in clients:
+            if client.nif:
+                self.clients_by_nif.setdefault(client.nif, client)
+        self.fallback_client = clients[0] if clients else None
+        if self.profile.is_org_admin or self.profile.can_view_all_clients:
+            self.accessible_client_ids = {client.id for client in clients}
+        else:
+            self.accessible_client_ids = set(self.profile.visible_clients.values_list('id', flat=True))
+
+        client_id = self.task_data.get('client')
+        self.default_client = self.clients_by_id.get(str(client_id)) if client_id else None
+
+        category_id = self.task_data.get('category')
+        self.category = TaskCategory.objects.filter(id=category_id).first() if category_id else None
+
+        # Só utilizadores da mesma organização podem ser responsáveis
+        assignee_id = self.task_data.get('assigned_to')
+        self.assignee = User.objects.filter(
+            id=assignee_id, profile__organization=organization
+        ).first() if assignee_id else None
+
+        # Convertido aqui: bulk_create não passa pelo to_python e os contadores precisam de um datetime
+        self.deadline, self.deadline_error = None, None
+        if self.task_data.get('deadline'):
+            try:
+                self.deadline = Task._meta.get_field('deadline').to_python(self.task_data['deadline'])
+            except ValidationError:
+                self.deadline_error = f"Prazo inválido: {self.task_data['deadline']}"
+            if self.deadline and timezone.is_naive(self.deadline):
+                self.deadline = timezone.make_aware(self.deadline)
+
+        self.workflow, self.first_step = None, None
+        workflow_id = self.task_data.get('workflow')
+        if workflow_id:
+            self.first_step = WorkflowStep.objects.select_related('workflow').filter(
+                workflow_id=workflow_id, workflow__is_active=True
+            ).order_by('order').first()
+            if self.first_step:
+                self.workflow = self.first_step.workflow
+
+    def can_access(self, client: Client) -> bool:
+        return client.id in self.accessible_client_ids
+
+    def create(self, invoices: List[ScannedInvoice]) -> Dict[str, Any]:
+        """
+        Cria as tarefas das faturas indicadas.
+
+        Returns:
+            Dict com tasks_created, tasks_failed, errors e created_task_ids
+        """
+        result = {'tasks_created': 0, 'tasks_failed': 0, 'errors': [], 'created_task_ids': []}
+        progress = {
+            'status': 'processing', 'total': len(invoices), 'processed': 0,
+            'tasks_created': 0, 'tasks_failed': 0, 'started_at': timezone.now().isoformat(),
+        }
+        self._publish_progress(progress)
+
+        for start in range(0, len(invoices), self.BULK_BATCH_SIZE):
+            chunk = invoices[start:start + self.BULK_BATCH_SIZE]
+            tasks = []
+            for invoice in chunk:
+                task, error = self._build_task(invoice)
+                if error:
+                    result['tasks_failed'] += 1
+                    result['errors'].append(f"Fatura {invoice.original_filename}: {error}")
+                else:
+                    tasks.append(task)
+            self._insert(tasks, result)
+            progress.update(
+                processed=progress['processed'] + len(chunk),
+                tasks_created=result['tasks_created'], tasks_failed=result['tasks_failed'],
+            )
+            self._publish_progress(progress)
+
+        self._notify_assignee(result, len(invoices))
+        progress.update(status='done', finished_at=timezone.now().isoformat())
+        self._publish_progress(progress)
+        logger.info(
+            f"Batch {self.batch.id}: {result['tasks_created']} invoice tasks created, {result['tasks_failed']} failed"
+        )
+        return result
+
+    def _build_task(self, invoice: ScannedInvoice) -> Tuple[Optional[Task], Optional[str]]:
+        """Task (por gravar) de uma fatura, ou o motivo pelo qual não pode ser criada."""
+        target_client = (
+            self.default_client
+            or (self.clients_by_nif.get(invoice.nif_acquirer) if invoice.nif_acquirer else None)
+            or self.fallback_client
+        )
+        if not target_client:
+            return None, "Nenhum cliente disponível"
+        if not self.can_access(target_client):
+            return None, f"Sem acesso ao cliente {target_client.name}"
+
+        try:
+            title = self.title_template.format(
+                invoice_ref=invoice.atcud or invoice.original_filename,
+                client_name=target_client.name,
+                batch_description=self.batch.description or f"Lote {self.batch.id}"
+            )
+        except (KeyError, IndexError, ValueError) as e:
+            return None, f"Título inválido: {e}"
+
+        if self.description_template:
+            description = self.description_template
+        else:
+            description = f"Lançamento contabilístico da fatura de {invoice.nif_emitter or 'N/A'}.\n"
+            description += f"Data: {invoice.doc_date or 'N/A'}\n"
+            description += f"Valor Total: {invoice.gross_total or '0.00'}€\n"
+            description += f"IVA: {invoice.vat_amount or '0.00'}€\n"
+            if self.batch.description:
+                description += f"Processada em lote: {self.batch.description}"
+
+        task = Task(
+            title=title,
+            description=description,
+            client=target_client,
+            created_by=self.user,
+            source_scanned_invoice=invoice,
+            status=self.task_data.get('status', 'pending'),
+            priority=self.task_data.get('priority', 3),
+            category=self.category,
+            assigned_to=self.assignee,
+        )
+        if self.deadline_error:
+            return None, self.deadline_error
+        task.deadline = self.deadline
+        if self.task_data.get('estimated_time_minutes'):
+            task.estimated_time_minutes = self.task_data['estimated_time_minutes']
+        # bulk_create não passa pelo Task.save
+        if task.status == 'completed':
+            task.completed_at = timezone.now()
+        if self.first_step:
+            task.workflow = self.workflow
+            task.enter_workflow_step(self.first_step)
+        return task, None
+
+    def _insert(self, tasks: List[Task], result: Dict) -> None:
+        if not tasks:
+            return
+        try:
+            # A restrição unique_task_per_scanned_invoice descarta faturas que entretanto ganharam tarefa
+            inserted = {task.pk for task in TaskBulkService.insert(
+                tasks, changed_by=self.user,
+                history_comment=lambda task: f"Workflow '{self.workflow.name}' atribuído na criação em lote.",
+            )}
+        except Exception as e:
+            logger.error(f"Erro ao criar {len(tasks)} tarefas do lote {self.batch.id}: {e}", exc_info=True)
+            result['tasks_failed'] += len(tasks)
+            result['errors'].extend(
+                f"Fatura {task.source_scanned_invoice.original_filename}: {e}" for task in tasks
+            )
+            return
+
+        for task in tasks:
+            if task.pk in inserted:
+                result['tasks_created'] += 1
+                result['created_task_ids'].append(str(task.pk))
+            else:
+                result['tasks_failed'] += 1
+                result['errors'].append(
+                    f"Fatura {task.source_scanned_invoice.original_filename}: já tem uma tarefa associada"
+                )
+
+    def _notify_assignee(self, result: Dict, invoice_count: int) -> None:
+        if not result['tasks_created'] or not self.assignee or self.assignee.id == self.user.id:
+            return
+        try:
+            NotificationService.create_notification(
+                user=self.assignee,
+                task=None,  # Múltiplas tarefas
+                notification_type='task_assigned_to_you',
+                title=f"{result['tasks_created']} Novas Tarefas Atribuídas (Lote)",
+                message=f"Foram-lhe atribuídas {result['tasks_created']} tarefas do lote '{self.batch.description or 'Sem descrição'}'. "
+                        f"Criadas por: {self.user.username}.",
+                created_by=self.user,
+                metadata={
+                    'batch_id': str(self.batch.id),
+                    'task_ids': result['created_task_ids'],
+                    'invoice_count': invoice_count
+                }
+            )
+        except Exception as e:
+            logger.warning(f"Erro ao enviar notificação de lote: {e}")
+
+    @classmethod
+    def get_progress(cls, batch_id) -> Optional[Dict]:
+        return cache.get(cls.PROGRESS_CACHE_KEY.format(batch_id=batch_id))
+
+    @classmethod
+    def publish_queued(cls, batch_id, total: int) -> None:
+        cls._publish(batch_id, {'status': 'queued', 'total': total, 'processed': 0, 'tasks_created': 0, 'tasks_failed': 0})
+
+    def _publish_progress(self, progress: Dict) -> None:
+        self._publish(self.batch.id, progress)
+
+    @classmethod
+    def _publish(cls, batch_id, progress: Dict) -> None:
+        progress['updated_at'] = timezone.now().isoformat()
+        try:
+            cache.set(cls.PROGRESS_CACHE_KEY.format(batch_id=batch_id), progress, timeout=cls.PROGRESS_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Não foi possível publicar o progresso da criação de tarefas do lote {batch_id}: {e}")
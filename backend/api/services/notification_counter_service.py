@@ -0,0 +1,342 @@
+# api/services/notification_counter_service.py
+from collections import Counter, defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from ..models import WorkflowNotification
+
+logger = logging.getLogger(__name__)
+
+# Dias (de calendário, incluindo hoje) cobertos pelo resumo semanal
+WINDOW_DAYS = 7
+# As chaves de um utilizador que deixa de consultar as notificações acabam por expirar
+COUNTER_TIMEOUT = 60 * 60 * 24 * 14
+DAY_TIMEOUT = 60 * 60 * 24 * (WINDOW_DAYS + 1)
+RECONCILE_BATCH_SIZE = 500
+
+PRIORITIES = [value for value, _ in WorkflowNotification.PRIORITY_LEVELS]
+TYPES = [value for value, _ in WorkflowNotification.NOTIFICATION_TYPES]
+STATE_FIELDS = ('user_id', 'is_read', 'is_archived', 'priority', 'notification_type', 'created_at')
+
+
+class NotificationCounterService:
+    """
+    Contadores de notificações por utilizador, guardados na cache (Redis).
+
+    Por utilizador existem contadores de não lidas (total, por prioridade e por tipo)
+    e, para cada um dos últimos WINDOW_DAYS dias, os totais usados pelo resumo
+    semanal. Notificações arquivadas não contam.
+
+    Os sinais de WorkflowNotification calculam a diferença entre o estado anterior e o
+    novo e, após o commit, aplicam-na com INCRBY. As alterações em bloco passam por
+    record_created/update_queryset. Se uma chave não existir (expirou ou ainda não foi
+    criada) o utilizador é invalidado e a próxima leitura reconstrói tudo com duas
+    agregações. A reconciliação periódica corrige o que escape aos sinais (ex.:
+    notificações apagadas em cascata).
+    """
+
+    SNAPSHOT_ATTR = '_notification_counter_snapshot'
+
+    # --- Chaves ---
+
+    @staticmethod
+    def _key(user_id: int, name: str) -> str:
+        return f'notification_counters_{user_id}_{name}'
+
+    @staticmethod
+    def _window(today: Optional[date] = None) -> List[date]:
+        today = today or timezone.localdate()
+        return [today - timedelta(days=offset) for offset in range(WINDOW_DAYS)]
+
+    @staticmethod
+    def _day_prefix(day: date) -> str:
+        return f'day_{day:%Y%m%d}'
+
+    @staticmethod
+    def _unread_names() -> List[str]:
+        return (
+            ['unread']
+            + [f'unread_priority_{priority}' for priority in PRIORITIES]
+            + [f'unread_type_{notification_type}' for notification_type in TYPES]
+        )
+
+    @classmethod
+    def _day_names(cls, today: Optional[date] = None) -> List[str]:
+        names = []
+        for day in cls._window(today):
+            prefix = cls._day_prefix(day)
+            names += [f'{prefix}_total', f'{prefix}_unread', f'{prefix}_urgent']
+            names += [f'{prefix}_type_{notification_type}' for notification_type in TYPES]
+        return names
+
+    # --- Estado e contribuições ---
+
+    @staticmethod
+    def _state(instance) -> Dict:
+        return {field: getattr(instance, field) for field in STATE_FIELDS}
+
+    @classmethod
+    def _contributions(cls, state: Optional[Dict], today: date) -> List[str]:
+        if state is None or state['is_archived'] or state['user_id'] is None:
+            return []
+        names = []
+        if not state['is_read']:
+            names += [
+                'unread',
+                f"unread_priority_{state['priority']}",
+                f"unread_type_{state['notification_type']}",
+            ]
+        created_at = state['created_at']
+        day = timezone.localdate(created_at) if created_at is not None else today
+        if 0 <= (today - day).days < WINDOW_DAYS:
+            prefix = cls._day_prefix(day)
+            names += [f'{prefix}_total', f"{prefix}_type_{state['notification_type']}"]
+            if not state['is_read']:
+                names.append(f'{prefix}_unread')
+                if state['priority'] == 'urgent':
+                    names.append(f'{prefix}_urgent')
+        return names
+
+    @classmethod
+    def _add(cls, deltas: Dict[int, Counter], state: Optional[Dict], sign: int, today: date) -> None:
+        for name in cls._contributions(state, today):
+            deltas[state['user_id']][name] += sign
+
+    # --- Escrita ---
+
+    @classmethod
+    def snapshot(cls, instance, update_fields=None) -> None:
+        """Chamado em pre_save: guarda na instância o estado atualmente gravado."""
+        previous, saved = None, None
+        if update_fields is not None:
+            # Com update_fields os restantes campos da instância podem estar desatualizados
+            saved = set(STATE_FIELDS) & {'user_id' if field == 'user' else field for field in update_fields}
+        if not instance._state.adding and saved != set():
+            previous = WorkflowNotification.objects.filter(pk=instance.pk).values(*STATE_FIELDS).first()
+        setattr(instance, cls.SNAPSHOT_ATTR, (previous, saved))
+
+    @classmethod
+    def record_change(cls, instance, deleted: bool = False) -> None:
+        """Aplica aos contadores a diferença causada por gravar ou remover uma notificação."""
+        previous, saved = getattr(instance, cls.SNAPSHOT_ATTR, (None, None))
+        if saved == set():
+            return
+        try:
+            current = cls._state(instance)
+            if previous is not None and saved is not None:
+                current = {**previous, **{field: current[field] for field in saved}}
+            removed, added = (current, None) if deleted else (previous, current)
+            if removed == added:
+                return
+            today = timezone.localdate()
+            deltas = defaultdict(Counter)
+            cls._add(deltas, removed, -1, today)
+            cls._add(deltas, added, 1, today)
+        except Exception as e:
+            logger.error(f"Erro ao calcular o delta dos contadores da notificação {instance.pk}: {e}", exc_info=True)
+            return
+        cls._schedule(deltas)
+
+    @classmethod
+    def record_created(cls, instances: Iterable[WorkflowNotification]) -> None:
+        """record_change para notificações criadas com bulk_create, que não dispara signals."""
+        today = timezone.localdate()
+        deltas = defaultdict(Counter)
+        for instance in instances:
+            cls._add(deltas, cls._state(instance), 1, today)
+        cls._schedule(deltas)
+
+    @classmethod
+    def update_queryset(cls, queryset, **changes) -> int:
+        """
+        queryset.update() que mantém os contadores. Só para alterações que retiram
+        notificações da contagem (marcar como lidas, arquivar): as linhas que já não
+        contam são atualizadas sem ler o estado.
+        """
+        window_start = timezone.make_aware(datetime.combine(cls._window()[-1], time.min))
+        counted = Q(is_archived=False) & (Q(is_read=False) | Q(created_at__gte=window_start))
+        with transaction.atomic():
+            states = list(queryset.filter(counted).select_for_update().values('pk', *STATE_FIELDS))
+            updated = queryset.exclude(counted).update(**changes)
+            if states:
+                updated += WorkflowNotification.objects.filter(
+                    pk__in=[state['pk'] for state in states]
+                ).update(**changes)
+            today = timezone.localdate()
+            deltas = defaultdict(Counter)
+            for state in states:
+                state.pop('pk')
+                cls._add(deltas, state, -1, today)
+                cls._add(deltas, {**state, **{k: v for k, v in changes.items() if k in state}}, 1, today)
+            cls._schedule(deltas)
+        return updated
+
+    @classmethod
+    def _schedule(cls, deltas: Dict[int, Counter]) -> None:
+        deltas = {user_id: counter for user_id, counter in deltas.items() if any(counter.values())}
+        if deltas:
+            # Só depois do commit: um rollback não deixa os contadores desviados
+            transaction.on_commit(lambda: cls.increment(deltas))
+
+    @classmethod
+    def increment(cls, deltas: Dict[int, Counter]) -> None:
+        for user_id, counter in deltas.items():
+            try:
+                for name, delta in counter.items():
+                    if delta:
+                        cache.incr(cls._key(user_id, name), delta)
+            except ValueError:
+                # Chave em falta: a próxima leitura reconstrói os contadores do utilizador
+                cls.invalidate(user_id)
+            except Exception as e:
+                logger.error(f"Erro ao atualizar contadores de notificações do utilizador {user_id}: {e}", exc_info=True)
+                cls.invalidate(user_id)
+
+    @classmethod
+    def invalidate(cls, user_id: int) -> None:
+        try:
+            cache.delete(cls._key(user_id, 'unread'))
+        except Exception as e:
+            logger.error(f"Erro ao invalidar contadores de notificações do utilizador {user_id}: {e}", exc_info=True)
+
+    @classmethod
+    def rebuild(cls, user_ids: Iterable[int]) -> Dict[int, Dict[str, int]]:
+        """Recalcula a partir da base de dados e grava os contadores dos utilizadores indicados."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        today = timezone.localdate()
+        names = cls._unread_names() + cls._day_names(today)
+        values = {user_id: dict.fromkeys(names, 0) for user_id in user_ids}
+
+        unread = WorkflowNotification.objects.filter(
+            user_id__in=user_ids, is_read=False, is_archived=False
+        ).values_list('user_id', 'priority', 'notification_type').annotate(count=Count('id')).order_by()
+        for user_id, priority, notification_type, count in unread:
+            counters = values[user_id]
+            counters['unread'] += count
+            counters[f'unread_priority_{priority}'] = counters.get(f'unread_priority_{priority}', 0) + count
+            counters[f'unread_type_{notification_type}'] = counters.get(f'unread_type_{notification_type}', 0) + count
+
+        window_start = timezone.make_aware(datetime.combine(cls._window(today)[-1], time.min))
+        recent = WorkflowNotification.objects.filter(
+            user_id__in=user_ids, is_archived=False, created_at__gte=window_start
+        ).annotate(day=TruncDate('created_at')).values_list(
+            'user_id', 'day', 'notification_type', 'is_read', 'priority'
+        ).annotate(count=Count('id')).order_by()
+        for user_id, day, notification_type, is_read, priority, count in recent:
+            if day > today:
+                continue
+            counters, prefix = values[user_id], cls._day_prefix(day)
+            counters[f'{prefix}_total'] += count
+            type_name = f'{prefix}_type_{notification_type}'
+            counters[type_name] = counters.get(type_name, 0) + count
+            if not is_read:
+                counters[f'{prefix}_unread'] += count
+                if priority == 'urgent':
+                    counters[f'{prefix}_urgent'] += count
+
+        try:
+            # Os baldes diários primeiro: 'unread' marca os contadores do utilizador como válidos
+            for is_day, timeout in ((True, DAY_TIMEOUT), (False, COUNTER_TIMEOUT)):
+                cache.set_many({
+                    cls._key(user_id, name): value
+                    for user_id, counters in values.items()
+                    for name, value in counters.items()
+                    if name.startswith('day_') == is_day
+                }, timeout=timeout)
+        except Exception as e:
+            logger.error(f"Erro ao gravar contadores de notificações: {e}", exc_info=True)
+        return values
+
+    # --- Leitura ---
+
+    @classmethod
+    def _read(cls, user_id: int, names: List[str]) -> Dict[str, int]:
+        keys = {cls._key(user_id, name): name for name in names}
+        try:
+            found = cache.get_many(list(keys))
+        except Exception as e:
+            logger.error(f"Erro ao ler contadores de notificações: {e}", exc_info=True)
+            found = {}
+        # O marcador 'unread' é sempre lido: sem ele os restantes podem estar desatualizados
+        if len(found) == len(keys) and cls._key(user_id, 'unread') in found:
+            return {name: found[key] for key, name in keys.items()}
+        counters = cls.rebuild([user_id])[user_id]
+        return {name: counters.get(name, 0) for name in names}
+
+    @classmethod
+    def unread_counts(cls, user) -> Dict:
+        """Não lidas do utilizador: total, por prioridade e por tipo (só com valor > 0)."""
+        counters = cls._read(user.id, cls._unread_names())
+        return {
+            'unread_count': max(counters['unread'], 0),
+            'by_priority': {
+                priority: counters[f'unread_priority_{priority}']
+                for priority in PRIORITIES if counters[f'unread_priority_{priority}'] > 0
+            },
+            'by_type': {
+                notification_type: counters[f'unread_type_{notification_type}']
+                for notification_type in TYPES if counters[f'unread_type_{notification_type}'] > 0
+            },
+        }
+
+    @classmethod
+    def get_unread_count(cls, user) -> int:
+        return max(cls._read(user.id, ['unread'])['unread'], 0)
+
+    @classmethod
+    def summary(cls, user) -> Dict:
+        """Resumo dos últimos WINDOW_DAYS dias (summary_stats), calculado a partir dos baldes diários."""
+        today = timezone.localdate()
+        counters = cls._read(user.id, ['unread'] + cls._day_names(today))
+        days = cls._window(today)
+        by_type = Counter()
+        oldest_unread = None
+        for day in days:
+            prefix = cls._day_prefix(day)
+            for notification_type in TYPES:
+                by_type[notification_type] += counters[f'{prefix}_type_{notification_type}']
+            if counters[f'{prefix}_unread'] > 0:
+                oldest_unread = day
+        most_frequent = by_type.most_common(1)
+        return {
+            'total_this_week': sum(counters[f'{cls._day_prefix(day)}_total'] for day in days),
+            'unread_this_week': sum(counters[f'{cls._day_prefix(day)}_unread'] for day in days),
+            'urgent_unread': sum(counters[f'{cls._day_prefix(day)}_urgent'] for day in days),
+            'most_frequent_type': (
+                {'notification_type': most_frequent[0][0], 'count': most_frequent[0][1]}
+                if most_frequent and most_frequent[0][1] > 0 else None
+            ),
+            'oldest_unread_days': (today - oldest_unread).days if oldest_unread else None,
+        }
+
+    # --- Reconciliação ---
+
+    @classmethod
+    def reconcile(cls) -> Dict[str, int]:
+        """
+        Reconstrói os contadores dos utilizadores que os têm em cache e conta quantos
+        estavam desviados. Quem não tem contadores é reconstruído na próxima leitura.
+        """
+        from django.contrib.auth.models import User
+
+        reconciled = drifted = 0
+        user_ids = list(User.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+        names = cls._unread_names()
+        for start in range(0, len(user_ids), RECONCILE_BATCH_SIZE):
+            batch = user_ids[start:start + RECONCILE_BATCH_SIZE]
+            cached = cache.get_many([cls._key(user_id, name) for user_id in batch for name in names])
+            present = [user_id for user_id in batch if cls._key(user_id, 'unread') in cached]
+            for user_id, counters in cls.rebuild(present).items():
+                reconciled += 1
+                if any(cached.get(cls._key(user_id, name)) != counters[name] for name in names):
+                    drifted += 1
+        return {'reconciled': reconciled, 'drifted': drifted}
@@ -4,6 +4,7 @@ from django.utils import timezone
 from datetime import timedelta
 from ..models import WorkflowNotification, Task, WorkflowStep, Profile, NotificationSettings, GeneratedReport
 from .notification_template_service import NotificationTemplateService
+from .notification_counter_service import NotificationCounterService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,15 +28,54 @@ class NotificationService:
         """
         try:
             settings = user.notification_settings
+        except NotificationSettings.DoesNotExist:
+            settings = None
+        allowed, metadata, scheduled_for = NotificationService._apply_user_settings(
+            settings, user, notification_type, metadata, scheduled_for
+        )
+        if not allowed:
+            return None
+
+        if check_existing_recent:
+            cutoff_time = timezone.now() - timedelta(hours=recent_threshold_hours)
+            query_filters = {'user': user, 'task': task, 'notification_type': notification_type, 'created_at__gte': cutoff_time}
+            if workflow_step: query_filters['workflow_step'] = workflow_step
+            
+            if WorkflowNotification.objects.filter(**query_filters).exists():
+                logger.info(f"Notificação similar recente ({notification_type}) já enviada para {user.username}")
+                return None
+
+        try:
+            notification = WorkflowNotification.objects.create(
+                user=user, task=task, workflow_step=workflow_step,
+                notification_type=notification_type, priority=priority,
+                title=title, message=message, created_by=created_by,
+                metadata=metadata or {}, scheduled_for=scheduled_for
+            )
+            logger.info(f"Notificação ({notification.id}) tipo '{notification_type}' criada: {notification.title} para {user.username}")
+            return notification
+        except Exception as e:
+            logger.error(f"Erro ao criar notificação do tipo '{notification_type}' para {user.username}: {e}", exc_info=True)
+            return None
+
+    @staticmethod
+    def _apply_user_settings(settings, user, notification_type, metadata, scheduled_for):
+        """
+        Regras das NotificationSettings do utilizador (tipos ativos, horário de silêncio,
+        digest e canais preferidos). Devolve (permitida, metadata, scheduled_for).
+        """
+        if settings is None:
+            return True, metadata, scheduled_for
+        try:
             # --- 1. Notification type enabled? ---
             if hasattr(settings, 'notification_types_enabled') and settings.notification_types_enabled:
                 enabled_types = settings.notification_types_enabled
                 if notification_type in enabled_types and not enabled_types[notification_type]:
                     logger.info(f"Notificação {notification_type} desabilitada para {user.username} via notification_types_enabled")
-                    return None
+                    return False, metadata, scheduled_for
             elif not settings.should_notify(notification_type):
                 logger.info(f"Notificação {notification_type} desabilitada para {user.username}")
-                return None
+                return False, metadata, scheduled_for
 
             # --- 2. Quiet hours logic ---
             if getattr(settings, 'quiet_hours_enabled', False) and settings.is_quiet_time() and not scheduled_for:
@@ -76,33 +116,89 @@ class NotificationService:
                     metadata = {}
                 metadata['preferred_channels'] = settings.preferred_channels
 
-        except NotificationSettings.DoesNotExist:
-            pass
         except AttributeError:
             logger.warning(f"NotificationSettings não encontradas para {user.username}. Usando defaults.")
-            pass
+        return True, metadata, scheduled_for
 
-        if check_existing_recent:
-            cutoff_time = timezone.now() - timedelta(hours=recent_threshold_hours)
-            query_filters = {'user': user, 'task': task, 'notification_type': notification_type, 'created_at__gte': cutoff_time}
-            if workflow_step: query_filters['workflow_step'] = workflow_step
-            
-            if WorkflowNotification.objects.filter(**query_filters).exists():
-                logger.info(f"Notificação similar recente ({notification_type}) já enviada para {user.username}")
-                return None
+    @staticmethod
+    def create_notifications_bulk(intents, batch_size=500):
+        """
+        Cria várias notificações de uma vez, com as mesmas regras de `create_notification`.
 
-        try:
-            notification = WorkflowNotification.objects.create(
-                user=user, task=task, workflow_step=workflow_step,
-                notification_type=notification_type, priority=priority,
-                title=title, message=message, created_by=created_by,
-                metadata=metadata or {}, scheduled_for=scheduled_for
+        Cada intenção é um dict com os argumentos de `create_notification` (user,
+        notification_type, title, message e, opcionalmente, task, workflow_step, priority,
+        created_by, metadata, scheduled_for, check_existing_recent, recent_threshold_hours).
+        As NotificationSettings de todos os destinatários são lidas numa query, a verificação
+        de duplicados recentes é feita numa única query agrupada (e também dentro do lote)
+        e as notificações são inseridas com bulk_create.
+
+        Returns:
+            list: Notificações criadas
+        """
+        intents = [intent for intent in intents if intent.get('user') is not None]
+        if not intents:
+            return []
+
+        user_ids = {intent['user'].id for intent in intents}
+        settings_by_user = {
+            settings.user_id: settings
+            for settings in NotificationSettings.objects.filter(user_id__in=user_ids)
+        }
+
+        # Notificações recentes dos mesmos utilizadores/tipos, numa query:
+        # (user_id, task_id, notification_type) -> [(workflow_step_id, created_at)]
+        now = timezone.now()
+        checked = [intent for intent in intents if intent.get('check_existing_recent')]
+        recent = {}
+        if checked:
+            oldest = now - timedelta(hours=max(intent.get('recent_threshold_hours', 24) for intent in checked))
+            for user_id, task_id, notification_type, step_id, created_at in WorkflowNotification.objects.filter(
+                user_id__in={intent['user'].id for intent in checked},
+                notification_type__in={intent['notification_type'] for intent in checked},
+                created_at__gte=oldest,
+            ).values_list('user_id', 'task_id', 'notification_type', 'workflow_step_id', 'created_at'):
+                recent.setdefault((user_id, task_id, notification_type), []).append((step_id, created_at))
+
+        to_create = []
+        for intent in intents:
+            user, notification_type = intent['user'], intent['notification_type']
+            task, step = intent.get('task'), intent.get('workflow_step')
+            allowed, metadata, scheduled_for = NotificationService._apply_user_settings(
+                settings_by_user.get(user.id), user, notification_type,
+                intent.get('metadata'), intent.get('scheduled_for')
             )
-            logger.info(f"Notificação ({notification.id}) tipo '{notification_type}' criada: {notification.title} para {user.username}")
-            return notification
+            if not allowed:
+                continue
+
+            key = (user.id, task.pk if task else None, notification_type)
+            step_id = step.pk if step else None
+            if intent.get('check_existing_recent'):
+                cutoff_time = now - timedelta(hours=intent.get('recent_threshold_hours', 24))
+                # Como em create_notification, o passo só conta quando é indicado
+                if any(
+                    created_at >= cutoff_time and (step_id is None or existing_step == step_id)
+                    for existing_step, created_at in recent.get(key, [])
+                ):
+                    logger.info(f"Notificação similar recente ({notification_type}) já enviada para {user.username}")
+                    continue
+            # As intenções seguintes do lote também veem esta
+            recent.setdefault(key, []).append((step_id, now))
+
+            to_create.append(WorkflowNotification(
+                user=user, task=task, workflow_step=step,
+                notification_type=notification_type, priority=intent.get('priority', 'normal'),
+                title=intent['title'], message=intent['message'], created_by=intent.get('created_by'),
+                metadata=metadata or {}, scheduled_for=scheduled_for
+            ))
+
+        try:
+            created = WorkflowNotification.objects.bulk_create(to_create, batch_size=batch_size)
         except Exception as e:
-            logger.error(f"Erro ao criar notificação do tipo '{notification_type}' para {user.username}: {e}", exc_info=True)
-            return None
+            logger.error(f"Erro ao criar {len(to_create)} notificações em bloco: {e}", exc_info=True)
+            return []
+        NotificationCounterService.record_created(created)
+        logger.info(f"{len(created)} notificações criadas em bloco ({len(intents)} pedidas)")
+        return created
 
     @staticmethod
     def _call_template_service_and_create(
@@ -369,10 +465,11 @@ class NotificationService:
     
     @staticmethod
     def get_unread_count(user):
-        return WorkflowNotification.objects.filter(user=user, is_read=False, is_archived=False).count()
+        return NotificationCounterService.get_unread_count(user)
     
     @staticmethod
     def mark_all_as_read(user):
-        return WorkflowNotification.objects.filter(user=user, is_read=False, is_archived=False).update(
+        return NotificationCounterService.update_queryset(
+            WorkflowNotification.objects.filter(user=user, is_read=False, is_archived=False),
             is_read=True, read_at=timezone.now()
         )
\ No newline at end of file
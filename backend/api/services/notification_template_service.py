@@ -1,180 +1,349 @@
 # api/services/notification_template_service.py
 import logging
-from typing import Optional
+import threading
+import time
+from string import Formatter
+from typing import Callable, Dict, Optional, Tuple
 
+from django.core.cache import cache
 from django.utils import timezone
-from datetime import datetime
 
 from ..models import NotificationTemplate, Task, User, WorkflowStep, GeneratedReport, Organization
 
 logger = logging.getLogger(__name__)
 
+# Templates do sistema, usados quando a organização não tem um template ativo para o tipo
+SYSTEM_DEFAULT_TEMPLATES = {
+    'step_ready': {
+        'title_template': 'Passo pronto: {step_name} para {task_title}',
+        'message_template': 'Olá {user_first_name},\n\nA tarefa "{task_title}" (Cliente: {client_name}) chegou ao passo "{step_name}" e está pronta para ser trabalhada por si.\n\nWorkflow: {workflow_name}\nData: {current_date}',
+        'default_priority': 'normal'
+    },
+    'step_completed': {
+        'title_template': 'Passo concluído: {step_name} (Tarefa: {task_title})',
+        'message_template': 'O passo "{step_name}" da tarefa "{task_title}" (Cliente: {client_name}) foi concluído por {changed_by_name}.\n\nData: {current_date}',
+        'default_priority': 'normal'
+    },
+    'approval_needed': {
+        'title_template': '{reminder_prefix}Aprovação necessária: {step_name} (Tarefa: {task_title})',
+        'message_template': 'Caro {user_first_name},\n\nO passo "{step_name}" da tarefa "{task_title}" (Cliente: {client_name}) precisa da sua aprovação.\n\n{comment}\nData: {current_date} às {current_time}',
+        'default_priority': 'high'
+    },
+    'approval_completed': {
+        'title_template': 'Aprovação Concluída: {step_name} ({approval_status})',
+        'message_template': 'O passo "{step_name}" da tarefa "{task_title}" (Cliente: {client_name}) foi {approval_status_text} por {approver_name}.\n\nComentário: {approval_comment}\nData: {current_date}',
+        'default_priority': 'normal'
+    },
+    'manual_advance_needed': {
+        'title_template': 'Escolha o próximo passo: {task_title}',
+        'message_template': 'A tarefa "{task_title}" completou o passo "{completed_step_name}" e tem múltiplos caminhos possíveis: {next_steps_names_list}. É necessário escolher manually o próximo passo.',
+        'default_priority': 'high'
+    },
+    'deadline_approaching': {
+        'title_template': 'Prazo próximo ({days_remaining_text}): {task_title}',
+        'message_template': 'A tarefa "{task_title}" (Cliente: {client_name}) vence {days_remaining_text} ({deadline_date}).\n\nPasso atual: {step_name}\nPor favor, verifique os detalhes.',
+        'default_priority': 'high'
+    },
+    'task_completed': { 
+        'title_template': '✅ Tarefa Concluída: {task_title}',
+        'message_template': 'A tarefa "{task_title}" (Cliente: {client_name}) foi marcada como concluída por {changed_by_name}.',
+        'default_priority': 'normal'
+    },
+    'step_overdue': {
+        'title_template': 'Passo atrasado: {step_name} (Tarefa: {task_title})',
+        'message_template': 'O passo "{step_name}" da tarefa "{task_title}" (Cliente: {client_name}) está {days_overdue_text} atrasado.\n\nResponsável pelo passo: {step_assignee_name}\nPrazo da tarefa: {deadline_date}',
+        'default_priority': 'urgent'
+    },
+    'workflow_assigned': {
+        'title_template': 'Novo Workflow Atribuído: {task_title}',
+        'message_template': 'O workflow "{workflow_name}" foi atribuído à tarefa "{task_title}" (Cliente: {client_name}) por {changed_by_name}.\n{first_step_message}Verifique a tarefa.',
+        'default_priority': 'normal'
+    },
+    'step_rejected': {
+        'title_template': 'Passo Rejeitado: {step_name} (Tarefa: {task_title})',
+        'message_template': 'O passo "{step_name}" da tarefa "{task_title}" (Cliente: {client_name}) foi REJEITADO por {changed_by_name}.\n\nComentário: {comment}\nData: {current_date}',
+        'default_priority': 'high'
+    },
+    'manual_reminder': {
+        'title_template': 'Lembrete: {manual_title}',
+        'message_template': 'Olá {user_first_name},\n\nEste é um lembrete sobre: {manual_message}\n\nRelacionado à tarefa: "{task_title}" (Cliente: {client_name})\n\nCriado por: {changed_by_name}\nData: {current_date}',
+        'default_priority': 'normal'
+    },
+    'task_assigned_to_you': {
+        'title_template': '🚀 Nova Tarefa: {task_title}',
+        'message_template': (
+            'Olá {user_first_name},\n\n'
+            'Você foi atribuído(a) à tarefa "{task_title}" para o cliente "{client_name}".\n'
+            'Criada por: {changed_by_name}.\n\n'
+            'Prazo: {deadline_date}\n'
+            'Prioridade: {priority_label}\n\n'
+            'Por favor, verifique os detalhes da tarefa.'
+        ),
+        'default_priority': 'normal'
+    },
+    'report_generated': {
+        'title_template': '📊 Relatório Gerado: {report_name}',
+        'message_template': (
+            'Olá {user_first_name},\n\n'
+            'O relatório "{report_name}" ({report_type_display}) foi gerado com sucesso por {changed_by_name}.\n'
+            'Formato: {report_format_display}\n'
+            'Pode aceder ao relatório na Central de Relatórios.'
+        ),
+        'default_priority': 'low'
+    }
+}
+
+GENERIC_FALLBACK_TEMPLATE = {
+    'title_template': 'Notificação do Sistema: {task_title}',
+    'message_template': 'Você tem uma nova notificação para a tarefa "{task_title}". Detalhes: {fallback_message}',
+    'default_priority': 'normal'
+}
+
+
+class CompiledTemplate:
+    """
+    Template de título/mensagem com as format strings já analisadas.
+
+    `missing_placeholder` define o que acontece a variáveis em falta: os templates do
+    sistema mostram "{Informação em falta: x}", os das organizações (como em
+    NotificationTemplate.render) devolvem o texto do template sem substituições.
+    """
+
+    _formatter = Formatter()
+
+    def __init__(self, notification_type: str, title_template: str, message_template: str,
+                 default_priority: str = 'normal', missing_placeholder: Optional[str] = None):
+        self.notification_type = notification_type
+        self.title_template = title_template
+        self.message_template = message_template
+        self.default_priority = default_priority
+        self.missing_placeholder = missing_placeholder
+        self._title = self._compile(title_template)
+        self._message = self._compile(message_template)
+        self.variables = frozenset(
+            field.split('.')[0].split('[')[0]
+            for parts in (self._title, self._message)
+            for _, field, _, _ in parts if field
+        )
+
+    def _compile(self, source: str):
+        try:
+            parts = list(self._formatter.parse(source))
+        except ValueError as e:
+            logger.error(f"Template '{self.notification_type}' inválido ({e}); usado como texto literal.")
+            return [(source, None, '', None)]
+        for _, field, spec, _ in parts:
+            if field == '' or field and field.isdigit():
+                logger.error(f"Template '{self.notification_type}' usa campos posicionais; usado como texto literal.")
+                return [(source, None, '', None)]
+        return parts
+
+    def _render_parts(self, parts, context) -> str:
+        chunks = []
+        for literal, field, spec, conversion in parts:
+            chunks.append(literal)
+            if field is None:
+                continue
+            if '.' in field or '[' in field:
+                value = self._formatter.get_field(field, (), context)[0]
+            else:
+                value = context[field]
+            if conversion:
+                value = self._formatter.convert_field(value, conversion)
+            if spec and '{' in spec:
+                spec = self._formatter.vformat(spec, (), context)
+            chunks.append(format(value, spec))
+        return ''.join(chunks)
+
+    def render(self, context) -> Tuple[str, str]:
+        if self.missing_placeholder is not None:
+            context = _MissingPlaceholderContext(context, self.missing_placeholder)
+        try:
+            return self._render_parts(self._title, context), self._render_parts(self._message, context)
+        except (KeyError, AttributeError, IndexError) as e:
+            logger.error(f"Variável ausente no template '{self.notification_type}': {e}")
+            return self.title_template, self.message_template
+
+
+class _MissingPlaceholderContext(dict):
+    """Vista do contexto que devolve um marcador para variáveis desconhecidas."""
+
+    def __init__(self, context, placeholder: str):
+        super().__init__()
+        self._context = context
+        self._placeholder = placeholder
+
+    def __missing__(self, key):
+        try:
+            return self._context[key]
+        except KeyError:
+            return self._placeholder.format(key=key)
+
+
+class NotificationContext(dict):
+    """
+    Contexto de renderização em que as variáveis padrão (utilizador, tarefa, cliente,
+    passo, workflow, organização, data) só são calculadas quando um template as usa.
+    Os valores calculados ficam no dicionário, que também serve de metadata.
+    """
+
+    def __init__(self, resolvers: Dict[str, Callable], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._resolvers = resolvers
+
+    def __missing__(self, key):
+        resolver = self._resolvers.get(key)
+        if resolver is None:
+            raise KeyError(key)
+        value = self[key] = resolver()
+        return value
+
+    @classmethod
+    def for_objects(cls, task=None, user=None, workflow_step=None) -> 'NotificationContext':
+        """Mesmas variáveis e valores por omissão de NotificationTemplate.get_context_variables."""
+        now = []
+
+        def current(fmt):
+            if not now:
+                now.append(timezone.now())
+            return now[0].strftime(fmt)
+
+        def client():
+            return task.client if task and task.client_id else None
+
+        def organization_name():
+            organization = client().organization if client() and client().organization_id else None
+            return organization.name if organization else 'Organização não especificada'
+
+        def workflow_name():
+            if workflow_step:
+                workflow = workflow_step.workflow if workflow_step.workflow_id else None
+            else:
+                workflow = task.workflow if task and task.workflow_id else None
+            return workflow.name if workflow else 'Workflow não especificado'
+
+        return cls({
+            'user_name': lambda: user.username if user else 'Utilizador',
+            'user_first_name': lambda: (user.first_name or user.username) if user else 'Utilizador',
+            'task_title': lambda: task.title if task else 'Tarefa não especificada',
+            'client_name': lambda: client().name if client() else 'Cliente não especificado',
+            'step_name': lambda: workflow_step.name if workflow_step else 'Passo não especificado',
+            'workflow_name': workflow_name,
+            'organization_name': organization_name,
+            'current_date': lambda: current('%d/%m/%Y'),
+            'current_time': lambda: current('%H:%M'),
+        })
+
+
+class NotificationTemplateRegistry:
+    """
+    Templates resolvidos por (organização, tipo), compilados uma única vez por processo.
+
+    Os templates de uma organização são lidos numa só query na primeira utilização. Gravar
+    ou apagar um NotificationTemplate invalida a organização neste processo e incrementa
+    uma versão na cache partilhada; os outros processos (workers Celery, outros servidores)
+    comparam essa versão no máximo a cada VERSION_CHECK_SECONDS.
+    """
+
+    VERSION_CACHE_KEY = 'notification_templates:version:{organization_id}'
+    VERSION_CHECK_SECONDS = 60
+    MISSING_PLACEHOLDER = '{{Informação em falta: {key}}}'
+
+    _lock = threading.Lock()
+    _organizations: Dict = {}  # organization_id -> (versão, verificar após, {tipo: CompiledTemplate})
+    _defaults: Dict[str, CompiledTemplate] = {}
+
+    @classmethod
+    def get(cls, organization_id, notification_type: str) -> CompiledTemplate:
+        if organization_id is not None:
+            template = cls._organization_templates(organization_id).get(notification_type)
+            if template is not None:
+                return template
+        return cls.default(notification_type)
+
+    @classmethod
+    def default(cls, notification_type: str) -> CompiledTemplate:
+        template = cls._defaults.get(notification_type)
+        if template is None:
+            template_data = SYSTEM_DEFAULT_TEMPLATES.get(notification_type)
+            if not template_data:
+                logger.warning(f"Nenhum template padrão do sistema definido para o tipo: {notification_type}. Usando fallback genérico.")
+                template_data = GENERIC_FALLBACK_TEMPLATE
+            template = cls._defaults[notification_type] = CompiledTemplate(
+                notification_type, missing_placeholder=cls.MISSING_PLACEHOLDER, **template_data
+            )
+        return template
+
+    @classmethod
+    def _organization_templates(cls, organization_id) -> Dict[str, CompiledTemplate]:
+        now = time.monotonic()
+        entry = cls._organizations.get(organization_id)
+        if entry is not None and now < entry[1]:
+            return entry[2]
+
+        # A versão é lida antes dos templates: uma gravação entretanto volta a invalidar
+        version = cls._shared_version(organization_id)
+        if entry is not None and entry[0] == version:
+            templates = entry[2]
+        else:
+            templates = {}
+            # O padrão do tipo tem prioridade; senão o ativo mais recente
+            for template in NotificationTemplate.objects.filter(
+                organization_id=organization_id, is_active=True
+            ).order_by('-is_default', '-updated_at'):
+                if template.notification_type not in templates:
+                    templates[template.notification_type] = CompiledTemplate(
+                        template.notification_type, template.title_template,
+                        template.message_template, template.default_priority
+                    )
+        with cls._lock:
+            cls._organizations[organization_id] = (version, now + cls.VERSION_CHECK_SECONDS, templates)
+        return templates
+
+    @classmethod
+    def _shared_version(cls, organization_id):
+        try:
+            return cache.get(cls.VERSION_CACHE_KEY.format(organization_id=organization_id))
+        except Exception as e:
+            logger.warning(f"Não foi possível ler a versão dos templates de notificação: {e}")
+            return None
+
+    @classmethod
+    def invalidate(cls, organization_id, shared: bool = True):
+        with cls._lock:
+            cls._organizations.pop(organization_id, None)
+        if not shared:
+            return
+        key = cls.VERSION_CACHE_KEY.format(organization_id=organization_id)
+        try:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+        except Exception as e:
+            logger.warning(f"Não foi possível invalidar os templates de notificação noutros processos: {e}")
+
+
 class NotificationTemplateService:
     """
     Serviço para gestão e renderização de templates de notificação.
     """
 
     @staticmethod
-    def get_template(organization: Optional[Organization], notification_type: str) -> 'Template':
+    def get_template(organization: Optional[Organization], notification_type: str) -> CompiledTemplate:
         """
-        Obtém o template de notificação apropriado.
+        Obtém o template de notificação apropriado (via NotificationTemplateRegistry).
         Busca primeiro um template customizado e ativo para a organização.
         Se não encontrar, retorna um template padrão do sistema.
         """
-        template = None
-        if organization:
-            # Tenta encontrar um template customizado que seja o padrão para este tipo
-            template = NotificationTemplate.objects.filter(
-                organization=organization,
-                notification_type=notification_type,
-                is_active=True,
-                is_default=True
-            ).first()
-        
-            # Se não houver padrão, pega o mais recente ativo
-            if not template:
-                template = NotificationTemplate.objects.filter(
-                    organization=organization,
-                    notification_type=notification_type,
-                    is_active=True
-                ).order_by('-updated_at').first()
-        
-        # Se ainda não encontrou template (sem organização ou sem customização), usa o padrão do sistema
-        if not template:
-            template = NotificationTemplateService._get_system_default_template(notification_type)
-        
-        return template
+        organization_id = organization.pk if isinstance(organization, Organization) else organization
+        return NotificationTemplateRegistry.get(organization_id, notification_type)
 
     @staticmethod
-    def _get_system_default_template(notification_type: str) -> 'Template':
+    def _get_system_default_template(notification_type: str) -> CompiledTemplate:
         """
-        Retorna um objeto de template padrão do sistema para um tipo de notificação.
+        Retorna o template padrão do sistema para um tipo de notificação.
         Isso serve como fallback se nenhum template customizado for encontrado.
         """
-        default_templates = {
-            'step_ready': {
-                'title_template': 'Passo pronto: {step_name} para {task_title}',
-                'message_template': 'Olá {user_first_name},\n\nA tarefa "{task_title}" (Cliente: {client_name}) chegou ao passo "{step_name}" e está pronta para ser trabalhada por si.\n\nWorkflow: {workflow_name}\nData: {current_date}',
-                'default_priority': 'normal'
-            },
-            'step_completed': {
-                'title_template': 'Passo concluído: {step_name} (Tarefa: {task_title})',
-                'message_template': 'O passo "{step_name}" da tarefa "{task_title}" (Cliente: {client_name}) foi concluído por {changed_by_name}.\n\nData: {current_date}',
-                'default_priority': 'normal'
-            },
-            'approval_needed': {
-                'title_template': '{reminder_prefix}Aprovação necessária: {step_name} (Tarefa: {task_title})',
-                'message_template': 'Caro {user_first_name},\n\nO passo "{step_name}" da tarefa "{task_title}" (Cliente: {client_name}) precisa da sua aprovação.\n\n{comment}\nData: {current_date} às {current_time}',
-                'default_priority': 'high'
-            },
-            'approval_completed': {
-                'title_template': 'Aprovação Concluída: {step_name} ({approval_status})',
-                'message_template': 'O passo "{step_name}" da tarefa "{task_title}" (Cliente: {client_name}) foi {approval_status_text} por {approver_name}.\n\nComentário: {approval_comment}\nData: {current_date}',
-                'default_priority': 'normal'
-            },
-            'manual_advance_needed': {
-                'title_template': 'Escolha o próximo passo: {task_title}',
-                'message_template': 'A tarefa "{task_title}" completou o passo "{completed_step_name}" e tem múltiplos caminhos possíveis: {next_steps_names_list}. É necessário escolher manually o próximo passo.',
-                'default_priority': 'high'
-            },
-            'deadline_approaching': {
-                'title_template': 'Prazo próximo ({days_remaining_text}): {task_title}',
-                'message_template': 'A tarefa "{task_title}" (Cliente: {client_name}) vence {days_remaining_text} ({deadline_date}).\n\nPasso atual: {step_name}\nPor favor, verifique os detalhes.',
-                'default_priority': 'high'
-            },
-            'task_completed': { 
-                'title_template': '✅ Tarefa Concluída: {task_title}',
-                'message_template': 'A tarefa "{task_title}" (Cliente: {client_name}) foi marcada como concluída por {changed_by_name}.',
-                'default_priority': 'normal'
-            },
-            'step_overdue': {
-                'title_template': 'Passo atrasado: {step_name} (Tarefa: {task_title})',
-                'message_template': 'O passo "{step_name}" da tarefa "{task_title}" (Cliente: {client_name}) está {days_overdue_text} atrasado.\n\nResponsável pelo passo: {step_assignee_name}\nPrazo da tarefa: {deadline_date}',
-                'default_priority': 'urgent'
-            },
-            'workflow_assigned': {
-                'title_template': 'Novo Workflow Atribuído: {task_title}',
-                'message_template': 'O workflow "{workflow_name}" foi atribuído à tarefa "{task_title}" (Cliente: {client_name}) por {changed_by_name}.\n{first_step_message}Verifique a tarefa.',
-                'default_priority': 'normal'
-            },
-            'step_rejected': {
-                'title_template': 'Passo Rejeitado: {step_name} (Tarefa: {task_title})',
-                'message_template': 'O passo "{step_name}" da tarefa "{task_title}" (Cliente: {client_name}) foi REJEITADO por {changed_by_name}.\n\nComentário: {comment}\nData: {current_date}',
-                'default_priority': 'high'
-            },
-            'manual_reminder': {
-                'title_template': 'Lembrete: {manual_title}',
-                'message_template': 'Olá {user_first_name},\n\nEste é um lembrete sobre: {manual_message}\n\nRelacionado à tarefa: "{task_title}" (Cliente: {client_name})\n\nCriado por: {changed_by_name}\nData: {current_date}',
-                'default_priority': 'normal'
-            },
-            'task_assigned_to_you': {
-                'title_template': '🚀 Nova Tarefa: {task_title}',
-                'message_template': (
-                    'Olá {user_first_name},\n\n'
-                    'Você foi atribuído(a) à tarefa "{task_title}" para o cliente "{client_name}".\n'
-                    'Criada por: {changed_by_name}.\n\n'
-                    'Prazo: {deadline_date}\n'
-                    'Prioridade: {priority_label}\n\n'
-                    'Por favor, verifique os detalhes da tarefa.'
-                ),
-                'default_priority': 'normal'
-            },
-            'report_generated': {
-                'title_template': '📊 Relatório Gerado: {report_name}',
-                'message_template': (
-                    'Olá {user_first_name},\n\n'
-                    'O relatório "{report_name}" ({report_type_display}) foi gerado com sucesso por {changed_by_name}.\n'
-                    'Formato: {report_format_display}\n'
-                    'Pode aceder ao relatório na Central de Relatórios}'
-                ),
-                'default_priority': 'low'
-            }
-        }
-        
-        template_data = default_templates.get(notification_type)
-        if not template_data:
-            logger.warning(f"Nenhum template padrão do sistema definido para o tipo: {notification_type}. Usando fallback genérico.")
-            template_data = {
-                'title_template': 'Notificação do Sistema: {task_title}',
-                'message_template': 'Você tem uma nova notificação para a tarefa "{task_title}". Detalhes: {fallback_message}',
-                'default_priority': 'normal'
-            }
-        
-        from types import SimpleNamespace
-        template = SimpleNamespace()
-        template.notification_type = notification_type
-        template.title_template = template_data['title_template']
-        template.message_template = template_data['message_template']
-        template.default_priority = template_data['default_priority']
-
-        def render_template(context_vars):
-            safe_context = context_vars.copy()
-            expected_keys = [
-                'user_first_name', 'task_title', 'client_name', 'step_name', 'workflow_name',
-                'organization_name', 'current_date', 'current_time', 'changed_by_name',
-                'deadline_date', 'priority_label', 'fallback_message', 'reminder_prefix',
-                'comment', 'approval_status', 'approval_status_text', 'approver_name',
-                'approval_comment', 'completed_step_name', 'next_steps_names_list',
-                'days_remaining_text', 'days_overdue_text', 'step_assignee_name',
-                'manual_title', 'manual_message', 'report_name', 'report_type_display',
-                'report_format_display', 'report_file_size_kb', 'report_download_url'
-            ]
-            for key in expected_keys:
-                if key not in safe_context:
-                    safe_context[key] = f"{{Informação em falta: {key}}}"
-            
-            try:
-                final_title = template.title_template.format_map(safe_context)
-                final_message = template.message_template.format_map(safe_context)
-                return final_title, final_message
-            except KeyError as e:
-                logger.error(f"Erro de chave ausente ao renderizar template padrão '{template.notification_type}': {e}. Contexto: {safe_context}")
-                final_title = template.title_template.format_map(safe_context)
-                final_message = template.message_template.format_map(safe_context)
-                return final_title, final_message
-
-        template.render = render_template
-        return template
+        return NotificationTemplateRegistry.default(notification_type)
     
     @staticmethod
     def get_rendered_notification_content(
@@ -194,17 +363,18 @@ class NotificationTemplateService:
         Returns:
             dict: Um dicionário contendo 'title', 'message', 'priority', e 'context'.
         """
-        organization = None
-        if report and hasattr(report, 'organization'):
-            organization = report.organization
-        elif task and hasattr(task, 'client') and hasattr(task.client, 'organization'):
-            organization = task.client.organization
-        elif hasattr(user_target, 'profile') and hasattr(user_target.profile, 'organization'):
-            organization = user_target.profile.organization
-
-        template = NotificationTemplateService.get_template(organization, notification_type)
-        
-        context = NotificationTemplate.get_context_variables(
+        organization_id = None
+        if report and hasattr(report, 'organization_id'):
+            organization_id = report.organization_id
+        elif task and task.client_id:
+            organization_id = task.client.organization_id
+        elif hasattr(user_target, 'profile'):
+            organization_id = user_target.profile.organization_id
+
+        template = NotificationTemplateRegistry.get(organization_id, notification_type)
+
+        # Só as variáveis usadas pelo template são calculadas (e guardadas na metadata)
+        context = NotificationContext.for_objects(
             task=task, user=user_target, workflow_step=workflow_step
         )
 
@@ -224,12 +394,12 @@ class NotificationTemplateService:
             context.update(extra_context)
 
         title, message = template.render(context)
-        
+
         priority_to_use = priority_override or template.default_priority or kwargs.get('priority', 'normal')
 
         return {
             "title": title,
             "message": message,
             "priority": priority_to_use,
-            "context": context,
+            "context": dict(context),
         }
\ No newline at end of file
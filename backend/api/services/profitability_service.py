@@ -0,0 +1,539 @@
+# api/services/profitability_service.py
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from ..models import (
+    Client, ClientProfitability, ClientProfitabilityDelta, Expense, Organization, Profile, TimeEntry
+)
+from .dashboard_counter_service import DashboardCounterService
+
+logger = logging.getLogger(__name__)
+
+Period = Tuple[int, int]
+AggregateKey = Tuple[str, int, int]
+
+ZERO = Decimal('0.00')
+SIXTY = Decimal('60')
+CENT = Decimal('0.01')
+# Limites de ClientProfitability.profit_margin (max_digits=5, decimal_places=2)
+MAX_MARGIN = Decimal('999.99')
+
+
+class ProfitabilityEngine:
+    """
+    Motor de rentabilidade baseado em conjuntos.
+
+    Em vez de chamar `update_client_profitability` cliente a cliente, calcula os
+    minutos, o custo do tempo (ligado a Profile.hourly_rate) e as despesas de todos
+    os pares cliente/mês com agregações agrupadas em SQL e grava os registos
+    ClientProfitability num único upsert em bloco.
+    """
+
+    CLIENT_CHUNK_SIZE = 2000
+    BULK_BATCH_SIZE = 1000
+    UPDATE_FIELDS = [
+        'monthly_fee', 'total_time_minutes', 'time_cost', 'total_expenses',
+        'profit', 'profit_margin', 'is_profitable', 'last_updated',
+    ]
+
+    @staticmethod
+    def normalize_periods(periods: Iterable) -> List[Period]:
+        """Converte [(ano, mês), ...] (ou listas vindas do Celery) numa lista ordenada e sem duplicados."""
+        return sorted({(int(year), int(month)) for year, month in periods})
+
+    @staticmethod
+    def _period_filter(periods: List[Period]) -> Q:
+        query = Q()
+        for year, month in periods:
+            query |= Q(date__year=year, date__month=month)
+        return query
+
+    @staticmethod
+    def _empty_aggregate() -> Dict:
+        return {'total_time_minutes': 0, 'time_cost': ZERO, 'total_expenses': ZERO}
+
+    @classmethod
+    def aggregate_periods(cls, client_ids: List, periods: List[Period]) -> Dict[AggregateKey, Dict]:
+        """
+        Agrega tempo, custo do tempo e despesas para os clientes e períodos indicados.
+        Executa exatamente duas queries agrupadas (TimeEntry e Expense).
+
+        Returns:
+            Dict {(client_id, ano, mês): {'total_time_minutes', 'time_cost', 'total_expenses'}}
+        """
+        results: Dict[AggregateKey, Dict] = defaultdict(cls._empty_aggregate)
+        if not client_ids or not periods:
+            return results
+
+        period_q = cls._period_filter(periods)
+        hourly_rate = Coalesce(
+            F('user__profile__hourly_rate'), Value(ZERO),
+            output_field=DecimalField(max_digits=10, decimal_places=2)
+        )
+        entry_cost = ExpressionWrapper(
+            F('minutes_spent') * hourly_rate,
+            output_field=DecimalField(max_digits=20, decimal_places=2)
+        )
+
+        time_rows = (
+            TimeEntry.objects.filter(period_q, client_id__in=client_ids)
+            .annotate(period_year=ExtractYear('date'), period_month=ExtractMonth('date'))
+            .values('client_id', 'period_year', 'period_month')
+            .annotate(minutes=Sum('minutes_spent'), rate_minutes=Sum(entry_cost))
+            .order_by()
+        )
+        for row in time_rows:
+            key = (str(row['client_id']), row['period_year'], row['period_month'])
+            results[key]['total_time_minutes'] = row['minutes'] or 0
+            results[key]['time_cost'] = (row['rate_minutes'] or ZERO) / SIXTY
+
+        expense_rows = (
+            Expense.objects.filter(period_q, client_id__in=client_ids)
+            .annotate(period_year=ExtractYear('date'), period_month=ExtractMonth('date'))
+            .values('client_id', 'period_year', 'period_month')
+            .annotate(amount=Sum('amount'))
+            .order_by()
+        )
+        for row in expense_rows:
+            key = (str(row['client_id']), row['period_year'], row['period_month'])
+            results[key]['total_expenses'] = row['amount'] or ZERO
+
+        return results
+
+    @classmethod
+    def reference_aggregate(cls, time_entries: Iterable, expenses: Iterable, periods: Iterable) -> Dict[AggregateKey, Dict]:
+        """
+        Caminho de referência em Python puro, com a mesma semântica de
+        `update_client_profitability`. Serve para testes de paridade com `aggregate_periods`.
+
+        Args:
+            time_entries: iterável de (client_id, date, minutes_spent, hourly_rate | None)
+            expenses: iterável de (client_id, date, amount)
+            periods: iterável de (ano, mês)
+        """
+        wanted = set(cls.normalize_periods(periods))
+        results: Dict[AggregateKey, Dict] = defaultdict(cls._empty_aggregate)
+
+        for client_id, entry_date, minutes, hourly_rate in time_entries:
+            if (entry_date.year, entry_date.month) not in wanted:
+                continue
+            key = (str(client_id), entry_date.year, entry_date.month)
+            results[key]['total_time_minutes'] += minutes
+            results[key]['time_cost'] += (Decimal(minutes) / SIXTY) * (hourly_rate or ZERO)
+
+        for client_id, expense_date, amount in expenses:
+            if client_id is None or (expense_date.year, expense_date.month) not in wanted:
+                continue
+            key = (str(client_id), expense_date.year, expense_date.month)
+            results[key]['total_expenses'] += amount
+
+        return results
+
+    @staticmethod
+    def finalize_record(record: ClientProfitability) -> ClientProfitability:
+        """
+        Recalcula lucro e margem e arredonda os valores como a base de dados faria ao gravar.
+        Tal como em update_client_profitability, o lucro é calculado antes do arredondamento.
+        """
+        record.calculate_profit()
+        record.time_cost = record.time_cost.quantize(CENT, rounding=ROUND_HALF_UP)
+        record.total_expenses = record.total_expenses.quantize(CENT, rounding=ROUND_HALF_UP)
+        record.profit = record.profit.quantize(CENT, rounding=ROUND_HALF_UP)
+        if record.profit_margin is not None:
+            # Uma margem fora do intervalo da coluna faria falhar o upsert do bloco inteiro
+            margin = max(-MAX_MARGIN, min(MAX_MARGIN, record.profit_margin))
+            record.profit_margin = margin.quantize(CENT, rounding=ROUND_HALF_UP)
+        return record
+
+    @classmethod
+    def build_record(cls, client: Client, year: int, month: int, aggregate: Dict) -> ClientProfitability:
+        """Constrói (sem gravar) um ClientProfitability com lucro e margem calculados."""
+        record = ClientProfitability(
+            client=client,
+            year=year,
+            month=month,
+            monthly_fee=client.monthly_fee or ZERO,
+            total_time_minutes=aggregate['total_time_minutes'],
+            time_cost=Decimal(aggregate['time_cost']),
+            total_expenses=Decimal(aggregate['total_expenses']),
+        )
+        return cls.finalize_record(record)
+
+    @staticmethod
+    def _clients_query(organization: Optional[Organization] = None, client_ids: Optional[Iterable] = None):
+        clients_query = Client.objects.filter(is_active=True).only('id', 'monthly_fee').order_by('id')
+        if organization is not None:
+            clients_query = clients_query.filter(organization=organization)
+        if client_ids is not None:
+            clients_query = clients_query.filter(id__in=list(client_ids))
+        return clients_query
+
+    @classmethod
+    def _client_chunks(cls, clients_query, chunk_size: int):
+        chunk: List[Client] = []
+        for client in clients_query.iterator(chunk_size=chunk_size):
+            chunk.append(client)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @classmethod
+    def recompute(cls, periods: Iterable, organization: Optional[Organization] = None,
+                  client_ids: Optional[Iterable] = None, chunk_size: Optional[int] = None) -> Dict[Period, int]:
+        """
+        Recalcula a rentabilidade de todos os clientes ativos para os períodos indicados.
+
+        Args:
+            periods: iterável de (ano, mês)
+            organization: limita a uma organização (None para todas)
+            client_ids: limita a um conjunto de clientes
+            chunk_size: número de clientes agregados por bloco
+
+        Returns:
+            Dict (ano, mês) -> número de registos cliente/mês gravados nesse período
+        """
+        periods = cls.normalize_periods(periods)
+        written = {period: 0 for period in periods}
+        if not periods:
+            return written
+
+        clients_query = cls._clients_query(organization, client_ids)
+        for chunk in cls._client_chunks(clients_query, chunk_size or cls.CLIENT_CHUNK_SIZE):
+            with transaction.atomic():
+                cls._discard_pending_deltas(chunk, periods)
+                records = cls._build_chunk_records(chunk, periods)
+                cls._upsert(records)
+            for record in records:
+                written[(record.year, record.month)] += 1
+
+        logger.info(f"Rentabilidade recalculada em bloco: {sum(written.values())} registos para {len(periods)} período(s)")
+        return written
+
+    @classmethod
+    def reconcile(cls, periods: Iterable, organization: Optional[Organization] = None,
+                  chunk_size: Optional[int] = None, tolerance: Decimal = CENT, max_examples: int = 20) -> Dict:
+        """
+        Compara os registos ClientProfitability mantidos incrementalmente com um
+        recálculo completo, corrige os que divergem e devolve um relatório da deriva.
+
+        Returns:
+            Dict com records_checked, records_missing, records_drifted,
+            time_cost_drift / expenses_drift (soma absoluta) e alguns exemplos.
+            Diferenças de custo/lucro até `tolerance` resultam do arredondamento
+            dos deltas e não contam como deriva. Registos em falta sem atividade
+            são criados mas não reportados.
+        """
+        periods = cls.normalize_periods(periods)
+        report = {
+            'periods': [f"{month:02d}/{year}" for year, month in periods],
+            'records_checked': 0,
+            'records_missing': 0,
+            'records_drifted': 0,
+            'minutes_drift': 0,
+            'time_cost_drift': ZERO,
+            'expenses_drift': ZERO,
+            'examples': [],
+        }
+        if not periods:
+            return report
+
+        years = {year for year, _ in periods}
+        months = {month for _, month in periods}
+        clients_query = cls._clients_query(organization)
+        for chunk in cls._client_chunks(clients_query, chunk_size or cls.CLIENT_CHUNK_SIZE):
+            with transaction.atomic():
+                cls._discard_pending_deltas(chunk, periods)
+                expected_records = cls._build_chunk_records(chunk, periods)
+                stored = {
+                    (str(row['client_id']), row['year'], row['month']): row
+                    for row in ClientProfitability.objects.filter(
+                        client_id__in=[c.id for c in chunk], year__in=years, month__in=months
+                    ).values('client_id', 'year', 'month', 'total_time_minutes', 'time_cost',
+                             'total_expenses', 'monthly_fee', 'profit')
+                }
+
+                to_fix = []
+                for record in expected_records:
+                    report['records_checked'] += 1
+                    current = stored.get((str(record.client_id), record.year, record.month))
+                    if current is None:
+                        if record.total_time_minutes or record.total_expenses:
+                            report['records_missing'] += 1
+                        to_fix.append(record)
+                        continue
+                    minutes_diff = record.total_time_minutes - current['total_time_minutes']
+                    cost_diff = record.time_cost - current['time_cost']
+                    expenses_diff = record.total_expenses - current['total_expenses']
+                    if (minutes_diff or abs(cost_diff) > tolerance or expenses_diff
+                            or record.monthly_fee != current['monthly_fee']
+                            or abs(record.profit - current['profit']) > tolerance):
+                        report['records_drifted'] += 1
+                        report['minutes_drift'] += abs(minutes_diff)
+                        report['time_cost_drift'] += abs(cost_diff)
+                        report['expenses_drift'] += abs(expenses_diff)
+                        if len(report['examples']) < max_examples:
+                            report['examples'].append({
+                                'client_id': str(record.client_id),
+                                'period': f"{record.month:02d}/{record.year}",
+                                'minutes': [current['total_time_minutes'], record.total_time_minutes],
+                                'time_cost': [str(current['time_cost']), str(record.time_cost)],
+                                'total_expenses': [str(current['total_expenses']), str(record.total_expenses)],
+                            })
+                        to_fix.append(record)
+                cls._upsert(to_fix)
+
+        if report['records_drifted'] or report['records_missing']:
+            logger.warning(
+                f"Reconciliação de rentabilidade: {report['records_drifted']} registos com deriva e "
+                f"{report['records_missing']} em falta em {report['records_checked']} verificados"
+            )
+        else:
+            logger.info(f"Reconciliação de rentabilidade sem deriva ({report['records_checked']} registos)")
+        report['time_cost_drift'] = str(report['time_cost_drift'])
+        report['expenses_drift'] = str(report['expenses_drift'])
+        return report
+
+    @classmethod
+    def _discard_pending_deltas(cls, clients: List[Client], periods: List[Period]) -> int:
+        """
+        Apaga os deltas ainda por aplicar dos clientes/meses que vão ser recalculados:
+        os totais absolutos já os incluem e o apply_pending voltaria a somá-los. Deve
+        correr na mesma transação do recálculo e antes da agregação; deltas reclamados
+        por um apply_pending em curso bloqueiam até este terminar.
+        """
+        period_q = Q()
+        for year, month in periods:
+            period_q |= Q(year=year, month=month)
+        deleted, _ = ClientProfitabilityDelta.objects.filter(
+            period_q, client_id__in=[client.id for client in clients]
+        ).delete()
+        return deleted
+
+    @classmethod
+    def _build_chunk_records(cls, clients: List[Client], periods: List[Period]) -> List[ClientProfitability]:
+        aggregates = cls.aggregate_periods([c.id for c in clients], periods)
+        empty = cls._empty_aggregate()
+        return [
+            cls.build_record(client, year, month, aggregates.get((str(client.id), year, month), empty))
+            for client in clients
+            for year, month in periods
+        ]
+
+    @classmethod
+    def _upsert(cls, records: List[ClientProfitability]) -> None:
+        if not records:
+            return
+        with transaction.atomic():
+            ClientProfitability.objects.bulk_create(
+                records,
+                batch_size=cls.BULK_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['client', 'year', 'month'],
+                update_fields=cls.UPDATE_FIELDS,
+            )
+            # bulk_create não envia post_save
+            DashboardCounterService.schedule_profitability_refresh(
+                {(record.year, record.month) for record in records}, {record.client_id for record in records}
+            )
+
+
+class ProfitabilityDeltaQueue:
+    """
+    Manutenção incremental de ClientProfitability.
+
+    Os sinais de TimeEntry/Expense chamam `enqueue_for_instance`, que grava o delta
+    (cliente, ano, mês, minutos, custo, despesas) na tabela ClientProfitabilityDelta
+    na mesma transação da alteração. Após o commit é agendado (com debounce) o
+    `apply_profitability_deltas_task`, que agrupa os deltas pendentes por cliente/mês,
+    aplica-os às linhas afetadas e volta a correr `calculate_profit`.
+    """
+
+    SCHEDULE_CACHE_KEY = 'profitability_deltas_scheduled'
+    DEBOUNCE_SECONDS = 5
+    APPLY_BATCH_SIZE = 5000
+    SNAPSHOT_ATTR = '_profitability_snapshot'
+
+    @staticmethod
+    def _hourly_rate(user_id) -> Decimal:
+        rate = Profile.objects.filter(user_id=user_id).values_list('hourly_rate', flat=True).first()
+        return rate or ZERO
+
+    @classmethod
+    def _state(cls, instance) -> Optional[Dict]:
+        """Estado relevante para a rentabilidade de um TimeEntry ou Expense (None se não contar)."""
+        if instance.client_id is None or instance.date is None:
+            return None
+        if isinstance(instance, TimeEntry):
+            return {
+                'client_id': instance.client_id, 'date': instance.date,
+                'minutes': instance.minutes_spent or 0, 'user_id': instance.user_id,
+            }
+        return {'client_id': instance.client_id, 'date': instance.date, 'amount': instance.amount or ZERO}
+
+    @classmethod
+    def snapshot(cls, instance) -> None:
+        """Chamado em pre_save: guarda na instância o estado atualmente gravado."""
+        previous = None
+        if not instance._state.adding:
+            stored = type(instance).objects.filter(pk=instance.pk).first()
+            if stored is not None:
+                previous = cls._state(stored)
+        setattr(instance, cls.SNAPSHOT_ATTR, previous)
+
+    @classmethod
+    def _deltas_for_state(cls, state: Optional[Dict], sign: int) -> List[Tuple]:
+        if state is None:
+            return []
+        entry_date = state['date']
+        if 'minutes' in state:
+            cost = Decimal(state['minutes']) / SIXTY * cls._hourly_rate(state['user_id'])
+            return [(state['client_id'], entry_date.year, entry_date.month,
+                     sign * state['minutes'], sign * cost, ZERO)]
+        return [(state['client_id'], entry_date.year, entry_date.month, 0, ZERO, sign * Decimal(state['amount']))]
+
+    @classmethod
+    def enqueue_for_instance(cls, instance, deleted: bool = False) -> None:
+        """Calcula e enfileira o delta de um TimeEntry/Expense gravado ou removido."""
+        try:
+            if deleted:
+                deltas = cls._deltas_for_state(cls._state(instance), -1)
+            else:
+                previous = getattr(instance, cls.SNAPSHOT_ATTR, None)
+                current = cls._state(instance)
+                if previous == current:
+                    return
+                deltas = cls._deltas_for_state(previous, -1) + cls._deltas_for_state(current, 1)
+            cls.enqueue(deltas)
+        except Exception as e:
+            # A reconciliação semanal corrige qualquer delta perdido
+            logger.error(f"Erro ao enfileirar delta de rentabilidade para {instance.pk}: {e}", exc_info=True)
+
+    @classmethod
+    def enqueue_for_created(cls, instances: Iterable) -> int:
+        """enqueue_for_instance para TimeEntries/Expenses criados com bulk_create, que não dispara signals."""
+        return cls.enqueue(
+            delta for instance in instances for delta in cls._deltas_for_state(cls._state(instance), 1)
+        )
+
+    @classmethod
+    def enqueue(cls, deltas: Iterable[Tuple], touch: bool = False) -> int:
+        """
+        Agrupa os deltas (client_id, ano, mês, minutos, custo, despesas) por cliente/mês e
+        grava-os na fila. Com touch=True, deltas nulos são mantidos para forçar a atualização
+        da avença do registo.
+        """
+        coalesced: Dict[AggregateKey, List] = {}
+        for client_id, year, month, minutes, cost, amount in deltas:
+            key = (client_id, int(year), int(month))
+            totals = coalesced.setdefault(key, [0, ZERO, ZERO])
+            totals[0] += minutes
+            totals[1] += cost
+            totals[2] += amount
+
+        rows = [
+            ClientProfitabilityDelta(
+                client_id=client_id, year=year, month=month,
+                minutes_delta=minutes, time_cost_delta=cost, expenses_delta=amount,
+            )
+            for (client_id, year, month), (minutes, cost, amount) in coalesced.items()
+            if touch or minutes or cost or amount
+        ]
+        if not rows:
+            return 0
+        ClientProfitabilityDelta.objects.bulk_create(rows)
+        transaction.on_commit(cls.schedule_apply)
+        return len(rows)
+
+    @classmethod
+    def schedule_apply(cls) -> None:
+        """Agenda a aplicação dos deltas, no máximo uma vez por janela de debounce."""
+        from ..tasks import apply_profitability_deltas_task
+        try:
+            if cache.add(cls.SCHEDULE_CACHE_KEY, True, timeout=cls.DEBOUNCE_SECONDS * 6):
+                apply_profitability_deltas_task.apply_async(countdown=cls.DEBOUNCE_SECONDS)
+        except Exception as e:
+            # O job periódico acaba por aplicar os deltas pendentes
+            logger.warning(f"Não foi possível agendar a aplicação de deltas de rentabilidade: {e}")
+
+    @classmethod
+    def apply_pending(cls, batch_size: Optional[int] = None) -> int:
+        """
+        Aplica um lote de deltas pendentes. Os deltas são reclamados com
+        SELECT ... FOR UPDATE SKIP LOCKED, pelo que vários workers podem correr em paralelo.
+
+        Returns:
+            int: Número de deltas consumidos
+        """
+        batch_size = batch_size or cls.APPLY_BATCH_SIZE
+        with transaction.atomic():
+            pending = list(
+                ClientProfitabilityDelta.objects.select_for_update(skip_locked=True)
+                .order_by('id')
+                .values_list('id', 'client_id', 'year', 'month', 'minutes_delta', 'time_cost_delta', 'expenses_delta')
+                [:batch_size]
+            )
+            if not pending:
+                return 0
+
+            coalesced: Dict[AggregateKey, List] = {}
+            for _, client_id, year, month, minutes, cost, amount in pending:
+                totals = coalesced.setdefault((client_id, year, month), [0, ZERO, ZERO])
+                totals[0] += minutes
+                totals[1] += cost
+                totals[2] += amount
+
+            client_ids = {key[0] for key in coalesced}
+            fees = dict(Client.objects.filter(id__in=client_ids).values_list('id', 'monthly_fee'))
+            existing = {
+                (record.client_id, record.year, record.month): record
+                for record in ClientProfitability.objects.select_for_update().filter(
+                    client_id__in=client_ids,
+                    year__in={key[1] for key in coalesced},
+                    month__in={key[2] for key in coalesced},
+                )
+            }
+
+            to_update, to_create = [], []
+            now = timezone.now()
+            for key, (minutes, cost, amount) in coalesced.items():
+                client_id, year, month = key
+                if client_id not in fees:
+                    continue  # Cliente removido entretanto
+                record = existing.get(key)
+                if record is None:
+                    record = ClientProfitability(client_id=client_id, year=year, month=month)
+                    to_create.append(record)
+                else:
+                    to_update.append(record)
+                record.monthly_fee = fees[client_id] or ZERO
+                record.total_time_minutes = max(0, record.total_time_minutes + minutes)
+                record.time_cost = max(ZERO, record.time_cost + cost)
+                record.total_expenses = record.total_expenses + amount
+                # bulk_update não aplica o auto_now
+                record.last_updated = now
+                ProfitabilityEngine.finalize_record(record)
+
+            if to_update:
+                ClientProfitability.objects.bulk_update(
+                    to_update, ProfitabilityEngine.UPDATE_FIELDS, batch_size=ProfitabilityEngine.BULK_BATCH_SIZE
+                )
+            if to_create:
+                ClientProfitability.objects.bulk_create(to_create, batch_size=ProfitabilityEngine.BULK_BATCH_SIZE)
+
+            ClientProfitabilityDelta.objects.filter(id__in=[row[0] for row in pending]).delete()
+            DashboardCounterService.schedule_profitability_refresh(
+                {key[1:] for key in coalesced}, {key[0] for key in coalesced}
+            )
+
+        logger.info(f"Aplicados {len(pending)} deltas de rentabilidade a {len(coalesced)} registos cliente/mês")
+        return len(pending)
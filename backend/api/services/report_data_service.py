@@ -0,0 +1,274 @@
+# api/services/report_data_service.py
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+import logging
+
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q, Sum, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from ..models import (
+    Client, ClientProfitability, Organization, Task, TaskCategory, TimeEntry, User
+)
+from .saft_analytics_service import SAFTAnalyticsService
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ('pending', 'in_progress')
+
+
+class ReportDataService:
+    """
+    Recolha dos dados dos relatórios, partilhada pelos renderers PDF, CSV e XLSX do
+    ReportGenerationService.
+
+    Cada relatório usa um número fixo de queries, seja qual for o número de clientes:
+    as métricas por cliente saem de agregações agrupadas por client_id e os "top N"
+    por cliente de um ROW_NUMBER() particionado por cliente. Nos formatos tabulares
+    as listas de detalhe ficam como querysets, lidos em streaming pelos renderers;
+    o PDF recebe só as PDF_DETAIL_LIMIT linhas mais recentes.
+    """
+
+    TOP_PER_CLIENT = 5
+    PDF_DETAIL_LIMIT = 500
+
+    # --- Resumo de clientes ---
+
+    @classmethod
+    def client_summary(
+        cls, organization: Organization, client_ids: List[str] = None,
+        include_profitability: bool = True, include_tasks: bool = True,
+        include_time_entries: bool = True, date_from: datetime = None,
+        date_to: datetime = None
+    ) -> Dict:
+        clients_query = Client.objects.filter(organization=organization, is_active=True)
+        if client_ids:
+            clients_query = clients_query.filter(id__in=client_ids)
+        clients = list(clients_query.select_related('account_manager').order_by('name'))
+        ids = [client.id for client in clients]
+        logger.info(f"Client Summary Report: Found {len(clients)} clients for org {organization.name} with client_ids {client_ids}")
+
+        details = {
+            client.id: {
+                'client_obj': client, 'active_tasks_count': 0, 'completed_tasks_count': 0, 'total_time_minutes': 0,
+                'recent_profitability': None, 'top_tasks': [], 'recent_time_entries': [], 'saft_revenue': None,
+            }
+            for client in clients
+        }
+        if ids:
+            # Revenue from each client's latest SAF-T, read from the stored aggregates
+            saft_revenue = SAFTAnalyticsService.revenue_summary_by_tax_id(organization, [c.nif for c in clients])
+            for client in clients:
+                details[client.id]['saft_revenue'] = saft_revenue.get(client.nif)
+            if include_tasks:
+                cls._collect_client_tasks(details, ids, date_from, date_to)
+            if include_time_entries:
+                cls._collect_client_time(details, ids, date_from, date_to)
+            if include_profitability:
+                cls._collect_client_profitability(details, ids, date_from, date_to)
+
+        logger.info(f"Client Summary Report Data: {len(details)} clients processed for PDF/CSV/XLSX.")
+        return {
+            'organization': organization, 'clients_data': list(details.values()),
+            'generation_date': timezone.now(), 'date_from': date_from, 'date_to': date_to,
+            'total_clients': len(clients),
+            'total_monthly_fees': sum((client.monthly_fee or Decimal('0.00') for client in clients), Decimal('0.00')),
+        }
+
+    @classmethod
+    def _collect_client_tasks(cls, details: Dict, ids: List, date_from, date_to):
+        task_filter = Q(client_id__in=ids)
+        if date_from:
+            task_filter &= (Q(created_at__gte=date_from) | Q(completed_at__gte=date_from))
+        if date_to:
+            task_filter &= (Q(created_at__lte=date_to) | Q(completed_at__lte=date_to))
+        tasks = Task.objects.filter(task_filter)
+
+        for row in tasks.values('client_id').annotate(
+            active=Count('id', filter=Q(status__in=OPEN_STATUSES)),
+            completed=Count('id', filter=Q(status='completed')),
+        ).order_by():
+            details[row['client_id']]['active_tasks_count'] = row['active']
+            details[row['client_id']]['completed_tasks_count'] = row['completed']
+
+        for task in cls._top_per_client(
+            tasks.select_related('category'), [F('priority').desc(), F('created_at').desc()]
+        ):
+            details[task.client_id]['top_tasks'].append(task)
+
+    @classmethod
+    def _collect_client_time(cls, details: Dict, ids: List, date_from, date_to):
+        time_filter = Q(client_id__in=ids)
+        if date_from:
+            time_filter &= Q(date__gte=date_from.date())
+        if date_to:
+            time_filter &= Q(date__lte=date_to.date())
+        entries = TimeEntry.objects.filter(time_filter)
+
+        for client_id, total_minutes in entries.values('client_id').annotate(
+            total=Sum('minutes_spent')
+        ).order_by().values_list('client_id', 'total'):
+            details[client_id]['total_time_minutes'] = total_minutes or 0
+
+        for entry in cls._top_per_client(
+            entries.select_related('user', 'task', 'category'), [F('date').desc(), F('created_at').desc()]
+        ):
+            details[entry.client_id]['recent_time_entries'].append(entry)
+
+    @classmethod
+    def _collect_client_profitability(cls, details: Dict, ids: List, date_from, date_to):
+        records = ClientProfitability.objects.filter(client_id__in=ids)
+        if date_from and date_to:
+            records = records.filter(cls._month_range_filter(date_from, date_to))
+        for row in records.values('client_id').annotate(
+            avg_profit_margin=Avg('profit_margin'), total_profit=Sum('profit')
+        ).order_by():
+            if row['avg_profit_margin'] is not None or row['total_profit'] is not None:
+                details[row['client_id']]['recent_profitability'] = {
+                    'profit_margin': row['avg_profit_margin'], 'profit': row['total_profit'],
+                }
+
+    @classmethod
+    def _top_per_client(cls, queryset, order_by: List, limit: Optional[int] = None):
+        """As primeiras `limit` linhas de cada cliente segundo `order_by`, numa única query."""
+        limit = limit or cls.TOP_PER_CLIENT
+        return queryset.annotate(
+            position=Window(RowNumber(), partition_by=[F('client_id')], order_by=order_by)
+        ).filter(position__lte=limit).order_by('client_id', 'position')
+
+    @staticmethod
+    def _month_range_filter(date_from: datetime, date_to: datetime) -> Q:
+        """Registos mensais (year, month) entre o mês de date_from e o de date_to, inclusive."""
+        return (
+            (Q(year__gt=date_from.year) | Q(year=date_from.year, month__gte=date_from.month))
+            & (Q(year__lt=date_to.year) | Q(year=date_to.year, month__lte=date_to.month))
+        )
+
+    # --- Rentabilidade ---
+
+    @staticmethod
+    def profitability_analysis(
+        organization: Organization, client_ids: List[str] = None,
+        year: int = None, month: int = None, format_type: str = 'pdf'
+    ) -> Dict:
+        profit_query = ClientProfitability.objects.filter(client__organization=organization)
+        if client_ids: profit_query = profit_query.filter(client_id__in=client_ids)
+
+        current_period_label = "Geral (Todos os Períodos)"
+        if year and month:
+            profit_query = profit_query.filter(year=year, month=month)
+            try:
+                current_period_label = f"{datetime(year,month,1).strftime('%B %Y')}"
+            except ValueError:
+                current_period_label = f"{month}/{year}"
+        elif year:
+            profit_query = profit_query.filter(year=year)
+            current_period_label = f"Ano {year}"
+
+        records = profit_query.select_related('client').order_by('-profit_margin')
+
+        stats = records.aggregate(
+            total_records=Count('id'),
+            total_profit=Sum('profit'), avg_margin=Avg('profit_margin'),
+            profitable_count=Count('id', filter=Q(is_profitable=True)),
+            unprofitable_count=Count('id', filter=Q(is_profitable=False))
+        )
+
+        # CSV/XLSX percorrem o queryset em streaming; o PDF precisa da lista
+        return {
+            'organization': organization,
+            'profitability_records': list(records) if format_type == 'pdf' else records,
+            'top_profitable': list(records.filter(profit__isnull=False).order_by('-profit')[:10]) if format_type == 'xlsx' else [],
+            'stats': stats, 'generation_date': timezone.now(),
+            'total_records': stats['total_records'], 'month_name': current_period_label
+        }
+
+    # --- Registo de tempos ---
+
+    @classmethod
+    def time_tracking_summary(
+        cls, organization: Organization, user_ids: List[str] = None, client_ids: List[str] = None,
+        date_from: datetime = None, date_to: datetime = None, format_type: str = 'pdf'
+    ) -> Dict:
+        time_query = TimeEntry.objects.filter(client__organization=organization)
+        if user_ids: time_query = time_query.filter(user_id__in=user_ids)
+        if client_ids: time_query = time_query.filter(client_id__in=client_ids)
+
+        actual_date_from = date_from or (timezone.now() - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
+        actual_date_to = date_to or timezone.now().replace(hour=23, minute=59, second=59, microsecond=999999)
+        time_query = time_query.filter(date__gte=actual_date_from.date(), date__lte=actual_date_to.date())
+
+        time_entries = time_query.select_related('user', 'client', 'task', 'category').order_by('-date', 'user__username')
+        # O PDF lista só os registos mais recentes; CSV/XLSX exportam todos em streaming
+        time_entries = list(time_entries[:cls.PDF_DETAIL_LIMIT]) if format_type == 'pdf' else time_entries
+
+        total_stats = time_query.aggregate(total_minutes=Sum('minutes_spent'), total_entries=Count('id'), unique_users=Count('user', distinct=True), unique_clients=Count('client', distinct=True))
+        user_stats = list(time_query.values('user__username').annotate(total_minutes=Sum('minutes_spent'), entry_count=Count('id'), client_count=Count('client', distinct=True)).order_by('-total_minutes'))
+        client_stats = list(time_query.values('client__name').annotate(total_minutes=Sum('minutes_spent'), entry_count=Count('id'), user_count=Count('user', distinct=True)).order_by('-total_minutes'))
+        category_stats = list(time_query.filter(category__isnull=False).values('category__name').annotate(total_minutes=Sum('minutes_spent'), entry_count=Count('id')).order_by('-total_minutes'))
+
+        return {
+            'organization': organization, 'time_entries': time_entries, 'total_stats': total_stats,
+            'user_stats': user_stats, 'client_stats': client_stats, 'category_stats': category_stats,
+            'date_from': actual_date_from, 'date_to': actual_date_to,
+            'generation_date': timezone.now()
+        }
+
+    # --- Performance de tarefas ---
+
+    @classmethod
+    def task_performance(
+        cls, organization: Organization, date_from: datetime = None, date_to: datetime = None,
+        client_ids: List[str] = None, user_ids: List[str] = None,
+        category_ids: List[str] = None, statuses: List[str] = None,
+        format_type: str = 'pdf'
+    ) -> Dict:
+        task_query = Task.objects.filter(client__organization=organization)
+
+        actual_date_from = date_from or (timezone.now() - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
+        actual_date_to = date_to or timezone.now().replace(hour=23, minute=59, second=59, microsecond=999999)
+
+        task_query = task_query.filter(created_at__gte=actual_date_from, created_at__lte=actual_date_to)
+
+        if client_ids: task_query = task_query.filter(client_id__in=client_ids)
+        if user_ids: task_query = task_query.filter(Q(assigned_to_id__in=user_ids) | Q(collaborators__id__in=user_ids)).distinct()
+        if category_ids: task_query = task_query.filter(category_id__in=category_ids)
+        if statuses: task_query = task_query.filter(status__in=statuses)
+
+        tasks = task_query.select_related('client', 'category', 'assigned_to', 'created_by', 'workflow').order_by('-created_at')
+        # O PDF lista só as tarefas mais recentes; CSV/XLSX exportam todas em streaming
+        tasks = list(tasks[:cls.PDF_DETAIL_LIMIT]) if format_type == 'pdf' else tasks
+
+        total_tasks = task_query.count()
+        status_distribution = list(task_query.values('status').annotate(count=Count('id')).order_by('-count'))
+        category_distribution = list(task_query.filter(category__isnull=False).values('category__name').annotate(count=Count('id')).order_by('-count'))
+        assignee_distribution = list(task_query.filter(assigned_to__isnull=False).values('assigned_to__username').annotate(count=Count('id')).order_by('-count'))
+
+        completed_tasks_in_filtered_set = task_query.filter(status='completed', completed_at__isnull=False, created_at__isnull=False)
+
+        avg_completion_time_data = completed_tasks_in_filtered_set.annotate(
+            duration=ExpressionWrapper(F('completed_at') - F('created_at'), output_field=DurationField())
+        ).aggregate(avg_duration=Avg('duration'))
+
+        avg_completion_seconds = avg_completion_time_data['avg_duration'].total_seconds() if avg_completion_time_data['avg_duration'] else None
+
+        overdue_tasks_count = task_query.filter(deadline__lt=timezone.now().date(), status__in=OPEN_STATUSES).count()
+
+        return {
+            'organization': organization, 'tasks': tasks, 'generation_date': timezone.now(),
+            'date_from': actual_date_from, 'date_to': actual_date_to,
+            'filters_applied': {
+                'clients': list(Client.objects.filter(id__in=client_ids).values_list('name', flat=True)) if client_ids else "Todos",
+                'users': list(User.objects.filter(id__in=user_ids).values_list('username', flat=True)) if user_ids else "Todos",
+                'categories': list(TaskCategory.objects.filter(id__in=category_ids).values_list('name', flat=True)) if category_ids else "Todas",
+                'statuses': statuses or "Todos"
+            },
+            'summary_stats': {
+                'total_tasks': total_tasks, 'status_distribution': status_distribution,
+                'overdue_tasks_count': overdue_tasks_count,
+                'avg_completion_days': (avg_completion_seconds / (24*3600)) if avg_completion_seconds is not None else None,
+            },
+            'category_distribution': category_distribution,
+            'assignee_distribution': assignee_distribution,
+        }
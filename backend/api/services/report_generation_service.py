@@ -1,13 +1,10 @@
 # api/services/report_generation_service.py
 import io
-import csv
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from decimal import Decimal
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, BinaryIO, Iterator
 
-from django.db.models import Sum, Count, Avg, Q, F, ExpressionWrapper, DurationField
-from django.db.models.functions import TruncMonth, TruncDay
 from django.utils import timezone
 from django.conf import settings
 
@@ -23,16 +20,15 @@ from reportlab.graphics.charts.lineplots import LinePlot
 from reportlab.graphics.charts.axes import XCategoryAxis, YValueAxis
 from reportlab.graphics.charts.legends import Legend
 
-import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.chart import BarChart as OpenpyxlBarChart, PieChart as OpenpyxlPieChart, LineChart as OpenpyxlLineChart, Reference
 from openpyxl.chart.axis import DateAxis
-from openpyxl.utils import get_column_letter
 
 
-from ..models import (
-    Client, Task, TimeEntry, ClientProfitability,
-    Organization, Profile, GeneratedReport, TaskCategory, User
+from ..models import Organization, Task
+from .report_data_service import ReportDataService
+from .streaming_export_service import (
+    CSV_CONTENT_TYPE, XLSX_CONTENT_TYPE, StreamingWorkbook, iterate_rows, write_csv
 )
 
 logger = logging.getLogger(__name__)
@@ -193,68 +189,12 @@ class ReportGenerationService:
         include_profitability: bool = True, include_tasks: bool = True,
         include_time_entries: bool = True, date_from: datetime = None,
         date_to: datetime = None, format_type: str = 'pdf'
-    ) -> Tuple[io.BytesIO, str]:
-        clients_query = Client.objects.filter(organization=organization, is_active=True)
-        if client_ids:
-            clients_query = clients_query.filter(id__in=client_ids)
-        clients = clients_query.select_related('account_manager').order_by('name')
-        
-        logger.info(f"Client Summary Report: Found {clients.count()} clients for org {organization.name} with client_ids {client_ids}")
-
-        report_data = {'organization': organization, 'clients_data': [], 'generation_date': timezone.now(), 'date_from': date_from, 'date_to': date_to}
-        report_data['total_clients'] = clients.count()
-        report_data['total_monthly_fees'] = clients.aggregate(total=Sum('monthly_fee'))['total'] or Decimal('0.00')
-
-        for client_obj in clients:
-            client_detail = {'client_obj': client_obj, 'active_tasks_count': 0, 'completed_tasks_count': 0, 'total_time_minutes': 0, 'recent_profitability': None, 'top_tasks': [], 'recent_time_entries': []}
-            
-            task_filter = Q(client=client_obj)
-            time_filter = Q(client=client_obj)
-            if date_from:
-                task_filter &= (Q(created_at__gte=date_from) | Q(completed_at__gte=date_from))
-                time_filter &= Q(date__gte=date_from.date())
-            if date_to:
-                task_filter &= (Q(created_at__lte=date_to) | Q(completed_at__lte=date_to))
-                time_filter &= Q(date__lte=date_to.date())
-
-            if include_tasks:
-                client_detail['active_tasks_count'] = Task.objects.filter(task_filter & Q(status__in=['pending', 'in_progress'])).count()
-                client_detail['completed_tasks_count'] = Task.objects.filter(task_filter & Q(status='completed')).count()
-                client_detail['top_tasks'] = Task.objects.filter(task_filter).select_related('category').order_by('-priority', '-created_at')[:5]
-            
-            if include_time_entries:
-                time_stats = TimeEntry.objects.filter(time_filter).aggregate(total_minutes=Sum('minutes_spent'))
-                client_detail['total_time_minutes'] = time_stats['total_minutes'] or 0
-                client_detail['recent_time_entries'] = TimeEntry.objects.filter(time_filter).select_related('user', 'task', 'category').order_by('-date')[:5]
-            
-            if include_profitability:
-                profit_filter = Q(client=client_obj)
-                if date_from and date_to:
-                    current_date_for_period = date_from
-                    year_month_pairs = set()
-                    while current_date_for_period <= date_to:
-                        year_month_pairs.add((current_date_for_period.year, current_date_for_period.month))
-                        if current_date_for_period.month == 12:
-                            current_date_for_period = current_date_for_period.replace(year=current_date_for_period.year + 1, month=1)
-                        else:
-                            current_date_for_period = current_date_for_period.replace(month=current_date_for_period.month + 1)
-                    
-                    q_objects_profit = Q()
-                    for ym_pair in year_month_pairs:
-                        q_objects_profit |= Q(year=ym_pair[0], month=ym_pair[1])
-                    profit_filter &= q_objects_profit
-                
-                recent_profit_agg = ClientProfitability.objects.filter(profit_filter).aggregate(
-                    avg_profit_margin=Avg('profit_margin'),
-                    total_profit=Sum('profit')
-                )
-                client_detail['recent_profitability'] = {
-                    'profit_margin': recent_profit_agg['avg_profit_margin'],
-                    'profit': recent_profit_agg['total_profit']
-                } if recent_profit_agg['avg_profit_margin'] is not None or recent_profit_agg['total_profit'] is not None else None
-            report_data['clients_data'].append(client_detail)
-        
-        logger.info(f"Client Summary Report Data: {len(report_data['clients_data'])} clients processed for PDF/CSV/XLSX.")
+    ) -> Tuple[BinaryIO, str]:
+        report_data = ReportDataService.client_summary(
+            organization, client_ids=client_ids, include_profitability=include_profitability,
+            include_tasks=include_tasks, include_time_entries=include_time_entries,
+            date_from=date_from, date_to=date_to
+        )
 
         if format_type == 'pdf':
             return ReportGenerationService._generate_client_summary_pdf(report_data)
@@ -304,6 +244,12 @@ class ReportGenerationService:
                     [Paragraph("Gestor de Conta:", styles['TableCellText']), Paragraph(client_obj.account_manager.username if client_obj.account_manager else 'N/A', styles['TableCellText'])],
                     [Paragraph("Avença Mensal:", styles['TableCellText']), Paragraph(f"€{client_obj.monthly_fee or Decimal('0.00'):.2f}", styles['TableCellNumber'])],
                 ]
+                saft_info = client_data.get('saft_revenue')
+                if saft_info:
+                    client_info_data.append([
+                        Paragraph(f"Faturação SAF-T ({saft_info['fiscal_year'] or 'N/A'}):", styles['TableCellText']),
+                        Paragraph(f"€{saft_info['net_revenue']:.2f} ({saft_info['cancelled_count']} doc. anulados)", styles['TableCellNumber'])
+                    ])
                 client_info_table = Table(client_info_data, colWidths=[1.5*inch, 4*inch])
                 client_info_table.setStyle(TableStyle([('GRID', (0,0), (-1,-1), 0.5, C['border_color']), ('BACKGROUND', (0,0), (0,-1), C['bg_light'])]))
                 story.append(client_info_table)
@@ -356,126 +302,92 @@ class ReportGenerationService:
         return buffer, 'application/pdf'
 
     @staticmethod
-    def _generate_client_summary_csv(data: Dict) -> Tuple[io.BytesIO, str]:
-        buffer = io.StringIO()
-        writer = csv.writer(buffer)
-        
-        writer.writerow(['Relatório de Resumo de Clientes'])
-        writer.writerow([f"Organização: {data['organization'].name}"])
-        writer.writerow([f"Gerado em: {data['generation_date'].strftime('%d/%m/%Y %H:%M')}"])
-        if data.get('date_from') and data.get('date_to'): writer.writerow([f"Período: {data['date_from'].strftime('%d/%m/%Y')} a {data['date_to'].strftime('%d/%m/%Y')}"])
-        writer.writerow([])
+    def _generate_client_summary_csv(data: Dict) -> Tuple[BinaryIO, str]:
+        return write_csv(ReportGenerationService._client_summary_csv_rows(data)), CSV_CONTENT_TYPE
+
+    @staticmethod
+    def _client_summary_csv_rows(data: Dict) -> Iterator[List]:
+        yield ['Relatório de Resumo de Clientes']
+        yield [f"Organização: {data['organization'].name}"]
+        yield [f"Gerado em: {data['generation_date'].strftime('%d/%m/%Y %H:%M')}"]
+        if data.get('date_from') and data.get('date_to'): yield [f"Período: {data['date_from'].strftime('%d/%m/%Y')} a {data['date_to'].strftime('%d/%m/%Y')}"]
+        yield []
         
         if not data['clients_data']:
-            writer.writerow(["Nenhum cliente encontrado para os critérios selecionados."])
-        else:
-            writer.writerow(['Nome Cliente', 'NIF', 'Email', 'Telefone', 'Morada', 'Gestor de Conta', 'Avença Mensal (€)', 'Tarefas Ativas (Período)', 'Tarefas Concluídas (Período)', 'Tempo Total (min)', 'Lucro Agregado (Período)', 'Margem Média (%)'])
-            for client_detail in data['clients_data']:
-                client_obj = client_detail['client_obj']
-                profit = client_detail.get('recent_profitability')
-                writer.writerow([
-                    client_obj.name, client_obj.nif or '', client_obj.email or '', client_obj.phone or '', client_obj.address or '',
-                    client_obj.account_manager.username if client_obj.account_manager else '',
-                    float(client_obj.monthly_fee or 0), client_detail['active_tasks_count'], client_detail['completed_tasks_count'],
-                    client_detail['total_time_minutes'] or 0,
-                    float(profit['profit']) if profit and profit.get('profit') is not None else 'N/A',
-                    float(profit['profit_margin']) if profit and profit.get('profit_margin') is not None else 'N/A',
-                ])
-        
-        csv_content = buffer.getvalue()
-        buffer.close()
-        return io.BytesIO(csv_content.encode('utf-8-sig')), 'text/csv'
+            yield ["Nenhum cliente encontrado para os critérios selecionados."]
+            return
+        yield ['Nome Cliente', 'NIF', 'Email', 'Telefone', 'Morada', 'Gestor de Conta', 'Avença Mensal (€)', 'Tarefas Ativas (Período)', 'Tarefas Concluídas (Período)', 'Tempo Total (min)', 'Lucro Agregado (Período)', 'Margem Média (%)', 'Faturação SAF-T (€)', 'Docs Anulados SAF-T']
+        for client_detail in iterate_rows(data['clients_data']):
+            client_obj = client_detail['client_obj']
+            profit = client_detail.get('recent_profitability')
+            saft_info = client_detail.get('saft_revenue')
+            yield [
+                client_obj.name, client_obj.nif or '', client_obj.email or '', client_obj.phone or '', client_obj.address or '',
+                client_obj.account_manager.username if client_obj.account_manager else '',
+                float(client_obj.monthly_fee or 0), client_detail['active_tasks_count'], client_detail['completed_tasks_count'],
+                client_detail['total_time_minutes'] or 0,
+                float(profit['profit']) if profit and profit.get('profit') is not None else 'N/A',
+                float(profit['profit_margin']) if profit and profit.get('profit_margin') is not None else 'N/A',
+                float(saft_info['net_revenue']) if saft_info else 'N/A',
+                saft_info['cancelled_count'] if saft_info else 'N/A',
+            ]
 
     @staticmethod
-    def _generate_client_summary_xlsx(data: Dict) -> Tuple[io.BytesIO, str]:
-        buffer = io.BytesIO()
-        wb = openpyxl.Workbook()
-        
-        ws_summary = wb.active
-        ws_summary.title = "Sumário Geral"
-        ws_summary['A1'] = f"Relatório de Resumo de Clientes - {data['organization'].name}"
-        ws_summary.merge_cells('A1:F1'); ReportGenerationService._apply_xlsx_header_style(ws_summary['A1'], font_bold=True, fill_color="1E40AF")
-        ws_summary['A2'] = f"Gerado em: {data['generation_date'].strftime('%d/%m/%Y %H:%M')}"
-        if data.get('date_from') and data.get('date_to'): ws_summary['A3'] = f"Período: {data['date_from'].strftime('%d/%m/%Y')} a {data['date_to'].strftime('%d/%m/%Y')}"
-        
-        ws_summary['A5'] = "Total de Clientes Analisados:"; ReportGenerationService._apply_xlsx_cell_style(ws_summary['A5'], font_bold=True)
-        ws_summary['B5'] = data['total_clients']; ReportGenerationService._apply_xlsx_cell_style(ws_summary['B5'])
-        ws_summary['A6'] = "Avenças Totais (€):"; ReportGenerationService._apply_xlsx_cell_style(ws_summary['A6'], font_bold=True)
-        ws_summary['B6'] = ReportGenerationService._format_currency_excel(data['total_monthly_fees']); ReportGenerationService._apply_xlsx_cell_style(ws_summary['B6'], number_format='#,##0.00€')
+    def _generate_client_summary_xlsx(data: Dict) -> Tuple[BinaryIO, str]:
+        workbook = StreamingWorkbook()
+        header_style, cell_style = ReportGenerationService._apply_xlsx_header_style, ReportGenerationService._apply_xlsx_cell_style
+        
+        ws_summary = workbook.sheet("Sumário Geral", padding=3)
+        ws_summary.append([f"Relatório de Resumo de Clientes - {data['organization'].name}"], ws_summary.style(header_style, fill_color="1E40AF"))
+        ws_summary.append([f"Gerado em: {data['generation_date'].strftime('%d/%m/%Y %H:%M')}"])
+        ws_summary.append([f"Período: {data['date_from'].strftime('%d/%m/%Y')} a {data['date_to'].strftime('%d/%m/%Y')}"] if data.get('date_from') and data.get('date_to') else [])
+        ws_summary.append([])
+        label = ws_summary.style(cell_style, font_bold=True)
+        ws_summary.append(["Total de Clientes Analisados:", data['total_clients']], [label, ws_summary.style(cell_style)])
+        ws_summary.append(
+            ["Avenças Totais (€):", ReportGenerationService._format_currency_excel(data['total_monthly_fees'])],
+            [label, ws_summary.style(cell_style, number_format='#,##0.00€')]
+        )
 
         if not data['clients_data']:
-            ws_summary['A8'] = "Nenhum cliente encontrado para os critérios selecionados."
+            ws_summary.append([])
+            ws_summary.append(["Nenhum cliente encontrado para os critérios selecionados."])
         else:
-            ws_details = wb.create_sheet("Detalhes Clientes")
-            headers = ['Cliente', 'NIF', 'Email', 'Telefone', 'Morada', 'Gestor', 'Avença (€)', 'Tarefas Ativas', 'Tarefas Concluídas', 'Tempo (min)', 'Lucro (€)', 'Margem (%)']
-            for col_idx, header_text in enumerate(headers, 1):
-                ReportGenerationService._apply_xlsx_header_style(ws_details.cell(row=1, column=col_idx, value=header_text))
-
-            for row_idx, client_detail in enumerate(data['clients_data'], 2):
+            ws_details = workbook.sheet("Detalhes Clientes", padding=3)
+            headers = ['Cliente', 'NIF', 'Email', 'Telefone', 'Morada', 'Gestor', 'Avença (€)', 'Tarefas Ativas', 'Tarefas Concluídas', 'Tempo (min)', 'Lucro (€)', 'Margem (%)', 'Faturação SAF-T (€)', 'Docs Anulados SAF-T']
+            ws_details.append(headers, ws_details.style(header_style))
+
+            text = ws_details.style(cell_style)
+            currency = ws_details.style(cell_style, number_format='#,##0.00€')
+            percentage = ws_details.style(cell_style, number_format='0.00%')
+            styles = [text] * 6 + [currency, text, text, text, currency, percentage, currency, text]
+            for client_detail in iterate_rows(data['clients_data']):
                 client_obj = client_detail['client_obj']
                 profit = client_detail.get('recent_profitability')
-                
-                row_values = [
+                saft_info = client_detail.get('saft_revenue')
+                ws_details.append([
                     client_obj.name, client_obj.nif, client_obj.email, client_obj.phone, client_obj.address,
                     client_obj.account_manager.username if client_obj.account_manager else '',
                     ReportGenerationService._format_currency_excel(client_obj.monthly_fee),
                     client_detail['active_tasks_count'], client_detail['completed_tasks_count'],
                     client_detail['total_time_minutes'] or 0,
                     ReportGenerationService._format_currency_excel(profit['profit'] if profit and profit.get('profit') is not None else None),
-                    ReportGenerationService._format_percentage_excel(profit['profit_margin'] if profit and profit.get('profit_margin') is not None else None)
-                ]
-                for col_idx, cell_value in enumerate(row_values, 1):
-                    cell = ws_details.cell(row=row_idx, column=col_idx, value=cell_value)
-                    if col_idx == 7 or col_idx == 11: cell.number_format = '#,##0.00€'
-                    elif col_idx == 12: cell.number_format = '0.00%'
-                    ReportGenerationService._apply_xlsx_cell_style(cell)
-            
-            for sheet_name_key in [ws_summary.title, ws_details.title]:
-                current_sheet = wb[sheet_name_key]
-                for i, column_cells in enumerate(current_sheet.columns):
-                    length = 0
-                    if column_cells:
-                        str_values = [str(cell.value) if cell.value is not None else "" for cell in column_cells]
-                        if str_values: length = max(len(val) for val in str_values)
-                    current_sheet.column_dimensions[get_column_letter(i + 1)].width = length + 3
-
-        wb.save(buffer)
-        buffer.seek(0)
-        return buffer, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                    ReportGenerationService._format_percentage_excel(profit['profit_margin'] if profit and profit.get('profit_margin') is not None else None),
+                    ReportGenerationService._format_currency_excel(saft_info['net_revenue'] if saft_info else None),
+                    saft_info['cancelled_count'] if saft_info else None,
+                ], styles)
+
+        return workbook.save(), XLSX_CONTENT_TYPE
         
     # --- Report: Profitability Analysis ---
     @staticmethod
     def generate_profitability_analysis_report(
         organization: Organization, client_ids: List[str] = None,
         year: int = None, month: int = None, format_type: str = 'pdf'
-    ) -> Tuple[io.BytesIO, str]:
-        profit_query = ClientProfitability.objects.filter(client__organization=organization)
-        if client_ids: profit_query = profit_query.filter(client_id__in=client_ids)
-        
-        current_period_label = "Geral (Todos os Períodos)"
-        if year and month:
-            profit_query = profit_query.filter(year=year, month=month)
-            try:
-                current_period_label = f"{datetime(year,month,1).strftime('%B %Y')}"
-            except ValueError: 
-                current_period_label = f"{month}/{year}"
-        elif year:
-            profit_query = profit_query.filter(year=year)
-            current_period_label = f"Ano {year}"
-
-        records = profit_query.select_related('client').order_by('-profit_margin')
-        
-        stats = records.aggregate(
-            total_profit=Sum('profit'), avg_margin=Avg('profit_margin'),
-            profitable_count=Count('id', filter=Q(is_profitable=True)),
-            unprofitable_count=Count('id', filter=Q(is_profitable=False))
+    ) -> Tuple[BinaryIO, str]:
+        report_data = ReportDataService.profitability_analysis(
+            organization, client_ids=client_ids, year=year, month=month, format_type=format_type
         )
-        
-        report_data = {
-            'organization': organization, 'profitability_records': list(records), 
-            'stats': stats, 'generation_date': timezone.now(), 
-            'total_records': records.count(), 'month_name': current_period_label
-        }
 
         if format_type == 'pdf':
             return ReportGenerationService._generate_profitability_pdf(report_data)
@@ -538,52 +450,49 @@ class ReportGenerationService:
         return buffer, 'application/pdf'
 
     @staticmethod
-    def _generate_profitability_csv(data: Dict) -> Tuple[io.BytesIO, str]:
-        buffer = io.StringIO()
-        writer = csv.writer(buffer)
-        writer.writerow(['Análise de Rentabilidade'])
-        writer.writerow([f"Organização: {data['organization'].name}"])
-        writer.writerow([f"Período: {data['month_name']}"])
-        writer.writerow([f"Gerado em: {data['generation_date'].strftime('%d/%m/%Y %H:%M')}"])
-        writer.writerow([])
+    def _generate_profitability_csv(data: Dict) -> Tuple[BinaryIO, str]:
+        return write_csv(ReportGenerationService._profitability_csv_rows(data)), CSV_CONTENT_TYPE
+
+    @staticmethod
+    def _profitability_csv_rows(data: Dict) -> Iterator[List]:
+        yield ['Análise de Rentabilidade']
+        yield [f"Organização: {data['organization'].name}"]
+        yield [f"Período: {data['month_name']}"]
+        yield [f"Gerado em: {data['generation_date'].strftime('%d/%m/%Y %H:%M')}"]
+        yield []
         
         stats = data['stats']
-        writer.writerow(['Estatísticas Resumo'])
-        writer.writerow(['Total de Registos:', data['total_records']])
-        writer.writerow(['Clientes Rentáveis:', stats.get('profitable_count',0) or 0])
-        writer.writerow(['Clientes Não Rentáveis:', stats.get('unprofitable_count',0) or 0])
-        writer.writerow(['Lucro Total (€):', float(stats.get('total_profit',0)) if stats.get('total_profit') is not None else 0])
-        writer.writerow(['Margem Média (%):', float(stats.get('avg_margin',0)) if stats.get('avg_margin') is not None else 0])
-        writer.writerow([])
-        
-        if not data['profitability_records']:
-            writer.writerow(["Nenhum dado de rentabilidade encontrado."])
-        else:
-            writer.writerow(['Cliente', 'Ano', 'Mês', 'Avença (€)', 'Custo Tempo (€)', 'Despesas (€)', 'Lucro (€)', 'Margem (%)', 'Rentável'])
-            for record in data['profitability_records']:
-                writer.writerow([
-                    record.client.name, record.year, record.month,
-                    float(record.monthly_fee), float(record.time_cost), float(record.total_expenses),
-                    float(record.profit) if record.profit is not None else 'N/A',
-                    float(record.profit_margin) if record.profit_margin is not None else 'N/A',
-                    'Sim' if record.is_profitable else ('Não' if record.is_profitable == False else 'N/D')
-                ])
-        csv_content = buffer.getvalue()
-        buffer.close()
-        return io.BytesIO(csv_content.encode('utf-8-sig')), 'text/csv'
+        yield ['Estatísticas Resumo']
+        yield ['Total de Registos:', data['total_records']]
+        yield ['Clientes Rentáveis:', stats.get('profitable_count',0) or 0]
+        yield ['Clientes Não Rentáveis:', stats.get('unprofitable_count',0) or 0]
+        yield ['Lucro Total (€):', float(stats.get('total_profit',0)) if stats.get('total_profit') is not None else 0]
+        yield ['Margem Média (%):', float(stats.get('avg_margin',0)) if stats.get('avg_margin') is not None else 0]
+        yield []
+        
+        if not data['total_records']:
+            yield ["Nenhum dado de rentabilidade encontrado."]
+            return
+        yield ['Cliente', 'Ano', 'Mês', 'Avença (€)', 'Custo Tempo (€)', 'Despesas (€)', 'Lucro (€)', 'Margem (%)', 'Rentável']
+        for record in iterate_rows(data['profitability_records']):
+            yield [
+                record.client.name, record.year, record.month,
+                float(record.monthly_fee), float(record.time_cost), float(record.total_expenses),
+                float(record.profit) if record.profit is not None else 'N/A',
+                float(record.profit_margin) if record.profit_margin is not None else 'N/A',
+                'Sim' if record.is_profitable else ('Não' if record.is_profitable == False else 'N/D')
+            ]
 
     @staticmethod
-    def _generate_profitability_xlsx(data: Dict) -> Tuple[io.BytesIO, str]:
-        buffer = io.BytesIO()
-        wb = openpyxl.Workbook()
+    def _generate_profitability_xlsx(data: Dict) -> Tuple[BinaryIO, str]:
+        workbook = StreamingWorkbook()
+        header_style, cell_style = ReportGenerationService._apply_xlsx_header_style, ReportGenerationService._apply_xlsx_cell_style
         
         # Summary Sheet
-        ws_summary = wb.active
-        ws_summary.title = "Sumário Rentabilidade"
-        ws_summary['A1'] = f"Análise de Rentabilidade - {data['month_name']} ({data['organization'].name})"
-        ws_summary.merge_cells('A1:E1'); ReportGenerationService._apply_xlsx_header_style(ws_summary['A1'], font_bold=True, fill_color="1E40AF")
+        ws_summary = workbook.sheet("Sumário Rentabilidade", min_width=12)
+        ws_summary.append([f"Análise de Rentabilidade - {data['month_name']} ({data['organization'].name})"], ws_summary.style(header_style, fill_color="1E40AF"))
+        ws_summary.append([])
         
-        row_idx = 3
         stats = data['stats']
         summary_items = [
             ("Total de Registos:", data['total_records']),
@@ -592,23 +501,27 @@ class ReportGenerationService:
             ("Lucro Total (€):", ReportGenerationService._format_currency_excel(stats.get('total_profit'))),
             ("Margem Média (%):", ReportGenerationService._format_percentage_excel(stats.get('avg_margin'))),
         ]
-        for label, value in summary_items:
-            ReportGenerationService._apply_xlsx_cell_style(ws_summary.cell(row=row_idx, column=1, value=label), font_bold=True)
-            cell = ws_summary.cell(row=row_idx, column=2, value=value)
-            if "€" in label: cell.number_format = '#,##0.00€'
-            elif "%" in label: cell.number_format = '0.00%'
-            ReportGenerationService._apply_xlsx_cell_style(cell)
-            row_idx +=1
+        label = ws_summary.style(cell_style, font_bold=True)
+        value_styles = {
+            '€': ws_summary.style(cell_style, number_format='#,##0.00€'),
+            '%': ws_summary.style(cell_style, number_format='0.00%'),
+            '': ws_summary.style(cell_style),
+        }
+        for label_text, value in summary_items:
+            unit = '€' if "€" in label_text else ('%' if "%" in label_text else '')
+            ws_summary.append([label_text, value], [label, value_styles[unit]])
 
         # Detailed Data Sheet
-        if data['profitability_records']:
-            ws_details = wb.create_sheet("Detalhes Rentabilidade")
+        if data['total_records']:
+            ws_details = workbook.sheet("Detalhes Rentabilidade", min_width=12)
             headers = ['Cliente', 'Ano', 'Mês', 'Avença (€)', 'Custo Tempo (€)', 'Despesas (€)', 'Lucro (€)', 'Margem (%)', 'Rentável']
-            for col_idx, header_text in enumerate(headers, 1):
-                ReportGenerationService._apply_xlsx_header_style(ws_details.cell(row=1, column=col_idx, value=header_text))
+            ws_details.append(headers, ws_details.style(header_style))
 
-            for row_idx_det, record in enumerate(data['profitability_records'], 2):
-                row_values = [
+            text = ws_details.style(cell_style)
+            currency = ws_details.style(cell_style, number_format='#,##0.00€')
+            styles = [text, text, text, currency, currency, currency, currency, ws_details.style(cell_style, number_format='0.00%'), text]
+            for record in iterate_rows(data['profitability_records']):
+                ws_details.append([
                     record.client.name, record.year, record.month,
                     ReportGenerationService._format_currency_excel(record.monthly_fee),
                     ReportGenerationService._format_currency_excel(record.time_cost),
@@ -616,74 +529,38 @@ class ReportGenerationService:
                     ReportGenerationService._format_currency_excel(record.profit),
                     ReportGenerationService._format_percentage_excel(record.profit_margin),
                     'Sim' if record.is_profitable else ('Não' if record.is_profitable == False else 'N/D')
-                ]
-                for col_idx, cell_value in enumerate(row_values, 1):
-                    cell = ws_details.cell(row=row_idx_det, column=col_idx, value=cell_value)
-                    if col_idx in [4,5,6,7]: cell.number_format = '#,##0.00€'
-                    elif col_idx == 8: cell.number_format = '0.00%'
-                    ReportGenerationService._apply_xlsx_cell_style(cell)
+                ], styles)
             
-            # Bar Chart for Top 5 Profitable Clients
-            if len(data['profitability_records']) > 0:
-                chart_sheet = wb.create_sheet("Top Rentáveis")
-                top_profitable = sorted([r for r in data['profitability_records'] if r.profit is not None], key=lambda x: x.profit, reverse=True)[:10]
-                chart_sheet.cell(row=1, column=1, value="Cliente")
-                chart_sheet.cell(row=1, column=2, value="Lucro (€)")
-                for i, rec in enumerate(top_profitable, 2):
-                    chart_sheet.cell(row=i, column=1, value=rec.client.name)
-                    chart_sheet.cell(row=i, column=2, value=ReportGenerationService._format_currency_excel(rec.profit))
-
-                bar_chart = OpenpyxlBarChart()
-                bar_chart.title = "Top 10 Clientes Mais Rentáveis"
-                bar_chart.style = 10
-                labels_ref = Reference(chart_sheet, min_col=1, min_row=2, max_row=len(top_profitable)+1)
-                data_ref = Reference(chart_sheet, min_col=2, min_row=1, max_row=len(top_profitable)+1)
-                bar_chart.add_data(data_ref, titles_from_data=True)
-                bar_chart.set_categories(labels_ref)
-                bar_chart.y_axis.title = "Lucro (€)"
-                bar_chart.x_axis.title = "Cliente"
-                chart_sheet.add_chart(bar_chart, "D2")
-        
-        for sheet_name_key in wb.sheetnames:
-            current_sheet = wb[sheet_name_key]
-            for i, column_cells in enumerate(current_sheet.columns):
-                length = 0
-                if column_cells:
-                    str_values = [str(cell.value) if cell.value is not None else "" for cell in column_cells]
-                    if str_values: length = max(len(val) for val in str_values)
-                current_sheet.column_dimensions[get_column_letter(i + 1)].width = max(length + 2, 12) # Min width 12
-
-        wb.save(buffer)
-        buffer.seek(0)
-        return buffer, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            # Bar Chart for Top 10 Profitable Clients
+            top_profitable = data['top_profitable']
+            chart_sheet = workbook.sheet("Top Rentáveis", min_width=12)
+            chart_sheet.append(["Cliente", "Lucro (€)"])
+            for rec in top_profitable:
+                chart_sheet.append([rec.client.name, ReportGenerationService._format_currency_excel(rec.profit)])
+
+            bar_chart = OpenpyxlBarChart()
+            bar_chart.title = "Top 10 Clientes Mais Rentáveis"
+            bar_chart.style = 10
+            labels_ref = Reference(chart_sheet.worksheet, min_col=1, min_row=2, max_row=len(top_profitable)+1)
+            data_ref = Reference(chart_sheet.worksheet, min_col=2, min_row=1, max_row=len(top_profitable)+1)
+            bar_chart.add_data(data_ref, titles_from_data=True)
+            bar_chart.set_categories(labels_ref)
+            bar_chart.y_axis.title = "Lucro (€)"
+            bar_chart.x_axis.title = "Cliente"
+            chart_sheet.worksheet.add_chart(bar_chart, "D2")
+
+        return workbook.save(), XLSX_CONTENT_TYPE
         
     # --- Report: Time Tracking Summary ---
     @staticmethod
     def generate_time_tracking_summary_report(
         organization: Organization, user_ids: List[str] = None, client_ids: List[str] = None,
         date_from: datetime = None, date_to: datetime = None, format_type: str = 'pdf'
-    ) -> Tuple[io.BytesIO, str]:
-        time_query = TimeEntry.objects.filter(client__organization=organization)
-        if user_ids: time_query = time_query.filter(user_id__in=user_ids)
-        if client_ids: time_query = time_query.filter(client_id__in=client_ids)
-        
-        actual_date_from = date_from or (timezone.now() - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
-        actual_date_to = date_to or timezone.now().replace(hour=23, minute=59, second=59, microsecond=999999)
-        time_query = time_query.filter(date__gte=actual_date_from.date(), date__lte=actual_date_to.date())
-
-        time_entries = list(time_query.select_related('user', 'client', 'task', 'category').order_by('-date', 'user__username')[:500]) 
-
-        total_stats = time_query.aggregate(total_minutes=Sum('minutes_spent'), total_entries=Count('id'), unique_users=Count('user', distinct=True), unique_clients=Count('client', distinct=True))
-        user_stats = list(time_query.values('user__username').annotate(total_minutes=Sum('minutes_spent'), entry_count=Count('id'), client_count=Count('client', distinct=True)).order_by('-total_minutes'))
-        client_stats = list(time_query.values('client__name').annotate(total_minutes=Sum('minutes_spent'), entry_count=Count('id'), user_count=Count('user', distinct=True)).order_by('-total_minutes'))
-        category_stats = list(time_query.filter(category__isnull=False).values('category__name').annotate(total_minutes=Sum('minutes_spent'), entry_count=Count('id')).order_by('-total_minutes'))
-
-        report_data = {
-            'organization': organization, 'time_entries': time_entries, 'total_stats': total_stats,
-            'user_stats': user_stats, 'client_stats': client_stats, 'category_stats': category_stats,
-            'date_from': actual_date_from, 'date_to': actual_date_to,
-            'generation_date': timezone.now()
-        }
+    ) -> Tuple[BinaryIO, str]:
+        report_data = ReportDataService.time_tracking_summary(
+            organization, user_ids=user_ids, client_ids=client_ids,
+            date_from=date_from, date_to=date_to, format_type=format_type
+        )
         if format_type == 'pdf':
             return ReportGenerationService._generate_time_tracking_pdf(report_data)
         elif format_type == 'csv':
@@ -756,98 +633,79 @@ class ReportGenerationService:
         return buffer, 'application/pdf'
         
     @staticmethod
-    def _generate_time_tracking_csv(data: Dict) -> Tuple[io.BytesIO, str]:
-        buffer = io.StringIO()
-        writer = csv.writer(buffer)
-        writer.writerow(["Resumo de Registo de Tempos", f"Organização: {data['organization'].name}"])
-        writer.writerow([f"Período: {data['date_from'].strftime('%d/%m/%Y')} a {data['date_to'].strftime('%d/%m/%Y')}"])
-        writer.writerow([f"Gerado em: {data['generation_date'].strftime('%d/%m/%Y %H:%M')}"])
-        writer.writerow([])
+    def _generate_time_tracking_csv(data: Dict) -> Tuple[BinaryIO, str]:
+        return write_csv(ReportGenerationService._time_tracking_csv_rows(data)), CSV_CONTENT_TYPE
+
+    @staticmethod
+    def _time_tracking_csv_rows(data: Dict) -> Iterator[List]:
+        yield ["Resumo de Registo de Tempos", f"Organização: {data['organization'].name}"]
+        yield [f"Período: {data['date_from'].strftime('%d/%m/%Y')} a {data['date_to'].strftime('%d/%m/%Y')}"]
+        yield [f"Gerado em: {data['generation_date'].strftime('%d/%m/%Y %H:%M')}"]
+        yield []
         
         ts = data['total_stats']
-        writer.writerow(['Sumário Geral'])
-        writer.writerow(['Total de Registos:', ts.get('total_entries',0) or 0])
-        writer.writerow(['Total de Minutos:', ts.get('total_minutes',0) or 0])
-        writer.writerow(['Total de Horas:', f"{(ts.get('total_minutes',0) or 0) / 60:.1f}"])
-        writer.writerow(['Utilizadores Únicos:', ts.get('unique_users',0) or 0])
-        writer.writerow(['Clientes Únicos:', ts.get('unique_clients',0) or 0])
-        writer.writerow([])
-        
-        writer.writerow(['Registos Detalhados'])
-        writer.writerow(['Data', 'Utilizador', 'Cliente', 'Tarefa', 'Categoria', 'Descrição', 'Minutos', 'Horas'])
-        for entry in data['time_entries']: 
-            writer.writerow([
+        yield ['Sumário Geral']
+        yield ['Total de Registos:', ts.get('total_entries',0) or 0]
+        yield ['Total de Minutos:', ts.get('total_minutes',0) or 0]
+        yield ['Total de Horas:', f"{(ts.get('total_minutes',0) or 0) / 60:.1f}"]
+        yield ['Utilizadores Únicos:', ts.get('unique_users',0) or 0]
+        yield ['Clientes Únicos:', ts.get('unique_clients',0) or 0]
+        yield []
+        
+        yield ['Registos Detalhados']
+        yield ['Data', 'Utilizador', 'Cliente', 'Tarefa', 'Categoria', 'Descrição', 'Minutos', 'Horas']
+        for entry in iterate_rows(data['time_entries']):
+            yield [
                 entry.date.strftime('%Y-%m-%d'), entry.user.username, entry.client.name,
                 entry.task.title if entry.task else '',
                 entry.category.name if entry.category else '',
                 entry.description, entry.minutes_spent, round(entry.minutes_spent / 60, 2)
-            ])
-        csv_content = buffer.getvalue()
-        buffer.close()
-        return io.BytesIO(csv_content.encode('utf-8-sig')), 'text/csv'
+            ]
 
     @staticmethod
-    def _generate_time_tracking_xlsx(data: Dict) -> Tuple[io.BytesIO, str]:
-        buffer = io.BytesIO()
-        wb = openpyxl.Workbook()
+    def _generate_time_tracking_xlsx(data: Dict) -> Tuple[BinaryIO, str]:
+        workbook = StreamingWorkbook()
+        header_style, cell_style = ReportGenerationService._apply_xlsx_header_style, ReportGenerationService._apply_xlsx_cell_style
         
         # Summary Sheet
-        ws_summary = wb.active
-        ws_summary.title = "Sumário Tempos"
-        ws_summary['A1'] = f"Resumo de Registo de Tempos - {data['organization'].name}"
-        ws_summary.merge_cells('A1:E1'); ReportGenerationService._apply_xlsx_header_style(ws_summary['A1'], font_bold=True, fill_color="1E40AF")
-        # ... Add overall summary stats (total_stats) to this sheet ...
+        ws_summary = workbook.sheet("Sumário Tempos", min_width=12)
+        ws_summary.append([f"Resumo de Registo de Tempos - {data['organization'].name}"], ws_summary.style(header_style, fill_color="1E40AF"))
+        ws_summary.append([])
         ts = data['total_stats']
-        row_idx = 3
-        ws_summary.cell(row=row_idx, column=1, value="Período:"); ReportGenerationService._apply_xlsx_cell_style(ws_summary.cell(row=row_idx,column=1), font_bold=True)
-        ws_summary.cell(row=row_idx, column=2, value=f"{data['date_from'].strftime('%d/%m/%Y')} - {data['date_to'].strftime('%d/%m/%Y')}"); row_idx+=1
-        ws_summary.cell(row=row_idx, column=1, value="Total Registos:"); ReportGenerationService._apply_xlsx_cell_style(ws_summary.cell(row=row_idx,column=1), font_bold=True)
-        ws_summary.cell(row=row_idx, column=2, value=ts.get('total_entries',0) or 0); row_idx+=1
-        ws_summary.cell(row=row_idx, column=1, value="Total Horas:"); ReportGenerationService._apply_xlsx_cell_style(ws_summary.cell(row=row_idx,column=1), font_bold=True)
-        ws_summary.cell(row=row_idx, column=2, value=(ts.get('total_minutes',0) or 0)/60).number_format = '0.00 "h"'; row_idx+=2
+        label = ws_summary.style(cell_style, font_bold=True)
+        ws_summary.append(["Período:", f"{data['date_from'].strftime('%d/%m/%Y')} - {data['date_to'].strftime('%d/%m/%Y')}"], [label])
+        ws_summary.append(["Total Registos:", ts.get('total_entries',0) or 0], [label])
+        ws_summary.append(
+            ["Total Horas:", (ts.get('total_minutes',0) or 0)/60],
+            [label, ws_summary.style(cell_style, number_format='0.00 "h"')]
+        )
 
         # Sheet for User Stats
         if data['user_stats']:
-            ws_user = wb.create_sheet("Tempo por Utilizador")
+            ws_user = workbook.sheet("Tempo por Utilizador", min_width=12)
             headers_user = ["Utilizador", "Total Minutos", "Nº Registos", "Nº Clientes"]
-            for col_idx, header in enumerate(headers_user,1): ReportGenerationService._apply_xlsx_header_style(ws_user.cell(row=1, column=col_idx, value=header))
-            for r_idx, stat in enumerate(data['user_stats'], 2):
-                ws_user.cell(row=r_idx, column=1, value=stat['user__username'])
-                ws_user.cell(row=r_idx, column=2, value=stat.get('total_minutes',0) or 0)
-                ws_user.cell(row=r_idx, column=3, value=stat.get('entry_count',0) or 0)
-                ws_user.cell(row=r_idx, column=4, value=stat.get('client_count',0) or 0)
-                for c_idx in range(1, len(headers_user)+1): ReportGenerationService._apply_xlsx_cell_style(ws_user.cell(row=r_idx, column=c_idx))
-
-        # Sheet for Client Stats & Category Stats (similar to User Stats)
-        # ...
+            ws_user.append(headers_user, ws_user.style(header_style))
+            text = ws_user.style(cell_style)
+            for stat in data['user_stats']:
+                ws_user.append([
+                    stat['user__username'], stat.get('total_minutes',0) or 0,
+                    stat.get('entry_count',0) or 0, stat.get('client_count',0) or 0,
+                ], text)
 
         # Detailed Time Entries Sheet
-        ws_details = wb.create_sheet("Registos Detalhados")
+        ws_details = workbook.sheet("Registos Detalhados", min_width=12)
         headers_details = ['Data', 'Utilizador', 'Cliente', 'Tarefa', 'Categoria', 'Descrição', 'Minutos']
-        for col_idx, header in enumerate(headers_details,1): ReportGenerationService._apply_xlsx_header_style(ws_details.cell(row=1, column=col_idx, value=header))
-        for r_idx, entry in enumerate(data['time_entries'], 2):
-            row_values = [
+        ws_details.append(headers_details, ws_details.style(header_style))
+        text = ws_details.style(cell_style)
+        styles = [ws_details.style(cell_style, number_format='YYYY-MM-DD'), text, text, text, text, ws_details.style(cell_style, wrap_text=True), text]
+        for entry in iterate_rows(data['time_entries']):
+            ws_details.append([
                 entry.date, entry.user.username, entry.client.name,
                 entry.task.title if entry.task else '', entry.category.name if entry.category else '',
                 entry.description, entry.minutes_spent
-            ]
-            for c_idx, val in enumerate(row_values,1):
-                cell = ws_details.cell(row=r_idx, column=c_idx, value=val)
-                if c_idx == 1: cell.number_format = 'YYYY-MM-DD'
-                ReportGenerationService._apply_xlsx_cell_style(cell, wrap_text=(c_idx==6))
-
-        for sheet_name_key in wb.sheetnames:
-            current_sheet = wb[sheet_name_key]
-            for i, column_cells in enumerate(current_sheet.columns):
-                length = 0
-                if column_cells:
-                    str_values = [str(cell.value) if cell.value is not None else "" for cell in column_cells]
-                    if str_values: length = max(len(val) for val in str_values)
-                current_sheet.column_dimensions[get_column_letter(i + 1)].width = max(length + 2, 12)
-
-        wb.save(buffer)
-        buffer.seek(0)
-        return buffer, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            ], styles)
+
+        return workbook.save(), XLSX_CONTENT_TYPE
 
     # --- Report: Task Performance (New) ---
     @staticmethod
@@ -856,53 +714,11 @@ class ReportGenerationService:
         client_ids: List[str] = None, user_ids: List[str] = None, 
         category_ids: List[str] = None, statuses: List[str] = None,
         format_type: str = 'pdf'
-    ) -> Tuple[io.BytesIO, str]:
-        task_query = Task.objects.filter(client__organization=organization)
-
-        actual_date_from = date_from or (timezone.now() - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
-        actual_date_to = date_to or timezone.now().replace(hour=23, minute=59, second=59, microsecond=999999)
-        
-        task_query = task_query.filter(created_at__gte=actual_date_from, created_at__lte=actual_date_to)
-
-        if client_ids: task_query = task_query.filter(client_id__in=client_ids)
-        if user_ids: task_query = task_query.filter(Q(assigned_to_id__in=user_ids) | Q(collaborators__id__in=user_ids)).distinct()
-        if category_ids: task_query = task_query.filter(category_id__in=category_ids)
-        if statuses: task_query = task_query.filter(status__in=statuses)
-        
-        tasks = list(task_query.select_related('client', 'category', 'assigned_to', 'created_by', 'workflow').order_by('-created_at')[:500])
-
-        total_tasks = task_query.count()
-        status_distribution = list(task_query.values('status').annotate(count=Count('id')).order_by('-count'))
-        category_distribution = list(task_query.filter(category__isnull=False).values('category__name').annotate(count=Count('id')).order_by('-count'))
-        assignee_distribution = list(task_query.filter(assigned_to__isnull=False).values('assigned_to__username').annotate(count=Count('id')).order_by('-count'))
-        
-        completed_tasks_in_filtered_set = task_query.filter(status='completed', completed_at__isnull=False, created_at__isnull=False)
-        
-        avg_completion_time_data = completed_tasks_in_filtered_set.annotate(
-            duration=ExpressionWrapper(F('completed_at') - F('created_at'), output_field=DurationField())
-        ).aggregate(avg_duration=Avg('duration'))
-        
-        avg_completion_seconds = avg_completion_time_data['avg_duration'].total_seconds() if avg_completion_time_data['avg_duration'] else None
-        
-        overdue_tasks_count = task_query.filter(deadline__lt=timezone.now().date(), status__in=['pending', 'in_progress']).count()
-
-        report_data = {
-            'organization': organization, 'tasks': tasks, 'generation_date': timezone.now(),
-            'date_from': actual_date_from, 'date_to': actual_date_to, 
-            'filters_applied': {
-                'clients': Client.objects.filter(id__in=client_ids).values_list('name', flat=True) if client_ids else "Todos",
-                'users': User.objects.filter(id__in=user_ids).values_list('username', flat=True) if user_ids else "Todos",
-                'categories': TaskCategory.objects.filter(id__in=category_ids).values_list('name', flat=True) if category_ids else "Todas",
-                'statuses': statuses or "Todos"
-            },
-            'summary_stats': {
-                'total_tasks': total_tasks, 'status_distribution': status_distribution,
-                'overdue_tasks_count': overdue_tasks_count, 
-                'avg_completion_days': (avg_completion_seconds / (24*3600)) if avg_completion_seconds is not None else None,
-            },
-            'category_distribution': category_distribution,
-            'assignee_distribution': assignee_distribution,
-        }
+    ) -> Tuple[BinaryIO, str]:
+        report_data = ReportDataService.task_performance(
+            organization, date_from=date_from, date_to=date_to, client_ids=client_ids, user_ids=user_ids,
+            category_ids=category_ids, statuses=statuses, format_type=format_type
+        )
 
         if format_type == 'pdf':
             return ReportGenerationService._generate_task_performance_pdf(report_data)
@@ -971,24 +787,26 @@ class ReportGenerationService:
         return buffer, 'application/pdf'
 
     @staticmethod
-    def _generate_task_performance_csv(data: Dict) -> Tuple[io.BytesIO, str]:
-        buffer = io.StringIO()
-        writer = csv.writer(buffer)
-        writer.writerow(["Relatório de Performance de Tarefas", f"Organização: {data['organization'].name}"])
-        if data['date_from'] and data['date_to']: writer.writerow([f"Período Tarefas Criadas: {data['date_from'].strftime('%d/%m/%Y')} a {data['date_to'].strftime('%d/%m/%Y')}"])
-        writer.writerow(["Filtros Aplicados:", f"Clientes: {data['filters_applied']['clients']}", f"Utilizadores: {data['filters_applied']['users']}", f"Categorias: {data['filters_applied']['categories']}", f"Status: {data['filters_applied']['statuses']}"])
-        writer.writerow([])
+    def _generate_task_performance_csv(data: Dict) -> Tuple[BinaryIO, str]:
+        return write_csv(ReportGenerationService._task_performance_csv_rows(data)), CSV_CONTENT_TYPE
+
+    @staticmethod
+    def _task_performance_csv_rows(data: Dict) -> Iterator[List]:
+        yield ["Relatório de Performance de Tarefas", f"Organização: {data['organization'].name}"]
+        if data['date_from'] and data['date_to']: yield [f"Período Tarefas Criadas: {data['date_from'].strftime('%d/%m/%Y')} a {data['date_to'].strftime('%d/%m/%Y')}"]
+        yield ["Filtros Aplicados:", f"Clientes: {data['filters_applied']['clients']}", f"Utilizadores: {data['filters_applied']['users']}", f"Categorias: {data['filters_applied']['categories']}", f"Status: {data['filters_applied']['statuses']}"]
+        yield []
         
         summary = data['summary_stats']
-        writer.writerow(['Sumário Geral'])
-        writer.writerow(['Total de Tarefas (filtros):', summary['total_tasks']])
-        writer.writerow(['Tarefas Atrasadas:', summary['overdue_tasks_count']])
-        writer.writerow(['Tempo Médio Conclusão (dias):', f"{summary['avg_completion_days']:.1f}" if summary['avg_completion_days'] is not None else "N/A"])
-        writer.writerow([])
-
-        writer.writerow(['ID Tarefa', 'Título', 'Cliente', 'Status', 'Prioridade', 'Prazo', 'Responsável', 'Categoria', 'Workflow', 'Criado em', 'Concluído em', 'Estimado (min)', 'Descrição'])
-        for task in data['tasks']:
-            writer.writerow([
+        yield ['Sumário Geral']
+        yield ['Total de Tarefas (filtros):', summary['total_tasks']]
+        yield ['Tarefas Atrasadas:', summary['overdue_tasks_count']]
+        yield ['Tempo Médio Conclusão (dias):', f"{summary['avg_completion_days']:.1f}" if summary['avg_completion_days'] is not None else "N/A"]
+        yield []
+
+        yield ['ID Tarefa', 'Título', 'Cliente', 'Status', 'Prioridade', 'Prazo', 'Responsável', 'Categoria', 'Workflow', 'Criado em', 'Concluído em', 'Estimado (min)', 'Descrição']
+        for task in iterate_rows(data['tasks']):
+            yield [
                 task.id, task.title, task.client.name, task.get_status_display(), task.get_priority_display(),
                 task.deadline.strftime('%Y-%m-%d') if task.deadline else '',
                 task.assigned_to.username if task.assigned_to else '',
@@ -998,114 +816,85 @@ class ReportGenerationService:
                 task.completed_at.strftime('%Y-%m-%d %H:%M') if task.completed_at else '',
                 task.estimated_time_minutes or '',
                 task.description or ''
-            ])
-        csv_content = buffer.getvalue()
-        buffer.close()
-        return io.BytesIO(csv_content.encode('utf-8-sig')), 'text/csv'
+            ]
 
     @staticmethod
-    def _generate_task_performance_xlsx(data: Dict) -> Tuple[io.BytesIO, str]:
-        buffer = io.BytesIO()
-        wb = openpyxl.Workbook()
+    def _generate_task_performance_xlsx(data: Dict) -> Tuple[BinaryIO, str]:
+        workbook = StreamingWorkbook()
+        header_style, cell_style = ReportGenerationService._apply_xlsx_header_style, ReportGenerationService._apply_xlsx_cell_style
         
         # Summary Sheet
-        ws_summary = wb.active
-        ws_summary.title = "Sumário Performance"
-        ws_summary['A1'] = f"Relatório Performance Tarefas - {data['organization'].name}"
-        ws_summary.merge_cells('A1:G1'); ReportGenerationService._apply_xlsx_header_style(ws_summary['A1'], fill_color="1E40AF")
-        if data['date_from'] and data['date_to']: ws_summary['A2'] = f"Período Criação: {data['date_from'].strftime('%d/%m/%Y')} a {data['date_to'].strftime('%d/%m/%Y')}"
+        ws_summary = workbook.sheet("Sumário Performance", min_width=12, padding=3)
+        ws_summary.append([f"Relatório Performance Tarefas - {data['organization'].name}"], ws_summary.style(header_style, fill_color="1E40AF"))
+        ws_summary.append([f"Período Criação: {data['date_from'].strftime('%d/%m/%Y')} a {data['date_to'].strftime('%d/%m/%Y')}"] if data['date_from'] and data['date_to'] else [])
+        ws_summary.append([])
         
-        row_idx = 4
         summary = data['summary_stats']
-        ws_summary.cell(row=row_idx, column=1, value="Total Tarefas (filtros):"); ReportGenerationService._apply_xlsx_cell_style(ws_summary.cell(row=row_idx,column=1), font_bold=True)
-        ws_summary.cell(row=row_idx, column=2, value=summary['total_tasks']); row_idx+=1
-        ws_summary.cell(row=row_idx, column=1, value="Tarefas Atrasadas:"); ReportGenerationService._apply_xlsx_cell_style(ws_summary.cell(row=row_idx,column=1), font_bold=True)
-        ws_summary.cell(row=row_idx, column=2, value=summary['overdue_tasks_count']); row_idx+=1
-        ws_summary.cell(row=row_idx, column=1, value="Tempo Médio Conclusão (dias):"); ReportGenerationService._apply_xlsx_cell_style(ws_summary.cell(row=row_idx,column=1), font_bold=True)
-        ws_summary.cell(row=row_idx, column=2, value=summary['avg_completion_days'] if summary['avg_completion_days'] is not None else 'N/A').number_format = '0.0'
-        row_idx+=2
-
-        ReportGenerationService._apply_xlsx_header_style(ws_summary.cell(row=row_idx, column=1, value="Status"))
-        ReportGenerationService._apply_xlsx_header_style(ws_summary.cell(row=row_idx, column=2, value="Quantidade"))
-        row_idx+=1
+        label = ws_summary.style(cell_style, font_bold=True)
+        ws_summary.append(["Total Tarefas (filtros):", summary['total_tasks']], [label])
+        ws_summary.append(["Tarefas Atrasadas:", summary['overdue_tasks_count']], [label])
+        ws_summary.append(
+            ["Tempo Médio Conclusão (dias):", summary['avg_completion_days'] if summary['avg_completion_days'] is not None else 'N/A'],
+            [label, ws_summary.style(cell_style, number_format='0.0')]
+        )
+        ws_summary.append([])
+
+        header = ws_summary.style(header_style)
+        ws_summary.append(["Status", "Quantidade"], header)
+        status_styles = [ws_summary.style(cell_style), ws_summary.style(cell_style, alignment='right')]
+        status_labels = dict(Task.STATUS_CHOICES)
         for s_dist in summary['status_distribution']:
-            status_display = dict(Task.STATUS_CHOICES).get(s_dist['status'], s_dist['status'])
-            ws_summary.cell(row=row_idx, column=1, value=status_display)
-            ws_summary.cell(row=row_idx, column=2, value=s_dist['count'])
-            ReportGenerationService._apply_xlsx_cell_style(ws_summary.cell(row=row_idx, column=1))
-            ReportGenerationService._apply_xlsx_cell_style(ws_summary.cell(row=row_idx, column=2), alignment='right')
-            row_idx+=1
+            ws_summary.append([status_labels.get(s_dist['status'], s_dist['status']), s_dist['count']], status_styles)
         
         # Detailed Task List Sheet
-        ws_details = wb.create_sheet("Lista Tarefas Detalhada")
+        ws_details = workbook.sheet("Lista Tarefas Detalhada", min_width=12, padding=3)
         headers = ['ID', 'Título', 'Cliente', 'Status', 'Prioridade', 'Prazo', 'Responsável', 'Categoria', 'Workflow', 'Criado em', 'Concluído em', 'Estimado (min)', 'Descrição']
-        for col_idx, header_text in enumerate(headers, 1):
-            ReportGenerationService._apply_xlsx_header_style(ws_details.cell(row=1, column=col_idx, value=header_text))
-
-        for r_idx, task in enumerate(data['tasks'], 2):
-            row_values = [
+        ws_details.append(headers, ws_details.style(header_style))
+
+        text = ws_details.style(cell_style)
+        wrapped = ws_details.style(cell_style, wrap_text=True)
+        timestamp = ws_details.style(cell_style, number_format='YYYY-MM-DD HH:MM') # Created/Completed At
+        styles = [text, wrapped, text, text, text, ws_details.style(cell_style, number_format='YYYY-MM-DD'), text, text, text, timestamp, timestamp, text, wrapped]
+        for task in iterate_rows(data['tasks']):
+            ws_details.append([
                 str(task.id), task.title, task.client.name, task.get_status_display(), task.get_priority_display(),
                 task.deadline, task.assigned_to.username if task.assigned_to else None,
                 task.category.name if task.category else None, task.workflow.name if task.workflow else None,
-                task.created_at, task.completed_at, task.estimated_time_minutes, task.description
-            ]
-            for c_idx, val in enumerate(row_values,1):
-                cell = ws_details.cell(row=r_idx, column=c_idx, value=val)
-                if c_idx == 6: cell.number_format = 'YYYY-MM-DD' # Deadline
-                elif c_idx == 10 or c_idx == 11: cell.number_format = 'YYYY-MM-DD HH:MM' # Created/Completed At
-                ReportGenerationService._apply_xlsx_cell_style(cell, wrap_text=(c_idx in [2,13]))
+                # Excel não guarda fusos horários: datas em hora local, sem tzinfo
+                timezone.make_naive(task.created_at) if task.created_at else None,
+                timezone.make_naive(task.completed_at) if task.completed_at else None,
+                task.estimated_time_minutes, task.description
+            ], styles)
 
         # Chart for Tasks by Status
-        chart_sheet_status = wb.create_sheet("Gráfico Status Tarefas")
-        chart_sheet_status.cell(row=1, column=1, value="Status")
-        chart_sheet_status.cell(row=1, column=2, value="Quantidade")
-        for i, item in enumerate(summary['status_distribution'], 2):
-            status_display = dict(Task.STATUS_CHOICES).get(item['status'], item['status'])
-            chart_sheet_status.cell(row=i, column=1, value=status_display)
-            chart_sheet_status.cell(row=i, column=2, value=item['count'])
+        chart_sheet_status = workbook.sheet("Gráfico Status Tarefas", min_width=12, padding=3)
+        chart_sheet_status.append(["Status", "Quantidade"])
+        for item in summary['status_distribution']:
+            chart_sheet_status.append([status_labels.get(item['status'], item['status']), item['count']])
         
         pie_chart = OpenpyxlPieChart()
-        labels_ref = Reference(chart_sheet_status, min_col=1, min_row=2, max_row=len(summary['status_distribution'])+1)
-        data_ref = Reference(chart_sheet_status, min_col=2, min_row=1, max_row=len(summary['status_distribution'])+1)
+        labels_ref = Reference(chart_sheet_status.worksheet, min_col=1, min_row=2, max_row=len(summary['status_distribution'])+1)
+        data_ref = Reference(chart_sheet_status.worksheet, min_col=2, min_row=1, max_row=len(summary['status_distribution'])+1)
         pie_chart.add_data(data_ref, titles_from_data=True)
         pie_chart.set_categories(labels_ref)
         pie_chart.title = "Distribuição de Tarefas por Status"
-        chart_sheet_status.add_chart(pie_chart, "E2")
-
-        for sheet_name_key in wb.sheetnames:
-            current_sheet = wb[sheet_name_key]
-            for i, column_cells in enumerate(current_sheet.columns):
-                length = 0
-                if column_cells:
-                    str_values = [str(cell.value) if cell.value is not None else "" for cell in column_cells]
-                    if str_values: length = max(len(val) for val in str_values)
-                current_sheet.column_dimensions[get_column_letter(i + 1)].width = max(length + 3, 12)
+        chart_sheet_status.worksheet.add_chart(pie_chart, "E2")
 
-
-        wb.save(buffer)
-        buffer.seek(0)
-        return buffer, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        return workbook.save(), XLSX_CONTENT_TYPE
 
     # --- Report: Custom Report (Placeholder) ---
     @staticmethod
-    def generate_custom_report(*args, **kwargs) -> Tuple[io.BytesIO, str]:
-        buffer = io.BytesIO() 
+    def generate_custom_report(*args, **kwargs) -> Tuple[BinaryIO, str]:
         format_type = kwargs.get('format_type', 'pdf')
 
         if format_type == 'csv':
-            s_buffer = io.StringIO()
-            writer = csv.writer(s_buffer)
-            writer.writerow(["Relatório Personalizado - Em Desenvolvimento"])
-            s_buffer.seek(0)
-            return io.BytesIO(s_buffer.read().encode('utf-8-sig')), 'text/csv'
+            return write_csv([["Relatório Personalizado - Em Desenvolvimento"]]), CSV_CONTENT_TYPE
         elif format_type == 'xlsx':
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws['A1'] = "Relatório Personalizado - Em Desenvolvimento"
-            wb.save(buffer)
-            buffer.seek(0)
-            return buffer, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            workbook = StreamingWorkbook()
+            workbook.sheet("Sheet").append(["Relatório Personalizado - Em Desenvolvimento"])
+            return workbook.save(), XLSX_CONTENT_TYPE
         else: # Default to PDF
+            buffer = io.BytesIO()
             styles, C = ReportGenerationService._get_pdf_styles()
             story = [
                 Paragraph("Relatório Personalizado", styles['ReportTitle']),
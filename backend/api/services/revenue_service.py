@@ -1,5 +1,6 @@
 # api/services/revenue_service.py (NEW FILE)
 from ..models import Client, ClientProfitability, Task, TaskCategory
+from django.utils import timezone
 from decimal import Decimal
 
 class RevenueService:
@@ -14,12 +15,16 @@ class RevenueService:
     def _identify_fee_review_opportunity(client: Client) -> list:
         # Based on profitability
         profit_record = ClientProfitability.objects.filter(client=client).order_by('-year', '-month').first()
-        if profit_record and profit_record.profit_margin is not None and profit_record.profit_margin < 25.0:
+        return RevenueService.fee_review_opportunities(profit_record.profit_margin if profit_record else None)
+
+    @staticmethod
+    def fee_review_opportunities(margin) -> list:
+        if margin is not None and margin < 25:
             return [{
                 'type': 'FEE_REVIEW',
                 'severity': 'medium',
                 'title': 'Revisão de Avença Recomendada',
-                'details': f"A margem de lucro atual é de {profit_record.profit_margin:.1f}%. Sugerimos uma revisão da avença para melhorar a rentabilidade.",
+                'details': f"A margem de lucro atual é de {margin:.1f}%. Sugerimos uma revisão da avença para melhorar a rentabilidade.",
                 'action_suggestion': 'Agendar reunião para discutir reajuste de preço.'
             }]
         return []
@@ -27,13 +32,18 @@ class RevenueService:
     @staticmethod
     def _identify_service_gap_opportunity(client: Client) -> list:
         # Example: if client has 'IRS' tag but no recent 'Consultoria Fiscal' task
-        client_tags = client.fiscal_tags or []
-        if 'IRS' in client_tags:
-            has_consulting_task = Task.objects.filter(
-                client=client,
-                category__name__icontains='Consultoria',
-                created_at__year=timezone.now().year
-            ).exists()
+        if 'IRS' not in (client.fiscal_tags or []):
+            return []
+        has_consulting_task = Task.objects.filter(
+            client=client,
+            category__name__icontains='Consultoria',
+            created_at__year=timezone.now().year
+        ).exists()
+        return RevenueService.service_gap_opportunities(client.fiscal_tags, has_consulting_task)
+
+    @staticmethod
+    def service_gap_opportunities(fiscal_tags, has_consulting_task: bool) -> list:
+        if 'IRS' in (fiscal_tags or []):
             if not has_consulting_task:
                 return [{
                     'type': 'SERVICE_GAP',
@@ -0,0 +1,142 @@
+# api/services/saft_analytics_service.py
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+import logging
+
+from django.db import transaction
+from django.db.models import Sum
+
+from ..models import Organization, SAFTAggregate, SAFTFile
+
+logger = logging.getLogger(__name__)
+
+
+class SAFTAnalyticsService:
+    """
+    Gravação e leitura dos agregados SAF-T (SAFTAggregate) produzidos pelo SAFTParser.
+    Os detalhes do ficheiro, o score de cash flow e os relatórios leem daqui em vez
+    de voltarem a fazer parsing do XML.
+    """
+
+    BULK_BATCH_SIZE = 1000
+
+    @staticmethod
+    def store(saft_file: SAFTFile, aggregates: Dict) -> int:
+        """Substitui os agregados do ficheiro pelos devolvidos pelo parser."""
+        rows = [
+            SAFTAggregate(
+                saft_file=saft_file,
+                dimension=dimension,
+                key=str(key)[:100],
+                label=str(values['label'])[:255] if values.get('label') else None,
+                document_count=values['document_count'],
+                cancelled_count=values['cancelled_count'],
+                net_total=values['net_total'],
+                tax_total=values['tax_total'],
+                gross_total=values['gross_total'],
+            )
+            for dimension, buckets in (aggregates or {}).items()
+            for key, values in buckets.items()
+        ]
+        with transaction.atomic():
+            SAFTAggregate.objects.filter(saft_file=saft_file).delete()
+            SAFTAggregate.objects.bulk_create(rows, batch_size=SAFTAnalyticsService.BULK_BATCH_SIZE)
+        return len(rows)
+
+    @staticmethod
+    def _serialize(row: Dict) -> Dict:
+        return {
+            'key': row['key'],
+            'label': row['label'],
+            'document_count': row['document_count'],
+            'cancelled_count': row['cancelled_count'],
+            'net_total': float(row['net_total']),
+            'tax_total': float(row['tax_total']),
+            'gross_total': float(row['gross_total']),
+        }
+
+    @staticmethod
+    def breakdown(saft_file: SAFTFile, top_customers: int = 20) -> Dict:
+        """Agregados de um ficheiro para o endpoint de detalhes (clientes limitados aos maiores)."""
+        fields = ('dimension', 'key', 'label', 'document_count', 'cancelled_count', 'net_total', 'tax_total', 'gross_total')
+        result = {'by_month': [], 'by_tax_rate': [], 'by_doc_type': [], 'top_customers': []}
+        for row in SAFTAggregate.objects.filter(saft_file=saft_file).exclude(dimension='customer').values(*fields):
+            result[f"by_{row['dimension']}"].append(SAFTAnalyticsService._serialize(row))
+        result['top_customers'] = [
+            SAFTAnalyticsService._serialize(row)
+            for row in SAFTAggregate.objects.filter(saft_file=saft_file, dimension='customer')
+            .order_by('-gross_total').values(*fields)[:top_customers]
+        ]
+        result['customer_count'] = SAFTAggregate.objects.filter(saft_file=saft_file, dimension='customer').count()
+        return result
+
+    @staticmethod
+    def latest_files_by_tax_id(organization: Organization, tax_ids: Iterable[str]) -> Dict[str, SAFTFile]:
+        """Último SAF-T processado de cada NIF (uma única query)."""
+        tax_ids = [tax_id for tax_id in set(tax_ids) if tax_id]
+        if not tax_ids:
+            return {}
+        latest = {}
+        files = SAFTFile.objects.filter(
+            organization=organization, status='COMPLETED', company_tax_id__in=tax_ids
+        ).order_by('company_tax_id', '-end_date', '-processed_at')
+        for saft_file in files.only('id', 'company_tax_id', 'fiscal_year', 'end_date', 'summary_data'):
+            latest.setdefault(saft_file.company_tax_id, saft_file)
+        return latest
+
+    @staticmethod
+    def latest_file_for_client(client) -> Optional[SAFTFile]:
+        if not client.nif:
+            return None
+        return SAFTAnalyticsService.latest_files_by_tax_id(client.organization_id, [client.nif]).get(client.nif)
+
+    @staticmethod
+    def monthly_revenue(saft_file: SAFTFile) -> List[Dict]:
+        """Faturação mensal (líquida de notas de crédito e sem documentos anulados), por ordem cronológica."""
+        return [
+            {'month': key, 'net_total': net_total, 'gross_total': gross_total, 'cancelled_count': cancelled_count}
+            for key, net_total, gross_total, cancelled_count in SAFTAggregate.objects.filter(
+                saft_file=saft_file, dimension='month'
+            ).exclude(key='N/A').order_by('key').values_list('key', 'net_total', 'gross_total', 'cancelled_count')
+        ]
+
+    @staticmethod
+    def monthly_revenue_by_file(saft_file_ids: Iterable) -> Dict:
+        """`monthly_revenue` de vários ficheiros numa única query, indexado pelo id do ficheiro."""
+        months = {}
+        for saft_file_id, key, net_total, gross_total, cancelled_count in SAFTAggregate.objects.filter(
+            saft_file_id__in=list(saft_file_ids), dimension='month'
+        ).exclude(key='N/A').order_by('saft_file_id', 'key').values_list(
+            'saft_file_id', 'key', 'net_total', 'gross_total', 'cancelled_count'
+        ):
+            months.setdefault(saft_file_id, []).append(
+                {'month': key, 'net_total': net_total, 'gross_total': gross_total, 'cancelled_count': cancelled_count}
+            )
+        return months
+
+    @staticmethod
+    def revenue_summary_by_tax_id(organization: Organization, tax_ids: Iterable[str]) -> Dict[str, Dict]:
+        """Faturação anual e documentos anulados do último SAF-T de cada NIF, para relatórios."""
+        latest = SAFTAnalyticsService.latest_files_by_tax_id(organization, tax_ids)
+        if not latest:
+            return {}
+        summaries = {}
+        month_totals = SAFTAnalyticsService._month_totals([saft_file.id for saft_file in latest.values()])
+        for tax_id, saft_file in latest.items():
+            net_total, gross_total, cancelled_count = month_totals.get(saft_file.id, (Decimal('0'), Decimal('0'), 0))
+            summaries[tax_id] = {
+                'fiscal_year': saft_file.fiscal_year,
+                'net_revenue': net_total,
+                'gross_revenue': gross_total,
+                'cancelled_count': cancelled_count,
+            }
+        return summaries
+
+    @staticmethod
+    def _month_totals(saft_file_ids: List) -> Dict:
+        return {
+            row['saft_file_id']: (row['net'] or Decimal('0'), row['gross'] or Decimal('0'), row['cancelled'] or 0)
+            for row in SAFTAggregate.objects.filter(saft_file_id__in=saft_file_ids, dimension='month')
+            .values('saft_file_id')
+            .annotate(net=Sum('net_total'), gross=Sum('gross_total'), cancelled=Sum('cancelled_count'))
+        }
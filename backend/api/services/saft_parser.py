@@ -7,11 +7,135 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+
+class SAFTAggregator:
+    """
+    Columnar aggregates built in the same pass as the summary: revenue per month,
+    per customer (MasterFiles/Customer joined on CustomerID), per TaxCode/TaxPercentage
+    (from the invoice lines) and per document type, plus cancelled-document counts.
+
+    Cancelled documents (InvoiceStatus 'A') only count towards cancelled_count. Credit
+    notes (NC) reduce revenue in the month/customer aggregates; the doc_type aggregate
+    keeps the document totals as issued.
+    """
+
+    DIMENSIONS = ('month', 'customer', 'tax_rate', 'doc_type')
+    CREDIT_DOC_TYPES = ('NC',)
+
+    def __init__(self):
+        self.customers = {}
+        self.cancelled_count = 0
+        self.aggregates = {dimension: {} for dimension in self.DIMENSIONS}
+
+    @staticmethod
+    def _decimal(text):
+        try:
+            return Decimal(text) if text else Decimal('0')
+        except InvalidOperation:
+            return Decimal('0')
+
+    def _bucket(self, dimension, key, label=None):
+        bucket = self.aggregates[dimension].get(key)
+        if bucket is None:
+            bucket = {
+                'label': label,
+                'document_count': 0,
+                'cancelled_count': 0,
+                'net_total': Decimal('0'),
+                'tax_total': Decimal('0'),
+                'gross_total': Decimal('0'),
+            }
+            self.aggregates[dimension][key] = bucket
+        return bucket
+
+    @staticmethod
+    def _children(element):
+        """Direct children by local name: one pass instead of a namespaced find() per field."""
+        return {child.tag.rsplit('}', 1)[-1]: child for child in element}
+
+    @staticmethod
+    def _text(children, name, default=None):
+        child = children.get(name)
+        return child.text if child is not None and child.text is not None else default
+
+    def add_customer(self, customer):
+        children = self._children(customer)
+        customer_id = self._text(children, 'CustomerID')
+        if customer_id:
+            self.customers[customer_id] = (
+                self._text(children, 'CustomerTaxID') or customer_id,
+                self._text(children, 'CompanyName'),
+            )
+
+    def add_invoice(self, invoice):
+        children = self._children(invoice)
+        document_status = children.get('DocumentStatus')
+        status = self._text(self._children(document_status), 'InvoiceStatus', 'N') if document_status is not None else 'N'
+        doc_type = self._text(children, 'InvoiceType', 'OT')
+        month_key = (self._text(children, 'InvoiceDate', '') or '')[:7] or 'N/A'
+        customer_id = self._text(children, 'CustomerID')
+        customer_key, customer_name = self.customers.get(customer_id, (customer_id or 'N/A', None))
+
+        buckets = (
+            self._bucket('month', month_key),
+            self._bucket('customer', customer_key, customer_name),
+            self._bucket('doc_type', doc_type),
+        )
+        if status == 'A':
+            self.cancelled_count += 1
+            for bucket in buckets:
+                bucket['cancelled_count'] += 1
+            return
+
+        document_totals = children.get('DocumentTotals')
+        totals = self._children(document_totals) if document_totals is not None else {}
+        net = self._decimal(self._text(totals, 'NetTotal'))
+        tax = self._decimal(self._text(totals, 'TaxPayable'))
+        gross = self._decimal(self._text(totals, 'GrossTotal'))
+        sign = -1 if doc_type in self.CREDIT_DOC_TYPES else 1
+        for index, bucket in enumerate(buckets):
+            factor = 1 if index == 2 else sign
+            bucket['document_count'] += 1
+            bucket['net_total'] += factor * net
+            bucket['tax_total'] += factor * tax
+            bucket['gross_total'] += factor * gross
+
+        rates_seen = set()
+        for line in invoice:
+            if not line.tag.endswith('Line'):
+                continue
+            line_children = self._children(line)
+            tax_node = line_children.get('Tax')
+            tax_children = self._children(tax_node) if tax_node is not None else {}
+            code = self._text(tax_children, 'TaxCode', 'N/A')
+            percentage = self._decimal(self._text(tax_children, 'TaxPercentage')).normalize()
+            # Credit notes carry DebitAmount, so credit - debit already has the right sign
+            base = self._decimal(self._text(line_children, 'CreditAmount')) - self._decimal(self._text(line_children, 'DebitAmount'))
+            line_tax = base * percentage / 100
+            key = f"{code}:{percentage:f}"
+            bucket = self._bucket('tax_rate', key)
+            if key not in rates_seen:
+                rates_seen.add(key)
+                bucket['document_count'] += 1
+            bucket['net_total'] += base
+            bucket['tax_total'] += line_tax
+            bucket['gross_total'] += base + line_tax
+
+    def result(self):
+        cent = Decimal('0.01')
+        for buckets in self.aggregates.values():
+            for bucket in buckets.values():
+                for field in ('net_total', 'tax_total', 'gross_total'):
+                    bucket[field] = bucket[field].quantize(cent)
+        return self.aggregates
+
+
 class SAFTParser:
     """A robust service to parse SAFT-PT XML files, handling missing tags and namespaces."""
 
-    def __init__(self, file_or_path):
+    def __init__(self, file_or_path, streaming=True):
         self.file_or_path = file_or_path
+        self.streaming = streaming
         self.ns = {'saf': 'urn:OECD:StandardAuditFile-Tax:PT_1.04_01'}
 
     def _extract_real_xml_content(self, raw_content):
@@ -48,7 +172,9 @@ class SAFTParser:
             header_node = root.find('Header')  # Fallback
             if header_node is None:
                 raise ValueError("SAFT Parse Error: Could not find the <Header> tag.")
+        return self._parse_header_node(header_node)
 
+    def _parse_header_node(self, header_node):
         address_node = header_node.find('saf:CompanyAddress', self.ns)
         if address_node is None:
             address_node = header_node.find('CompanyAddress') # Fallback
@@ -93,7 +219,149 @@ class SAFTParser:
         }
 
     def parse(self):
-        """Main parsing method with enhanced error handling."""
+        """
+        Main parsing method with enhanced error handling.
+        Uses the streaming parser unless the instance was created with streaming=False.
+        """
+        if self.streaming:
+            return self.parse_streaming()
+        return self.parse_in_memory()
+
+    # --- Streaming mode ---------------------------------------------------
+
+    @staticmethod
+    def _local_name(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    def _open_stream(self):
+        """Returns (file handle, should_close). Storage handles are rewound and used as-is."""
+        if hasattr(self.file_or_path, 'read'):
+            self.file_or_path.seek(0)
+            return self.file_or_path, False
+        return open(self.file_or_path, 'rb'), True
+
+    def _is_record(self, depth, path):
+        """
+        Top-level records of a SAF-T file: the Header, each MasterFiles entry and each
+        document under SourceDocuments/GeneralLedgerEntries. A record is only discarded
+        once it has been fully read.
+        """
+        if depth == 2:
+            return path[1] == 'Header'
+        if depth == 3:
+            return path[1] == 'MasterFiles'
+        if depth == 4:
+            return path[1] in ('SourceDocuments', 'GeneralLedgerEntries')
+        return False
+
+    def _handle_record(self, path, element, state):
+        """Processes one complete record. Only the header and sales invoices are needed for the summary."""
+        tag = path[-1]
+        if tag == 'Header' and len(path) == 2:
+            state['header'] = self._parse_header_node(element)
+        elif tag == 'Customer' and path[1] == 'MasterFiles':
+            state['aggregator'].add_customer(element)
+        elif tag == 'Invoice' and path[1:3] == ['SourceDocuments', 'SalesInvoices']:
+            self._add_invoice_totals(element, state['totals'])
+            state['aggregator'].add_invoice(element)
+
+    def _add_invoice_totals(self, invoice, totals):
+        totals['invoice_count'] += 1
+        doc_totals = invoice.find('saf:DocumentTotals', self.ns)
+        if doc_totals is None:
+            doc_totals = invoice.find('DocumentTotals')
+        if doc_totals is None:
+            return
+        try:
+            gross_text = self._safe_find_text(doc_totals, 'saf:GrossTotal', '0')
+            net_text = self._safe_find_text(doc_totals, 'saf:NetTotal', '0')
+            tax_text = self._safe_find_text(doc_totals, 'saf:TaxPayable', '0')
+            gross = Decimal(gross_text) if gross_text else Decimal('0')
+            net = Decimal(net_text) if net_text else Decimal('0')
+            tax = Decimal(tax_text) if tax_text else Decimal('0')
+        except InvalidOperation:
+            logger.warning(f"Invalid decimal value in DocumentTotals for invoice {self._safe_find_text(invoice, 'saf:InvoiceNo', 'N/A')}")
+            return
+        totals['total_gross'] += gross
+        totals['total_net'] += net
+        totals['total_tax'] += tax
+
+    def parse_streaming(self):
+        """
+        Parses the file incrementally with iterparse. Each record is processed when its
+        end tag is read and then detached from the tree, so memory stays bounded by the
+        largest single record instead of growing with the file. Produces the same
+        dictionary as parse_in_memory.
+        """
+        handle, should_close = self._open_stream()
+        state = {
+            'header': None,
+            'aggregator': SAFTAggregator(),
+            'totals': {
+                'invoice_count': 0,
+                'total_gross': Decimal('0.0'),
+                'total_net': Decimal('0.0'),
+                'total_tax': Decimal('0.0'),
+            },
+        }
+        path = []
+        elements = []
+        try:
+            for event, element in ET.iterparse(handle, events=('start', 'end')):
+                if event == 'start':
+                    local = self._local_name(element.tag)
+                    if not path:
+                        if local == 'article':
+                            # HTML-escaped SAF-T inside a wrapper document cannot be streamed
+                            logger.info("SAFT file wrapped in an article document, using the in-memory parser.")
+                            return self.parse_in_memory()
+                        if '}' in element.tag:
+                            self.ns['saf'] = element.tag.split('}')[0][1:]
+                            logger.info(f"Detected SAFT namespace: {self.ns['saf']}")
+                    path.append(local)
+                    elements.append(element)
+                    continue
+
+                depth = len(path)
+                if self._is_record(depth, path):
+                    self._handle_record(path, element, state)
+                    elements[-2].remove(element)
+                elif depth == 2 or (depth == 3 and path[1] in ('SourceDocuments', 'GeneralLedgerEntries')):
+                    # Section containers (MasterFiles, SalesInvoices, ...) hold only detached records
+                    elements[-2].remove(element)
+                path.pop()
+                elements.pop()
+
+            if state['header'] is None:
+                raise ValueError("SAFT Parse Error: Could not find the <Header> tag.")
+
+            totals = state['totals']
+            return {
+                'header': state['header'],
+                'summary': {
+                    'invoice_count': totals['invoice_count'],
+                    'total_gross': float(totals['total_gross']),
+                    'total_net': float(totals['total_net']),
+                    'total_tax': float(totals['total_tax']),
+                    'cancelled_count': state['aggregator'].cancelled_count,
+                    'customer_count': len(state['aggregator'].aggregates['customer']),
+                },
+                'aggregates': state['aggregator'].result(),
+            }
+        except ET.ParseError as e:
+            logger.error(f"XML Parsing Error: {e}")
+            raise ValueError(f"O ficheiro XML está malformado. Erro: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error during SAFT parsing: {e}", exc_info=True)
+            raise
+        finally:
+            if should_close:
+                handle.close()
+
+    # --- In-memory mode ---------------------------------------------------
+
+    def parse_in_memory(self):
+        """Reads the whole file and builds the full tree. Needed for HTML-wrapped uploads."""
         try:
             if hasattr(self.file_or_path, 'read'):
                 self.file_or_path.seek(0)
@@ -117,8 +385,16 @@ class SAFTParser:
 
             header = self._parse_header(root)
             summary = self._calculate_summary(root)
+
+            aggregator = SAFTAggregator()
+            for customer in root.iterfind('saf:MasterFiles/saf:Customer', self.ns):
+                aggregator.add_customer(customer)
+            for invoice in root.iterfind('.//saf:SalesInvoices/saf:Invoice', self.ns):
+                aggregator.add_invoice(invoice)
+            summary['cancelled_count'] = aggregator.cancelled_count
+            summary['customer_count'] = len(aggregator.aggregates['customer'])
             
-            return {'header': header, 'summary': summary}
+            return {'header': header, 'summary': summary, 'aggregates': aggregator.result()}
         
         except ET.ParseError as e:
             logger.error(f"XML Parsing Error: {e}")
@@ -0,0 +1,191 @@
+# api/services/streaming_export_service.py
+import codecs
+import csv
+import os
+import tempfile
+from copy import copy
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import Cell
+from openpyxl.utils import get_column_letter
+
+from django.db.models import QuerySet
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_CONTENT_TYPE = 'text/csv'
+
+# Até este tamanho o ficheiro gerado fica em memória; acima passa para disco
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+ITERATOR_CHUNK_SIZE = 2000
+CSV_CHUNK_SIZE = 64 * 1024
+
+
+def spooled_file():
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+
+def file_size(fileobj) -> int:
+    """Tamanho de um ficheiro aberto, sem o ler nem mexer na posição atual."""
+    position = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(position)
+    return size
+
+
+def iterate_rows(rows: Iterable, chunk_size: int = ITERATOR_CHUNK_SIZE) -> Iterator:
+    """Querysets são lidos com um cursor do servidor em vez de serem carregados de uma vez."""
+    if isinstance(rows, QuerySet):
+        return rows.iterator(chunk_size=chunk_size)
+    return iter(rows)
+
+
+class _Echo:
+    """Pseudo-ficheiro para o csv.writer: devolve a linha formatada em vez de a guardar."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows: Iterable[Sequence]) -> Iterator[bytes]:
+    """
+    CSV em UTF-8 com BOM (para o Excel abrir os acentos corretamente), em blocos de
+    ~64KB. Serve diretamente um StreamingHttpResponse ou a escrita para um ficheiro.
+    """
+    writer = csv.writer(_Echo())
+    yield codecs.BOM_UTF8
+    pending, size = [], 0
+    for row in rows:
+        line = writer.writerow(row)
+        pending.append(line)
+        size += len(line)
+        if size >= CSV_CHUNK_SIZE:
+            yield ''.join(pending).encode('utf-8')
+            pending, size = [], 0
+    if pending:
+        yield ''.join(pending).encode('utf-8')
+
+
+def write_csv(rows: Iterable[Sequence], output=None):
+    """Escreve as linhas num ficheiro temporário e devolve-o posicionado no início."""
+    output = output or spooled_file()
+    for chunk in iter_csv(rows):
+        output.write(chunk)
+    output.seek(0)
+    return output
+
+
+class StreamingSheet:
+    """
+    Folha de um StreamingWorkbook.
+
+    O openpyxl em modo write-only escreve as larguras das colunas antes da primeira
+    linha, por isso as primeiras WIDTH_SAMPLE_ROWS linhas ficam retidas enquanto se
+    acumula o comprimento máximo de cada coluna. A partir daí as larguras ficam
+    fixas e as linhas seguem diretamente para o ficheiro temporário da folha.
+    """
+
+    WIDTH_SAMPLE_ROWS = 1000
+    MAX_WIDTH = 80
+
+    def __init__(self, worksheet, min_width: int = 0, padding: int = 2):
+        self.worksheet = worksheet
+        self.min_width = min_width
+        self.padding = padding
+        self._lengths: List[int] = []
+        self._pending: Optional[List[List]] = []
+
+    def style(self, apply: Callable, **kwargs) -> Cell:
+        """
+        Célula modelo: `apply(cell, **kwargs)` corre uma única vez e as células
+        escritas com este modelo copiam-lhe o estilo já indexado no workbook.
+        """
+        template = WriteOnlyCell(self.worksheet)
+        apply(template, **kwargs)
+        return template
+
+    def append(self, values: Sequence, styles=None):
+        """
+        Acrescenta uma linha. `styles` é uma célula modelo para toda a linha ou uma
+        lista com um modelo (ou None) por coluna.
+        """
+        if self._pending is not None:
+            self._measure(values)
+        if styles is not None:
+            values = self._styled(values, styles)
+        if self._pending is not None:
+            self._pending.append(values)
+            if len(self._pending) >= self.WIDTH_SAMPLE_ROWS:
+                self.flush()
+        else:
+            self.worksheet.append(values)
+
+    def append_all(self, rows: Iterable[Sequence], styles=None) -> int:
+        count = 0
+        for values in rows:
+            self.append(values, styles)
+            count += 1
+        return count
+
+    def flush(self):
+        """Fixa as larguras das colunas e escreve as linhas retidas."""
+        if self._pending is None:
+            return
+        for index, length in enumerate(self._lengths, 1):
+            width = min(max(length + self.padding, self.min_width), self.MAX_WIDTH)
+            self.worksheet.column_dimensions[get_column_letter(index)].width = width
+        for values in self._pending:
+            self.worksheet.append(values)
+        self._pending = None
+
+    def _measure(self, values: Sequence):
+        lengths = self._lengths
+        for index, value in enumerate(values):
+            length = len(str(value)) if value is not None else 0
+            if index >= len(lengths):
+                lengths.append(length)
+            elif length > lengths[index]:
+                lengths[index] = length
+
+    def _styled(self, values: Sequence, styles) -> List:
+        if isinstance(styles, Cell):
+            styles = [styles] * len(values)
+        row = []
+        for value, template in zip(values, styles):
+            if template is None:
+                row.append(value)
+                continue
+            cell = WriteOnlyCell(self.worksheet, value=value)
+            cell._style = copy(template._style)
+            row.append(cell)
+        row.extend(values[len(row):])
+        return row
+
+
+class StreamingWorkbook:
+    """
+    Workbook XLSX em modo write-only (openpyxl), com memória limitada: cada folha é
+    escrita para um ficheiro temporário à medida que as linhas chegam e o XLSX
+    final vai para um ficheiro temporário que só passa para disco acima de
+    SPOOL_MAX_SIZE. Não suporta células unidas nem edição de linhas já escritas.
+    """
+
+    def __init__(self):
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self._sheets: List[StreamingSheet] = []
+
+    def sheet(self, title: str, min_width: int = 0, padding: int = 2) -> StreamingSheet:
+        sheet = StreamingSheet(self.workbook.create_sheet(title), min_width=min_width, padding=padding)
+        self._sheets.append(sheet)
+        return sheet
+
+    def save(self, output=None):
+        """Escreve o XLSX e devolve o ficheiro posicionado no início."""
+        for sheet in self._sheets:
+            sheet.flush()
+        output = output or spooled_file()
+        self.workbook.save(output)
+        output.seek(0)
+        return output
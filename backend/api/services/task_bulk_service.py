@@ -0,0 +1,55 @@
+# api/services/task_bulk_service.py
+from typing import Callable, List, Optional
+import logging
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from ..models import Task, TaskInvolvement, WorkflowHistory
+from .dashboard_counter_service import DashboardCounterService
+
+logger = logging.getLogger(__name__)
+
+
+class TaskBulkService:
+    """
+    Inserção de Tasks em bloco (bulk_create) com o que o Task.save e os signals de
+    post_save fariam para cada uma: histórico da atribuição do workflow, TaskInvolvement
+    e contadores do dashboard.
+    """
+
+    @staticmethod
+    def insert(
+        tasks: List[Task],
+        changed_by: Optional[User] = None,
+        history_comment: Optional[Callable[[Task], str]] = None,
+    ) -> List[Task]:
+        """
+        Insere as tarefas numa transação. As que violam uma restrição de unicidade
+        (ex.: unique_task_per_scanned_invoice) são descartadas em silêncio.
+
+        Returns:
+            As tarefas efetivamente inseridas, pela ordem recebida
+        """
+        if not tasks:
+            return []
+        with transaction.atomic():
+            Task.objects.bulk_create(tasks, ignore_conflicts=True)
+            # Com ignore_conflicts não há forma de saber quais entraram sem voltar a ler
+            inserted = set(Task.objects.filter(pk__in=[task.pk for task in tasks]).values_list('pk', flat=True))
+            created = [task for task in tasks if task.pk in inserted]
+            WorkflowHistory.objects.bulk_create([
+                WorkflowHistory(
+                    task=task,
+                    from_step=None,
+                    to_step=task.current_workflow_step,
+                    changed_by=changed_by,
+                    action='workflow_assigned',
+                    comment=history_comment(task) if history_comment else '',
+                )
+                for task in created if task.workflow_id
+            ])
+            # bulk_create não dispara o post_save destas tabelas derivadas
+            TaskInvolvement.add_for_new_tasks(created)
+            DashboardCounterService.record_created(created)
+        return created
@@ -0,0 +1,135 @@
+# api/services/upload_dedup_service.py
+from typing import Dict, Iterable, List, Optional
+import hashlib
+import logging
+import os
+
+from django.core.cache import cache
+from django.core.files.uploadhandler import FileUploadHandler
+
+from ..models import SAFTFile, ScannedInvoice
+
+logger = logging.getLogger(__name__)
+
+
+class ContentHashUploadHandler(FileUploadHandler):
+    """
+    Primeiro handler da cadeia de upload: calcula o SHA-256 de cada ficheiro à medida
+    que os blocos chegam e passa-os sem alterações aos handlers seguintes (memória ou
+    ficheiro temporário). O hash fica pronto sem uma segunda leitura do ficheiro.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests: Dict[str, List[tuple]] = {}
+        self._hasher = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self._hasher is not None:
+            self.digests.setdefault(self.field_name, []).append((self.file_name, self._hasher.hexdigest()))
+            self._hasher = None
+        # O ficheiro em si é criado pelos handlers seguintes
+        return None
+
+
+class UploadDedupService:
+    """
+    Deteção de uploads repetidos (SAF-T e faturas) pelo hash do conteúdo, dentro de cada
+    organização. Um ficheiro idêntico a um já processado reutiliza o resultado anterior
+    ou é marcado como duplicado sem voltar a passar pelo parser XML ou pelo OpenCV.
+    """
+
+    DECODE_RESULT_CACHE_KEY = 'invoice_decode_result_{organization_id}_{content_hash}'
+    DECODE_RESULT_TIMEOUT = 60 * 60 * 24 * 30
+
+    @staticmethod
+    def install_hash_handler(request) -> None:
+        """Coloca o ContentHashUploadHandler à frente da cadeia (antes de o corpo ser lido)."""
+        if request.method == 'POST':
+            request.upload_handlers.insert(0, ContentHashUploadHandler(request))
+
+    @staticmethod
+    def hash_file(uploaded_file) -> str:
+        """Hash lendo o ficheiro; só usado quando o handler não esteve ativo no upload."""
+        hasher = hashlib.sha256()
+        for chunk in uploaded_file.chunks():
+            hasher.update(chunk)
+        uploaded_file.seek(0)
+        return hasher.hexdigest()
+
+    @classmethod
+    def upload_hashes(cls, request, field_name: str) -> List[str]:
+        """Hashes dos ficheiros de um campo do upload, pela ordem de request.FILES.getlist()."""
+        files = request.FILES.getlist(field_name)
+        handler = next((h for h in request.upload_handlers if isinstance(h, ContentHashUploadHandler)), None)
+        recorded = handler.digests.get(field_name, []) if handler else []
+        hashes = []
+        for index, uploaded_file in enumerate(files):
+            if index < len(recorded) and os.path.basename(recorded[index][0] or '') == uploaded_file.name:
+                hashes.append(recorded[index][1])
+            else:
+                hashes.append(cls.hash_file(uploaded_file))
+        return hashes
+
+    @staticmethod
+    def find_saft_file(organization, content_hash: str) -> Optional[SAFTFile]:
+        """SAF-T idêntico já enviado pela organização (concluído ou ainda em processamento)."""
+        if not content_hash:
+            return None
+        return SAFTFile.objects.filter(
+            organization=organization, content_hash=content_hash
+        ).exclude(status='ERROR').order_by('-uploaded_at').first()
+
+    @staticmethod
+    def completed_invoices_by_hash(organization, hashes: Iterable[str]) -> Dict[str, ScannedInvoice]:
+        """Faturas concluídas da organização com o mesmo conteúdo, indexadas pelo hash."""
+        hashes = [content_hash for content_hash in set(hashes) if content_hash]
+        if not hashes:
+            return {}
+        invoices = {}
+        for invoice in ScannedInvoice.objects.filter(
+            organization=organization, status='COMPLETED', content_hash__in=hashes
+        ).order_by('created_at').only('id', 'atcud', 'content_hash', 'original_file'):
+            invoices.setdefault(invoice.content_hash, invoice)
+        return invoices
+
+    @classmethod
+    def cached_decode_result(cls, organization_id, content_hash: Optional[str]) -> Optional[Dict]:
+        if not content_hash:
+            return None
+        try:
+            return cache.get(cls.DECODE_RESULT_CACHE_KEY.format(organization_id=organization_id, content_hash=content_hash))
+        except Exception as e:
+            logger.warning(f"Não foi possível ler a cache de descodificação ({content_hash}): {e}")
+            return None
+
+    @classmethod
+    def store_decode_result(cls, organization_id, content_hash: Optional[str], result: Dict) -> None:
+        """Guarda o resultado do QR Code; só descodificações com ATCUD (uma falha pode ser do orçamento de tempo)."""
+        if not content_hash or result.get('reused') or not result.get('invoice_data', {}).get('atcud'):
+            return
+        try:
+            cache.set(
+                cls.DECODE_RESULT_CACHE_KEY.format(organization_id=organization_id, content_hash=content_hash),
+                result, timeout=cls.DECODE_RESULT_TIMEOUT
+            )
+        except Exception as e:
+            logger.warning(f"Não foi possível guardar o resultado de descodificação ({content_hash}): {e}")
+
+    @staticmethod
+    def reused_result(result: Dict) -> Dict:
+        """Cópia do resultado em cache com a indicação de reutilização no registo."""
+        return {
+            **result,
+            'reused': True,
+            'processing_log': ["Resultado reutilizado de um ficheiro idêntico já processado."]
+                              + list(result.get('processing_log', [])),
+        }
@@ -59,7 +59,7 @@ class WorkflowService:
             possible_next_steps = []
 
         if not possible_next_steps:
-            task.current_workflow_step = None
+            task.enter_workflow_step(None)
             if task.status != 'completed':
                 task.status = 'completed'
                 task.completed_at = timezone.now()
@@ -94,7 +94,7 @@ class WorkflowService:
             return False, "Múltiplos próximos passos disponíveis. Requer escolha manual."
 
         if actual_next_step:
-            task.current_workflow_step = actual_next_step
+            task.enter_workflow_step(actual_next_step)
             task.workflow_comment = comment_for_advance
             task.save(update_fields=['current_workflow_step', 'workflow_comment'])
             
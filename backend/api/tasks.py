@@ -1,11 +1,14 @@
 from celery import shared_task
 from django.utils import timezone
+from django.core.cache import cache
 from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
 import logging
 from django.conf import settings # Moved up
 
 from .models import (
-    Organization, Task, Profile, WorkflowHistory, TaskApproval, 
+    Organization, Task, Profile, TaskApproval, 
     NotificationDigest, WorkflowNotification, FiscalObligationDefinition,
     FiscalSystemSettings
 )
@@ -16,16 +19,26 @@ from .services.notification_escalation import NotificationEscalationService
 from .services.fiscal_obligation_service import FiscalObligationGenerator
 from .services.fiscal_notification_service import FiscalNotificationService
 from .models import GeneratedReport
-from .utils import update_profitability_for_period, update_client_profitability
+from .services.profitability_service import ProfitabilityEngine, ProfitabilityDeltaQueue
+from .services.dashboard_counter_service import DashboardCounterService
+from .services.notification_counter_service import NotificationCounterService
 from dateutil.relativedelta import relativedelta
-from .models import Client
 from .services.saft_parser import SAFTParser
 from .models import SAFTFile
+from .services.saft_analytics_service import SAFTAnalyticsService
+from django.core.files.base import File
 from django.core.files.storage import default_storage
+from django.utils.dateparse import parse_datetime
+from .services.report_generation_service import ReportGenerationService
+from .services.streaming_export_service import file_size
+import uuid
 logger = logging.getLogger(__name__)
 # In api/tasks.py
 from .services.qr_code_parser import QRCodeParser
-from .models import ScannedInvoice
+from .models import ScannedInvoice, InvoiceBatch
+from .services.invoice_batch_service import InvoiceBatchProcessor, InvoiceBatchTaskCreator
+from .services.upload_dedup_service import UploadDedupService
+from .services.expense_categorization_service import ExpenseCategorizationService
 
 # Add this import at the top of tasks.py
 from datetime import datetime
@@ -50,12 +63,17 @@ def process_invoice_file_task(self, invoice_id):
         if not invoice.original_file:
             raise FileNotFoundError("Original file not associated with the invoice record.")
         
-        with default_storage.open(invoice.original_file.name, 'rb') as f:
-            file_content = f.read()
-
-        # Process using the enhanced processor
-        processor = EnhancedQRProcessor()
-        result = processor.process_image(file_content)  # Now properly handles bytes
+        # An identical file already decoded in this organization reuses its QR result
+        organization_id = invoice.batch.organization_id
+        result = UploadDedupService.cached_decode_result(organization_id, invoice.content_hash)
+        if result is not None:
+            result = UploadDedupService.reused_result(result)
+        else:
+            # Process using the enhanced processor (images and PDFs; PDFs are read page by page)
+            processor = EnhancedQRProcessor()
+            with default_storage.open(invoice.original_file.name, 'rb') as f:
+                result = processor.process_file(f, filename=invoice.original_filename)
+            UploadDedupService.store_decode_result(organization_id, invoice.content_hash, result)
         
         # Extract the parsed data
         parsed_data = result.get('invoice_data', {})
@@ -72,122 +90,33 @@ def process_invoice_file_task(self, invoice_id):
             logger.warning(f"No valid ATCUD QR code found for invoice {invoice.id}")
             return {"status": "error", "message": "No valid QR code found."}
 
-        # --- DUPLICATE CHECK LOGIC ---
-        atcud_code = parsed_data.get('atcud')
-        
-        # Check if another invoice in the same organization already has this ATCUD
-        existing_invoice = ScannedInvoice.objects.filter(
-            batch__organization=invoice.batch.organization,
-            atcud=atcud_code,
-            status='COMPLETED'  # Only check against successfully completed invoices
-        ).exclude(id=invoice.id).first()
-
-        if existing_invoice:
+        # --- SAVE WITH DUPLICATE DETECTION ---
+        # The partial unique constraint on (organization, atcud) for completed invoices
+        # rejects duplicates, including two workers decoding the same invoice at once
+        InvoiceBatchProcessor.apply_decode_result(invoice, result)
+        atcud_code = invoice.atcud
+        try:
+            with transaction.atomic():
+                invoice.save()
+        except IntegrityError as e:
+            if not ScannedInvoice.is_duplicate_atcud_error(e):
+                raise
+            existing_invoice = ScannedInvoice.objects.filter(
+                organization_id=invoice.organization_id, atcud=atcud_code, status='COMPLETED'
+            ).exclude(id=invoice.id).first()
+            existing_id = existing_invoice.id if existing_invoice else None
             # Duplicate found! Mark this one as an error and stop.
-            invoice.status = 'ERROR'
-            invoice.processing_log = f"Fatura duplicada. O ATCUD '{atcud_code}' já existe no sistema (Fatura ID: {existing_invoice.id})."
-            invoice.save()
-            logger.warning(f"Duplicate invoice detected for ATCUD {atcud_code}. Original: {existing_invoice.id}, New: {invoice.id}")
-            return {"status": "duplicate", "invoice_id": invoice.id, "original_invoice_id": existing_invoice.id}
-        
-        # --- NO DUPLICATE FOUND - PROCEED WITH SAVING ---
-        # Map the extracted data to model fields
-        if 'nif_emitter' in parsed_data:
-            invoice.nif_emitter = parsed_data['nif_emitter']
-        if 'nif_acquirer' in parsed_data:
-            invoice.nif_acquirer = parsed_data['nif_acquirer']
-        if 'country_code' in parsed_data:
-            invoice.country_code = parsed_data['country_code']
-        if 'doc_type' in parsed_data:
-            invoice.doc_type = parsed_data['doc_type']
-        if 'doc_date' in parsed_data:
-            # Handle date conversion if it's a string
-            doc_date = parsed_data['doc_date']
-            if isinstance(doc_date, str):
-                try:
-                    invoice.doc_date = datetime.strptime(doc_date, '%Y-%m-%d').date()
-                except ValueError:
-                    try:
-                        invoice.doc_date = datetime.strptime(doc_date, '%d-%m-%Y').date()
-                    except ValueError:
-                        logger.warning(f"Could not parse date: {doc_date}")
-            else:
-                invoice.doc_date = doc_date
-        if 'doc_uid' in parsed_data:
-            invoice.doc_uid = parsed_data['doc_uid']
-        if 'atcud' in parsed_data:
-            invoice.atcud = parsed_data['atcud']
-        if 'taxable_amount' in parsed_data:
-            invoice.taxable_amount = parsed_data['taxable_amount']
-        if 'vat_amount' in parsed_data:
-            invoice.vat_amount = parsed_data['vat_amount']
-        if 'gross_total' in parsed_data:
-            invoice.gross_total = parsed_data['gross_total']
-        
-        # Store raw QR data
-        if 'raw_qr_code_data' in parsed_data:
-            invoice.raw_qr_code_data = parsed_data['raw_qr_code_data']
-        elif result.get('raw_qr_data'):
-            invoice.raw_qr_code_data = result['raw_qr_data'][0] if result['raw_qr_data'] else ''
-        
-        # Set status based on results
-        if parsed_data and any(key in parsed_data for key in ['atcud', 'gross_total', 'nif_emitter']):
-            invoice.status = 'COMPLETED'
-            invoice.processing_log = "Dados extraídos com sucesso do QR Code."
-        else:
-            invoice.status = 'REVIEW'  # Needs manual review
-            invoice.processing_log = "QR Code encontrado mas alguns dados podem precisar de revisão."
-        
-        invoice.save()
+            ScannedInvoice.objects.filter(id=invoice.id).update(
+                status='ERROR',
+                processing_log=f"Fatura duplicada. O ATCUD '{atcud_code}' já existe no sistema (Fatura ID: {existing_id})."
+            )
+            logger.warning(f"Duplicate invoice detected for ATCUD {atcud_code}. Original: {existing_id}, New: {invoice.id}")
+            return {"status": "duplicate", "invoice_id": invoice.id, "original_invoice_id": existing_id}
         
         logger.info(f"Finished processing for invoice {invoice_id}. Status: {invoice.status}")
 
-        invoice = ScannedInvoice.objects.get(id=invoice_id)
-        if invoice.status == 'COMPLETED':
-            try:
-                # Step 1: Auto-categorize and create Expense
-                category = ExpenseCategorizationService.categorize_from_invoice(invoice)
-                client = invoice.batch.organization.clients.filter(nif=invoice.nif_acquirer).first()
-                
-                Expense.objects.create(
-                    organization=invoice.batch.organization,
-                    client=client, # Link to client if NIF matches
-                    amount=invoice.gross_total,
-                    description=f"Fatura de {invoice.original_filename}",
-                    category=category,
-                    date=invoice.doc_date,
-                    is_auto_categorized=True,
-                    source_scanned_invoice=invoice
-                )
-                logger.info(f"Expense created and categorized as '{category}' for invoice {invoice.id}")
-
-                # Step 2: Auto-create a bookkeeping task
-                if client:
-                    task_title = f"Lançamento Contabilístico - Fatura {invoice.atcud}"
-                    task_description = (
-                        f"Realizar o lançamento contabilístico da fatura de {invoice.original_filename}.\n"
-                        f"Valor: {invoice.gross_total}€\n"
-                        f"NIF Emissor: {invoice.nif_emitter}\n"
-                        f"Categoria Sugerida: {category}"
-                    )
-                    
-                    # Assign to the client's account manager or a default user
-                    assignee = client.account_manager or invoice.batch.uploaded_by
-
-                    Task.objects.create(
-                        client=client,
-                        title=task_title,
-                        description=task_description,
-                        assigned_to=assignee,
-                        priority=4 # Low priority by default
-                    )
-                    logger.info(f"Bookkeeping task created for invoice {invoice.id} and client {client.name}")
-
-            except Exception as e:
-                logger.error(f"Error in post-processing for invoice {invoice.id}: {e}", exc_info=True)
-                # Don't fail the entire task, just log the error. The main invoice data is already saved.
-                invoice.processing_log += f"\nErro na automação pós-processamento: {str(e)}"
-                invoice.save(update_fields=['processing_log'])
+        # Expense and bookkeeping task, shared with the batch path
+        InvoiceBatchProcessor.create_follow_ups([invoice], invoice.batch)
         
         return {"status": "success", "invoice_id": invoice.id}
     except ScannedInvoice.DoesNotExist:
@@ -204,7 +133,66 @@ def process_invoice_file_task(self, invoice_id):
             pass  # Nothing to do if it's already gone
         self.retry(exc=e)
 
-    
+
+
+@shared_task(bind=True, max_retries=1, default_retry_delay=120)
+def process_invoice_batch_task(self, batch_id):
+    """
+    Processes every pending invoice of an InvoiceBatch in one task, decoding the
+    files in a process pool. Progress is published for batch_status.
+    """
+    logger.info(f"Starting batch invoice processing for batch: {batch_id}")
+    try:
+        progress = InvoiceBatchProcessor.process_batch(batch_id)
+        return {"status": "success", "batch_id": str(batch_id), **progress}
+    except InvoiceBatch.DoesNotExist:
+        logger.error(f"Invoice batch {batch_id} not found.")
+        return {"status": "error", "message": f"Invoice batch {batch_id} not found."}
+    except Exception as e:
+        logger.error(f"Error processing invoice batch {batch_id}: {e}", exc_info=True)
+        # Invoices left in PROCESSING go back to PENDING so the retry picks them up
+        ScannedInvoice.objects.filter(batch_id=batch_id, status='PROCESSING').update(status='PENDING')
+        self.retry(exc=e)
+
+
+
+@shared_task
+def create_invoice_batch_tasks_task(batch_id, user_id, task_data, invoice_ids):
+    """
+    Creates the bookkeeping tasks for a large set of invoices of an InvoiceBatch
+    (create_batch_tasks at or above InvoiceBatchTaskCreator.ASYNC_THRESHOLD invoices).
+    Progress is published for batch_status.
+    """
+    from django.contrib.auth.models import User
+
+    try:
+        batch = InvoiceBatch.objects.get(id=batch_id)
+        user = User.objects.select_related('profile').get(id=user_id)
+    except (InvoiceBatch.DoesNotExist, User.DoesNotExist) as e:
+        logger.error(f"Batch task creation aborted for batch {batch_id}: {e}")
+        return {"status": "error", "message": str(e)}
+
+    creator = InvoiceBatchTaskCreator(batch, user, task_data)
+    invoices = list(InvoiceBatchTaskCreator.eligible_invoices(batch, invoice_ids))
+    result = creator.create(invoices)
+    return {
+        "status": "success", "batch_id": str(batch_id),
+        "tasks_created": result['tasks_created'], "tasks_failed": result['tasks_failed'],
+    }
+
+
+@shared_task
+def categorize_pending_expenses_task(organization_id):
+    """
+    Categorizes the auto-created expenses of an organization that the local tier could
+    not resolve, sending the unknown issuers to Gemini in batched prompts.
+    Scheduled (debounced) by process_invoice_file_task.
+    """
+    cache.delete(ExpenseCategorizationService.SCHEDULE_CACHE_KEY.format(organization_id=organization_id))
+    categorized = ExpenseCategorizationService.categorize_pending(organization_id)
+    if categorized:
+        logger.info(f"Categorized {categorized} pending expenses for organization {organization_id}.")
+    return {"organization_id": str(organization_id), "expenses_categorized": categorized}
         
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
 def process_saft_file_task(self, saft_file_id):
@@ -220,7 +208,7 @@ def process_saft_file_task(self, saft_file_id):
             parser = SAFTParser(f)
             parsed_data = parser.parse()
 
-        logger.info(f"TASK INFO: Parsed data for {saft_file_id}: {parsed_data}")
+        logger.info(f"TASK INFO: Parsed data for {saft_file_id}: header={parsed_data.get('header')} summary={parsed_data.get('summary')}")
 
         header = parsed_data.get('header', {})
         summary = parsed_data.get('summary', {})
@@ -237,6 +225,7 @@ def process_saft_file_task(self, saft_file_id):
         saft_instance.company_name = header.get('company_name')
         saft_instance.company_tax_id = header.get('company_tax_id')
         saft_instance.summary_data = summary
+        SAFTAnalyticsService.store(saft_instance, parsed_data.get('aggregates'))
 
         saft_instance.status = 'COMPLETED'
         saft_instance.processed_at = timezone.now()
@@ -261,6 +250,17 @@ def process_saft_file_task(self, saft_file_id):
         # Retry the task with exponential backoff
         self.retry(exc=e)
 
+
+def _report_datetime(value):
+    """Report parameters arrive as ISO strings from the API; date-only values start at midnight."""
+    if not value or isinstance(value, datetime):
+        return value or None
+    parsed = parse_datetime(value) or parse_datetime(f"{value}T00:00:00")
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
 @shared_task(bind=True, max_retries=3)
 def generate_report_task(self, report_id):
     """
@@ -284,7 +284,7 @@ def generate_report_task(self, report_id):
         if report.report_type == 'client_summary':
             file_buffer, content_type = ReportGenerationService.generate_client_summary_report(
                 organization=organization, client_ids=params.get('client_ids'),
-                date_from=params.get('date_from'), date_to=params.get('date_to'),
+                date_from=_report_datetime(params.get('date_from')), date_to=_report_datetime(params.get('date_to')),
                 format_type=report_format
             )
         elif report.report_type == 'profitability_analysis':
@@ -293,6 +293,19 @@ def generate_report_task(self, report_id):
                 year=params.get('year'), month=params.get('month'),
                 format_type=report_format
             )
+        elif report.report_type == 'time_tracking_summary':
+            file_buffer, content_type = ReportGenerationService.generate_time_tracking_summary_report(
+                organization=organization, user_ids=params.get('user_ids'), client_ids=params.get('client_ids'),
+                date_from=_report_datetime(params.get('date_from')), date_to=_report_datetime(params.get('date_to')),
+                format_type=report_format
+            )
+        elif report.report_type == 'task_performance':
+            file_buffer, content_type = ReportGenerationService.generate_task_performance_report(
+                organization=organization, client_ids=params.get('client_ids'), user_ids=params.get('user_ids'),
+                category_ids=params.get('category_ids'), statuses=params.get('statuses'),
+                date_from=_report_datetime(params.get('date_from')), date_to=_report_datetime(params.get('date_to')),
+                format_type=report_format
+            )
         # ... Add other report types here ...
         else:
             raise ValueError(f"Report type '{report.report_type}' not implemented for async generation.")
@@ -301,16 +314,19 @@ def generate_report_task(self, report_id):
             raise ValueError("Report generation service returned an empty file buffer.")
 
         # --- Save the generated file to storage ---
+        # The buffer may be a spooled temporary file (CSV/XLSX): storage reads it in chunks
+        # instead of copying the whole content into memory.
         file_extension = report_format
         filename = f"reports/{organization.id}/{uuid.uuid4()}.{file_extension}"
         
-        file_content = ContentFile(file_buffer.getvalue())
-        saved_file_path = default_storage.save(filename, file_content)
+        with file_buffer:
+            size = file_size(file_buffer)
+            saved_file_path = default_storage.save(filename, File(file_buffer, name=filename))
         storage_url = default_storage.url(saved_file_path)
 
         # --- Update the report instance with the final details ---
         report.storage_url = storage_url
-        report.file_size_kb = len(file_buffer.getvalue()) // 1024
+        report.file_size_kb = size // 1024
         report.status = 'COMPLETED'
         report.save()
 
@@ -352,6 +368,7 @@ def generate_report_task(self, report_id):
 def update_profitability_for_single_organization_task(organization_id, months_to_update_list):
     """
     Updates client profitability for a specific organization for specified months.
+    All client-months are computed with grouped aggregates and written in one bulk upsert.
     
     Args:
         organization_id: The ID of the organization to process.
@@ -361,24 +378,9 @@ def update_profitability_for_single_organization_task(organization_id, months_to
         organization = Organization.objects.get(id=organization_id)
         logger.info(f"Starting profitability update task for organization: {organization.name} ({organization_id})")
         
-        total_clients_processed_overall = 0
-        
-        for year, month in months_to_update_list:
-            org_clients = Client.objects.filter(organization=organization, is_active=True)
-            clients_updated_this_period = 0
-            logger.info(f"Processing period: {month:02d}/{year} for org: {organization.name}")
-            
-            for client_instance in org_clients:
-                try:
-                    result = update_client_profitability(client_instance.id, year, month)
-                    if result:
-                        clients_updated_this_period += 1
-                except Exception as e:
-                    logger.error(f"Error updating profitability for client {client_instance.id} "
-                                 f"in org {organization.id} for period {month}/{year}: {e}", exc_info=True)
-            
-            logger.info(f"Profitability updated for {clients_updated_this_period} clients in org {organization.name} for period {month:02d}/{year}.")
-            total_clients_processed_overall += clients_updated_this_period
+        total_clients_processed_overall = sum(ProfitabilityEngine.recompute(
+            months_to_update_list, organization=organization
+        ).values())
 
         logger.info(f"Finished profitability update task for organization: {organization.name}. Total client-month records updated: {total_clients_processed_overall}")
         return {
@@ -400,21 +402,99 @@ def update_profitability_for_single_organization_task(organization_id, months_to
 def update_client_profitability_globally_task():
     logger.info("Starting global client profitability update task.")
     now = timezone.now()
-    current_month_year = now.year
-    current_month_month = now.month
-    
-    # Update for current month
-    updated_current = update_profitability_for_period(current_month_year, current_month_month)
-    logger.info(f"Updated profitability for {updated_current} client-month records for {current_month_month}/{current_month_year}.")
-
-    # Optionally, update for previous month to catch late entries
+    current_period = (now.year, now.month)
+    # Also recompute the previous month to catch late entries
     prev_month_date = now - relativedelta(months=1)
-    prev_month_year = prev_month_date.year
-    prev_month_month = prev_month_date.month
-    updated_prev = update_profitability_for_period(prev_month_year, prev_month_month)
-    logger.info(f"Updated profitability for {updated_prev} client-month records for {prev_month_month}/{prev_month_year}.")
+    previous_period = (prev_month_date.year, prev_month_date.month)
+
+    updated = ProfitabilityEngine.recompute([current_period, previous_period])
+    logger.info(f"Updated profitability for {updated[current_period]} client records for {current_period[1]}/{current_period[0]} and {updated[previous_period]} for {previous_period[1]}/{previous_period[0]}.")
     logger.info("Finished global client profitability update task.")
-    return {"current_month_updated": updated_current, "previous_month_updated": updated_prev}
+    return {"current_month_updated": updated[current_period], "previous_month_updated": updated[previous_period]}
+
+
+@shared_task
+def apply_profitability_deltas_task(max_batches=50):
+    """
+    Applies the queued ClientProfitabilityDelta rows written by the TimeEntry/Expense signals.
+    Scheduled (debounced) after each commit and also run every minute as a safety net.
+    """
+    cache.delete(ProfitabilityDeltaQueue.SCHEDULE_CACHE_KEY)
+    applied = 0
+    for _ in range(max_batches):
+        consumed = ProfitabilityDeltaQueue.apply_pending()
+        if not consumed:
+            break
+        applied += consumed
+    if applied:
+        logger.info(f"Applied {applied} profitability deltas.")
+    return {"deltas_applied": applied}
+
+
+@shared_task
+def reconcile_client_profitability_task(months_back=12, organization_id=None):
+    """
+    Weekly full recompute of the last `months_back` months compared against the
+    incrementally maintained records. Drifted or missing rows are corrected and reported.
+    """
+    now = timezone.now()
+    periods = []
+    for offset in range(months_back):
+        period_date = now - relativedelta(months=offset)
+        periods.append((period_date.year, period_date.month))
+
+    organization = None
+    if organization_id:
+        try:
+            organization = Organization.objects.get(id=organization_id)
+        except Organization.DoesNotExist:
+            logger.error(f"Organization with ID {organization_id} not found for profitability reconciliation.")
+            return {"status": "error", "message": f"Organization {organization_id} not found."}
+
+    # Pending deltas would show up as drift
+    apply_profitability_deltas_task()
+    report = ProfitabilityEngine.reconcile(periods, organization=organization)
+    logger.info(
+        f"Profitability reconciliation finished: {report['records_checked']} checked, "
+        f"{report['records_drifted']} drifted, {report['records_missing']} missing."
+    )
+    return report
+
+
+@shared_task
+def rollover_dashboard_counters_task(rebuild=False):
+    """
+    Midnight rollover of the DashboardCounter rows (past deadlines folded, old history pruned).
+    With rebuild=True every organization's counters are recomputed from the source tables.
+    """
+    if not rebuild:
+        return DashboardCounterService.rollover()
+    rebuilt = 0
+    for organization_id in Organization.objects.filter(is_active=True).values_list('id', flat=True):
+        try:
+            DashboardCounterService.rebuild(organization_id)
+            rebuilt += 1
+        except Exception as e:
+            logger.error(f"Error rebuilding dashboard counters for organization {organization_id}: {e}", exc_info=True)
+    logger.info(f"Dashboard counters rebuilt for {rebuilt} organizations.")
+    return {"organizations_rebuilt": rebuilt}
+
+
+@shared_task
+def reconcile_notification_counters_task():
+    """
+    Recomputes the cached notification counters of every user that has them and reports
+    how many had drifted (deletes and other changes that bypass the signals).
+    """
+    try:
+        result = NotificationCounterService.reconcile()
+    except Exception as e:
+        logger.error(f"Error reconciling notification counters: {e}", exc_info=True)
+        return {'status': 'error', 'message': str(e)}
+    if result['drifted']:
+        logger.warning(f"Notification counters drifted for {result['drifted']} of {result['reconciled']} users.")
+    logger.info(f"Notification counters reconciled for {result['reconciled']} users.")
+    return {'status': 'success', **result}
 
 
 @shared_task(bind=True, max_retries=3)
@@ -744,121 +824,97 @@ def check_upcoming_deadlines_and_notify_task():
 
 @shared_task
 def check_overdue_steps_and_notify_task(default_overdue_threshold_days=3):
+    """
+    Notifies about workflow steps a task has been on for at least the threshold.
+    Task.current_step_entered_at turns this into one indexed range query per run.
+    """
     logger.info(f"Starting task: check_overdue_steps_and_notify_task (threshold: {default_overdue_threshold_days} days)")
     now = timezone.now()
     notifications_created_total = 0
     tasks_processed_total = 0
-    organizations_processed = 0
-
-    for org in Organization.objects.filter(is_active=True):
-        organizations_processed += 1
-        logger.debug(f"Processing overdue steps for organization: {org.name} ({org.id})")
-        
-        # In a real system, overdue_threshold_days might come from Organization settings
-        # For now, we use the task parameter.
-        overdue_threshold_days = default_overdue_threshold_days 
-
-        active_workflow_tasks = Task.objects.filter(
-            client__organization=org,
-            status__in=['pending', 'in_progress'],
-            workflow__isnull=False,
-            current_workflow_step__isnull=False
-        ).select_related(
-            'current_workflow_step', 
-            'current_workflow_step__assign_to', 
-            'assigned_to', 
-            'created_by', 
-            'client', 
-            'client__account_manager'
-        )
-
-        for task_item in active_workflow_tasks: # Renamed to avoid conflict
-            tasks_processed_total += 1
-            
-            last_significant_history = WorkflowHistory.objects.filter(
-                task=task_item, 
-                to_step=task_item.current_workflow_step,
-                action__in=['step_advanced', 'workflow_assigned'] 
-            ).order_by('-created_at').first()
-
-            step_became_current_at = task_item.updated_at 
-            if last_significant_history:
-                step_became_current_at = last_significant_history.created_at
-            
-            days_on_current_step = (now - step_became_current_at).days
-
-            if days_on_current_step >= overdue_threshold_days:
-                logger.debug(f"Task {task_item.id} ({task_item.title}) step '{task_item.current_workflow_step.name}' is {days_on_current_step} days overdue (threshold: {overdue_threshold_days}). Notifying.")
-                notifications = NotificationService.notify_step_overdue(task_item, task_item.current_workflow_step, days_on_current_step)
-                if notifications:
-                    notifications_created_total += len(notifications)
-        
-    logger.info(f"Finished task: check_overdue_steps_and_notify_task. Orgs processed: {organizations_processed}. Tasks checked: {tasks_processed_total}. Notifications created: {notifications_created_total}.")
+    organization_ids = set()
+
+    # In a real system, overdue_threshold_days might come from Organization settings
+    # For now, we use the task parameter.
+    overdue_threshold_days = default_overdue_threshold_days
+    overdue_tasks = Task.objects.filter(
+        client__organization__is_active=True,
+        status__in=['pending', 'in_progress'],
+        workflow__isnull=False,
+        current_workflow_step__isnull=False,
+        current_step_entered_at__lte=now - timedelta(days=overdue_threshold_days)
+    ).select_related(
+        'current_workflow_step', 
+        'current_workflow_step__assign_to', 
+        'assigned_to', 
+        'created_by', 
+        'client', 
+        'client__account_manager'
+    ).order_by('current_step_entered_at')
+
+    for task_item in overdue_tasks.iterator(chunk_size=500):
+        tasks_processed_total += 1
+        organization_ids.add(task_item.client.organization_id)
+        days_on_current_step = (now - task_item.current_step_entered_at).days
+        logger.debug(f"Task {task_item.id} ({task_item.title}) step '{task_item.current_workflow_step.name}' is {days_on_current_step} days overdue (threshold: {overdue_threshold_days}). Notifying.")
+        notifications = NotificationService.notify_step_overdue(task_item, task_item.current_workflow_step, days_on_current_step)
+        if notifications:
+            notifications_created_total += len(notifications)
+
+    logger.info(f"Finished task: check_overdue_steps_and_notify_task. Orgs with overdue steps: {len(organization_ids)}. Overdue tasks: {tasks_processed_total}. Notifications created: {notifications_created_total}.")
     return {
         'status': 'success',
-        'organizations_processed': organizations_processed,
+        'organizations_processed': len(organization_ids),
         'tasks_with_active_workflow_step_checked': tasks_processed_total,
         'overdue_step_notifications_created': notifications_created_total
     }
 
 @shared_task
 def check_pending_approvals_and_remind_task(default_reminder_threshold_days=2):
+    """
+    Reminds approvers of steps still unapproved after the threshold, selected with one
+    range query on Task.current_step_entered_at (approved steps excluded in SQL).
+    """
     logger.info(f"Starting task: check_pending_approvals_and_remind_task (reminder threshold: {default_reminder_threshold_days} days)")
     now = timezone.now()
     notifications_sent_total = 0
     tasks_checked_count = 0
-    organizations_processed = 0
-
-    for org in Organization.objects.filter(is_active=True):
-        organizations_processed += 1
-        logger.debug(f"Processing pending approvals for organization: {org.name} ({org.id})")
-        
-        reminder_threshold_days = default_reminder_threshold_days
-
-        candidate_tasks = Task.objects.filter(
-            client__organization=org,
-            status__in=['pending', 'in_progress'],
-            current_workflow_step__requires_approval=True
-        ).select_related(
-            'current_workflow_step', 
-            'client', 
-            'client__organization' 
-        ).prefetch_related('approvals') 
-
-        for task_item in candidate_tasks: # Renamed
-            tasks_checked_count += 1
-            
-            is_current_step_approved = any(
-                app.workflow_step_id == task_item.current_workflow_step_id and app.approved
-                for app in task_item.approvals.all() 
-            )
-
-            if is_current_step_approved:
-                continue
-
-            step_became_current_history = WorkflowHistory.objects.filter(
-                task=task_item, to_step=task_item.current_workflow_step,
-                action__in=['step_advanced', 'workflow_assigned']
-            ).order_by('-created_at').first()
-
-            if step_became_current_history:
-                days_pending_approval = (now - step_became_current_history.created_at).days
-                if days_pending_approval >= reminder_threshold_days:
-                    logger.debug(f"Task {task_item.id} ({task_item.title}) step '{task_item.current_workflow_step.name}' pending approval for {days_pending_approval} days. Sending reminder.")
-                    reminders = NotificationService.notify_approval_needed(
-                        task_item, task_item.current_workflow_step, 
-                        approvers=None, 
-                        is_reminder=True
-                    )
-                    if reminders:
-                        notifications_sent_total += len(reminders)
-            else:
-                logger.warning(f"Task {task_item.id} has current_workflow_step {task_item.current_workflow_step.id} requiring approval, but no history record of it becoming current.")
+    organization_ids = set()
+
+    reminder_threshold_days = default_reminder_threshold_days
+    current_step_approved = TaskApproval.objects.filter(
+        task=OuterRef('pk'), workflow_step=OuterRef('current_workflow_step'), approved=True
+    )
+    candidate_tasks = Task.objects.filter(
+        client__organization__is_active=True,
+        status__in=['pending', 'in_progress'],
+        current_workflow_step__requires_approval=True,
+        current_step_entered_at__lte=now - timedelta(days=reminder_threshold_days)
+    ).exclude(
+        Exists(current_step_approved)
+    ).select_related(
+        'current_workflow_step', 
+        'client', 
+        'client__organization' 
+    ).order_by('current_step_entered_at')
+
+    for task_item in candidate_tasks.iterator(chunk_size=500):
+        tasks_checked_count += 1
+        organization_ids.add(task_item.client.organization_id)
+        days_pending_approval = (now - task_item.current_step_entered_at).days
+        logger.debug(f"Task {task_item.id} ({task_item.title}) step '{task_item.current_workflow_step.name}' pending approval for {days_pending_approval} days. Sending reminder.")
+        reminders = NotificationService.notify_approval_needed(
+            task_item, task_item.current_workflow_step, 
+            approvers=None, 
+            is_reminder=True
+        )
+        if reminders:
+            notifications_sent_total += len(reminders)
 
-    logger.info(f"Finished task: check_pending_approvals_and_remind_task. Orgs processed: {organizations_processed}. Tasks checked: {tasks_checked_count}. Reminders sent: {notifications_sent_total}.")
+    logger.info(f"Finished task: check_pending_approvals_and_remind_task. Orgs with pending approvals: {len(organization_ids)}. Tasks pending approval: {tasks_checked_count}. Reminders sent: {notifications_sent_total}.")
     return {
         'status': 'success',
-        'organizations_processed': organizations_processed,
+        'organizations_processed': len(organization_ids),
         'tasks_checked_for_pending_approval': tasks_checked_count,
         'approval_reminder_notifications_sent': notifications_sent_total
     }
@@ -879,7 +935,7 @@ def notification_cleanup_task(days=90):
             is_archived=False,
             created_at__lt=cutoff_date
         )
-        archived_count = to_archive.update(is_archived=True)
+        archived_count = NotificationCounterService.update_queryset(to_archive, is_archived=True)
         logger.info(f"Archived {archived_count} read notifications older than {days} days.")
 
         very_old_cutoff = timezone.now() - timedelta(days=days * 2) # e.g., 180 days
@@ -945,154 +1001,59 @@ def notification_escalate_task():
     return {'status': 'success', 'notifications_escalated': escalated_count}
 
 @shared_task
-def check_client_health_scores_and_notify():
+def run_client_intelligence_task(organization_id=None):
     """
-    Calculates health scores and churn risk for all active clients, notifies if risk is high or medium.
+    Nightly client intelligence (health score, churn risk, compliance risks, revenue
+    opportunities and anomalies) in a single pass. Without an organization it fans out
+    one task per active organization so the work is spread across workers.
     """
-    from .services.financial_health_service import FinancialHealthService
-    from .models import Client, Profile
-    updated_count = 0
-    for client in Client.objects.filter(is_active=True):
-        score = FinancialHealthService.calculate_for_client(client)
-        churn_risk = FinancialHealthService.calculate_churn_risk(client)
-        client.financial_health_score = score
-        client.churn_risk = churn_risk
-        client.save(update_fields=['financial_health_score', 'churn_risk'])
-        updated_count += 1
-        if churn_risk in ['HIGH', 'MEDIUM']:
-            # Prefer account manager, fallback to org admins
-            notified = False
-            if client.account_manager and client.account_manager.is_active:
-                NotificationService.create_notification(
-                    user=client.account_manager,
-                    task=None,
-                    notification_type='client_churn_risk',
-                    title=f"Alerta: Risco de churn {churn_risk.lower()} para {client.name}",
-                    message=f"O cliente {client.name} apresenta risco {churn_risk.lower()} de churn.",
-                    check_existing_recent=True,
-                    recent_threshold_hours=24
-                )
-                notified = True
-            if not notified and client.organization:
-                org_admins = Profile.objects.filter(organization=client.organization, is_org_admin=True, user__is_active=True)
-                for admin in org_admins:
-                    NotificationService.create_notification(
-                        user=admin.user,
-                        task=None,
-                        notification_type='client_churn_risk',
-                        title=f"Alerta: Risco de churn {churn_risk.lower()} para {client.name}",
-                        message=f"O cliente {client.name} apresenta risco {churn_risk.lower()} de churn.",
-                        check_existing_recent=True,
-                        recent_threshold_hours=24
-                    )
-
-@shared_task
-def check_compliance_risks_and_notify():
-    """
-    Checks compliance risks for all active clients and notifies account manager or org admins if high severity risks are found.
-    """
-    from .services.compliance_monitor_service import ComplianceMonitor
-    from .models import Client, Profile
-    for client in Client.objects.filter(is_active=True):
-        risks = ComplianceMonitor.check_for_client(client)
-        for risk in risks:
-            if risk.get('severity') == 'high':
-                notified = False
-                if client.account_manager and client.account_manager.is_active:
-                    NotificationService.create_notification(
-                        user=client.account_manager,
-                        task=None,
-                        notification_type='client_compliance_risk',
-                        title=risk.get('title', f"Risco de compliance para {client.name}"),
-                        message=risk.get('details', ''),
-                        check_existing_recent=True,
-                        recent_threshold_hours=24
-                    )
-                    notified = True
-                if not notified and client.organization:
-                    org_admins = Profile.objects.filter(organization=client.organization, is_org_admin=True, user__is_active=True)
-                    for admin in org_admins:
-                        NotificationService.create_notification(
-                            user=admin.user,
-                            task=None,
-                            notification_type='client_compliance_risk',
-                            title=risk.get('title', f"Risco de compliance para {client.name}"),
-                            message=risk.get('details', ''),
-                            check_existing_recent=True,
-                            recent_threshold_hours=24
-                        )
-
-@shared_task
-def check_revenue_opportunities_and_notify():
-    """
-    Identifies revenue opportunities for all active clients and notifies account manager or org admins if found.
-    """
-    from .services.revenue_service import RevenueService
-    from .models import Client, Profile
-    for client in Client.objects.filter(is_active=True):
-        opportunities = RevenueService.identify_for_client(client)
-        for opp in opportunities:
-            notified = False
-            if client.account_manager and client.account_manager.is_active:
-                NotificationService.create_notification(
-                    user=client.account_manager,
-                    task=None,
-                    notification_type='client_revenue_opportunity',
-                    title=opp.get('title', f"Oportunidade de receita para {client.name}"),
-                    message=opp.get('details', ''),
-                    check_existing_recent=True,
-                    recent_threshold_hours=24
-                )
-                notified = True
-            if not notified and client.organization:
-                org_admins = Profile.objects.filter(organization=client.organization, is_org_admin=True, user__is_active=True)
-                for admin in org_admins:
-                    NotificationService.create_notification(
-                        user=admin.user,
-                        task=None,
-                        notification_type='client_revenue_opportunity',
-                        title=opp.get('title', f"Oportunidade de receita para {client.name}"),
-                        message=opp.get('details', ''),
-                        check_existing_recent=True,
-                        recent_threshold_hours=24
-                    )
+    from .services.client_intelligence_service import ClientIntelligenceService
+    if organization_id is None:
+        organization_ids = list(Organization.objects.filter(is_active=True).values_list('id', flat=True))
+        for org_id in organization_ids:
+            run_client_intelligence_task.delay(organization_id=str(org_id))
+        logger.info(f"Client intelligence dispatched for {len(organization_ids)} organizations.")
+        return {"organizations_dispatched": len(organization_ids)}
+    return ClientIntelligenceService.run_for_organization(organization_id)
 
 @shared_task
 def send_smart_daily_digest():
     """
     Sends a daily digest notification to each user summarizing all relevant unread notifications from the last 24h.
     """
-    from .models import Profile, WorkflowNotification
+    from .models import WorkflowNotification
+    from django.contrib.auth.models import User
     from django.utils import timezone
     from datetime import timedelta
     from collections import defaultdict
 
     since = timezone.now() - timedelta(hours=24)
-    for profile in Profile.objects.filter(user__is_active=True):
-        user = profile.user
-        notifications = WorkflowNotification.objects.filter(
-            user=user, is_read=False, created_at__gte=since, is_archived=False
-        ).order_by('priority', '-created_at')
-        if notifications.exists():
-            grouped = defaultdict(list)
-            for n in notifications:
-                grouped[n.notification_type].append(n)
-            summary_lines = []
-            for notif_type, notifs in grouped.items():
-                count = len(notifs)
-                titles = ', '.join([n.title for n in notifs[:3]])
-                more = f" (+{count-3} mais)" if count > 3 else ""
-                summary_lines.append(f"[{notif_type}] {titles}{more}")
-            summary = "\n".join(summary_lines)
-            NotificationService.create_notification(
-                user=user,
-                task=None,
-                notification_type='daily_digest',
-                title="Resumo Diário de Alertas",
-                message=summary,
-                check_existing_recent=True,
-                recent_threshold_hours=20
-            )
+    # One query for every active user: user -> type -> titles (priority, newest first)
+    grouped = defaultdict(lambda: defaultdict(list))
+    for user_id, notification_type, title in WorkflowNotification.objects.filter(
+        user__is_active=True, user__profile__isnull=False,
+        is_read=False, created_at__gte=since, is_archived=False
+    ).order_by('user_id', 'priority', '-created_at').values_list('user_id', 'notification_type', 'title'):
+        grouped[user_id][notification_type].append(title)
+
+    users = User.objects.in_bulk(list(grouped))
+    intents = []
+    for user_id, by_type in grouped.items():
+        summary_lines = []
+        for notif_type, titles in by_type.items():
+            count = len(titles)
+            more = f" (+{count-3} mais)" if count > 3 else ""
+            summary_lines.append(f"[{notif_type}] {', '.join(titles[:3])}{more}")
+        intents.append({
+            'user': users[user_id],
+            'notification_type': 'daily_digest',
+            'title': "Resumo Diário de Alertas",
+            'message': "\n".join(summary_lines),
+            'check_existing_recent': True,
+            'recent_threshold_hours': 20,
+        })
+    created = NotificationService.create_notifications_bulk(intents)
+    return {"digests_created": len(created)}
 
 @shared_task
 def escalate_unread_urgent_notifications():
@@ -1102,114 +1063,45 @@ def escalate_unread_urgent_notifications():
     from .models import WorkflowNotification, Profile
     from django.utils import timezone
     from datetime import timedelta
+    from collections import defaultdict
 
     threshold = timezone.now() - timedelta(hours=24)
-    for notif in WorkflowNotification.objects.filter(priority='urgent', is_read=False, created_at__lt=threshold, is_archived=False):
+    unread = list(WorkflowNotification.objects.filter(
+        priority='urgent', is_read=False, created_at__lt=threshold, is_archived=False,
+        user__profile__organization__isnull=False
+    ).select_related('user__profile', 'task'))
+
+    admins_by_org = defaultdict(list)
+    for admin in Profile.objects.filter(
+        organization_id__in={notif.user.profile.organization_id for notif in unread},
+        is_org_admin=True, user__is_active=True
+    ).select_related('user'):
+        admins_by_org[admin.organization_id].append(admin.user)
+
+    intents = []
+    for notif in unread:
         user = notif.user
-        # Escalate to org admin if not already done
-        if hasattr(user, 'profile') and user.profile.organization:
-            org_admins = Profile.objects.filter(organization=user.profile.organization, is_org_admin=True, user__is_active=True).exclude(user=user)
-            for admin in org_admins:
-                NotificationService.create_notification(
-                    user=admin.user,
-                    task=notif.task,
-                    notification_type='escalated_urgent',
-                    title=f"Escalado: {notif.title}",
-                    message=f"O alerta urgente para {user.username} não foi lido em 24h: {notif.message}",
-                    check_existing_recent=True,
-                    recent_threshold_hours=24
-                )
-
-@shared_task
-def detect_anomalies_and_notify():
-    """
-    Detects anomalies in client metrics (e.g., sudden drop in profit margin, spike in overdue tasks) and notifies account manager or org admins.
-    """
-    from .models import Client, Profile, ClientProfitability, Task
-    from django.utils import timezone
-    from datetime import timedelta
-    import statistics
-
-    for client in Client.objects.filter(is_active=True):
-        # --- Profit Margin Anomaly ---
-        profit_margins = list(ClientProfitability.objects.filter(client=client).order_by('-year', '-month').values_list('profit_margin', flat=True)[:12])
-        if len(profit_margins) >= 6:
-            recent = profit_margins[:3]
-            past = profit_margins[3:]
-            if past:
-                avg_past = statistics.mean(past)
-                avg_recent = statistics.mean(recent)
-                if avg_past > 0 and avg_recent < avg_past * 0.7:  # >30% drop
-                    message = f"A margem de lucro média caiu de {avg_past:.1f}% para {avg_recent:.1f}% nos últimos meses para o cliente {client.name}."
-                    notified = False
-                    if client.account_manager and client.account_manager.is_active:
-                        NotificationService.create_notification(
-                            user=client.account_manager,
-                            task=None,
-                            notification_type='client_anomaly_detected',
-                            title=f"Alerta preditivo: Queda de margem de lucro em {client.name}",
-                            message=message,
-                            check_existing_recent=True,
-                            recent_threshold_hours=24
-                        )
-                        notified = True
-                    if not notified and client.organization:
-                        org_admins = Profile.objects.filter(organization=client.organization, is_org_admin=True, user__is_active=True)
-                        for admin in org_admins:
-                            NotificationService.create_notification(
-                                user=admin.user,
-                                task=None,
-                                notification_type='client_anomaly_detected',
-                                title=f"Alerta preditivo: Queda de margem de lucro em {client.name}",
-                                message=message,
-                                check_existing_recent=True,
-                                recent_threshold_hours=24
-                            )
-        # --- Overdue Tasks Spike ---
-        now = timezone.now()
-        overdue_counts = []
-        for weeks_ago in range(1, 5):
-            week_start = now - timedelta(weeks=weeks_ago)
-            week_end = week_start + timedelta(days=7)
-            count = Task.objects.filter(
-                client=client,
-                status__in=['pending', 'in_progress'],
-                deadline__lt=week_end,
-                deadline__gte=week_start
-            ).count()
-            overdue_counts.append(count)
-        if len(overdue_counts) >= 3:
-            avg_past = statistics.mean(overdue_counts[1:])
-            recent = overdue_counts[0]
-            if avg_past > 0 and recent > avg_past * 2:  # Spike: more than double
-                message = f"O número de tarefas atrasadas para {client.name} subiu de média {avg_past:.1f} para {recent} na última semana."
-                notified = False
-                if client.account_manager and client.account_manager.is_active:
-                    NotificationService.create_notification(
-                        user=client.account_manager,
-                        task=None,
-                        notification_type='client_anomaly_detected',
-                        title=f"Alerta preditivo: Pico de tarefas atrasadas em {client.name}",
-                        message=message,
-                        check_existing_recent=True,
-                        recent_threshold_hours=24
-                    )
-                    notified = True
-                if not notified and client.organization:
-                    org_admins = Profile.objects.filter(organization=client.organization, is_org_admin=True, user__is_active=True)
-                    for admin in org_admins:
-                        NotificationService.create_notification(
-                            user=admin.user,
-                            task=None,
-                            notification_type='client_anomaly_detected',
-                            title=f"Alerta preditivo: Pico de tarefas atrasadas em {client.name}",
-                            message=message,
-                            check_existing_recent=True,
-                            recent_threshold_hours=24
-                        )
+        for admin_user in admins_by_org[user.profile.organization_id]:
+            if admin_user.id == user.id:
+                continue
+            intents.append({
+                'user': admin_user,
+                'task': notif.task,
+                'notification_type': 'escalated_urgent',
+                'title': f"Escalado: {notif.title}",
+                'message': f"O alerta urgente para {user.username} não foi lido em 24h: {notif.message}",
+                'check_existing_recent': True,
+                'recent_threshold_hours': 24,
+            })
+    created = NotificationService.create_notifications_bulk(intents)
+    return {"escalations_created": len(created)}
 
 # Re-export all tasks for Celery worker and beat to find easily
 __all__ = [
+    'process_invoice_batch_task',
+    'apply_profitability_deltas_task',
+    'reconcile_client_profitability_task',
+    'rollover_dashboard_counters_task',
     'check_upcoming_deadlines_and_notify_task',
     'check_overdue_steps_and_notify_task',
     'check_pending_approvals_and_remind_task',
@@ -1223,10 +1115,7 @@ __all__ = [
     'check_fiscal_deadlines_task', 
     'generate_weekly_fiscal_report_task',
     'generate_fiscal_obligations_for_organization_task',
-    'check_client_health_scores_and_notify',
-    'check_compliance_risks_and_notify',
-    'check_revenue_opportunities_and_notify',
+    'run_client_intelligence_task',
     'send_smart_daily_digest',
     'escalate_unread_urgent_notifications',
-    'detect_anomalies_and_notify'
 ]
\ No newline at end of file
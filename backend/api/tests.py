@@ -1,4 +1,1576 @@
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
+import hashlib
+import html
+import io
+import os
+import random
+import tempfile
+import xml.etree.ElementTree as ET
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import load_workbook
+from rest_framework.test import APIClient
+
+from .models import (Client, ClientProfitability, ClientProfitabilityDelta, DashboardCounter, Expense, FiscalObligationDefinition, InvoiceBatch, NotificationSettings,
+                     NotificationTemplate, Organization, SAFTAggregate, SAFTFile, ScannedInvoice, Task, TaskApproval, TaskCategory, TaskInvolvement, TimeEntry, WorkflowDefinition, WorkflowHistory,
+                     WorkflowNotification, WorkflowStep)
+from .management.commands.benchmark_saft_parser import SAFT_NAMESPACE, Command as SAFTBenchmarkCommand
+from .serializers import TaskSerializer
+from .tasks import (check_overdue_steps_and_notify_task, check_pending_approvals_and_remind_task, process_saft_file_task,
+                    update_client_profitability_globally_task)
+from .services.client_intelligence_service import ClientIntelligenceService
+from .services.compliance_monitor_service import ComplianceMonitor
+from .services.dashboard_counter_service import DashboardCounterService
+from .services.expense_categorization_service import ExpenseCategorizationService
+from .services.financial_health_service import FinancialHealthService
+from .services.fiscal_obligation_service import FiscalObligationGenerator
+from .services.invoice_batch_service import InvoiceBatchProcessor, InvoiceBatchTaskCreator
+from .services.notification_counter_service import NotificationCounterService
+from .services.notification_service import NotificationService
+from .services.notification_template_service import NotificationTemplateRegistry, NotificationTemplateService
+from .services.profitability_service import CENT, ProfitabilityDeltaQueue, ProfitabilityEngine
+from .services.report_data_service import ReportDataService
+from .services.report_generation_service import ReportGenerationService
+from .services.revenue_service import RevenueService
+from .services.saft_analytics_service import SAFTAnalyticsService
+from .services.saft_parser import SAFTParser
+from .services.streaming_export_service import StreamingSheet
+from .services.upload_dedup_service import UploadDedupService
+
+
+class TaskListQueryCountTests(TestCase):
+    """The task list must use a fixed number of queries, whatever the page size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Teste')
+        cls.admin = User.objects.create(username='admin_tarefas')
+        profile = cls.admin.profile
+        profile.organization = cls.organization
+        profile.is_org_admin = True
+        profile.save()
+
+        cls.members = [User.objects.create(username=f'membro_{i}') for i in range(3)]
+        cls.client_obj = Client.objects.create(organization=cls.organization, name='Cliente', monthly_fee=Decimal('100'))
+
+        workflow = WorkflowDefinition.objects.create(name='Fluxo', created_by=cls.admin)
+        steps = [
+            WorkflowStep.objects.create(workflow=workflow, name=f'Passo {order}', order=order, assign_to=cls.members[order % 3])
+            for order in range(1, 4)
+        ]
+        steps[0].next_steps.add(steps[1])
+        steps[1].next_steps.add(steps[2])
+
+        for i in range(25):
+            task = Task.objects.create(
+                title=f'Tarefa {i}', client=cls.client_obj, created_by=cls.admin,
+                assigned_to=cls.members[i % 3], priority=(i % 5) + 1,
+                workflow=workflow if i % 2 else None,
+                current_workflow_step=steps[i % 3] if i % 4 == 1 else None,
+                workflow_step_assignments={str(step.id): str(cls.members[(i + n) % 3].id) for n, step in enumerate(steps)},
+            )
+            task.collaborators.set(cls.members[:i % 3])
+            if task.workflow_id:
+                WorkflowHistory.objects.create(task=task, from_step=steps[0], to_step=steps[1], changed_by=cls.admin, action='step_completed')
+            WorkflowNotification.objects.create(
+                user=cls.admin, task=task, notification_type='manual_reminder', title=f'Lembrete {i}', message='-'
+            )
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def _list(self, page_size):
+        with CaptureQueriesContext(connection) as context:
+            response = self.api.get('/api/tasks/', {'page_size': page_size, 'ordering': 'title'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return response.data['results'], len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        _, small = self._list(3)
+        _, large = self._list(25)
+        self.assertEqual(small, large)
+
+    def test_list_matches_detail_serialization(self):
+        results, _ = self._list(25)
+        for item in results:
+            expected = TaskSerializer(Task.objects.get(id=item['id'])).data
+            for field in ('workflow_progress', 'available_next_steps', 'assignment_summary', 'latest_notification'):
+                self.assertEqual(item[field], expected[field], field)
+            # The collaborators relation has no ordering
+            for field in ('collaborators_info', 'all_assigned_users'):
+                self.assertCountEqual(item[field], expected[field], field)
+
+    def test_sparse_fieldset_skips_batch_lookups(self):
+        with CaptureQueriesContext(connection) as full:
+            self.api.get('/api/tasks/', {'page_size': 25})
+        with CaptureQueriesContext(connection) as sparse:
+            response = self.api.get('/api/tasks/', {'page_size': 25, 'fields': 'id,title'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+        self.assertLess(len(sparse.captured_queries), len(full.captured_queries))
+
+
+class KeysetCursorPaginationTests(TestCase):
+    """Cursor pagination is on by default and walks the list in the requested order without gaps."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Cursor')
+        cls.admin = User.objects.create(username='admin_cursor')
+        profile = cls.admin.profile
+        profile.organization = cls.organization
+        profile.is_org_admin = True
+        profile.save()
+        client = Client.objects.create(organization=cls.organization, name='Cliente', monthly_fee=Decimal('100'))
+        for i in range(12):
+            # Only three distinct priorities, so the ordering has ties
+            Task.objects.create(title=f'Tarefa {i}', client=client, created_by=cls.admin, priority=(i % 3) + 1)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def _walk(self, params):
+        ids, url, params = [], '/api/tasks/', dict(params)
+        while url:
+            response = self.api.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url, params = response.data['next'], None
+        return ids
+
+    def test_list_is_paginated_by_default(self):
+        with mock.patch('api.pagination.KeysetCursorPagination.page_size', 5):
+            response = self.api.get('/api/tasks/')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(response.data['page_size'], 5)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_following_next_matches_ordering(self):
+        expected = [str(pk) for pk in Task.objects.order_by('-priority', '-id').values_list('id', flat=True)]
+        self.assertEqual(self._walk({'page_size': 5, 'ordering': '-priority'}), expected)
+        expected = [str(pk) for pk in Task.objects.order_by('priority', 'id').values_list('id', flat=True)]
+        self.assertEqual(self._walk({'limit': 4, 'ordering': 'priority'}), expected)
+
+    def test_previous_returns_prior_page(self):
+        first = self.api.get('/api/tasks/', {'page_size': 5, 'ordering': '-priority'}).data
+        self.assertIsNone(first['previous'])
+        second = self.api.get(first['next']).data
+        back = self.api.get(second['previous']).data
+        self.assertEqual([item['id'] for item in back['results']], [item['id'] for item in first['results']])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.api.get('/api/tasks/', {'cursor': 'nao-e-um-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_size_is_capped(self):
+        with mock.patch('api.pagination.KeysetCursorPagination.max_page_size', 10):
+            response = self.api.get('/api/tasks/', {'page_size': 50})
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_sparse_fieldset_on_default_page(self):
+        response = self.api.get('/api/tasks/', {'fields': 'id,title,priority'})
+        self.assertEqual(len(response.data['results']), 12)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'priority'})
+
+
+class TaskInvolvementParityTests(TestCase):
+    """TaskManager.for_user (TaskInvolvement index) must match the previous jsonb-based query."""
+
+    @staticmethod
+    def legacy_for_user(user, organization):
+        # The previous OR of assigned_to, collaborators and a jsonb_each_text scan
+        in_workflow = RawSQL(
+            "SELECT t.id FROM api_task t, jsonb_each_text(t.workflow_step_assignments) vals WHERE vals.value = %s",
+            (str(user.id),)
+        )
+        return Task.objects.filter(client__organization=organization).filter(
+            Q(assigned_to=user) | Q(collaborators=user) | Q(id__in=in_workflow)
+        ).distinct()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Paridade')
+        other_organization = Organization.objects.create(name='Outra Org')
+        cls.users = [User.objects.create(username=f'paridade_{i}') for i in range(6)]
+        for user in cls.users:
+            user.profile.organization = cls.organization
+            user.profile.save()
+        client = Client.objects.create(organization=cls.organization, name='Cliente', monthly_fee=Decimal('50'))
+        other_client = Client.objects.create(organization=other_organization, name='Outro', monthly_fee=Decimal('50'))
+
+        cls.tasks = []
+        for i in range(40):
+            task = Task.objects.create(
+                title=f'Tarefa {i}', client=other_client if i % 10 == 9 else client,
+                assigned_to=cls.users[i % 6] if i % 3 else None,
+                workflow_step_assignments={
+                    f'passo{n}': str(cls.users[(i + n) % 6].id) for n in range(i % 3)
+                },
+            )
+            task.collaborators.set(cls.users[(i % 4):(i % 4) + (i % 3)])
+            cls.tasks.append(task)
+
+    def assertParity(self):
+        for user in self.users:
+            self.assertEqual(
+                set(Task.objects.for_user(user).values_list('id', flat=True)),
+                set(self.legacy_for_user(user, self.organization).values_list('id', flat=True)),
+                user.username
+            )
+
+    def test_for_user_matches_legacy_query(self):
+        self.assertParity()
+
+    def test_index_follows_changes(self):
+        task = self.tasks[1]
+        task.assigned_to = self.users[5]
+        task.workflow_step_assignments = {'passo0': str(self.users[4].id), 'passo1': 'sem-id'}
+        task.save()
+        task.collaborators.remove(*task.collaborators.all())
+        self.users[3].collaborative_tasks.add(self.tasks[2], self.tasks[3])
+        self.users[0].collaborative_tasks.clear()
+        Task.objects.get(id=self.tasks[4].id).collaborators.clear()
+        self.assertParity()
+        self.assertEqual(task.get_user_role_in_task(self.users[5]), 'primary')
+        self.assertEqual(task.get_user_role_in_task(self.users[4]), 'workflow_step')
+
+    def test_migration_backfill_matches_signals(self):
+        backfill = import_module('api.migrations.0068_task_involvement').BACKFILL_SQL
+        maintained = set(TaskInvolvement.objects.values_list('task_id', 'user_id', 'role'))
+        TaskInvolvement.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(backfill)
+        self.assertEqual(set(TaskInvolvement.objects.values_list('task_id', 'user_id', 'role')), maintained)
+        self.assertParity()
+
+
+class ProfitabilityEngineTests(TestCase):
+    """The set-based engine must match the pure-Python reference path."""
+
+    PERIODS = [(2025, 11), (2025, 12), (2026, 1)]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Rentabilidade')
+        cls.users = []
+        for i, rate in enumerate((Decimal('25.50'), Decimal('40.00'), Decimal('0.00'))):
+            user = User.objects.create(username=f'colaborador_rentabilidade_{i}')
+            user.profile.organization = cls.organization
+            user.profile.hourly_rate = rate
+            user.profile.save()
+            cls.users.append(user)
+        cls.clients = [
+            Client.objects.create(organization=cls.organization, name=f'Cliente {i}', monthly_fee=Decimal(fee))
+            for i, fee in enumerate(('150.00', '0.00', '400.00'))
+        ]
+        for i in range(30):
+            year, month = cls.PERIODS[i % 3]
+            TimeEntry.objects.create(
+                user=cls.users[i % 3], client=cls.clients[i % 2], description='-',
+                minutes_spent=7 + i * 11, date=timezone.datetime(year, month, 1 + i % 28).date(),
+            )
+        for i in range(12):
+            year, month = cls.PERIODS[i % 3]
+            Expense.objects.create(
+                client=cls.clients[i % 3] if i % 4 else None, amount=Decimal('13.37') * (i + 1),
+                date=timezone.datetime(year, month, 2 + i).date(),
+            )
+        # Outside the recomputed periods
+        TimeEntry.objects.create(user=cls.users[0], client=cls.clients[0], description='-', minutes_spent=999,
+                                 date=timezone.datetime(2025, 6, 1).date())
+
+    def reference(self):
+        return ProfitabilityEngine.reference_aggregate(
+            TimeEntry.objects.values_list('client_id', 'date', 'minutes_spent', 'user__profile__hourly_rate'),
+            Expense.objects.values_list('client_id', 'date', 'amount'),
+            self.PERIODS,
+        )
+
+    @staticmethod
+    def rounded(aggregates):
+        return {
+            key: (value['total_time_minutes'], Decimal(value['time_cost']).quantize(CENT), value['total_expenses'])
+            for key, value in aggregates.items()
+        }
+
+    def test_aggregate_matches_reference(self):
+        aggregates = ProfitabilityEngine.aggregate_periods([client.id for client in self.clients], self.PERIODS)
+        self.assertEqual(self.rounded(aggregates), self.rounded(self.reference()))
+        # Clients 0 and 1 have time in every month; client 2 only has expenses, in one month
+        self.assertEqual(len(aggregates), 7)
+
+    def test_recompute_writes_reference_rows(self):
+        self.assertEqual(ProfitabilityEngine.recompute(self.PERIODS, organization=self.organization),
+                         {period: 3 for period in self.PERIODS})
+        reference = self.reference()
+        empty = ProfitabilityEngine._empty_aggregate()
+        for client in self.clients:
+            for year, month in self.PERIODS:
+                expected = ProfitabilityEngine.build_record(
+                    client, year, month, reference.get((str(client.id), year, month), empty)
+                )
+                stored = ClientProfitability.objects.get(client=client, year=year, month=month)
+                self.assertEqual(
+                    (stored.total_time_minutes, stored.time_cost, stored.total_expenses, stored.profit,
+                     stored.profit_margin, stored.is_profitable),
+                    (expected.total_time_minutes, expected.time_cost, expected.total_expenses, expected.profit,
+                     expected.profit_margin, expected.is_profitable),
+                    f'{client.name} {month}/{year}'
+                )
+
+    def test_global_task_reports_each_period(self):
+        # The current and previous months may cover different clients
+        with mock.patch.object(ProfitabilityEngine, 'recompute', side_effect=lambda periods: {periods[0]: 5, periods[1]: 3}):
+            result = update_client_profitability_globally_task()
+        self.assertEqual(result, {'current_month_updated': 5, 'previous_month_updated': 3})
+
+    def test_recompute_discards_queued_deltas(self):
+        # The signals queued a delta for every entry and expense created above
+        self.assertTrue(ClientProfitabilityDelta.objects.filter(year=2026, month=1).exists())
+        ProfitabilityEngine.recompute(self.PERIODS, organization=self.organization)
+        before = {
+            record.pk: (record.total_time_minutes, record.total_expenses, record.last_updated)
+            for record in ClientProfitability.objects.all()
+        }
+        # Deltas of other months (the June entry, the fee touches of the current month) stay queued
+        self.assertFalse(ClientProfitabilityDelta.objects.filter(year__in=[2025, 2026], month__in=[11, 12, 1]).exists())
+        self.assertTrue(ProfitabilityDeltaQueue.apply_pending())
+        june = ClientProfitability.objects.get(client=self.clients[0], year=2025, month=6)
+        self.assertEqual(june.total_time_minutes, 999)
+        for record in ClientProfitability.objects.filter(pk__in=before):
+            self.assertEqual((record.total_time_minutes, record.total_expenses, record.last_updated), before[record.pk])
+
+        with self.captureOnCommitCallbacks(execute=False):
+            TimeEntry.objects.create(user=self.users[1], client=self.clients[0], description='-', minutes_spent=30,
+                                     date=timezone.datetime(2025, 6, 3).date())
+        ProfitabilityDeltaQueue.apply_pending()
+        updated = ClientProfitability.objects.get(pk=june.pk)
+        self.assertEqual(updated.total_time_minutes, 1029)
+        self.assertGreater(updated.last_updated, june.last_updated)
+
+    def test_client_save_touches_profitability_only_when_the_fee_changes(self):
+        today = timezone.now().date()
+        touches = ClientProfitabilityDelta.objects.filter(client=self.clients[0], year=today.year, month=today.month)
+
+        def save(client, **fields):
+            touches.delete()
+            for name, value in fields.items():
+                setattr(client, name, value)
+            with self.captureOnCommitCallbacks(execute=False):
+                client.save()
+            return touches.exists()
+
+        client = Client.objects.get(pk=self.clients[0].pk)
+        self.assertFalse(save(client, name='Cliente renomeado'))
+        self.assertTrue(save(client, monthly_fee=Decimal('175.00')))
+        self.assertFalse(save(client))
+        self.assertFalse(save(client, is_active=False))
+        self.assertTrue(save(client, is_active=True))
+        # A deferred instance only saves the fields it loaded
+        self.assertFalse(save(Client.objects.only('id', 'name').get(pk=client.pk), name='Cliente'))
+
+
+class InvoiceBatchProcessingTests(TestCase):
+    """process_batch decodes a whole batch, saves it in chunks and publishes its progress."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Processamento')
+        cls.batch = InvoiceBatch.objects.create(organization=cls.organization)
+        # Completed in an earlier batch: a new invoice with this ATCUD is a duplicate
+        ScannedInvoice.objects.create(batch=InvoiceBatch.objects.create(organization=cls.organization),
+                                      original_file='invoice_uploads/antiga.pdf', atcud='ATCUD-9', status='COMPLETED')
+        for name in ('ok_1', 'ok_2', 'ok_3', 'semqr_1', 'ok_3', 'ok_4', 'erro_1', 'ok_9', 'ok_5'):
+            ScannedInvoice.objects.create(batch=cls.batch, original_file=f'invoice_uploads/{name}.pdf',
+                                          original_filename=f'{name}.pdf')
+
+    @staticmethod
+    def decode(source, filename, time_budget):
+        # The file name says what its QR Code holds
+        kind, number = filename.split('.')[0].split('_')
+        if kind == 'erro':
+            raise RuntimeError('ficheiro ilegível')
+        if kind == 'semqr':
+            return {'processing_log': ['Nenhum QR Code encontrado.'], 'invoice_data': {}}
+        return {'processing_log': [], 'invoice_data': {
+            'atcud': f'ATCUD-{number}', 'nif_emitter': '500000000', 'gross_total': Decimal('10.00'),
+            'doc_date': '2026-10-01',
+        }}
+
+    def test_batch_is_saved_in_chunks_with_progress(self):
+        published = []
+        publish = InvoiceBatchProcessor._publish_progress
+
+        def record(batch_id, progress):
+            published.append(progress['processed'])
+            publish(batch_id, progress)
+
+        with self.settings(INVOICE_DECODE_WORKERS=1), \
+                mock.patch('api.services.invoice_batch_service.decode_invoice_source', side_effect=self.decode), \
+                mock.patch.object(InvoiceBatchProcessor, '_decode_source', return_value=b''), \
+                mock.patch.object(InvoiceBatchProcessor, 'PERSIST_EVERY', 2), \
+                mock.patch.object(InvoiceBatchProcessor, '_publish_progress', side_effect=record), \
+                mock.patch.object(InvoiceBatchProcessor, '_persist', wraps=InvoiceBatchProcessor._persist) as persist, \
+                mock.patch.object(ExpenseCategorizationService, 'schedule_pending'), \
+                mock.patch.object(ProfitabilityDeltaQueue, 'schedule_apply'):
+            progress = InvoiceBatchProcessor.process_batch(self.batch.id)
+
+        self.assertEqual(
+            {key: progress[key] for key in ('status', 'total', 'processed', 'completed', 'review', 'duplicates', 'errors')},
+            {'status': 'done', 'total': 9, 'processed': 9, 'completed': 5, 'review': 0, 'duplicates': 2, 'errors': 2},
+        )
+        self.assertEqual([len(call.args[0]) for call in persist.call_args_list], [2, 2, 2, 2, 1])
+        self.assertEqual(published, [0, 2, 4, 6, 8, 9])
+        self.assertEqual(InvoiceBatchProcessor.get_progress(self.batch.id)['status'], 'done')
+
+        invoices = self.batch.invoices.all()
+        self.assertFalse(invoices.filter(status__in=('PENDING', 'PROCESSING')).exists())
+        self.assertEqual(
+            sorted(invoices.filter(status='COMPLETED').values_list('atcud', flat=True)),
+            ['ATCUD-1', 'ATCUD-2', 'ATCUD-3', 'ATCUD-4', 'ATCUD-5'],
+        )
+        self.assertEqual(invoices.filter(status='ERROR', processing_log__startswith='Fatura duplicada').count(), 2)
+        self.assertIn('ficheiro ilegível', invoices.get(original_filename='erro_1.pdf').processing_log)
+        self.assertEqual(invoices.get(original_filename='semqr_1.pdf').status, 'ERROR')
+
+    def test_empty_batch_is_done(self):
+        batch = InvoiceBatch.objects.create(organization=self.organization)
+        progress = InvoiceBatchProcessor.process_batch(batch.id)
+        self.assertEqual((progress['status'], progress['total']), ('done', 0))
+        self.assertEqual(InvoiceBatchProcessor.get_progress(batch.id)['status'], 'done')
+
+
+class SAFTStreamingParserTests(TestCase):
+    """The iterparse parser returns exactly what the in-memory parser returns."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        handle, cls.path = tempfile.mkstemp(suffix='.xml')
+        os.close(handle)
+        SAFTBenchmarkCommand()._generate(cls.path, 200, 3, random.Random(7))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+        super().tearDownClass()
+
+    def test_streaming_matches_in_memory(self):
+        streamed = SAFTParser(self.path).parse()
+        self.assertEqual(streamed, SAFTParser(self.path, streaming=False).parse())
+        self.assertEqual(streamed['summary']['invoice_count'], 200)
+        self.assertEqual(streamed['header']['company_tax_id'], '500000000')
+        # Storage handles are read from the start, whatever their position
+        with open(self.path, 'rb') as f:
+            f.read(100)
+            self.assertEqual(SAFTParser(f).parse(), streamed)
+
+    def test_wrapped_document_falls_back_to_in_memory(self):
+        with open(self.path, encoding='utf-8') as f:
+            wrapped = f'<article><para>{html.escape(f.read())}</para></article>'.encode()
+        self.assertEqual(SAFTParser(io.BytesIO(wrapped)).parse(), SAFTParser(self.path).parse())
+
+    def test_malformed_file_is_rejected(self):
+        with self.assertRaises(ValueError):
+            SAFTParser(io.BytesIO(b'<AuditFile><Header></AuditFile>')).parse()
+
+
+class SAFTAggregateTests(TestCase):
+    """The SAFTAggregate rows stored while parsing match totals computed invoice by invoice from the XML."""
+
+    @staticmethod
+    def per_invoice_totals(path):
+        """(dimension, key) -> [documents, cancelled, net, gross], walking the invoices one by one."""
+        ns = {'saf': SAFT_NAMESPACE}
+        root = ET.parse(path).getroot()
+        customers = {
+            customer.findtext('saf:CustomerID', namespaces=ns): customer.findtext('saf:CustomerTaxID', namespaces=ns)
+            for customer in root.iterfind('saf:MasterFiles/saf:Customer', ns)
+        }
+        totals = {}
+
+        def bucket(dimension, key):
+            return totals.setdefault((dimension, key), [0, 0, Decimal('0'), Decimal('0')])
+
+        for invoice in root.iterfind('saf:SourceDocuments/saf:SalesInvoices/saf:Invoice', ns):
+            doc_type = invoice.findtext('saf:InvoiceType', namespaces=ns)
+            keys = [
+                ('month', invoice.findtext('saf:InvoiceDate', namespaces=ns)[:7]),
+                ('customer', customers[invoice.findtext('saf:CustomerID', namespaces=ns)]),
+                ('doc_type', doc_type),
+            ]
+            if invoice.findtext('saf:DocumentStatus/saf:InvoiceStatus', namespaces=ns) == 'A':
+                for key in keys:
+                    bucket(*key)[1] += 1
+                continue
+            net = Decimal(invoice.findtext('saf:DocumentTotals/saf:NetTotal', namespaces=ns))
+            gross = Decimal(invoice.findtext('saf:DocumentTotals/saf:GrossTotal', namespaces=ns))
+            for dimension, key in keys:
+                # Credit notes reduce revenue; the document type keeps the totals as issued
+                sign = -1 if doc_type == 'NC' and dimension != 'doc_type' else 1
+                values = bucket(dimension, key)
+                values[0] += 1
+                values[2] += sign * net
+                values[3] += sign * gross
+            rates = set()
+            for line in invoice.iterfind('saf:Line', ns):
+                rate = Decimal(line.findtext('saf:Tax/saf:TaxPercentage', namespaces=ns))
+                key = f"{line.findtext('saf:Tax/saf:TaxCode', namespaces=ns)}:{rate}"
+                base = Decimal(line.findtext('saf:CreditAmount', '0', ns)) - Decimal(line.findtext('saf:DebitAmount', '0', ns))
+                values = bucket('tax_rate', key)
+                if key not in rates:
+                    rates.add(key)
+                    values[0] += 1
+                values[2] += base
+                values[3] += base + base * rate / 100
+        return {
+            key: (documents, cancelled, net.quantize(CENT), gross.quantize(CENT))
+            for key, (documents, cancelled, net, gross) in totals.items()
+        }
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.organization = Organization.objects.create(name='Org SAFT')
+        self.path = os.path.join(media.name, 'gerado.xml')
+        SAFTBenchmarkCommand()._generate(self.path, 300, 3, random.Random(11))
+
+    def test_stored_aggregates_match_per_invoice_totals(self):
+        with open(self.path, 'rb') as f:
+            saft_file = SAFTFile.objects.create(organization=self.organization, original_filename='saft.xml',
+                                                file=ContentFile(f.read(), name='saft.xml'))
+        process_saft_file_task(saft_file.id)
+        saft_file.refresh_from_db()
+        self.assertEqual(saft_file.status, 'COMPLETED')
+
+        expected = self.per_invoice_totals(self.path)
+        stored = {
+            (row.dimension, row.key): (row.document_count, row.cancelled_count, row.net_total, row.gross_total)
+            for row in SAFTAggregate.objects.filter(saft_file=saft_file)
+        }
+        self.assertEqual(stored, expected)
+        self.assertTrue(any(cancelled for _, cancelled, _, _ in expected.values()))
+        self.assertEqual(saft_file.summary_data['cancelled_count'],
+                         sum(cancelled for (dimension, _), (_, cancelled, _, _) in expected.items() if dimension == 'doc_type'))
+
+        months = SAFTAnalyticsService.monthly_revenue(saft_file)
+        self.assertEqual([month['month'] for month in months], sorted(key for dimension, key in expected if dimension == 'month'))
+        self.assertEqual(sum(month['net_total'] for month in months),
+                         sum(values[2] for (dimension, _), values in expected.items() if dimension == 'month'))
+
+
+class UploadDedupTests(TestCase):
+    """Identical SAF-T and invoice uploads are recognised by their content hash."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Duplicados')
+        cls.user = User.objects.create(username='utilizador_duplicados')
+        cls.user.profile.organization = cls.organization
+        cls.user.profile.save()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def upload_saft(self, content, **data):
+        return self.api.post('/api/saft-files/', {'file': SimpleUploadedFile('saft.xml', content), **data}, format='multipart')
+
+    def test_duplicate_saft_is_returned_and_force_reprocesses(self):
+        with mock.patch('api.views.process_saft_file_task.delay') as delay:
+            first = self.upload_saft(b'<AuditFile/>')
+            duplicate = self.upload_saft(b'<AuditFile/>')
+            forced = self.upload_saft(b'<AuditFile/>', force='true')
+            other = self.upload_saft(b'<AuditFile></AuditFile>')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(SAFTFile.objects.get(id=first.data['id']).content_hash, hashlib.sha256(b'<AuditFile/>').hexdigest())
+        self.assertEqual(duplicate.status_code, 200)
+        self.assertTrue(duplicate.data['duplicate'])
+        self.assertEqual(duplicate.data['id'], first.data['id'])
+        self.assertEqual(forced.status_code, 201)
+        self.assertNotEqual(forced.data['id'], first.data['id'])
+        self.assertNotIn('duplicate', forced.data)
+        self.assertEqual(other.status_code, 201)
+        self.assertEqual(delay.call_count, 3)
+
+    def test_identical_invoices_are_not_decoded_again(self):
+        completed = ScannedInvoice.objects.create(
+            batch=InvoiceBatch.objects.create(organization=self.organization), original_file='invoice_uploads/antiga.pdf',
+            content_hash=hashlib.sha256(b'%PDF-antiga').hexdigest(), atcud='AB-1', status='COMPLETED',
+        )
+        files = [SimpleUploadedFile(f'{name}.pdf', content) for name, content in (
+            ('nova', b'%PDF-nova'), ('copia', b'%PDF-nova'), ('antiga', b'%PDF-antiga'),
+        )]
+        with mock.patch('api.views.process_invoice_file_task.delay') as delay:
+            response = self.api.post('/api/invoice-batches/', {'files': files}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        invoices = {invoice.original_filename: invoice for invoice in ScannedInvoice.objects.filter(batch_id=response.data['id'])}
+        self.assertEqual(delay.call_args_list, [mock.call(str(invoices['nova.pdf'].id))])
+        self.assertEqual(invoices['nova.pdf'].status, 'PENDING')
+        for name, original in (('copia.pdf', invoices['nova.pdf']), ('antiga.pdf', completed)):
+            self.assertEqual(invoices[name].status, 'ERROR')
+            self.assertIn(str(original.id), invoices[name].processing_log)
+            # The stored copy is reused instead of writing the same file again
+            self.assertEqual(invoices[name].original_file.name, original.original_file.name)
+
+    def test_decode_result_is_reused_for_identical_content(self):
+        result = {'processing_log': ['QR Code lido.'], 'invoice_data': {'atcud': 'AB-2'}}
+        UploadDedupService.store_decode_result(self.organization.id, 'hash-igual', result)
+        UploadDedupService.store_decode_result(self.organization.id, 'hash-sem-atcud', {'invoice_data': {}})
+        self.assertIsNone(UploadDedupService.cached_decode_result(self.organization.id, 'hash-sem-atcud'))
+
+        invoice = ScannedInvoice(content_hash='hash-igual')
+        with mock.patch('api.services.invoice_batch_service.decode_invoice_source') as decode:
+            [(decoded, reused)] = InvoiceBatchProcessor._decode_all([invoice], None, self.organization.id)
+        decode.assert_not_called()
+        self.assertIs(decoded, invoice)
+        self.assertTrue(reused['reused'])
+        self.assertEqual(reused['invoice_data'], result['invoice_data'])
+
+
+class DashboardCounterTests(TestCase):
+    """The incrementally maintained counters must match a rebuild from the source tables."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Dashboard')
+        cls.admin = User.objects.create(username='admin_dashboard')
+        cls.member = User.objects.create(username='membro_dashboard')
+        for user, is_admin in ((cls.admin, True), (cls.member, False)):
+            user.profile.organization = cls.organization
+            user.profile.is_org_admin = is_admin
+            user.profile.save()
+        cls.client_obj = Client.objects.create(organization=cls.organization, name='Cliente', monthly_fee=Decimal('100'))
+
+    def setUp(self):
+        self.now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            DashboardCounterService.rebuild(self.organization.id)
+            self.tasks = [
+                Task.objects.create(
+                    title=f'Tarefa {i}', client=self.client_obj,
+                    assigned_to=self.member if i % 2 else self.admin,
+                    status=['pending', 'in_progress', 'completed'][i % 3],
+                    deadline=[None, self.now, self.now - timedelta(days=3), self.now + timedelta(days=2)][i % 4],
+                )
+                for i in range(12)
+            ]
+            self.entries = [
+                TimeEntry.objects.create(
+                    user=self.member if i % 2 else self.admin, client=self.client_obj, description='-',
+                    minutes_spent=30 + i, date=self.now.date() - timedelta(days=i % 9)
+                )
+                for i in range(10)
+            ]
+
+    def assertMatchesRebuild(self):
+        incremental = DashboardCounterService.organization_summary(self.organization.id)
+        DashboardCounterService.rebuild(self.organization.id)
+        self.assertEqual(incremental, DashboardCounterService.organization_summary(self.organization.id))
+        return incremental
+
+    def test_counters_follow_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tasks[0].status = 'completed'
+            self.tasks[0].save()
+            self.tasks[2].status = 'pending'
+            self.tasks[2].save()
+            self.tasks[1].deadline = self.now - timedelta(days=1)
+            self.tasks[1].save()
+            self.tasks[4].delete()
+            self.entries[0].minutes_spent = 120
+            self.entries[0].save()
+            self.entries[1].date = self.now.date()
+            self.entries[1].save()
+            self.entries[2].delete()
+            ClientProfitability.objects.create(
+                client=self.client_obj, year=self.now.year, month=self.now.month,
+                monthly_fee=Decimal('100'), profit=Decimal('-20'), profit_margin=Decimal('-20'), is_profitable=False
+            )
+        summary = self.assertMatchesRebuild()
+
+        today, week_ago = self.now.date(), self.now.date() - timedelta(days=7)
+        open_tasks = Task.objects.filter(client__organization=self.organization, status__in=['pending', 'in_progress'])
+        self.assertEqual(summary['active_tasks'], open_tasks.count())
+        self.assertEqual(summary['overdue_tasks'], open_tasks.filter(deadline__date__lt=today).count())
+        self.assertEqual(summary['today_tasks'], open_tasks.filter(deadline__date=today).count())
+        self.assertEqual(summary['completed_tasks_week'], Task.objects.filter(status='completed').count())
+        self.assertEqual(summary['time_tracked_today'], sum(e.minutes_spent for e in TimeEntry.objects.filter(date=today)))
+        self.assertEqual(
+            summary['time_tracked_week'], sum(e.minutes_spent for e in TimeEntry.objects.filter(date__gte=week_ago))
+        )
+        self.assertEqual(summary['unprofitable_clients'], 1)
+        self.assertEqual(summary['average_profit_margin'], -20.0)
+
+    def test_rollover_keeps_totals(self):
+        yesterday = self.now.date() - timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tasks[0].deadline = self.now - timedelta(days=1)
+            self.tasks[0].save()
+        before = DashboardCounterService.organization_summary(self.organization.id)
+        self.assertTrue(DashboardCounter.objects.filter(metric='open_tasks', day=yesterday).exists())
+
+        DashboardCounterService.rollover()
+        self.assertFalse(DashboardCounter.objects.filter(metric='open_tasks', day=yesterday).exists())
+        self.assertEqual(DashboardCounterService.organization_summary(self.organization.id), before)
+        self.assertMatchesRebuild()
+
+    def test_member_sees_own_slice(self):
+        api = APIClient(SERVER_NAME='localhost')
+        api.force_authenticate(self.member)
+        response = api.get('/api/dashboard-summary/')
+        self.assertEqual(response.status_code, 200)
+        own_open = Task.objects.filter(assigned_to=self.member, status__in=['pending', 'in_progress'])
+        self.assertEqual(response.data['active_tasks'], own_open.count())
+        self.assertEqual(
+            response.data['time_tracked_week'],
+            sum(e.minutes_spent for e in TimeEntry.objects.filter(user=self.member))
+        )
+        self.assertNotIn('unprofitable_clients', response.data)
+
+
+class ClientIntelligenceTests(TestCase):
+    """The single-pass job must match the per-client services with a fixed number of queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Inteligência')
+        cls.admin = User.objects.create(username='admin_inteligencia')
+        cls.admin.profile.organization = cls.organization
+        cls.admin.profile.is_org_admin = True
+        cls.admin.profile.save()
+        cls.manager = User.objects.create(username='gestor_inteligencia')
+        obligation = FiscalObligationDefinition.objects.create(name='IVA', periodicity='MONTHLY', deadline_day=20)
+        consulting = TaskCategory.objects.create(name='Consultoria Fiscal')
+        now = timezone.now()
+
+        for i in range(6):
+            client = Client.objects.create(
+                organization=cls.organization, name=f'Cliente {i}', monthly_fee=Decimal(100 * i),
+                account_manager=cls.manager if i % 2 else None, fiscal_tags=['IRS'] if i % 3 == 0 else [],
+            )
+            for months_ago in range(i * 2):
+                period = (now.replace(day=1) - timedelta(days=31 * months_ago))
+                margin = Decimal(40 - months_ago * 10 * (i % 2)) if months_ago != 2 else None
+                ClientProfitability.objects.create(
+                    client=client, year=period.year, month=period.month, monthly_fee=Decimal('100'),
+                    profit_margin=margin, is_profitable=margin is None or margin > 0,
+                )
+            for n in range(i):
+                Task.objects.create(
+                    title=f'Tarefa {i}.{n}', client=client, deadline=now - timedelta(days=3 + 9 * (n % 3)),
+                    source_fiscal_obligation=obligation if n % 2 else None, obligation_period_key=f'P{n}',
+                )
+            if i == 3:
+                Task.objects.create(title='Consultoria', client=client, category=consulting, status='completed')
+
+    def test_matches_per_client_services(self):
+        ClientIntelligenceService.run_for_organization(self.organization.id)
+        for client in Client.objects.filter(organization=self.organization):
+            self.assertEqual(client.financial_health_score, FinancialHealthService.calculate_for_client(client), client.name)
+            self.assertEqual(client.churn_risk, FinancialHealthService.calculate_churn_risk(client), client.name)
+            self.assertEqual(client.compliance_risks, ComplianceMonitor.check_for_client(client), client.name)
+            self.assertEqual(client.revenue_opportunities, RevenueService.identify_for_client(client), client.name)
+
+    def test_query_count_does_not_depend_on_clients(self):
+        with CaptureQueriesContext(connection) as small:
+            ClientIntelligenceService.run_for_organization(self.organization.id, chunk_size=10)
+        WorkflowNotification.objects.all().delete()
+        for i in range(6, 12):
+            Client.objects.create(organization=self.organization, name=f'Cliente {i}', monthly_fee=Decimal('10'))
+        with CaptureQueriesContext(connection) as large:
+            ClientIntelligenceService.run_for_organization(self.organization.id, chunk_size=20)
+        load = lambda context: [q for q in context.captured_queries if 'api_workflownotification' not in q['sql']
+                                and 'notificationsettings' not in q['sql'] and 'auth_user' not in q['sql']]
+        self.assertEqual(len(load(small)), len(load(large)))
+
+    def test_notifications_are_deduplicated(self):
+        first = ClientIntelligenceService.run_for_organization(self.organization.id)
+        self.assertGreater(first['notifications_created'], 0)
+        notifications = WorkflowNotification.objects.filter(user__in=[self.admin, self.manager])
+        self.assertEqual(notifications.count(), first['notifications_created'])
+        self.assertEqual(
+            notifications.count(),
+            len(set(notifications.values_list('user_id', 'notification_type', 'title')))
+        )
+        second = ClientIntelligenceService.run_for_organization(self.organization.id)
+        self.assertEqual(second['notifications_created'], 0)
+
+
+class BulkNotificationTests(TestCase):
+    """create_notifications_bulk applies the same settings and dedup rules as create_notification."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Notificações')
+        cls.client_record = Client.objects.create(organization=cls.organization, name='Cliente Notificações')
+        cls.users = [User.objects.create(username=f'destinatario_{i}') for i in range(4)]
+        NotificationSettings.objects.create(user=cls.users[0], notify_manual_reminders=False)
+        cls.task = Task.objects.create(title='Tarefa notificada', client=cls.client_record)
+
+    def intent(self, user, **extra):
+        return dict(user=user, task=self.task, notification_type='manual_reminder',
+                    title='Lembrete', message='Mensagem', check_existing_recent=True, **extra)
+
+    def test_matches_single_notifications(self):
+        NotificationService.create_notification(**self.intent(self.users[1]))
+        with CaptureQueriesContext(connection) as queries:
+            created = NotificationService.create_notifications_bulk(
+                [self.intent(user) for user in self.users] + [self.intent(self.users[2])]
+            )
+        # Desativado nas definições, já notificado recentemente e repetido dentro do lote
+        self.assertEqual(sorted(n.user_id for n in created), [self.users[2].id, self.users[3].id])
+        self.assertEqual(len(queries), 3)
+
+        # O caminho individual chega à mesma decisão depois do lote
+        for user in self.users:
+            self.assertIsNone(NotificationService.create_notification(**self.intent(user)), user.username)
+
+
+class NotificationTemplateRegistryTests(TestCase):
+    """Templates are resolved once per organization and only referenced variables are computed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Templates')
+        cls.user = User.objects.create(username='destinatario_templates', first_name='Ana')
+        cls.user.profile.organization = cls.organization
+        cls.user.profile.save()
+        cls.client_record = Client.objects.create(organization=cls.organization, name='Cliente Templates')
+        cls.task = Task.objects.create(title='Tarefa Templates', client=cls.client_record)
+        cls.template = NotificationTemplate.objects.create(
+            organization=cls.organization, notification_type='step_ready', name='Passo pronto',
+            title_template='Pronto: {task_title}', message_template='{user_first_name}, {task_title} está pronta.',
+            is_default=True,
+        )
+
+    def setUp(self):
+        # O registo é por processo e não acompanha o rollback entre testes
+        NotificationTemplateRegistry.invalidate(self.organization.id, shared=False)
+
+    def render(self, notification_type='step_ready'):
+        task = Task.objects.get(pk=self.task.pk)
+        return NotificationTemplateService.get_rendered_notification_content(
+            user_target=self.user, notification_type=notification_type, task=task
+        )
+
+    def test_templates_table_is_read_once(self):
+        self.render()
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(5):
+                content = self.render()
+        self.assertEqual(content['title'], 'Pronto: Tarefa Templates')
+        self.assertEqual(content['message'], 'Ana, Tarefa Templates está pronta.')
+        self.assertFalse([q for q in queries.captured_queries if 'api_notificationtemplate' in q['sql']])
+        # O nome da organização não é usado pelo template, por isso não é lido
+        self.assertFalse([q for q in queries.captured_queries if 'api_organization' in q['sql']])
+        self.assertNotIn('organization_name', content['context'])
+
+    def test_saving_a_template_invalidates_the_registry(self):
+        self.render()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template.title_template = 'Novo: {task_title} ({client_name})'
+            self.template.save()
+        self.assertEqual(self.render()['title'], 'Novo: Tarefa Templates (Cliente Templates)')
+
+        self.template.delete()
+        self.assertEqual(self.render()['title'], 'Passo pronto: Passo não especificado para Tarefa Templates')
+
+    def test_system_defaults_mark_missing_variables(self):
+        content = self.render('workflow_assigned')
+        self.assertIn('{Informação em falta: first_step_message}', content['message'])
+        self.assertIn('Cliente Templates', content['message'])
+
+
+class FiscalObligationGenerationTests(TestCase):
+    """The set-based generator plans once per definition-period and bulk-creates the missing tasks."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Obrigações')
+        cls.admin = User.objects.create(username='admin_obrigacoes')
+        cls.admin.profile.organization = cls.organization
+        cls.admin.profile.is_org_admin = True
+        cls.admin.profile.save()
+        cls.manager = User.objects.create(username='gestor_obrigacoes')
+        workflow = WorkflowDefinition.objects.create(name='Fluxo IVA', created_by=cls.admin)
+        cls.first_step = WorkflowStep.objects.create(workflow=workflow, name='Recolha', order=1)
+        WorkflowStep.objects.create(workflow=workflow, name='Submissão', order=2)
+        # Prazo no último dia do mês corrente, já dentro da janela de geração
+        cls.definition = FiscalObligationDefinition.objects.create(
+            name='IVA Mensal', periodicity='MONTHLY', deadline_day=31, deadline_month_offset=1,
+            generation_trigger_offset_days=60, applies_to_client_tags=['IVA_MENSAL'], default_workflow=workflow,
+        )
+        cls.clients = [
+            Client.objects.create(
+                organization=cls.organization, name=f'Cliente IVA {i}', account_manager=cls.manager,
+                fiscal_tags=['IVA_MENSAL', 'IRC'] if i % 2 == 0 else ['IRC'],
+            )
+            for i in range(6)
+        ]
+
+    def generate(self, **kwargs):
+        today = timezone.localdate()
+        return FiscalObligationGenerator.generate_obligations_for_period(today.year, today.month, self.organization, **kwargs)
+
+    def test_dry_run_plans_without_writing(self):
+        stats = self.generate(dry_run=True)
+        self.assertEqual(stats['tasks_created'], 0)
+        self.assertEqual(sorted(item['client_name'] for item in stats['plan']), ['Cliente IVA 0', 'Cliente IVA 2', 'Cliente IVA 4'])
+        self.assertEqual({item['assigned_to'] for item in stats['plan']}, {'gestor_obrigacoes'})
+        self.assertFalse(Task.objects.filter(source_fiscal_obligation=self.definition).exists())
+
+    def test_generation_creates_missing_tasks_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = self.generate()
+        self.assertEqual((stats['tasks_created'], stats['tasks_skipped'], stats['errors']), (3, 0, []))
+        tasks = Task.objects.filter(source_fiscal_obligation=self.definition)
+        self.assertEqual(tasks.count(), 3)
+        self.assertTrue(all(task.current_workflow_step_id == self.first_step.id for task in tasks))
+        self.assertEqual(WorkflowHistory.objects.filter(task__in=tasks, action='workflow_assigned').count(), 3)
+        self.assertEqual(TaskInvolvement.objects.filter(task__in=tasks, user=self.manager, role='primary').count(), 3)
+        open_tasks = DashboardCounter.objects.filter(organization=self.organization, metric='open_tasks')
+        self.assertEqual(sum(counter.value for counter in open_tasks), 3)
+        self.assertEqual(WorkflowNotification.objects.filter(task__in=tasks, user=self.manager).count(), 3)
+        self.assertEqual(WorkflowNotification.objects.filter(task__in=tasks, user=self.admin).count(), 3)
+
+        again = self.generate()
+        self.assertEqual((again['tasks_created'], again['tasks_skipped']), (0, 3))
+        self.assertEqual(tasks.count(), 3)
+
+    def test_plan_query_count_does_not_depend_on_clients(self):
+        with CaptureQueriesContext(connection) as small:
+            self.generate(dry_run=True)
+        for i in range(6, 12):
+            Client.objects.create(organization=self.organization, name=f'Cliente IVA {i}', fiscal_tags=['IVA_MENSAL'])
+        with CaptureQueriesContext(connection) as large:
+            stats = self.generate(dry_run=True)
+        self.assertEqual(len(stats['plan']), 9)
+        self.assertEqual(len(small), len(large))
+
+
+class FiscalTagQueryTests(TestCase):
+    """Tag matching and histograms run in SQL with the same results as the Python checks."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Tags')
+        tag_sets = [['IVA_MENSAL', 'IRC'], ['IRC'], ['IVA_MENSAL'], [], ['IRS', 'IRC', 'IVA_MENSAL']]
+        cls.clients = [
+            Client.objects.create(organization=cls.organization, name=f'Cliente Tags {i}', fiscal_tags=tags)
+            for i, tags in enumerate(tag_sets)
+        ]
+
+    def test_with_all_tags_matches_python(self):
+        clients = Client.objects.filter(organization=self.organization)
+        for tags in (['IRC'], ['IVA_MENSAL', 'IRC'], ['IRS', 'IVA_MENSAL'], []):
+            expected = {client.id for client in self.clients if all(tag in client.fiscal_tags for tag in tags)}
+            self.assertEqual(set(clients.with_all_tags(tags).values_list('id', flat=True)), expected, tags)
+
+    def test_fiscal_tag_histogram(self):
+        histogram = Client.objects.filter(organization=self.organization).fiscal_tag_histogram()
+        self.assertEqual(histogram, {'IRC': 3, 'IVA_MENSAL': 3, 'IRS': 1})
+        self.assertEqual(list(Client.objects.filter(organization=self.organization).fiscal_tag_histogram(limit=1)), ['IRC'])
+
+
+class StepEntryTimestampTests(TestCase):
+    """current_step_entered_at follows step changes and drives the overdue/approval jobs."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Passos')
+        cls.owner = User.objects.create(username='responsavel_passos')
+        cls.owner.profile.organization = cls.organization
+        cls.owner.profile.is_org_admin = True
+        cls.owner.profile.save()
+        cls.client_record = Client.objects.create(organization=cls.organization, name='Cliente Passos')
+        cls.workflow = WorkflowDefinition.objects.create(name='Fluxo Passos', created_by=cls.owner)
+        cls.review = WorkflowStep.objects.create(workflow=cls.workflow, name='Revisão', order=1, assign_to=cls.owner)
+        cls.approval = WorkflowStep.objects.create(
+            workflow=cls.workflow, name='Aprovação', order=2, assign_to=cls.owner, requires_approval=True
+        )
+
+    def make_task(self, step, days_on_step):
+        task = Task.objects.create(
+            title=f'Tarefa {step.name} {days_on_step}', client=self.client_record, assigned_to=self.owner,
+            workflow=self.workflow,
+        )
+        task.enter_workflow_step(step, at=timezone.now() - timedelta(days=days_on_step, hours=1))
+        task.save(update_fields=['current_workflow_step'])
+        return task
+
+    def test_save_stamps_step_changes(self):
+        task = Task.objects.create(title='Tarefa', client=self.client_record, workflow=self.workflow,
+                                   current_workflow_step=self.review)
+        self.assertIsNotNone(task.current_step_entered_at)
+        entered = task.current_step_entered_at
+
+        task = Task.objects.get(pk=task.pk)
+        task.title = 'Outro título'
+        task.save()
+        self.assertEqual(Task.objects.get(pk=task.pk).current_step_entered_at, entered)
+
+        task.current_workflow_step = self.approval
+        task.save(update_fields=['current_workflow_step'])
+        self.assertGreater(Task.objects.get(pk=task.pk).current_step_entered_at, entered)
+
+        task.enter_workflow_step(None)
+        task.save(update_fields=['current_workflow_step'])
+        self.assertIsNone(Task.objects.get(pk=task.pk).current_step_entered_at)
+
+    def test_overdue_job_uses_one_query_without_history(self):
+        overdue = self.make_task(self.review, 5)
+        self.make_task(self.review, 1)
+        with CaptureQueriesContext(connection) as queries:
+            result = check_overdue_steps_and_notify_task(default_overdue_threshold_days=3)
+        self.assertEqual(result['tasks_with_active_workflow_step_checked'], 1)
+        self.assertEqual(set(WorkflowNotification.objects.filter(notification_type='step_overdue').values_list('task_id', flat=True)), {overdue.id})
+        self.assertFalse([q for q in queries.captured_queries if 'api_workflowhistory' in q['sql']])
+
+    def test_approval_reminders_skip_approved_steps(self):
+        pending = self.make_task(self.approval, 4)
+        approved = self.make_task(self.approval, 4)
+        TaskApproval.objects.create(task=approved, workflow_step=self.approval, approved_by=self.owner, approved=True)
+        self.make_task(self.approval, 1)
+        result = check_pending_approvals_and_remind_task(default_reminder_threshold_days=2)
+        self.assertEqual(result['tasks_checked_for_pending_approval'], 1)
+        self.assertEqual(set(WorkflowNotification.objects.filter(notification_type='approval_needed').values_list('task_id', flat=True)), {pending.id})
+
+
+class StreamingExportTests(TestCase):
+    """CSV/XLSX reports stream every row from the database and size columns while writing."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Exportação')
+        cls.user = User.objects.create(username='exportador')
+        cls.client_record = Client.objects.create(organization=cls.organization, name='Cliente Exportação')
+        cls.task = Task.objects.create(title='Tarefa exportada', client=cls.client_record, assigned_to=cls.user)
+        cls.descriptions = ['Curta', 'Uma descrição bastante mais comprida', 'Média', 'x' * 200]
+        for description in cls.descriptions:
+            TimeEntry.objects.create(user=cls.user, client=cls.client_record, task=cls.task,
+                                     description=description, minutes_spent=30)
+
+    def test_time_tracking_xlsx_writes_all_rows_with_sampled_widths(self):
+        # A sample smaller than the export exercises the flush of retained rows
+        with mock.patch.object(StreamingSheet, 'WIDTH_SAMPLE_ROWS', 2):
+            output, content_type = ReportGenerationService.generate_time_tracking_summary_report(
+                organization=self.organization, format_type='xlsx'
+            )
+        self.assertIn('spreadsheetml', content_type)
+        sheet = load_workbook(output)['Registos Detalhados']
+        rows = list(sheet.iter_rows(min_row=2, values_only=True))
+        self.assertEqual(sorted(row[5] for row in rows), sorted(self.descriptions))
+        # Widths come from the first two rows only and are capped
+        description_width = sheet.column_dimensions['F'].width
+        self.assertLessEqual(description_width, StreamingSheet.MAX_WIDTH)
+        self.assertGreaterEqual(description_width, 12)
+
+    def test_task_performance_csv_and_xlsx(self):
+        output, _ = ReportGenerationService.generate_task_performance_report(
+            organization=self.organization, format_type='csv'
+        )
+        lines = output.read().decode('utf-8-sig').splitlines()
+        self.assertTrue(any('Tarefa exportada' in line for line in lines))
+
+        output, _ = ReportGenerationService.generate_task_performance_report(
+            organization=self.organization, format_type='xlsx'
+        )
+        rows = list(load_workbook(output)['Lista Tarefas Detalhada'].iter_rows(min_row=2, values_only=True))
+        self.assertEqual([row[1] for row in rows], ['Tarefa exportada'])
+        self.assertIsNotNone(rows[0][9])
+
+
+class ReportDataCollectionTests(TestCase):
+    """Report data is collected with a fixed number of queries, shared by every format."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Relatórios')
+        cls.user = User.objects.create(username='relatorios')
+        cls.add_clients(2)
+
+    @classmethod
+    def add_clients(cls, count):
+        for _ in range(count):
+            client = Client.objects.create(organization=cls.organization, name=f'Cliente {Client.objects.count()}',
+                                           monthly_fee=Decimal('100'))
+            for priority in range(1, 8):
+                task = Task.objects.create(title=f'Tarefa {priority}', client=client, priority=priority % 5 + 1,
+                                           status='completed' if priority % 2 else 'pending')
+                TimeEntry.objects.create(user=cls.user, client=client, task=task, description='Registo',
+                                         minutes_spent=priority * 10)
+            ClientProfitability.objects.create(client=client, year=2025, month=1, monthly_fee=100, time_cost=20,
+                                               total_expenses=0, profit=80, profit_margin=80, is_profitable=True)
+
+    def collect(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = ReportDataService.client_summary(self.organization)
+        return data, len(queries.captured_queries)
+
+    def test_client_summary_query_count_does_not_grow_with_clients(self):
+        data, baseline = self.collect()
+        self.add_clients(3)
+        data, queries = self.collect()
+        self.assertEqual(queries, baseline)
+        self.assertEqual(data['total_clients'], 5)
+        self.assertEqual(data['total_monthly_fees'], Decimal('500'))
+
+        for detail in data['clients_data']:
+            tasks = Task.objects.filter(client=detail['client_obj'])
+            self.assertEqual(detail['active_tasks_count'], tasks.filter(status='pending').count())
+            self.assertEqual(detail['completed_tasks_count'], tasks.filter(status='completed').count())
+            self.assertEqual(detail['total_time_minutes'], 280)
+            self.assertEqual(detail['recent_profitability']['profit'], Decimal('80'))
+            self.assertEqual(
+                [task.pk for task in detail['top_tasks']],
+                list(tasks.order_by('-priority', '-created_at').values_list('pk', flat=True)[:ReportDataService.TOP_PER_CLIENT])
+            )
+            self.assertEqual(len(detail['recent_time_entries']), ReportDataService.TOP_PER_CLIENT)
+
+    def test_month_range_filter_crosses_years(self):
+        client = Client.objects.filter(organization=self.organization).first()
+        for year, month in ((2024, 11), (2024, 12), (2025, 2), (2025, 3)):
+            ClientProfitability.objects.create(client=client, year=year, month=month, monthly_fee=100, time_cost=0,
+                                               total_expenses=0, profit=1, profit_margin=1, is_profitable=True)
+        months = ClientProfitability.objects.filter(client=client).filter(ReportDataService._month_range_filter(
+            timezone.datetime(2024, 12, 31), timezone.datetime(2025, 2, 1)
+        )).order_by('year', 'month').values_list('year', 'month')
+        self.assertEqual(list(months), [(2024, 12), (2025, 1), (2025, 2)])
+
+    def test_every_report_renders_in_every_format(self):
+        generators = [
+            ReportGenerationService.generate_client_summary_report,
+            ReportGenerationService.generate_profitability_analysis_report,
+            ReportGenerationService.generate_time_tracking_summary_report,
+            ReportGenerationService.generate_task_performance_report,
+        ]
+        for generate in generators:
+            for format_type in ('pdf', 'csv', 'xlsx'):
+                output, content_type = generate(organization=self.organization, format_type=format_type)
+                self.assertTrue(output.read(), (generate.__name__, format_type))
+
+
+class InvoiceBatchTaskCreationTests(TestCase):
+    """Invoice tasks are bulk inserted with lookups resolved once per batch, not per invoice."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Lotes')
+        cls.user = User.objects.create(username='criador_lotes')
+        cls.user.profile.organization = cls.organization
+        cls.user.profile.is_org_admin = True
+        cls.user.profile.save()
+        cls.assignee = User.objects.create(username='responsavel_lotes')
+        cls.assignee.profile.organization = cls.organization
+        cls.assignee.profile.save()
+        cls.matched_client = Client.objects.create(organization=cls.organization, name='B Cliente NIF', nif='500000001')
+        cls.fallback_client = Client.objects.create(organization=cls.organization, name='A Cliente', nif='500000002')
+        cls.workflow = WorkflowDefinition.objects.create(name='Fluxo Faturas', created_by=cls.user)
+        cls.first_step = WorkflowStep.objects.create(workflow=cls.workflow, name='Lançamento', order=1)
+        WorkflowStep.objects.create(workflow=cls.workflow, name='Revisão', order=2)
+
+    def make_batch(self, count):
+        batch = InvoiceBatch.objects.create(organization=self.organization, uploaded_by=self.user)
+        ScannedInvoice.objects.bulk_create([
+            ScannedInvoice(
+                batch=batch, organization=self.organization, original_file=f'invoice_uploads/f{i}.pdf', original_filename=f'f{i}.pdf',
+                status='COMPLETED', atcud=f'ATCUD-{batch.id.hex[:6]}-{i}',
+                nif_acquirer='500000001' if i % 2 else '999999990',
+            )
+            for i in range(count)
+        ])
+        return batch
+
+    def create(self, batch):
+        creator = InvoiceBatchTaskCreator(batch, self.user, {
+            'workflow': str(self.workflow.id), 'assigned_to': self.assignee.id, 'status': 'completed',
+        })
+        invoices = list(InvoiceBatchTaskCreator.eligible_invoices(batch))
+        with CaptureQueriesContext(connection) as queries:
+            result = creator.create(invoices)
+        return result, len(queries)
+
+    def test_query_count_does_not_grow_with_invoices(self):
+        small, small_queries = self.create(self.make_batch(3))
+        large_batch = self.make_batch(40)
+        large, large_queries = self.create(large_batch)
+        self.assertEqual((small['tasks_created'], large['tasks_created']), (3, 40))
+        self.assertEqual(small_queries, large_queries)
+
+        tasks = Task.objects.filter(source_scanned_invoice__batch=large_batch)
+        self.assertEqual(tasks.filter(client=self.matched_client).count(), 20)
+        self.assertEqual(tasks.filter(client=self.fallback_client).count(), 20)
+        self.assertFalse(tasks.filter(current_workflow_step=self.first_step, current_step_entered_at__isnull=True).exists())
+        self.assertFalse(tasks.filter(completed_at__isnull=True).exists())
+        self.assertEqual(WorkflowHistory.objects.filter(task__in=tasks, action='workflow_assigned').count(), 40)
+        self.assertEqual(TaskInvolvement.objects.filter(task__in=tasks, user=self.assignee).count(), 40)
+        self.assertEqual(InvoiceBatchTaskCreator.get_progress(large_batch.id)['processed'], 40)
+
+    def test_invoices_that_already_have_tasks_are_reported(self):
+        batch = self.make_batch(4)
+        invoices = list(InvoiceBatchTaskCreator.eligible_invoices(batch))
+        InvoiceBatchTaskCreator(batch, self.user).create(invoices[:1])
+        result = InvoiceBatchTaskCreator(batch, self.user).create(invoices)
+        self.assertEqual((result['tasks_created'], result['tasks_failed']), (3, 1))
+        self.assertIn('já tem uma tarefa', result['errors'][0])
+        self.assertEqual(Task.objects.filter(source_scanned_invoice__batch=batch).count(), 4)
+
+    def test_deadline_from_request_is_parsed(self):
+        batch = self.make_batch(2)
+        invoices = list(InvoiceBatchTaskCreator.eligible_invoices(batch))
+        with self.captureOnCommitCallbacks(execute=True):
+            result = InvoiceBatchTaskCreator(batch, self.user, {'deadline': '2030-05-10'}).create(invoices)
+        self.assertEqual(result['tasks_created'], 2)
+        self.assertEqual(DashboardCounter.objects.get(
+            organization=self.organization, metric='open_tasks', day='2030-05-10'
+        ).value, 2)
+
+        batch = self.make_batch(1)
+        result = InvoiceBatchTaskCreator(batch, self.user, {'deadline': 'amanhã'}).create(
+            list(InvoiceBatchTaskCreator.eligible_invoices(batch))
+        )
+        self.assertEqual(result['tasks_failed'], 1)
+        self.assertIn('Prazo inválido', result['errors'][0])
+
+
+class ExpenseCategorizationTests(TestCase):
+    """Known issuers are categorized locally; unknown issuers share one Gemini prompt."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Despesas')
+        cls.batch = InvoiceBatch.objects.create(organization=cls.organization)
+
+    def setUp(self):
+        cache.clear()
+
+    def make_invoice(self, nif, raw_qr='', **fields):
+        return ScannedInvoice.objects.create(
+            batch=self.batch, original_file='invoice_uploads/f.pdf', nif_emitter=nif,
+            raw_qr_code_data=raw_qr or f'A:{nif}*D:FT', **fields
+        )
+
+    def make_expense(self, invoice, category, auto=True):
+        return Expense.objects.create(
+            amount=Decimal('10.00'), date=timezone.now().date(), category=category,
+            is_auto_categorized=auto, source_scanned_invoice=invoice,
+        )
+
+    def test_nif_memory_prefers_user_corrections(self):
+        for _ in range(3):
+            self.make_expense(self.make_invoice('500100200'), 'FORNECEDORES')
+        self.make_expense(self.make_invoice('500100200'), 'COMBUSTÍVEL', auto=False)
+        self.make_invoice('500300400', edited_data={'category': 'seguros'})
+
+        with mock.patch.object(ExpenseCategorizationService, '_categorize_with_llm') as llm:
+            self.assertEqual(ExpenseCategorizationService.categorize_locally(self.make_invoice('500100200')), 'COMBUSTÍVEL')
+            self.assertEqual(ExpenseCategorizationService.categorize_locally(self.make_invoice('500300400')), 'SEGUROS')
+            self.assertIsNone(ExpenseCategorizationService.categorize_locally(self.make_invoice('500999999')))
+        llm.assert_not_called()
+
+    def test_classifier_learns_from_qr_fields(self):
+        # AT QR Code: I7 is the normal-rate taxable base
+        for nif in ('501000001', '501000002', '501000003'):
+            self.make_expense(self.make_invoice(nif, f'A:{nif}*D:FS*I7:40.00*I8:9.20', doc_type='FS',
+                                                gross_total=Decimal('49.20')), 'COMBUSTÍVEL')
+        invoice = self.make_invoice('501000009', 'A:501000009*D:FS*I7:30.00*I8:6.90', doc_type='FS',
+                                    gross_total=Decimal('36.90'))
+        self.assertEqual(ExpenseCategorizationService.categorize_locally(invoice), 'COMBUSTÍVEL')
+        restaurant = self.make_invoice('501000010', 'A:501000010*D:FS*I5:20.00*I6:2.60', doc_type='FS',
+                                       gross_total=Decimal('22.60'))
+        self.assertEqual(ExpenseCategorizationService.categorize_locally(restaurant), 'REFEIÇÕES E ESTADIAS')
+
+    def test_pending_expenses_use_one_prompt_per_batch_of_issuers(self):
+        expenses = [self.make_expense(self.make_invoice(nif), None) for nif in ('502000001', '502000001', '502000002')]
+        response = '```json\n{"1": "software e ti", "2": "RENDA"}\n```'
+        with mock.patch('api.services.expense_categorization_service.GeminiService') as gemini:
+            gemini.return_value.generate_conversational_response.return_value = response
+            self.assertEqual(ExpenseCategorizationService.categorize_pending(self.organization.id), 3)
+        gemini.return_value.generate_conversational_response.assert_called_once()
+        self.assertEqual(
+            [Expense.objects.get(pk=expense.pk).category for expense in expenses],
+            ['SOFTWARE E TI', 'SOFTWARE E TI', 'RENDA']
+        )
+        # The suggestion is remembered for the next invoice of the same issuer
+        self.assertEqual(ExpenseCategorizationService.categorize_locally(self.make_invoice('502000002')), 'RENDA')
+
+    def decoded(self, invoice, i, acquirer):
+        return invoice, {'processing_log': [], 'invoice_data': {
+            'atcud': f'AT-{invoice.id.hex[:8]}', 'nif_emitter': f'50300000{i % 3}', 'nif_acquirer': acquirer,
+            'gross_total': Decimal('12.30'), 'doc_date': '2026-10-01', 'doc_type': 'FT',
+        }}
+
+    def test_batch_path_creates_expenses_and_tasks(self):
+        manager = User.objects.create(username='gestor_despesas')
+        client = Client.objects.create(organization=self.organization, name='Cliente Despesas', nif='509000001',
+                                       account_manager=manager)
+        batch = InvoiceBatch.objects.create(organization=self.organization)
+        invoices = [
+            ScannedInvoice.objects.create(batch=batch, original_file=f'invoice_uploads/b{i}.pdf', original_filename=f'b{i}.pdf')
+            for i in range(6)
+        ]
+        results = [self.decoded(invoice, i, '509000001' if i % 2 else '999999990') for i, invoice in enumerate(invoices)]
+        with mock.patch.object(InvoiceBatchProcessor, '_decode_all', return_value=iter(results)), \
+                mock.patch.object(ExpenseCategorizationService, 'schedule_pending') as schedule, \
+                mock.patch.object(ProfitabilityDeltaQueue, 'schedule_apply'), \
+                self.captureOnCommitCallbacks(execute=True):
+            progress = InvoiceBatchProcessor.process_batch(batch.id)
+        self.assertEqual(progress['completed'], 6)
+        expenses = Expense.objects.filter(source_scanned_invoice__batch=batch)
+        self.assertEqual(expenses.count(), 6)
+        self.assertEqual(expenses.filter(client=client).count(), 3)
+        tasks = Task.objects.filter(client=client, title__startswith='Lançamento Contabilístico')
+        self.assertEqual(tasks.count(), 3)
+        self.assertFalse(tasks.exclude(assigned_to=manager).exists())
+        self.assertEqual(TaskInvolvement.objects.filter(task__in=tasks, user=manager).count(), 3)
+        schedule.assert_called_once_with(self.organization.id)
+
+    def test_follow_ups_query_count_does_not_grow(self):
+        Client.objects.create(organization=self.organization, name='Cliente Despesas', nif='509000001')
+
+        def follow_up(count):
+            invoices = [self.make_invoice(f'50400000{i % 3}', status='COMPLETED', nif_acquirer='509000001',
+                                          gross_total=Decimal('5.00'), doc_date=timezone.now().date(),
+                                          atcud=f'AT-{i}-{count}')
+                        for i in range(count)]
+            with CaptureQueriesContext(connection) as queries, \
+                    mock.patch.object(ExpenseCategorizationService, 'schedule_pending'):
+                InvoiceBatchProcessor.create_follow_ups(invoices, self.batch)
+            return invoices, len(queries)
+
+        ExpenseCategorizationService.get_model(self.organization.id)
+        small, small_queries = follow_up(2)
+        large, large_queries = follow_up(15)
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(Expense.objects.filter(source_scanned_invoice__in=small + large).count(), 17)
+        # Invoices that already have an expense are skipped
+        InvoiceBatchProcessor.create_follow_ups(large, self.batch)
+        self.assertEqual(Task.objects.filter(title__startswith='Lançamento Contabilístico').count(), 17)
+
+
+class InvoiceBatchListTests(TestCase):
+    """The batch list is served from SQL annotations, whatever the number of batches and invoices.
+
+    Invoices are only embedded in a batch's detail, or in the list when `fields` asks for them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org Lista Lotes')
+        cls.admin = User.objects.create(username='admin_lotes')
+        cls.admin.profile.organization = cls.organization
+        cls.admin.profile.is_org_admin = True
+        cls.admin.profile.save()
+        cls.client_record = Client.objects.create(organization=cls.organization, name='Cliente Lotes')
+        cls.add_batch(2)
+
+    @classmethod
+    def add_batch(cls, invoices):
+        batch = InvoiceBatch.objects.create(organization=cls.organization, uploaded_by=cls.admin)
+        created = ScannedInvoice.objects.bulk_create([
+            ScannedInvoice(batch=batch, organization=cls.organization, original_file=f'invoice_uploads/{i}.pdf',
+                           status='ERROR' if i % 3 == 0 else 'COMPLETED')
+            for i in range(invoices)
+        ])
+        Task.objects.create(title='Lançar', client=cls.client_record, source_scanned_invoice=created[1])
+        return batch
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def _list(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.api.get('/api/invoice-batches/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_batches_or_invoices(self):
+        _, few = self._list()
+        batch = self.add_batch(12)
+        self.add_batch(5)
+        results, many = self._list()
+        self.assertEqual(few, many)
+
+        item = next(item for item in results if item['id'] == str(batch.id))
+        self.assertNotIn('invoices', item)
+        self.assertEqual(item['invoice_count'], 12)
+        self.assertEqual(item['status_summary'], [{'status': 'COMPLETED', 'count': 8}, {'status': 'ERROR', 'count': 4}])
+
+    def test_invoices_on_request_and_in_detail(self):
+        batch = self.add_batch(12)
+        _, few = self._list(fields='id,invoices')
+        self.add_batch(5)
+        results, many = self._list(fields='id,invoices')
+        self.assertEqual(few, many)
+        item = next(item for item in results if item['id'] == str(batch.id))
+        self.assertEqual(len(item['invoices']), 12)
+
+        detail = self.api.get(f'/api/invoice-batches/{batch.id}/').data
+        self.assertEqual(detail['invoice_count'], 12)
+        with_tasks = [invoice for invoice in detail['invoices'] if invoice['has_tasks']]
+        self.assertEqual(len(with_tasks), 1)
+        self.assertEqual(with_tasks[0]['generated_task_ids'],
+                         [str(Task.objects.get(source_scanned_invoice__batch=batch).id)])
+
+    def test_lightweight_list_skips_invoices(self):
+        results, queries = self._list(fields='id,invoice_count,status_summary')
+        _, full = self._list(fields='id,invoice_count,status_summary,invoices')
+        self.assertEqual(set(results[0]), {'id', 'invoice_count', 'status_summary'})
+        self.assertLess(queries, full)
+
+    def test_batch_status_counts(self):
+        batch = self.add_batch(6)
+        response = self.api.get(f'/api/invoice-batches/{batch.id}/batch_status/')
+        self.assertEqual(response.data['invoice_stats'], {
+            'total': 6, 'completed': 4, 'with_tasks': 1, 'without_tasks': 3,
+            'processing': 0, 'pending': 0, 'error': 2,
+        })
+        self.assertEqual(response.data['task_stats'], {'pending': 1, 'in_progress': 0, 'completed': 0, 'cancelled': 0})
+        self.assertTrue(response.data['ready_for_batch_creation'])
+
+
+class AtcudUniquenessTests(TestCase):
+    """A completed ATCUD is unique per organization, enforced by the database."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Org ATCUD')
+        cls.other_organization = Organization.objects.create(name='Outra Org ATCUD')
+        cls.batch = InvoiceBatch.objects.create(organization=cls.organization)
+
+    def make_invoice(self, batch=None, **fields):
+        return ScannedInvoice.objects.create(batch=batch or self.batch, original_file='invoice_uploads/f.pdf', **fields)
+
+    def test_constraint_scope(self):
+        original = self.make_invoice(atcud='ABCD-1', status='COMPLETED')
+        self.assertEqual(original.organization, self.organization)
+        # Other statuses and other organizations may repeat the ATCUD
+        self.make_invoice(atcud='ABCD-1', status='REVIEW')
+        self.make_invoice(InvoiceBatch.objects.create(organization=self.other_organization), atcud='ABCD-1', status='COMPLETED')
+        with self.assertRaises(IntegrityError) as raised, transaction.atomic():
+            self.make_invoice(atcud='ABCD-1', status='COMPLETED')
+        self.assertTrue(ScannedInvoice.is_duplicate_atcud_error(raised.exception))
+
+    def test_batch_persist_marks_concurrent_duplicates(self):
+        # Completed by another worker after this batch loaded its ATCUD set
+        self.make_invoice(atcud='ABCD-2', status='COMPLETED')
+        invoices = [self.make_invoice(status='PROCESSING') for _ in range(2)]
+        for index, invoice in enumerate(invoices):
+            invoice.status, invoice.atcud = 'COMPLETED', f'ABCD-{index + 2}'
+        progress = {'completed': 2, 'duplicates': 0}
+        InvoiceBatchProcessor._persist(invoices, progress)
+        self.assertEqual(progress, {'completed': 1, 'duplicates': 1})
+        duplicate, saved = (ScannedInvoice.objects.get(pk=invoice.pk) for invoice in invoices)
+        self.assertEqual((duplicate.status, duplicate.atcud), ('ERROR', None))
+        self.assertEqual((saved.status, saved.atcud), ('COMPLETED', 'ABCD-3'))
+
+
+class NotificationCounterTests(TestCase):
+    """The cached notification counters must match a rebuild from WorkflowNotification."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='leitor_contadores')
+        cls.other = User.objects.create(username='outro_contadores')
+
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient(SERVER_NAME='localhost')
+        self.api.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notifications = [
+                self.notify(self.user if i % 4 else self.other, i) for i in range(10)
+            ]
+            # Fora da janela do resumo semanal, mas ainda por ler
+            WorkflowNotification.objects.filter(pk=self.notifications[1].pk).update(
+                created_at=timezone.now() - timedelta(days=10)
+            )
+
+    def notify(self, user, i):
+        return WorkflowNotification.objects.create(
+            user=user, title=f'Notificação {i}', message='-',
+            notification_type=['manual_reminder', 'step_overdue', 'report_generated'][i % 3],
+            priority=['normal', 'urgent', 'high'][i % 3],
+        )
+
+    def counters(self):
+        return NotificationCounterService.unread_counts(self.user), NotificationCounterService.summary(self.user)
+
+    def assertMatchesRebuild(self):
+        incremental = self.counters()
+        NotificationCounterService.invalidate(self.user.id)
+        self.assertEqual(incremental, self.counters())
+        return incremental
+
+    def test_counters_follow_changes(self):
+        self.counters()
+        own = [n for n in self.notifications if n.user_id == self.user.id]
+        with self.captureOnCommitCallbacks(execute=True):
+            own[0].mark_as_read()
+            own[1].mark_as_read()
+            own[1].mark_as_unread()
+            own[2].archive()
+            own[3].priority = 'urgent'
+            own[3].save()
+            self.notify(self.user, 10)
+            NotificationService.create_notifications_bulk([
+                dict(user=self.user, notification_type='manual_reminder', title='Lembrete', message='-', priority='urgent')
+            ])
+            self.api.delete(f'/api/workflow-notifications/{own[4].pk}/')
+        unread, summary = self.assertMatchesRebuild()
+
+        pending = WorkflowNotification.objects.filter(user=self.user, is_read=False, is_archived=False)
+        self.assertEqual(unread['unread_count'], pending.count())
+        self.assertEqual(unread['by_priority']['urgent'], 4)
+        self.assertFalse(WorkflowNotification.objects.filter(pk=own[4].pk).exists())
+        self.assertEqual(summary['unread_this_week'], 6)
+        self.assertEqual(summary['oldest_unread_days'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(NotificationService.mark_all_as_read(self.user), 6)
+        unread, summary = self.assertMatchesRebuild()
+        self.assertEqual((unread['unread_count'], summary['unread_this_week']), (0, 0))
+        self.assertEqual(NotificationCounterService.get_unread_count(self.other), 3)
 
-# Create your tests here.
+    def test_polling_endpoints_skip_database(self):
+        self.api.get('/api/workflow-notifications/unread_count/')
+        for path in ('unread_count', 'summary_stats'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.api.get(f'/api/workflow-notifications/{path}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([q for q in queries if 'api_workflownotification' in q['sql']], path)
+        self.assertEqual(response.data['total_this_week'], 6)
 
+    def test_reconcile_fixes_drift(self):
+        self.assertEqual(NotificationCounterService.get_unread_count(self.user), 7)
+        # Alterações que não passam pelos signals
+        WorkflowNotification.objects.filter(user=self.user, priority='urgent').update(is_read=True)
+        self.assertEqual(NotificationCounterService.get_unread_count(self.user), 7)
+        self.assertEqual(NotificationCounterService.reconcile(), {'reconciled': 1, 'drifted': 1})
+        self.assertEqual(NotificationCounterService.get_unread_count(self.user), 5)
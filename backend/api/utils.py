@@ -2,6 +2,7 @@ from django.db.models import Sum
 from django.utils import timezone
 from decimal import Decimal
 from .models import Client, TimeEntry, Expense, ClientProfitability, OrganizationActionLog
+from .services.profitability_service import ProfitabilityEngine
 import json
 from decimal import Decimal
 import uuid # If you also have UUIDs
@@ -99,6 +100,8 @@ def update_client_profitability(client_id, year, month):
 def update_profitability_for_period(year, month):
     """
     Atualiza a rentabilidade de todos os clientes ativos para um período específico.
+    Usa o ProfitabilityEngine (agregações agrupadas + upsert em bloco) em vez de
+    chamar update_client_profitability cliente a cliente.
     
     Args:
         year (int): Ano para cálculo
@@ -107,16 +110,7 @@ def update_profitability_for_period(year, month):
     Returns:
         int: Número de registros atualizados
     """
-    # Obter todos os clientes ativos
-    clients = Client.objects.filter(is_active=True)
-    
-    count = 0
-    for client in clients:
-        result = update_client_profitability(client.id, year, month)
-        if result:
-            count += 1
-    
-    return count
+    return ProfitabilityEngine.recompute([(year, month)])[(int(year), int(month))]
 
 def update_current_month_profitability():
     """
@@ -3,6 +3,7 @@ from rest_framework import viewsets, generics, status
 from rest_framework.request import Request
 from datetime import datetime, timedelta 
 from django.utils import timezone
+import itertools
 import json
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.exceptions import PermissionDenied, ValidationError 
@@ -12,8 +13,7 @@ from rest_framework.response import Response
 from django.db.models import Q, Prefetch, F, Count, Sum, Avg, Exists, OuterRef, Subquery
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.core.cache import cache
-from .models import (Organization, Client, TaskCategory, Task, TimeEntry, Expense, 
+from .models import (Organization, Client, TaskCategory, Task, TaskInvolvement, TimeEntry, Expense, 
                     ClientProfitability, Profile, AutoTimeTracking, WorkflowStep,
                     WorkflowDefinition, TaskApproval, WorkflowNotification,NotificationTemplate, 
                     WorkflowHistory,NotificationSettings, NotificationDigest, FiscalObligationDefinition, FiscalSystemSettings,GeneratedReport)
@@ -39,19 +39,27 @@ from .services.ai_advisor_service import AIAdvisorService
 from .utils import CustomJSONEncoder, update_client_profitability, log_organization_action  
 from django.db.models import ExpressionWrapper, fields
 from .services.workflow_service import WorkflowService
+from .services.dashboard_counter_service import DashboardCounterService
+from .services.notification_counter_service import NotificationCounterService
+from .services.expense_categorization_service import ExpenseCategorizationService
 from .tasks import update_profitability_for_single_organization_task # Import the new Celery task
 from dateutil.relativedelta import relativedelta
 from django.db.models.expressions import RawSQL # Make sure this is imported
 from .permissions import IsOrgAdmin, CanManageClients, CanManageTimeEntry
+from .pagination import KeysetCursorPagination
 from .tasks import generate_report_task # <-- Import the new task
 from rest_framework.parsers import MultiPartParser
 from .serializers import SAFTFileSerializer
 from .models import SAFTFile
+from .services.saft_analytics_service import SAFTAnalyticsService
 from .tasks import process_saft_file_task
 from .models import InvoiceBatch, ScannedInvoice
 from .serializers import InvoiceBatchSerializer, ScannedInvoiceSerializer
-from .tasks import process_invoice_file_task
-from django.db import transaction
+from .tasks import process_invoice_file_task, process_invoice_batch_task, create_invoice_batch_tasks_task
+from .services.invoice_batch_service import InvoiceBatchProcessor, InvoiceBatchTaskCreator
+from .services.streaming_export_service import CSV_CONTENT_TYPE, XLSX_CONTENT_TYPE, StreamingWorkbook, iter_csv, iterate_rows
+from .services.upload_dedup_service import UploadDedupService
+from django.db import IntegrityError, transaction
 from .models import OrganizationActionLog
 from .serializers import OrganizationActionLogSerializer
 from rest_framework import permissions
@@ -70,24 +78,40 @@ class InvoiceBatchViewSet(viewsets.ModelViewSet):
         
         # Handle superuser
         if user.is_superuser:
-            return InvoiceBatch.objects.all().select_related(
-                'uploaded_by', 'organization'
-            ).prefetch_related('invoices__generated_tasks').order_by('-created_at')
-        
-        try:
-            profile = user.profile
-            if not profile or not profile.organization:
+            queryset = InvoiceBatch.objects.all()
+        else:
+            try:
+                profile = user.profile
+                if not profile or not profile.organization:
+                    return InvoiceBatch.objects.none()
+                queryset = InvoiceBatch.objects.filter(organization=profile.organization)
+            except AttributeError:
+                # User has no profile
                 return InvoiceBatch.objects.none()
-            
-            return InvoiceBatch.objects.filter(
-                organization=profile.organization
-            ).select_related(
-                'uploaded_by', 'organization'
-            ).prefetch_related('invoices__generated_tasks').order_by('-created_at')
-            
-        except AttributeError:
-            # User has no profile
-            return InvoiceBatch.objects.none()
+        
+        # Contadores por estado em SQL; as faturas (com os ids das tarefas anotados)
+        # só são carregadas quando fazem parte da resposta (detalhe do lote ou fields=invoices)
+        queryset = queryset.select_related('uploaded_by', 'organization').with_invoice_stats().order_by('-created_at')
+        if self._includes_invoices():
+            queryset = queryset.prefetch_related(Prefetch('invoices', queryset=ScannedInvoice.objects.with_task_ids()))
+        return queryset
+
+    def _includes_invoices(self):
+        requested = self.request.query_params.get('fields')
+        if requested:
+            return 'invoices' in {name.strip() for name in requested.split(',')}
+        # A listagem usa só os contadores; as faturas vêm no detalhe de cada lote
+        return self.action != 'list'
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['include_invoices'] = self._includes_invoices()
+        return context
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Hash each uploaded file while it streams in
+        UploadDedupService.install_hash_handler(request)
+        return super().initialize_request(request, *args, **kwargs)
 
     def create(self, request, *args, **kwargs):
         files = request.FILES.getlist('files')
@@ -116,31 +140,72 @@ class InvoiceBatchViewSet(viewsets.ModelViewSet):
                 description=request.data.get('description', f'Lote de {len(files)} faturas')
             )
 
+            # Identical files (same content hash) are flagged as duplicates without decoding
+            content_hashes = UploadDedupService.upload_hashes(request, 'files')
+            completed_by_hash = UploadDedupService.completed_invoices_by_hash(profile.organization, content_hashes)
+            uploaded_by_hash = {}
+
             # Create invoice records and dispatch processing tasks
             created_invoices = []
-            for file in files:
+            duplicate_count = 0
+            for file, content_hash in zip(files, content_hashes):
+                original = completed_by_hash.get(content_hash) or uploaded_by_hash.get(content_hash)
+                if original is not None:
+                    # Reuse the stored copy instead of writing the same file again
+                    ScannedInvoice.objects.create(
+                        batch=batch,
+                        organization=batch.organization,
+                        original_file=original.original_file.name,
+                        original_filename=file.name,
+                        content_hash=content_hash,
+                        status='ERROR',
+                        processing_log=(
+                            f"Fatura duplicada. Ficheiro idêntico à fatura {original.id}"
+                            + (f" (ATCUD '{original.atcud}')." if original.atcud else " enviada neste lote.")
+                        )
+                    )
+                    duplicate_count += 1
+                    continue
                 invoice = ScannedInvoice.objects.create(
                     batch=batch, 
+                    organization=batch.organization,
                     original_file=file,
-                    original_filename=file.name
+                    original_filename=file.name,
+                    content_hash=content_hash
                 )
+                uploaded_by_hash[content_hash] = invoice
                 created_invoices.append(invoice)
-                
-                # Dispatch the processing task
+            
+            # Large uploads are decoded by a single batch task using a process pool
+            use_batch_mode = len(created_invoices) >= InvoiceBatchProcessor.MIN_FILES_FOR_POOL
+            dispatch_error = None
+            if use_batch_mode:
                 try:
-                    from .tasks import process_invoice_file_task
-                    process_invoice_file_task.delay(str(invoice.id))
+                    process_invoice_batch_task.delay(str(batch.id))
                 except Exception as e:
-                    # If Celery is not available or task fails to dispatch
-                    invoice.status = 'ERROR'
-                    invoice.processing_log = f'Erro ao iniciar processamento: {str(e)}'
-                    invoice.save()
+                    dispatch_error = e
+            else:
+                for invoice in created_invoices:
+                    try:
+                        process_invoice_file_task.delay(str(invoice.id))
+                    except Exception as e:
+                        # If Celery is not available or task fails to dispatch
+                        invoice.status = 'ERROR'
+                        invoice.processing_log = f'Erro ao iniciar processamento: {str(e)}'
+                        invoice.save()
+            if dispatch_error is not None:
+                ScannedInvoice.objects.filter(batch=batch, status='PENDING').update(
+                    status='ERROR', processing_log=f'Erro ao iniciar processamento: {str(dispatch_error)}'
+                )
             
             # Log organization action
             log_organization_action(
                 request,
                 action_type='CREATE_INVOICE_BATCH',
-                action_description=f"Lote de faturas criado: {batch.description} (ID: {batch.id}) com {len(created_invoices)} faturas.",
+                action_description=(
+                    f"Lote de faturas criado: {batch.description} (ID: {batch.id}) com {len(files)} faturas"
+                    f" ({duplicate_count} duplicadas)."
+                ),
                 related_object=batch
             )
             # Return the created batch with all related data
@@ -159,8 +224,11 @@ class InvoiceBatchViewSet(viewsets.ModelViewSet):
         Suporta dois modos:
         1. Criação simples (sem dados de tarefa específicos)
         2. Criação com dados de tarefa personalizados
+
+        Lotes grandes (InvoiceBatchTaskCreator.ASYNC_THRESHOLD faturas ou mais) são
+        criados em background; o progresso fica disponível no batch_status.
         """
-        batch = self.get_object()
+        batch = self._get_batch_without_prefetch()
         
         try:
             profile = request.user.profile
@@ -183,19 +251,10 @@ class InvoiceBatchViewSet(viewsets.ModelViewSet):
         task_data = request.data.get('task_data', {})
         invoice_ids_to_process = request.data.get('invoices_to_process', [])
         
-        # Filtrar faturas elegíveis
-        eligible_invoices_qs = batch.invoices.filter(
-            status='COMPLETED'
-        ).exclude(
-            generated_tasks__isnull=False  # Excluir faturas que já têm tarefas
-        )
-        
-        if invoice_ids_to_process:
-            eligible_invoices_qs = eligible_invoices_qs.filter(id__in=invoice_ids_to_process)
-        
-        eligible_invoices = list(eligible_invoices_qs.select_related('batch__organization'))
+        eligible_invoices_qs = InvoiceBatchTaskCreator.eligible_invoices(batch, invoice_ids_to_process)
+        invoice_count = eligible_invoices_qs.count()
         
-        if not eligible_invoices:
+        if not invoice_count:
             return Response({
                 'success': False,
                 'message': 'Nenhuma fatura elegível encontrada para criação de tarefas.',
@@ -203,216 +262,80 @@ class InvoiceBatchViewSet(viewsets.ModelViewSet):
                 'tasks_failed': 0
             }, status=status.HTTP_200_OK)
         
-        # Obter clientes disponíveis para matching
-        available_clients = Client.objects.filter(
-            organization=profile.organization,
-            is_active=True
-        ).select_related('organization')
-        
-        # Preparar dados base da tarefa
-        base_task_data = {
-            'status': task_data.get('status', 'pending'),
-            'priority': task_data.get('priority', 3),
-            'deadline': task_data.get('deadline'),
-            'estimated_time_minutes': task_data.get('estimated_time_minutes'),
-            'category_id': task_data.get('category'),
-            'workflow_id': task_data.get('workflow'),
-            'assigned_to_id': task_data.get('assigned_to'),
-            'description_template': task_data.get('description', ''),
-            'title_template': task_data.get('title', 'Lançar Fatura: {invoice_ref}')
-        }
+        # Clientes, categoria, responsável e workflow são resolvidos uma única vez
+        creator = InvoiceBatchTaskCreator(batch, request.user, task_data)
         
         # Se um cliente específico foi selecionado, usar esse
-        default_client = None
         if task_data.get('client'):
-            try:
-                default_client = available_clients.get(id=task_data['client'])
-                if not profile.can_access_client(default_client):
-                    return Response({
-                        'error': f'Sem acesso ao cliente selecionado: {default_client.name}'
-                    }, status=status.HTTP_403_FORBIDDEN)
-            except Client.DoesNotExist:
+            if not creator.default_client:
                 return Response({
                     'error': 'Cliente selecionado não encontrado'
                 }, status=status.HTTP_404_NOT_FOUND)
+            if not creator.can_access(creator.default_client):
+                return Response({
+                    'error': f'Sem acesso ao cliente selecionado: {creator.default_client.name}'
+                }, status=status.HTTP_403_FORBIDDEN)
         
-        tasks_created = 0
-        tasks_failed = 0
-        errors = []
-        created_task_ids = []
-        
-        with transaction.atomic():
+        if invoice_count >= InvoiceBatchTaskCreator.ASYNC_THRESHOLD:
+            invoice_ids = [str(invoice_id) for invoice_id in eligible_invoices_qs.values_list('id', flat=True)]
+            InvoiceBatchTaskCreator.publish_queued(batch.id, len(invoice_ids))
             try:
-                for invoice in eligible_invoices:
-                    try:
-                        # Determinar cliente para esta fatura
-                        target_client = default_client
-                        
-                        # Se não há cliente padrão, tentar encontrar por NIF
-                        if not target_client and invoice.nif_acquirer:
-                            target_client = available_clients.filter(
-                                nif=invoice.nif_acquirer
-                            ).first()
-                        
-                        # Se ainda não há cliente, usar o primeiro disponível
-                        if not target_client:
-                            target_client = available_clients.first()
-                        
-                        if not target_client:
-                            errors.append(f"Fatura {invoice.original_filename}: Nenhum cliente disponível")
-                            tasks_failed += 1
-                            continue
-                        
-                        # Verificar se utilizador tem acesso ao cliente
-                        if not profile.can_access_client(target_client):
-                            errors.append(f"Fatura {invoice.original_filename}: Sem acesso ao cliente {target_client.name}")
-                            tasks_failed += 1
-                            continue
-                        
-                        # Gerar título e descrição personalizados
-                        invoice_ref = invoice.atcud or invoice.original_filename
-                        task_title = base_task_data['title_template'].format(
-                            invoice_ref=invoice_ref,
-                            client_name=target_client.name,
-                            batch_description=batch.description or f"Lote {batch.id}"
-                        )
-                        
-                        # Criar descrição detalhada
-                        if base_task_data['description_template']:
-                            task_description = base_task_data['description_template']
-                        else:
-                            task_description = f"Lançamento contabilístico da fatura de {invoice.nif_emitter or 'N/A'}.\n"
-                            task_description += f"Data: {invoice.doc_date or 'N/A'}\n"
-                            task_description += f"Valor Total: {invoice.gross_total or '0.00'}€\n"
-                            task_description += f"IVA: {invoice.vat_amount or '0.00'}€\n"
-                            if batch.description:
-                                task_description += f"Processada em lote: {batch.description}"
-                        
-                        # Criar tarefa
-                        task_kwargs = {
-                            'title': task_title,
-                            'description': task_description,
-                            'client': target_client,
-                            'created_by': request.user,
-                            'source_scanned_invoice': invoice,
-                            'status': base_task_data['status'],
-                            'priority': base_task_data['priority']
-                        }
-                        
-                        # Adicionar campos opcionais se fornecidos
-                        if base_task_data['deadline']:
-                            task_kwargs['deadline'] = base_task_data['deadline']
-                        if base_task_data['estimated_time_minutes']:
-                            task_kwargs['estimated_time_minutes'] = base_task_data['estimated_time_minutes']
-                        if base_task_data['category_id']:
-                            try:
-                                category = TaskCategory.objects.get(id=base_task_data['category_id'])
-                                task_kwargs['category'] = category
-                            except TaskCategory.DoesNotExist:
-                                pass
-                        if base_task_data['assigned_to_id']:
-                            try:
-                                assigned_user = User.objects.get(id=base_task_data['assigned_to_id'])
-                                # Verificar se o usuário pertence à mesma organização
-                                assigned_profile = assigned_user.profile
-                                if assigned_profile.organization == profile.organization:
-                                    task_kwargs['assigned_to'] = assigned_user
-                            except (User.DoesNotExist, Profile.DoesNotExist):
-                                pass
-                        
-                        task = Task.objects.create(**task_kwargs)
-                        
-                        # Configurar workflow se especificado
-                        if base_task_data['workflow_id']:
-                            try:
-                                workflow = WorkflowDefinition.objects.get(
-                                    id=base_task_data['workflow_id'],
-                                    is_active=True
-                                )
-                                first_step = workflow.steps.order_by('order').first()
-                                if first_step:
-                                    task.workflow = workflow
-                                    task.current_workflow_step = first_step
-                                    task.save(update_fields=['workflow', 'current_workflow_step'])
-                                    
-                                    # Criar histórico de workflow
-                                    WorkflowHistory.objects.create(
-                                        task=task,
-                                        from_step=None,
-                                        to_step=first_step,
-                                        changed_by=request.user,
-                                        action='workflow_assigned',
-                                        comment=f"Workflow '{workflow.name}' atribuído na criação em lote."
-                                    )
-                            except WorkflowDefinition.DoesNotExist:
-                                pass
-                        
-                        tasks_created += 1
-                        created_task_ids.append(str(task.id))
-                        
-                        # Log da criação
-                        logger.info(f"Tarefa {task.id} criada para fatura {invoice.id} no batch {batch.id}")
-                        
-                    except Exception as e:
-                        logger.error(f"Erro ao criar tarefa para fatura {invoice.id}: {str(e)}")
-                        tasks_failed += 1
-                        errors.append(f"Fatura {invoice.original_filename}: {str(e)}")
-                
-                # Enviar notificações para tarefas criadas
-                if tasks_created > 0 and base_task_data.get('assigned_to_id'):
-                    try:
-                        assigned_user = User.objects.get(id=base_task_data['assigned_to_id'])
-                        if assigned_user.id != request.user.id:  # Não notificar o criador
-                            NotificationService.create_notification(
-                                user=assigned_user,
-                                task=None,  # Múltiplas tarefas
-                                notification_type='task_assigned_to_you',
-                                title=f"{tasks_created} Novas Tarefas Atribuídas (Lote)",
-                                message=f"Foram-lhe atribuídas {tasks_created} tarefas do lote '{batch.description or 'Sem descrição'}'. "
-                                    f"Criadas por: {request.user.username}.",
-                                created_by=request.user,
-                                metadata={
-                                    'batch_id': str(batch.id),
-                                    'task_ids': created_task_ids,
-                                    'invoice_count': len(eligible_invoices)
-                                }
-                            )
-                    except (User.DoesNotExist, Exception) as e:
-                        logger.warning(f"Erro ao enviar notificação de lote: {e}")
-                
-                response_data = {
-                    'success': True,
-                    'message': f'{tasks_created} tarefas criadas com sucesso.',
-                    'tasks_created': tasks_created,
-                    'tasks_failed': tasks_failed,
-                    'batch_id': str(batch.id),
-                    'created_task_ids': created_task_ids
-                }
-                
-                if errors:
-                    response_data['errors'] = errors
-                    response_data['message'] += f' {tasks_failed} falharam.'
-                # Log organization action for batch task creation
-                log_organization_action(
-                    request,
-                    action_type='BATCH_TASK_CREATION',
-                    action_description=f"{tasks_created} tarefas criadas em lote para batch {batch.id}.",
-                    related_object=batch
-                )
-                return Response(response_data, status=status.HTTP_201_CREATED)
-                
+                create_invoice_batch_tasks_task.delay(str(batch.id), request.user.id, task_data, invoice_ids)
             except Exception as e:
-                logger.error(f"Erro na criação em lote de tarefas para batch {batch.id}: {str(e)}")
+                logger.error(f"Erro ao iniciar a criação de tarefas do batch {batch.id}: {str(e)}")
                 return Response({
-                    'error': f'Erro interno ao criar tarefas: {str(e)}'
+                    'error': f'Erro ao iniciar a criação de tarefas: {str(e)}'
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            log_organization_action(
+                request,
+                action_type='BATCH_TASK_CREATION',
+                action_description=f"Criação em lote de {len(invoice_ids)} tarefas iniciada para batch {batch.id}.",
+                related_object=batch
+            )
+            return Response({
+                'success': True,
+                'async': True,
+                'message': f'A criar {len(invoice_ids)} tarefas em background.',
+                'batch_id': str(batch.id),
+                'invoice_count': len(invoice_ids),
+                'task_creation_progress': InvoiceBatchTaskCreator.get_progress(batch.id)
+            }, status=status.HTTP_202_ACCEPTED)
+        
+        try:
+            result = creator.create(list(eligible_invoices_qs))
+        except Exception as e:
+            logger.error(f"Erro na criação em lote de tarefas para batch {batch.id}: {str(e)}")
+            return Response({
+                'error': f'Erro interno ao criar tarefas: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        response_data = {
+            'success': True,
+            'message': f"{result['tasks_created']} tarefas criadas com sucesso.",
+            'tasks_created': result['tasks_created'],
+            'tasks_failed': result['tasks_failed'],
+            'batch_id': str(batch.id),
+            'created_task_ids': result['created_task_ids']
+        }
+        
+        if result['errors']:
+            response_data['errors'] = result['errors']
+            response_data['message'] += f" {result['tasks_failed']} falharam."
+        # Log organization action for batch task creation
+        log_organization_action(
+            request,
+            action_type='BATCH_TASK_CREATION',
+            action_description=f"{result['tasks_created']} tarefas criadas em lote para batch {batch.id}.",
+            related_object=batch
+        )
+        return Response(response_data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['get'])
     def batch_status(self, request, pk=None):
         """
         Retorna informações detalhadas sobre o estado do lote e suas tarefas.
         """
-        batch = self.get_object()
+        batch = self._get_batch_without_prefetch()
         
         try:
             profile = request.user.profile
@@ -423,110 +346,109 @@ class InvoiceBatchViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Perfil de utilizador não encontrado.'}, 
                         status=status.HTTP_400_BAD_REQUEST)
         
-        # Estatísticas das faturas
-        invoices = batch.invoices.all()
-        completed_invoices = invoices.filter(status='COMPLETED')
-        
-        # Estatísticas das tarefas
-        invoices_with_tasks = completed_invoices.filter(generated_tasks__isnull=False).distinct()
-        invoices_without_tasks = completed_invoices.exclude(generated_tasks__isnull=False)
-        
-        # Obter tarefas relacionadas
-        related_tasks = Task.objects.filter(
-            source_scanned_invoice__batch=batch
-        ).select_related('assigned_to', 'client', 'category')
+        # Estatísticas das faturas e das tarefas, cada uma numa única query
+        completed = Q(status='COMPLETED')
+        invoice_stats = batch.invoices.aggregate(
+            total=Count('id'),
+            completed=Count('id', filter=completed),
+            with_tasks=Count('id', filter=completed & Q(generated_tasks__isnull=False)),
+            processing=Count('id', filter=Q(status='PROCESSING')),
+            pending=Count('id', filter=Q(status='PENDING')),
+            error=Count('id', filter=Q(status='ERROR')),
+        )
+        invoices_without_tasks = invoice_stats['completed'] - invoice_stats['with_tasks']
         
-        task_stats = {
-            'pending': related_tasks.filter(status='pending').count(),
-            'in_progress': related_tasks.filter(status='in_progress').count(),
-            'completed': related_tasks.filter(status='completed').count(),
-            'cancelled': related_tasks.filter(status='cancelled').count(),
-        }
+        task_stats = Task.objects.filter(source_scanned_invoice__batch=batch).aggregate(**{
+            task_status: Count('id', filter=Q(status=task_status))
+            for task_status in ('pending', 'in_progress', 'completed', 'cancelled')
+        })
         
         return Response({
             'batch_id': str(batch.id),
             'batch_description': batch.description,
             'created_at': batch.created_at,
             'invoice_stats': {
-                'total': invoices.count(),
-                'completed': completed_invoices.count(),
-                'with_tasks': invoices_with_tasks.count(),
-                'without_tasks': invoices_without_tasks.count(),
-                'processing': invoices.filter(status='PROCESSING').count(),
-                'pending': invoices.filter(status='PENDING').count(),
-                'error': invoices.filter(status='ERROR').count(),
+                'total': invoice_stats['total'],
+                'completed': invoice_stats['completed'],
+                'with_tasks': invoice_stats['with_tasks'],
+                'without_tasks': invoices_without_tasks,
+                'processing': invoice_stats['processing'],
+                'pending': invoice_stats['pending'],
+                'error': invoice_stats['error'],
             },
             'task_stats': task_stats,
-            'can_create_more_tasks': invoices_without_tasks.count() > 0,
-            'ready_for_batch_creation': invoices_without_tasks.count() > 1,
+            # Progress published by process_invoice_batch_task (None for per-file processing)
+            'processing_progress': InvoiceBatchProcessor.get_progress(batch.id),
+            'task_creation_progress': InvoiceBatchTaskCreator.get_progress(batch.id),
+            'can_create_more_tasks': invoices_without_tasks > 0,
+            'ready_for_batch_creation': invoices_without_tasks > 1,
         })
 
+    INVOICE_EXPORT_HEADERS = [
+        'ID Fatura', 'Ficheiro Original', 'Status', 'NIF Emissor', 'NIF Adquirente',
+        'Data Documento', 'ATCUD', 'Total Bruto', 'Total IVA', 'Base Tributável'
+    ]
+
+    def _get_batch_without_prefetch(self):
+        """O lote sem o prefetch de faturas e tarefas do get_queryset: as faturas são lidas à parte."""
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        batch = generics.get_object_or_404(queryset, pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, batch)
+        return batch
+
+    @staticmethod
+    def _invoice_export_rows(batch):
+        """Linhas da exportação do lote, lidas da base de dados em blocos."""
+        invoices = batch.invoices.order_by('created_at').only(
+            'id', 'original_file', 'status', 'nif_emitter', 'nif_acquirer', 'doc_date',
+            'atcud', 'gross_total', 'vat_amount', 'taxable_amount', 'created_at'
+        )
+        for invoice in iterate_rows(invoices):
+            yield [
+                str(invoice.id), invoice.original_file.name.split('/')[-1], invoice.get_status_display(),
+                invoice.nif_emitter, invoice.nif_acquirer, invoice.doc_date, invoice.atcud,
+                float(invoice.gross_total or 0), float(invoice.vat_amount or 0), float(invoice.taxable_amount or 0),
+            ]
+
     @action(detail=True, methods=['get'])
     def generate_excel(self, request, pk=None):
         """
         Generates an Excel file with details of all invoices in a specific batch.
+        The workbook is written in write-only mode to a spooled temporary file and streamed back.
         """
-        batch = self.get_object()
-        invoices = batch.invoices.all().order_by('created_at')
-
-        # Create an in-memory workbook
-        buffer = io.BytesIO()
-        workbook = openpyxl.Workbook()
-        worksheet = workbook.active
-        worksheet.title = 'Faturas Processadas'
-
-        # Define headers
-        headers = [
-            'ID Fatura', 'Ficheiro Original', 'Status', 'NIF Emissor', 'NIF Adquirente',
-            'Data Documento', 'ATCUD', 'Total Bruto', 'Total IVA', 'Base Tributável'
-        ]
-        
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = openpyxl.styles.PatternFill(start_color="1E40AF", end_color="1E40AF", fill_type="solid")
+        batch = self._get_batch_without_prefetch()
+
+        workbook = StreamingWorkbook()
+        worksheet = workbook.sheet('Faturas Processadas')
 
-        for col_num, header_title in enumerate(headers, 1):
-            cell = worksheet.cell(row=1, column=col_num, value=header_title)
-            cell.font = header_font
-            cell.fill = header_fill
+        def header_style(cell):
+            cell.font = Font(bold=True, color="FFFFFF")
+            cell.fill = openpyxl.styles.PatternFill(start_color="1E40AF", end_color="1E40AF", fill_type="solid")
             cell.alignment = Alignment(horizontal='center', vertical='center')
 
-        # Populate rows with invoice data
-        for row_num, invoice in enumerate(invoices, 2):
-            worksheet.cell(row=row_num, column=1, value=str(invoice.id))
-            worksheet.cell(row=row_num, column=2, value=invoice.original_file.name.split('/')[-1])
-            worksheet.cell(row=row_num, column=3, value=invoice.get_status_display())
-            worksheet.cell(row=row_num, column=4, value=invoice.nif_emitter)
-            worksheet.cell(row=row_num, column=5, value=invoice.nif_acquirer)
-            worksheet.cell(row=row_num, column=6, value=invoice.doc_date)
-            worksheet.cell(row=row_num, column=7, value=invoice.atcud)
-            worksheet.cell(row=row_num, column=8, value=float(invoice.gross_total or 0)).number_format = '#,##0.00€'
-            worksheet.cell(row=row_num, column=9, value=float(invoice.vat_amount or 0)).number_format = '#,##0.00€'
-            worksheet.cell(row=row_num, column=10, value=float(invoice.taxable_amount or 0)).number_format = '#,##0.00€'
-
-        # Auto-fit column widths
-        for col in worksheet.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            worksheet.column_dimensions[column].width = adjusted_width
-
-        # Save the workbook to the buffer
-        workbook.save(buffer)
-        buffer.seek(0)
-
-        # Create the HTTP response
-        response = HttpResponse(
-            buffer,
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        def currency_style(cell):
+            cell.number_format = '#,##0.00€'
+
+        worksheet.append(self.INVOICE_EXPORT_HEADERS, worksheet.style(header_style))
+        currency = worksheet.style(currency_style)
+        worksheet.append_all(self._invoice_export_rows(batch), [None] * 7 + [currency] * 3)
+
+        return FileResponse(
+            workbook.save(),
+            as_attachment=True,
+            filename=f"faturas_lote_{batch.id}.xlsx",
+            content_type=XLSX_CONTENT_TYPE,
         )
-        response['Content-Disposition'] = f'attachment; filename="faturas_lote_{batch.id}.xlsx"'
 
+    @action(detail=True, methods=['get'])
+    def generate_csv(self, request, pk=None):
+        """
+        Same export as generate_excel, as CSV streamed row by row (no file is built in memory).
+        """
+        batch = self._get_batch_without_prefetch()
+        rows = itertools.chain([self.INVOICE_EXPORT_HEADERS], self._invoice_export_rows(batch))
+        response = StreamingHttpResponse(iter_csv(rows), content_type=CSV_CONTENT_TYPE)
+        response['Content-Disposition'] = f'attachment; filename="faturas_lote_{batch.id}.csv"'
         return response
 
 class ScannedInvoiceViewSet(viewsets.ModelViewSet):
@@ -537,7 +459,7 @@ class ScannedInvoiceViewSet(viewsets.ModelViewSet):
         user = self.request.user
         
         if user.is_superuser:
-            return ScannedInvoice.objects.all().select_related('batch__organization')
+            return ScannedInvoice.objects.all().select_related('batch__organization').with_task_ids()
         
         try:
             profile = user.profile
@@ -545,8 +467,8 @@ class ScannedInvoiceViewSet(viewsets.ModelViewSet):
                 return ScannedInvoice.objects.none()
             
             return ScannedInvoice.objects.filter(
-                batch__organization=profile.organization
-            ).select_related('batch__organization')
+                organization=profile.organization
+            ).select_related('batch__organization').with_task_ids()
             
         except AttributeError:
             return ScannedInvoice.objects.none()
@@ -565,7 +487,17 @@ class ScannedInvoiceViewSet(viewsets.ModelViewSet):
         invoice.edited_data = edited_data
         invoice.is_reviewed = True
         invoice.status = 'COMPLETED'  # Mark as completed after review
-        invoice.save()
+        try:
+            with transaction.atomic():
+                invoice.save()
+        except IntegrityError as e:
+            if not ScannedInvoice.is_duplicate_atcud_error(e):
+                raise
+            return Response({
+                'error': f"Fatura duplicada. O ATCUD '{invoice.atcud}' já existe numa fatura concluída."
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if edited_data.get('category'):
+            ExpenseCategorizationService.record_correction(invoice, edited_data['category'])
         # Log organization action
         log_organization_action(
             request,
@@ -603,6 +535,11 @@ class SAFTFileViewSet(viewsets.ModelViewSet):
             logger.error(f"Error in SAFTFileViewSet.get_queryset: {e}")
             return SAFTFile.objects.none()
 
+    def initialize_request(self, request, *args, **kwargs):
+        # Hash the uploaded file while it streams in
+        UploadDedupService.install_hash_handler(request)
+        return super().initialize_request(request, *args, **kwargs)
+
     def create(self, request, *args, **kwargs):
         """
         Custom create method to provide detailed error responses.
@@ -614,11 +551,23 @@ class SAFTFileViewSet(viewsets.ModelViewSet):
             # perform_create logic is now here:
             profile = request.user.profile
             file_obj = request.data.get('file')
+            content_hash = UploadDedupService.upload_hashes(request, 'file')[0]
+
+            # An identical SAFT already uploaded by the organization is returned as is (force=true reprocesses)
+            force = str(request.data.get('force', '')).lower() in ('1', 'true', 'yes')
+            existing = None if force else UploadDedupService.find_saft_file(profile.organization, content_hash)
+            if existing:
+                logger.info(f"SAFT upload {file_obj.name} is identical to {existing.id}, skipping processing")
+                data = dict(self.get_serializer(existing).data)
+                data['duplicate'] = True
+                data['detail'] = f"Este ficheiro SAFT já foi carregado ({existing.original_filename}). Foi reutilizado o resultado existente."
+                return Response(data, status=status.HTTP_200_OK)
             
             saft_instance = serializer.save(
                 organization=profile.organization,
                 uploaded_by=request.user,
-                original_filename=file_obj.name
+                original_filename=file_obj.name,
+                content_hash=content_hash
             )
             
             # Dispatch the background task
@@ -680,6 +629,8 @@ class SAFTFileViewSet(viewsets.ModelViewSet):
                 'company_name': saft_file.company_name,
                 'company_tax_id': saft_file.company_tax_id,
                 'summary_data': saft_file.summary_data or {},
+                # Aggregates stored at parse time (no XML re-parsing)
+                'analytics': SAFTAnalyticsService.breakdown(saft_file) if saft_file.status == 'COMPLETED' else None,
             }
             
             return Response(details)
@@ -934,6 +885,13 @@ class ClientViewSet(viewsets.ModelViewSet):
                 Q(email__icontains=search_term)
             )
 
+        # ?fiscal_tags=IVA_MENSAL,IRC -> clientes com todas as tags indicadas
+        fiscal_tags = self.request.query_params.get('fiscal_tags')
+        if fiscal_tags:
+            optimized_queryset = optimized_queryset.with_all_tags(
+                [tag.strip() for tag in fiscal_tags.split(',')]
+            )
+
         return optimized_queryset.order_by('name')
 
     def perform_create(self, serializer):
@@ -1116,6 +1074,7 @@ class TaskCategoryViewSet(viewsets.ModelViewSet):
 class TaskViewSet(viewsets.ModelViewSet):
     serializer_class = TaskSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetCursorPagination
     
     def get_queryset(self):
         user = self.request.user
@@ -1184,7 +1143,8 @@ class TaskViewSet(viewsets.ModelViewSet):
         ordering = query_params.get('ordering', 'priority') # Default to priority
         valid_ordering_fields = [
             'priority', '-priority', 'deadline', '-deadline', 
-            'title', '-title', 'client__name', '-client__name', 'status', '-status'
+            'title', '-title', 'client__name', '-client__name', 'status', '-status',
+            'created_at', '-created_at'
         ]
         if ordering in valid_ordering_fields:
             base_queryset = base_queryset.order_by(ordering)
@@ -1192,8 +1152,10 @@ class TaskViewSet(viewsets.ModelViewSet):
             base_queryset = base_queryset.order_by('priority', 'deadline') # Fallback ordering
 
         # 4. Return the final, optimized, and secure queryset.
+        # The remaining per-task lookups are batched by TaskSerializer's list mode.
         return base_queryset.select_related(
-            'client', 'category', 'assigned_to', 'workflow', 'current_workflow_step'
+            'client', 'category', 'assigned_to', 'created_by', 'workflow',
+            'current_workflow_step', 'current_workflow_step__assign_to'
         ).prefetch_related('collaborators')
          
     def perform_create(self, serializer):
@@ -1280,7 +1242,7 @@ class TaskViewSet(viewsets.ModelViewSet):
                     first_step = workflow.steps.order_by('order').first()
                     if first_step:
                         task.workflow = workflow
-                        task.current_workflow_step = first_step
+                        task.enter_workflow_step(first_step)
                         task.save(update_fields=['workflow', 'current_workflow_step'])
                         WorkflowHistory.objects.create(
                             task=task, from_step=None, to_step=first_step,
@@ -1677,15 +1639,14 @@ class TaskViewSet(viewsets.ModelViewSet):
             if not profile.organization:
                 return Response({"tasks": []})
             
-            # Get tasks where user is assigned in any capacity
-            my_tasks = Task.objects.filter(
-                Q(assigned_to=user) |  # Primary assignee
-                Q(collaborators=user) |  # Collaborator
-                Q(workflow_step_assignments__has_value=str(user.id)),  # Workflow step assignee
-                client__organization=profile.organization
-            ).select_related(
-                'client', 'category', 'assigned_to', 'workflow', 'current_workflow_step'
-            ).prefetch_related('collaborators').distinct()
+            # Roles of the user in each task, from the TaskInvolvement index
+            roles_by_task = {}
+            for task_id, role in TaskInvolvement.objects.filter(
+                user=user, task__client__organization=profile.organization
+            ).values_list('task_id', 'role'):
+                roles_by_task.setdefault(task_id, set()).add(role)
+
+            my_tasks = Task.objects.filter(id__in=list(roles_by_task)).select_related('client')
             
             # Group by assignment type
             assignments = {
@@ -1711,16 +1672,15 @@ class TaskViewSet(viewsets.ModelViewSet):
                     'priority': task.priority,
                     'deadline': task.deadline,
                     'is_overdue': task.deadline and task.deadline.date() < today and task.status != 'completed',
-                    'role_in_task': task.get_user_role_in_task(user)
+                    'role_in_task': TaskInvolvement.main_role(roles_by_task[task.id])
                 }
                 
                 # Categorize by assignment type
-                if task.assigned_to == user:
+                if task_data['role_in_task'] == 'primary':
                     assignments['primary_tasks'].append(task_data)
-                elif task.collaborators.filter(id=user.id).exists():
+                elif task_data['role_in_task'] == 'collaborator':
                     assignments['collaborative_tasks'].append(task_data)
-                elif (task.workflow_step_assignments and 
-                      str(user.id) in task.workflow_step_assignments.values()):
+                elif task_data['role_in_task'] == 'workflow_step':
                     assignments['workflow_step_tasks'].append(task_data)
                 
                 # Update summary
@@ -1746,6 +1706,7 @@ class CreateUserView(generics.CreateAPIView):
 class TimeEntryViewSet(viewsets.ModelViewSet):
     serializer_class = TimeEntrySerializer
     permission_classes = [IsAuthenticated, CanManageTimeEntry]
+    pagination_class = KeysetCursorPagination
 
     def get_queryset(self):
         """
@@ -2098,9 +2059,20 @@ class ExpenseViewSet(viewsets.ModelViewSet):
                 created_by=user
             )
 
+    def perform_update(self, serializer):
+        previous_category = serializer.instance.category
+        category = serializer.validated_data.get('category', previous_category)
+        if category != previous_category and serializer.instance.source_scanned_invoice_id:
+            # A recategorização manual passa a alimentar a memória por NIF emitente
+            expense = serializer.save(is_auto_categorized=False)
+            ExpenseCategorizationService.invalidate(expense.source_scanned_invoice.batch.organization_id)
+        else:
+            serializer.save()
+
 class ClientProfitabilityViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = ClientProfitabilitySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetCursorPagination
     
     def get_queryset(self):
         user = self.request.user
@@ -2298,7 +2270,7 @@ class WorkflowDefinitionViewSet(viewsets.ModelViewSet):
                                 status=status.HTTP_400_BAD_REQUEST)
                     
             task.workflow = workflow
-            task.current_workflow_step = first_step
+            task.enter_workflow_step(first_step)
             # Reset task status if it was completed, to allow workflow to run
             if task.status == 'completed':
                 task.status = 'pending' # Or 'in_progress'
@@ -2932,19 +2904,13 @@ class OrganizationViewSet(viewsets.ModelViewSet):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def dashboard_summary(request):
+        """
+        Totais do dashboard. Utilizadores com visão de toda a organização leem os contadores
+        mantidos em DashboardCounter; os restantes juntam-lhes a sua parte (tarefas em que
+        estão envolvidos e o seu próprio tempo), sem agregar as tabelas da organização.
+        """
         user = request.user
-        
-        # Create a unique cache key for this specific user's dashboard
-        cache_key = f'dashboard_summary_{user.id}'
-        
-        # 1. Try to get data from the cache
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            logger.info(f"Serving dashboard summary for user {user.username} from CACHE.")
-            return Response(cached_data)
 
-        logger.info(f"Cache miss for dashboard summary for user {user.username}. Computing now.")
-        
         try:
             profile = Profile.objects.select_related('organization').get(user=user)
             org_id = profile.organization_id if profile.organization else None
@@ -2952,55 +2918,35 @@ def dashboard_summary(request):
             if not org_id:
                 return Response({'error': 'Utilizador não associado a uma organização.'}, status=400)
 
-            today = timezone.now().date()
-            seven_days_ago = today - timedelta(days=7)
-
             tasks_qs = Task.objects.for_user(user)
-            time_entries_qs = TimeEntry.objects.for_user(user)
+            counters = DashboardCounterService.organization_summary(org_id)
+
+            if profile.is_org_admin or profile.can_view_all_tasks:
+                task_stats = counters
+            else:
+                task_stats = DashboardCounterService.user_task_summary(tasks_qs)
+
+            if profile.is_org_admin or profile.can_view_team_time:
+                time_stats = counters
+            else:
+                time_stats = DashboardCounterService.user_time_summary(user, org_id)
 
-            task_stats = tasks_qs.aggregate(
-                active_tasks=Count('id', filter=Q(status__in=['pending', 'in_progress'])),
-                overdue_tasks=Count('id', filter=Q(deadline__lt=today, status__in=['pending', 'in_progress'])),
-                today_tasks=Count('id', filter=Q(deadline=today, status__in=['pending', 'in_progress'])),
-                completed_tasks_week=Count('id', filter=Q(status='completed', completed_at__date__gte=seven_days_ago))
-            )
-            
-            time_stats = time_entries_qs.aggregate(
-                time_tracked_today=Sum('minutes_spent', filter=Q(date=today)),
-                time_tracked_week=Sum('minutes_spent', filter=Q(date__gte=seven_days_ago))
-            )
-            
-            clients_qs = Client.objects.for_user(user)
-            client_stats = clients_qs.aggregate(
-                active_clients=Count('id', filter=Q(is_active=True))
-            )
-            
             response_data = {
                 'permissions': ProfileSerializer(profile).data,
-                'active_tasks': task_stats.get('active_tasks', 0) or 0,
-                'overdue_tasks': task_stats.get('overdue_tasks', 0) or 0,
-                'today_tasks': task_stats.get('today_tasks', 0) or 0,
-                'completed_tasks_week': task_stats.get('completed_tasks_week', 0) or 0,
-                'time_tracked_today': time_stats.get('time_tracked_today', 0) or 0,
-                'time_tracked_week': time_stats.get('time_tracked_week', 0) or 0,
-                'active_clients': client_stats.get('active_clients', 0) or 0,
+                'active_tasks': task_stats['active_tasks'],
+                'overdue_tasks': task_stats['overdue_tasks'],
+                'today_tasks': task_stats['today_tasks'],
+                'completed_tasks_week': task_stats['completed_tasks_week'],
+                'time_tracked_today': time_stats['time_tracked_today'],
+                'time_tracked_week': time_stats['time_tracked_week'],
+                'active_clients': Client.objects.for_user(user).filter(is_active=True).count(),
             }
 
             if profile.is_org_admin or profile.can_view_organization_profitability:
-                # ... (your existing profitability logic)
-                profit_stats = ClientProfitability.objects.filter(
-                    client__organization_id=org_id, 
-                    year=today.year, 
-                    month=today.month
-                ).aggregate(
-                    unprofitable_count=Count('id', filter=Q(is_profitable=False)),
-                    avg_margin=Avg('profit_margin')
-                )
-                response_data['unprofitable_clients'] = profit_stats.get('unprofitable_count', 0) or 0
-                response_data['average_profit_margin'] = profit_stats.get('avg_margin', 0) or 0
+                response_data['unprofitable_clients'] = counters['unprofitable_clients']
+                response_data['average_profit_margin'] = counters['average_profit_margin']
 
             if profile.is_org_admin or profile.can_view_all_tasks:
-                # ... (your existing approval logic)
                 response_data['tasks_needing_approval'] = tasks_qs.filter(
                     current_workflow_step__requires_approval=True
                 ).exclude(
@@ -3008,14 +2954,9 @@ def dashboard_summary(request):
                     approvals__approved=True
                 ).distinct().count()
 
-            # 2. Store the computed data in the cache before returning it.
-            #    Timeout is in seconds. 300 seconds = 5 minutes.
-            cache.set(cache_key, response_data, timeout=300)
-            
             return Response(response_data)
-            
+
         except Profile.DoesNotExist:
-            # ... (your existing exception handling)
             if user.is_superuser:
                 return Response({'message': 'Superuser dashboard not implemented yet.'})
             return Response({'error': 'User profile not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -3026,6 +2967,7 @@ def dashboard_summary(request):
 class WorkflowNotificationViewSet(viewsets.ModelViewSet):
     serializer_class = WorkflowNotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetCursorPagination  # `limit` is the page size
     
     def get_queryset(self):
         user = self.request.user
@@ -3054,52 +2996,18 @@ class WorkflowNotificationViewSet(viewsets.ModelViewSet):
         is_archived_str = self.request.query_params.get('is_archived', 'false')
         is_archived = is_archived_str.lower() == 'true'
         base_queryset = base_queryset.filter(is_archived=is_archived)
-        
-        limit_str = self.request.query_params.get('limit')
-        if limit_str:
-            try:
-                limit = int(limit_str)
-                if limit > 0:
-                    base_queryset = base_queryset[:limit]
-            except ValueError:
-                pass
                 
         return base_queryset
     
     @action(detail=False, methods=['get'])
     def summary_stats(self, request):
-        """Resumo rápido de estatísticas"""
-        user = request.user
-        
-        # Últimos 7 dias
-        week_ago = timezone.now() - timedelta(days=7)
-        
-        notifications = WorkflowNotification.objects.filter(
-            user=user,
-            created_at__gte=week_ago,
-            is_archived=False
-        )
-        
-        stats = {
-            'total_this_week': notifications.count(),
-            'unread_this_week': notifications.filter(is_read=False).count(),
-            'urgent_unread': notifications.filter(
-                is_read=False, 
-                priority='urgent'
-            ).count(),
-            'most_frequent_type': notifications.values('notification_type').annotate(
-                count=Count('id')
-            ).order_by('-count').first(),
-            'oldest_unread_days': None,
-        }
-        
-        # Notificação não lida mais antiga
-        oldest_unread = notifications.filter(is_read=False).order_by('created_at').first()
-        if oldest_unread:
-            days_old = (timezone.now() - oldest_unread.created_at).days
-            stats['oldest_unread_days'] = days_old
-        
-        return Response(stats)
+        """Resumo rápido de estatísticas (últimos 7 dias), lido dos contadores em cache"""
+        return Response(NotificationCounterService.summary(request.user))
+    
+    def perform_destroy(self, instance):
+        # Remoções em bloco/cascata não disparam signals; ficam para a reconciliação
+        instance.delete()
+        NotificationCounterService.record_change(instance, deleted=True)
     
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
@@ -3124,8 +3032,7 @@ class WorkflowNotificationViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def unread_count(self, request):
-        count = NotificationService.get_unread_count(request.user)
-        return Response({'unread_count': count})
+        return Response(NotificationCounterService.unread_counts(request.user))
     
     @action(detail=True, methods=['post'])
     def archive(self, request, pk=None):
@@ -5106,10 +5013,9 @@ from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 import uuid
 import os
-import io
 import openpyxl
 from openpyxl.styles import Font, Alignment
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 
 
 @api_view(['POST'])
@@ -5364,9 +5270,10 @@ def time_entry_context(request):
         return Response({"error": "Erro interno ao buscar contexto."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 class OrganizationActionLogViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = OrganizationActionLog.objects.all().order_by('-timestamp')
+    queryset = OrganizationActionLog.objects.select_related('user', 'organization').order_by('-timestamp')
     serializer_class = OrganizationActionLogSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetCursorPagination
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -44,9 +44,31 @@ app.conf.beat_schedule = {
         'options': {'expires': 3600},
     },  
     # Client Profitability
-    'update-client-profitability-nightly': {
+    # Incremental: deltas queued by TimeEntry/Expense signals (also scheduled after each commit)
+    'apply-profitability-deltas-every-minute': {
+        'task': 'api.tasks.apply_profitability_deltas_task',
+        'schedule': crontab(minute='*'),
+    },
+    # Seeds the new month's records for every active client
+    'seed-client-profitability-monthly': {
         'task': 'api.tasks.update_client_profitability_globally_task',
-        'schedule': crontab(hour=2, minute=0), 
+        'schedule': crontab(hour=0, minute=15, day_of_month=1),
+    },
+    # Full recompute as a safety net; reports drift from the incremental path
+    'reconcile-client-profitability-weekly': {
+        'task': 'api.tasks.reconcile_client_profitability_task',
+        'schedule': crontab(hour=2, minute=0, day_of_week=0),
+        'kwargs': {'months_back': 12},
+    },
+    # Dashboard counters: folds past deadlines and prunes old history
+    'rollover-dashboard-counters-daily': {
+        'task': 'api.tasks.rollover_dashboard_counters_task',
+        'schedule': crontab(hour=0, minute=0),
+    },
+    'rebuild-dashboard-counters-weekly': {
+        'task': 'api.tasks.rollover_dashboard_counters_task',
+        'schedule': crontab(hour=2, minute=30, day_of_week=0),
+        'kwargs': {'rebuild': True},
     },
 
     # === General Notification & Maintenance Tasks ===
@@ -72,6 +94,11 @@ app.conf.beat_schedule = {
         'schedule': crontab(hour=3, minute=0), 
         'kwargs': {'days': 90}
     },
+    # Recomputes the cached unread counters; the run just after midnight seeds the new day
+    'reconcile-notification-counters-hourly': {
+        'task': 'api.tasks.reconcile_notification_counters_task',
+        'schedule': crontab(minute=5),
+    },
     'notification-maintenance-generate-digests-daily': {
         'task': 'api.tasks.notification_generate_digests_task',
         'schedule': crontab(hour=4, minute=0), 
@@ -84,21 +111,12 @@ app.conf.beat_schedule = {
         'task': 'api.tasks.notification_escalate_task',
         'schedule': crontab(minute=30), # Every hour at minute 30
     },
-    'check-client-health-scores-daily': {
-        'task': 'api.tasks.check_client_health_scores_and_notify',
+    # Health score, churn, compliance, revenue opportunities and anomalies (one task per organization)
+    'run-client-intelligence-daily': {
+        'task': 'api.tasks.run_client_intelligence_task',
         'schedule': crontab(hour=5, minute=0),
         'options': {'expires': 3600},
     },
-    'check-compliance-risks-daily': {
-        'task': 'api.tasks.check_compliance_risks_and_notify',
-        'schedule': crontab(hour=5, minute=10),
-        'options': {'expires': 3600},
-    },
-    'check-revenue-opportunities-daily': {
-        'task': 'api.tasks.check_revenue_opportunities_and_notify',
-        'schedule': crontab(hour=5, minute=20),
-        'options': {'expires': 3600},
-    },
     'send-smart-daily-digest': {
         'task': 'api.tasks.send_smart_daily_digest',
         'schedule': crontab(hour=7, minute=0),
@@ -109,11 +127,6 @@ app.conf.beat_schedule = {
         'schedule': crontab(hour=8, minute=0),
         'options': {'expires': 3600},
     },
-    'detect-anomalies-daily': {
-        'task': 'api.tasks.detect_anomalies_and_notify',
-        'schedule': crontab(hour=6, minute=0),
-        'options': {'expires': 3600},
-    },
 }
 
 app.conf.timezone = 'Europe/Lisbon' # Or your project's timezone
@@ -20,4 +20,23 @@ api.interceptors.request.use(
   }
 );
 
+// Largest page the list endpoints accept (KeysetCursorPagination.max_page_size)
+export const MAX_PAGE_SIZE = 500;
+
+// Loads every page of a cursor-paginated list by following `next`.
+// Endpoints that are not paginated return their array as is.
+export const fetchAllPages = async (url, config = {}) => {
+  let response = await api.get(url, { ...config, params: { page_size: MAX_PAGE_SIZE, ...config.params } });
+  if (!response.data || !Array.isArray(response.data.results)) {
+    return response.data || [];
+  }
+  const results = [...response.data.results];
+  while (response.data.next) {
+    // `next` already carries the filters, ordering and page size
+    response = await api.get(response.data.next);
+    results.push(...response.data.results);
+  }
+  return results;
+};
+
 export default api;
\ No newline at end of file
@@ -1,6 +1,7 @@
 // src/components/invoices/InvoiceBatchListItem.jsx
 
 import React, { useState } from 'react';
+import { useQuery } from '@tanstack/react-query';
 import { motion, AnimatePresence } from 'framer-motion';
 import { ChevronDown, CheckCircle, Clock, XCircle, FileSpreadsheet, Loader2, PlusSquare, Layers } from 'lucide-react';
 import ScannedInvoiceEditor from './ScannedInvoiceEditor';
@@ -16,16 +17,27 @@ const InvoiceBatchListItem = ({ batch, clients, isExpanded, onToggle }) => {
     return acc;
   }, {});
 
+  // A listagem de lotes não traz as faturas: só são carregadas quando o lote é expandido
+  const { data: invoices = [], isLoading: isLoadingInvoices } = useQuery({
+    queryKey: ['invoiceBatches', batch.id, 'invoices'],
+    queryFn: () => api.get(`/invoice-batches/${batch.id}/`).then(res => res.data.invoices || []),
+    enabled: isExpanded,
+    refetchInterval: query => (query.state.data || []).some(inv => ['PENDING', 'PROCESSING'].includes(inv.status)) ? 3000 : false,
+    staleTime: 1000,
+  });
+
   // Calcular estatísticas das tarefas
-  const completedInvoices = batch.invoices?.filter(inv => inv.status === 'COMPLETED') || [];
-  const invoicesWithTasks = batch.invoices?.filter(inv => 
+  const completedInvoices = invoices.filter(inv => inv.status === 'COMPLETED');
+  const invoicesWithTasks = invoices.filter(inv => 
     inv.generated_task_ids && inv.generated_task_ids.length > 0
-  ) || [];
+  );
   const invoicesWithoutTasks = completedInvoices.filter(inv => 
     !inv.generated_task_ids || inv.generated_task_ids.length === 0
   );
 
-  const batchHasAnyTasks = invoicesWithTasks.length > 0;
+  // Com o lote fechado, os números vêm do batch_status
+  const withTasksCount = isExpanded ? invoicesWithTasks.length : (batch.invoice_stats?.with_tasks || 0);
+  const batchHasAnyTasks = withTasksCount > 0;
   const canCreateBatchTasks = invoicesWithoutTasks.length > 0;
 
   const generateExcel = async () => {
@@ -100,7 +112,7 @@ const InvoiceBatchListItem = ({ batch, clients, isExpanded, onToggle }) => {
             {batch.invoice_count} ficheiros
             {batchHasAnyTasks && (
               <span style={{ marginLeft: '0.5rem', color: 'rgb(52, 211, 153)' }}>
-                • {invoicesWithTasks.length} com tarefas
+                • {withTasksCount} com tarefas
               </span>
             )}
           </p>
@@ -197,7 +209,12 @@ const InvoiceBatchListItem = ({ batch, clients, isExpanded, onToggle }) => {
               )}
 
               <div style={{ display: 'flex', flexDirection: 'column', gap: '0.75rem' }}>
-                {batch.invoices.map(invoice => (
+                {isLoadingInvoices && (
+                  <div style={{ display: 'flex', justifyContent: 'center', padding: '1rem' }}>
+                    <Loader2 size={20} className="animate-spin" />
+                  </div>
+                )}
+                {invoices.map(invoice => (
                   <ScannedInvoiceEditor 
                     key={invoice.id} 
                     invoice={invoice} 
@@ -2,7 +2,7 @@ import React, { useState, useMemo, useEffect, useCallback } from "react";
 import { toast, ToastContainer } from "react-toastify";
 import "react-toastify/dist/ReactToastify.css";
 import { motion, AnimatePresence } from "framer-motion";
-import api from "../api";
+import api, { fetchAllPages } from "../api";
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import {
   DollarSign, TrendingUp, Clock, Calendar, PieChart, Users, AlertTriangle,
@@ -59,8 +59,7 @@ const fetchProfitabilityData = async ({ queryKey }) => {
   // Add sorting to backend query if implemented
   // if (filters.sortConfig.key) params.append('ordering', `${filters.sortConfig.direction === 'desc' ? '-' : ''}${filters.sortConfig.key}`);
 
-  const response = await api.get(`/client-profitability/?${params.toString()}`);
-  return response.data.results || response.data || [];
+  return fetchAllPages(`/client-profitability/?${params.toString()}`);
 };
 
 const fetchClientsForFilter = async () => {
@@ -49,9 +49,10 @@ const InvoiceProcessingPage = () => {
 
   const hasPendingInvoices = (batches) => {
     if (!Array.isArray(batches)) return false;
-    return batches.some(batch => 
-      batch.invoices && batch.invoices.some(invoice => 
-        ['PENDING', 'PROCESSING'].includes(invoice.status)
+    // A listagem só traz os contadores por estado; as faturas carregam ao expandir o lote
+    return batches.some(batch =>
+      batch.status_summary && batch.status_summary.some(item =>
+        ['PENDING', 'PROCESSING'].includes(item.status) && item.count > 0
       )
     );
   };
@@ -69,12 +70,14 @@ const InvoiceProcessingPage = () => {
               // Buscar estado detalhado do lote
               const statusResponse = await api.get(`/invoice-batches/${batch.id}/batch_status/`);
               batch.task_stats = statusResponse.data.task_stats;
+              batch.invoice_stats = statusResponse.data.invoice_stats;
               batch.can_create_more_tasks = statusResponse.data.can_create_more_tasks;
               batch.ready_for_batch_creation = statusResponse.data.ready_for_batch_creation;
             } catch (error) {
               console.warn(`Erro ao buscar estado do lote ${batch.id}:`, error);
               // Usar valores padrão se a busca falhar
               batch.task_stats = { pending: 0, in_progress: 0, completed: 0, cancelled: 0 };
+              batch.invoice_stats = null;
               batch.can_create_more_tasks = false;
               batch.ready_for_batch_creation = false;
             }
@@ -85,7 +88,7 @@ const InvoiceProcessingPage = () => {
         
         return enhancedResults;
     },
-    refetchInterval: data => hasPendingInvoices(data) ? 3000 : false,
+    refetchInterval: query => hasPendingInvoices(query.state.data) ? 3000 : false,
     staleTime: 1000,
   });
 
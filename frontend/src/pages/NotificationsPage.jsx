@@ -25,7 +25,7 @@ import {
     Smartphone,
     UserCheck
 } from 'lucide-react';
-import api from "../api";
+import api, { fetchAllPages } from "../api";
 import { toast } from 'react-toastify';
 import dayjs from 'dayjs';
 
@@ -59,8 +59,7 @@ const NotificationsPage = () => {
             else if (sortBy === 'priority') ordering = 'priority,-created_at';
             params.append('ordering', ordering);
 
-            const response = await api.get(`/workflow-notifications/?${params.toString()}`);
-            return response.data.results || response.data;
+            return fetchAllPages(`/workflow-notifications/?${params.toString()}`);
         },
         staleTime: 30 * 1000,
     });
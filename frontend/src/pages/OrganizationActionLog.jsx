@@ -3,7 +3,7 @@ import { motion } from 'framer-motion';
 import { Activity, AlertCircle, RefreshCw, Clock, User, FileText } from 'lucide-react';
 
 // Import your API utility - this should be the same one used in other pages
-import api from '../api';
+import { fetchAllPages } from '../api';
 
 const columns = [
   { key: 'timestamp', label: 'Data/Hora' },
@@ -45,13 +45,9 @@ export default function OrganizationActionLog() {
       console.log('Fetching logs from /action-logs/...');
       
       // Use the same api instance that other components use
-      // This should automatically include authentication headers
-      const response = await api.get('/action-logs/');
-      
-      console.log('API Response:', response);
-      
-      // Handle both paginated and non-paginated responses
-      const data = response.data.results || response.data || [];
+      // This should automatically include authentication headers.
+      // The endpoint is cursor-paginated, so follow every page.
+      const data = await fetchAllPages('/action-logs/');
       
       console.log('Logs data:', data);
       setLogs(data);
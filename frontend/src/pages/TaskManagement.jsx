@@ -1,5 +1,5 @@
 import React, { useMemo, useCallback, useEffect } from "react";
-import api from "../api";
+import api, { fetchAllPages } from "../api";
 import { motion, AnimatePresence } from "framer-motion";
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import { toast, ToastContainer } from "react-toastify";
@@ -88,8 +88,7 @@ const fetchTasksOnly = async (taskFilters, taskSearchTerm, taskSortConfig) => {
   }
 
   const tasksEndpoint = `/tasks/?${params.toString()}`;
-  const tasksRes = await api.get(tasksEndpoint);
-  return tasksRes.data.results || tasksRes.data || [];
+  return fetchAllPages(tasksEndpoint);
 };
 
 const TaskManagement = () => {
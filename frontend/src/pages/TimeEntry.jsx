@@ -2,7 +2,7 @@
 import React, { useMemo, useCallback, useEffect } from "react";
 import { toast, ToastContainer } from "react-toastify";
 import 'react-toastify/dist/ReactToastify.css';
-import api from "../api";
+import api, { fetchAllPages } from "../api";
 import {
     Download, Loader2, AlertTriangle, RotateCcw, Brain, User, Activity,
     Plus, X, CheckCircle as CheckCircleIcon, Clock
@@ -69,8 +69,7 @@ const fetchTimeEntriesOnly = async (userId, timeEntryFiltersFromStore) => {
     }
 
     const endpoint = `/time-entries/?${params.toString()}`;
-    const response = await api.get(endpoint);
-    return response.data.results || response.data || [];
+    return fetchAllPages(endpoint);
 };
 
 // NEW fetching function for the form context
@@ -123,7 +122,7 @@ const TimeEntry = () => {
     // a mesma que a do TaskManagement, então mantemos a sua própria query.
     const { data: tasksForDropdown = [] } = useQuery({
         queryKey: ['tasksForTimeEntryDropdown'],
-        queryFn: () => api.get("/tasks/?status=pending,in_progress").then(res => res.data.results || res.data),
+        queryFn: () => fetchAllPages("/tasks/?status=pending,in_progress"),
         staleTime: 2 * 60 * 1000 // Tarefas mudam mais, então o staleTime é menor
     });
 